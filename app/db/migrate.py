@@ -0,0 +1,112 @@
+"""
+Versioned schema migrations.
+
+Every app/db/migrations/NNNN_name.sql file runs once, in order, inside its own
+transaction, and is recorded in schema_migrations with a checksum. A session
+advisory lock lets several workers or deploy hooks call it at the same time.
+
+    python -m app.db.migrate                # database from the app settings
+    python -m app.db.migrate --dsn postgresql://...
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import hashlib
+import logging
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+# Arbitrary constant shared by every process applying migrations
+MIGRATION_LOCK_KEY = 4_180_200_233
+
+
+class Migration:
+    def __init__(self, path: Path):
+        self.path = path
+        self.version = path.stem.split("_", 1)[0]
+        self.name = path.stem
+        self.sql = path.read_text()
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()
+
+
+def discover_migrations(directory=MIGRATIONS_DIR) -> list[Migration]:
+    migrations = [Migration(path) for path in sorted(directory.glob("*.sql"))]
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+async def apply_migrations(conn, directory=MIGRATIONS_DIR) -> list[str]:
+    """Applies the pending migrations on conn, returns the names of those applied."""
+    migrations = discover_migrations(directory)
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+    try:
+        await conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version TEXT PRIMARY KEY, "
+            "name TEXT NOT NULL, "
+            "checksum TEXT NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL DEFAULT NOW())"
+        )
+        applied = {
+            row["version"]: row["checksum"]
+            for row in await conn.fetch(
+                "SELECT version, checksum FROM schema_migrations"
+            )
+        }
+
+        newly_applied = []
+        for migration in migrations:
+            if migration.version in applied:
+                if applied[migration.version] != migration.checksum:
+                    logger.warning(
+                        f"Migration {migration.name} changed after it was applied, "
+                        "add a new migration instead of editing it"
+                    )
+                continue
+
+            async with conn.transaction():
+                await conn.execute(migration.sql)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+                    migration.version,
+                    migration.name,
+                    migration.checksum,
+                )
+            logger.info(f"Applied migration {migration.name}")
+            newly_applied.append(migration.name)
+        return newly_applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--dsn", help="defaults to the database in the app settings")
+    args = parser.parse_args(argv)
+
+    dsn = args.dsn
+    if not dsn:
+        from ..startup import load_settings
+
+        dsn = (await load_settings()).database_url
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        applied = await apply_migrations(conn)
+    finally:
+        await conn.close()
+    logger.info(f"{len(applied)} migrations applied, schema is up to date")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    asyncio.run(main())
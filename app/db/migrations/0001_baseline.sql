@@ -1,8 +1,9 @@
-CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+-- Schema as it existed before versioned migrations (app/db/db.sql + triggers.sql).
+-- Written with IF NOT EXISTS so environments created from those files adopt it as is.
+-- New installs default ids with the built-in gen_random_uuid() (no uuid-ossp needed).
 
--- Users table
-CREATE TABLE users (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+CREATE TABLE IF NOT EXISTS users (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     username VARCHAR(15) NOT NULL UNIQUE,
     email VARCHAR(40) NOT NULL UNIQUE,
     password VARCHAR(60) NOT NULL,
@@ -11,9 +12,11 @@ CREATE TABLE users (
     created_at TIMESTAMP NOT NULL DEFAULT NOW()
 );
 
--- Folders table
-CREATE TABLE folders (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+-- Set by the profile picture Lambda callback, read before presigning the photo download
+ALTER TABLE users ADD COLUMN IF NOT EXISTS has_profile_picture BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE TABLE IF NOT EXISTS folders (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     name VARCHAR(25) NOT NULL,
     created_at TIMESTAMP NOT NULL DEFAULT NOW(),
     last_interaction TIMESTAMP NOT NULL DEFAULT NOW(),
@@ -22,11 +25,10 @@ CREATE TABLE folders (
     UNIQUE (parent_folder_id, name, owner_id)
 );
 
--- Files table
-CREATE TABLE files (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+CREATE TABLE IF NOT EXISTS files (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     name VARCHAR(50) NOT NULL,
-    size_in_bytes BIGINT NOT NULL,  -- Changed from VARCHAR to BIGINT for proper sorting
+    size_in_bytes BIGINT NOT NULL,
     type VARCHAR(8) NOT NULL,
     created_at TIMESTAMP NOT NULL DEFAULT NOW(),
     last_interaction TIMESTAMP NOT NULL DEFAULT NOW(),
@@ -35,9 +37,8 @@ CREATE TABLE files (
     UNIQUE (parent_folder_id, name, owner_id)
 );
 
--- Shares table
-CREATE TABLE shares (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+CREATE TABLE IF NOT EXISTS shares (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     user_id UUID REFERENCES users(id) ON DELETE CASCADE,
     shared_with UUID REFERENCES users(id) ON DELETE CASCADE,
     file_id UUID REFERENCES files(id) ON DELETE CASCADE,
@@ -50,11 +51,30 @@ CREATE TABLE shares (
     UNIQUE (shared_with, file_id, folder_id)
 );
 
--- Permissions table
-CREATE TABLE permissions (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+CREATE TABLE IF NOT EXISTS permissions (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     share_id UUID UNIQUE REFERENCES shares(id) ON DELETE CASCADE,
     delete BOOLEAN NOT NULL DEFAULT FALSE,
     write BOOLEAN NOT NULL DEFAULT FALSE,
     read BOOLEAN NOT NULL DEFAULT FALSE
-);
\ No newline at end of file
+);
+
+-- Keep folder last_interaction fresh when files are added to it
+CREATE OR REPLACE FUNCTION update_folder_last_interaction()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.parent_folder_id IS NOT NULL THEN
+        UPDATE folders
+        SET last_interaction = NOW()
+        WHERE id = NEW.parent_folder_id;
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_update_folder_last_interaction ON files;
+CREATE TRIGGER trigger_update_folder_last_interaction
+    AFTER INSERT ON files
+    FOR EACH ROW
+    EXECUTE FUNCTION update_folder_last_interaction();
@@ -0,0 +1,39 @@
+-- Indexes shaped after the service queries.
+--
+-- UNIQUE (parent_folder_id, name, owner_id) never fired at the root, NULL parents are
+-- distinct, and it leads with parent_folder_id while every query filters on owner_id.
+-- Each name rule becomes two partial unique indexes, one for the root and one for folders,
+-- so INSERT ... ON CONFLICT can replace the name-taken pre-check SELECTs.
+-- Fails if an environment already holds duplicate names at a user's root; dedupe those first.
+
+CREATE UNIQUE INDEX files_owner_root_name_key
+    ON files (owner_id, name) WHERE parent_folder_id IS NULL;
+CREATE UNIQUE INDEX files_owner_folder_name_key
+    ON files (owner_id, parent_folder_id, name) WHERE parent_folder_id IS NOT NULL;
+ALTER TABLE files DROP CONSTRAINT IF EXISTS files_parent_folder_id_name_owner_id_key;
+
+CREATE UNIQUE INDEX folders_owner_root_name_key
+    ON folders (owner_id, name) WHERE parent_folder_id IS NULL;
+CREATE UNIQUE INDEX folders_owner_folder_name_key
+    ON folders (owner_id, parent_folder_id, name) WHERE parent_folder_id IS NOT NULL;
+ALTER TABLE folders DROP CONSTRAINT IF EXISTS folders_parent_folder_id_name_owner_id_key;
+
+-- ON DELETE CASCADE from a folder looks its children up by parent alone
+CREATE INDEX files_parent_folder_id_idx ON files (parent_folder_id) WHERE parent_folder_id IS NOT NULL;
+CREATE INDEX folders_parent_folder_id_idx ON folders (parent_folder_id) WHERE parent_folder_id IS NOT NULL;
+
+-- Same NULL problem for shares: a file could be shared with the same user twice
+CREATE UNIQUE INDEX shares_shared_with_file_key
+    ON shares (shared_with, file_id) WHERE file_id IS NOT NULL;
+CREATE UNIQUE INDEX shares_shared_with_folder_key
+    ON shares (shared_with, folder_id) WHERE folder_id IS NOT NULL;
+ALTER TABLE shares DROP CONSTRAINT IF EXISTS shares_shared_with_file_id_folder_id_key;
+
+-- Shared-with-me filters on the receiver, shared-by-me on the owner, cascades on the object
+CREATE INDEX shares_shared_with_idx ON shares (shared_with);
+CREATE INDEX shares_user_id_idx ON shares (user_id);
+CREATE INDEX shares_file_id_idx ON shares (file_id) WHERE file_id IS NOT NULL;
+CREATE INDEX shares_folder_id_idx ON shares (folder_id) WHERE folder_id IS NOT NULL;
+
+-- Login matches `username = $1 OR email = $1`, served by a BitmapOr over the existing
+-- users_username_key and users_email_key unique indexes, nothing to add there.
@@ -0,0 +1,33 @@
+-- Quota ledger: every upload charges users.available_storage_in_bytes through a reservation.
+--
+-- reserved   charged when the presigned upload is handed out
+-- committed  the upload arrived, a replacement that shrank the file is refunded the difference
+-- released   abandoned or superseded, the charge is refunded
+--
+-- A new file's charge is carried by its files row (size_in_bytes is the declared size),
+-- a replacement only charges what the file grows by and resizes the row on commit.
+-- So usage is SUM(files.size_in_bytes) plus the charges of pending replacements,
+-- which is what the reconciliation job recomputes available storage from.
+
+CREATE TABLE quota_ledger (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    -- Kept when the file goes away, the reservation still has to be settled
+    file_id UUID REFERENCES files(id) ON DELETE SET NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('new', 'replace')),
+    state TEXT NOT NULL DEFAULT 'reserved' CHECK (state IN ('reserved', 'committed', 'released')),
+    bytes BIGINT NOT NULL,
+    previous_bytes BIGINT NOT NULL DEFAULT 0,
+    charged_bytes BIGINT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    settled_at TIMESTAMP
+);
+
+-- One upload in flight per file, commits from the upload callback look it up by file
+CREATE UNIQUE INDEX quota_ledger_reserved_file_key ON quota_ledger (file_id) WHERE state = 'reserved';
+-- Expiry sweep and reconciliation only ever read pending reservations
+CREATE INDEX quota_ledger_reserved_created_at_idx ON quota_ledger (created_at) WHERE state = 'reserved';
+CREATE INDEX quota_ledger_reserved_user_id_idx ON quota_ledger (user_id) WHERE state = 'reserved';
+
+-- Reconciliation sums a batch of owners' files from the index alone
+CREATE INDEX files_owner_id_size_idx ON files (owner_id) INCLUDE (size_in_bytes);
@@ -0,0 +1,2 @@
+-- Set by the upload results callback once the thumbnail worker stored a file's previews
+ALTER TABLE files ADD COLUMN has_thumbnails BOOLEAN NOT NULL DEFAULT FALSE;
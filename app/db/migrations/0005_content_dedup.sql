@@ -0,0 +1,54 @@
+-- Content-addressed storage: uploads that send their SHA-256 are stored once per owner
+-- under files/{owner_id}/blobs/{blob_id}, every files row with that content points at it.
+--
+-- stored     the content arrived (upload callback), new files with the hash link to it
+--            instead of uploading again
+-- ref_count  files rows pointing at the blob, kept by the trigger below
+--
+-- A blob that never arrived is dropped with its last file. A stored one is left at zero
+-- references for the code that dropped it to delete its object and row.
+-- Scoped per owner on purpose: knowing a hash must never be enough to get someone
+-- else's content.
+
+CREATE TABLE blobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    owner_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    sha256 BYTEA NOT NULL CHECK (length(sha256) = 32),
+    size_in_bytes BIGINT NOT NULL,
+    stored BOOLEAN NOT NULL DEFAULT FALSE,
+    has_thumbnails BOOLEAN NOT NULL DEFAULT FALSE,
+    ref_count INT NOT NULL DEFAULT 0 CHECK (ref_count >= 0),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    UNIQUE (owner_id, sha256)
+);
+
+ALTER TABLE files ADD COLUMN blob_id UUID REFERENCES blobs(id);
+-- Upload callbacks resolve blob ids to their files
+CREATE INDEX files_blob_id_idx ON files (blob_id) WHERE blob_id IS NOT NULL;
+
+CREATE OR REPLACE FUNCTION count_blob_references()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'DELETE' AND NEW.blob_id IS NOT NULL THEN
+        UPDATE blobs SET ref_count = ref_count + 1 WHERE id = NEW.blob_id;
+    END IF;
+
+    IF TG_OP <> 'INSERT' AND OLD.blob_id IS NOT NULL THEN
+        DELETE FROM blobs WHERE id = OLD.blob_id AND ref_count = 1 AND NOT stored;
+        UPDATE blobs SET ref_count = ref_count - 1 WHERE id = OLD.blob_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_count_blob_references
+    AFTER INSERT OR DELETE ON files
+    FOR EACH ROW
+    EXECUTE FUNCTION count_blob_references();
+
+CREATE TRIGGER trigger_count_blob_references_on_update
+    AFTER UPDATE OF blob_id ON files
+    FOR EACH ROW
+    WHEN (OLD.blob_id IS DISTINCT FROM NEW.blob_id)
+    EXECUTE FUNCTION count_blob_references();
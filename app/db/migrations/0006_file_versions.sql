@@ -0,0 +1,76 @@
+-- File versions: a replacement no longer overwrites the file's object, it adds a version.
+--
+-- A version's content is one of
+--   a blob          replacements uploaded whole, see 0005_content_dedup.sql
+--   chunks          content-defined chunks listed in file_version_chunks, only the
+--                   chunks the owner doesn't store yet are uploaded
+--   neither         the file's original object at files/{owner}/[{folder}/]{file_id},
+--                   only ever version 1 of a file uploaded before it had versions
+--
+-- files.current_version_id is NULL until a file's first replacement, which snapshots the
+-- content it had as version 1. files.blob_id and has_thumbnails mirror the current version.
+
+-- Replacements uploaded without a hash are stored as blobs too, never deduplicated
+ALTER TABLE blobs ALTER COLUMN sha256 DROP NOT NULL;
+
+CREATE TABLE chunks (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    owner_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    sha256 BYTEA NOT NULL CHECK (length(sha256) = 32),
+    size_in_bytes INT NOT NULL,
+    stored BOOLEAN NOT NULL DEFAULT FALSE,
+    ref_count INT NOT NULL DEFAULT 0 CHECK (ref_count >= 0),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    UNIQUE (owner_id, sha256)
+);
+
+CREATE TABLE file_versions (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    number INT NOT NULL,
+    size_in_bytes BIGINT NOT NULL,
+    blob_id UUID REFERENCES blobs(id),
+    chunked BOOLEAN NOT NULL DEFAULT FALSE,
+    has_thumbnails BOOLEAN NOT NULL DEFAULT FALSE,
+    committed BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    UNIQUE (file_id, number)
+);
+-- Upload callbacks resolve a replacement's blob id to its version
+CREATE INDEX file_versions_blob_id_idx ON file_versions (blob_id) WHERE blob_id IS NOT NULL;
+
+CREATE TABLE file_version_chunks (
+    version_id UUID NOT NULL REFERENCES file_versions(id) ON DELETE CASCADE,
+    position INT NOT NULL,
+    chunk_id UUID NOT NULL REFERENCES chunks(id),
+    PRIMARY KEY (version_id, position)
+);
+-- Dropping an orphaned chunk checks nothing references it
+CREATE INDEX file_version_chunks_chunk_id_idx ON file_version_chunks (chunk_id);
+
+ALTER TABLE files ADD COLUMN current_version_id UUID REFERENCES file_versions(id);
+
+-- Versions hold references to blobs the same way files do
+CREATE TRIGGER trigger_count_blob_references
+    AFTER INSERT OR DELETE ON file_versions
+    FOR EACH ROW
+    EXECUTE FUNCTION count_blob_references();
+
+CREATE OR REPLACE FUNCTION count_chunk_references()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE chunks SET ref_count = ref_count + 1 WHERE id = NEW.chunk_id;
+    ELSE
+        DELETE FROM chunks WHERE id = OLD.chunk_id AND ref_count = 1 AND NOT stored;
+        UPDATE chunks SET ref_count = ref_count - 1 WHERE id = OLD.chunk_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_count_chunk_references
+    AFTER INSERT OR DELETE ON file_version_chunks
+    FOR EACH ROW
+    EXECUTE FUNCTION count_chunk_references();
@@ -0,0 +1,141 @@
+-- Change log for delta sync (GET /changes?cursor=).
+--
+-- Every change to a user's drive appends a row, written by the triggers below in the
+-- same transaction as the change itself, whichever code path made it:
+--
+--   created   files and folders rows inserted
+--   renamed   name changed
+--   moved     parent_folder_id changed
+--   uploaded  content arrived, a new file's or a new version's (quota_ledger committed)
+--   deleted   files and folders rows deleted
+--   shared    a file or folder was shared with the user, logged for the recipient
+--
+-- id is a per-user sequence taken from users.last_change_id. Bumping it locks the user's
+-- row until commit, so a user's changes commit in id order and a reader that saw id n
+-- never sees an id below n appear later. The triggers are per statement, a batch of
+-- rows costs one users update and one insert.
+
+ALTER TABLE users ADD COLUMN last_change_id BIGINT NOT NULL DEFAULT 0;
+
+CREATE TABLE changes (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    id BIGINT NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('created', 'renamed', 'moved', 'uploaded', 'deleted', 'shared')),
+    object_type TEXT NOT NULL CHECK (object_type IN ('file', 'folder')),
+    object_id UUID NOT NULL,
+    changed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, id)
+);
+
+CREATE OR REPLACE FUNCTION record_changes(
+    user_ids UUID[], kinds TEXT[], object_types TEXT[], object_ids UUID[]
+) RETURNS VOID AS $$
+    WITH entries AS (
+        SELECT * FROM unnest(user_ids, kinds, object_types, object_ids)
+            WITH ORDINALITY AS entry(user_id, kind, object_type, object_id, n)
+    ),
+    counts AS (
+        SELECT user_id, count(*) AS added FROM entries GROUP BY user_id
+    ),
+    -- A user being deleted has no row left to bump, their changes go with them
+    bumped AS (
+        UPDATE users SET last_change_id = last_change_id + counts.added FROM counts
+        WHERE users.id = counts.user_id
+        RETURNING users.id, users.last_change_id - counts.added AS base
+    )
+    INSERT INTO changes (user_id, id, kind, object_type, object_id)
+    SELECT entries.user_id,
+           bumped.base + row_number() OVER (PARTITION BY entries.user_id ORDER BY entries.n),
+           entries.kind, entries.object_type, entries.object_id
+    FROM entries JOIN bumped ON bumped.id = entries.user_id;
+$$ LANGUAGE sql;
+
+-- files and folders share their columns of interest, TG_ARGV[0] is the object type
+CREATE OR REPLACE FUNCTION log_inserted_objects()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM record_changes(
+        array_agg(owner_id), array_agg('created'::text), array_agg(TG_ARGV[0]), array_agg(id)
+    ) FROM inserted;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION log_updated_objects()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM record_changes(
+        array_agg(owner_id), array_agg(kind), array_agg(TG_ARGV[0]), array_agg(id)
+    ) FROM (
+        SELECT after.owner_id, after.id, 'renamed' AS kind
+        FROM before JOIN after ON after.id = before.id
+        WHERE after.name IS DISTINCT FROM before.name
+        UNION ALL
+        SELECT after.owner_id, after.id, 'moved'
+        FROM before JOIN after ON after.id = before.id
+        WHERE after.parent_folder_id IS DISTINCT FROM before.parent_folder_id
+    ) updated;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION log_deleted_objects()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM record_changes(
+        array_agg(owner_id), array_agg('deleted'::text), array_agg(TG_ARGV[0]), array_agg(id)
+    ) FROM deleted;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_log_inserted_files
+    AFTER INSERT ON files REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION log_inserted_objects('file');
+CREATE TRIGGER trigger_log_updated_files
+    AFTER UPDATE ON files REFERENCING OLD TABLE AS before NEW TABLE AS after
+    FOR EACH STATEMENT EXECUTE FUNCTION log_updated_objects('file');
+CREATE TRIGGER trigger_log_deleted_files
+    AFTER DELETE ON files REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT EXECUTE FUNCTION log_deleted_objects('file');
+
+CREATE TRIGGER trigger_log_inserted_folders
+    AFTER INSERT ON folders REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION log_inserted_objects('folder');
+CREATE TRIGGER trigger_log_updated_folders
+    AFTER UPDATE ON folders REFERENCING OLD TABLE AS before NEW TABLE AS after
+    FOR EACH STATEMENT EXECUTE FUNCTION log_updated_objects('folder');
+CREATE TRIGGER trigger_log_deleted_folders
+    AFTER DELETE ON folders REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT EXECUTE FUNCTION log_deleted_objects('folder');
+
+CREATE OR REPLACE FUNCTION log_committed_uploads()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM record_changes(
+        array_agg(after.user_id), array_agg('uploaded'::text), array_agg('file'::text), array_agg(after.file_id)
+    ) FROM before JOIN after ON after.id = before.id
+    WHERE before.state = 'reserved' AND after.state = 'committed' AND after.file_id IS NOT NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_log_committed_uploads
+    AFTER UPDATE ON quota_ledger REFERENCING OLD TABLE AS before NEW TABLE AS after
+    FOR EACH STATEMENT EXECUTE FUNCTION log_committed_uploads();
+
+CREATE OR REPLACE FUNCTION log_shares()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM record_changes(
+        array_agg(shared_with), array_agg('shared'::text),
+        array_agg(CASE WHEN file_id IS NULL THEN 'folder' ELSE 'file' END),
+        array_agg(COALESCE(file_id, folder_id))
+    ) FROM inserted WHERE shared_with IS NOT NULL;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_log_shares
+    AFTER INSERT ON shares REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION log_shares();
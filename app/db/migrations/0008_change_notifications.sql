@@ -0,0 +1,20 @@
+-- Push for the change log of 0007_change_log.sql: one NOTIFY per user and statement on
+-- channel drive_changes, delivered at commit, with the cursor to fetch GET /changes up to.
+-- Payload: {"user_id": ..., "cursor": <last change id>, "kinds": [...]}
+
+CREATE OR REPLACE FUNCTION notify_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify(
+        'drive_changes',
+        json_build_object(
+            'user_id', user_id, 'cursor', MAX(id), 'kinds', array_agg(DISTINCT kind)
+        )::text
+    ) FROM inserted GROUP BY user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_notify_changes
+    AFTER INSERT ON changes REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_changes();
@@ -0,0 +1,30 @@
+-- Background jobs, see app/services/job_queue.py.
+--
+-- A job is inserted by the service write that needs it, in the same transaction, so it
+-- exists exactly when that write committed. Workers claim queued jobs with
+-- FOR UPDATE SKIP LOCKED and mark them running under a lease: no row lock or
+-- transaction is held while a job runs, a worker that dies leaves its jobs to be
+-- requeued once their lease runs out.
+--
+--   queued   waiting for run_at, also after a failed attempt (exponential backoff)
+--   running  claimed until locked_until
+--   dead     failed max_attempts times, kept with its last error until retried by hand
+--
+-- Done jobs are deleted, the table only ever holds outstanding and dead ones.
+
+CREATE TABLE jobs (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL DEFAULT 'queued' CHECK (state IN ('queued', 'running', 'dead')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5 CHECK (max_attempts > 0),
+    run_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    locked_until TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- The claim reads the oldest due jobs, the lease sweep the expired running ones
+CREATE INDEX jobs_queued_run_at_idx ON jobs (run_at) WHERE state = 'queued';
+CREATE INDEX jobs_running_locked_until_idx ON jobs (locked_until) WHERE state = 'running';
@@ -0,0 +1,28 @@
+-- Server-side copies of files and folder subtrees, see app/services/copy_services.py.
+--
+-- The rows of the copy are inserted and charged at once. Content the copy can reference
+-- (blobs, chunks) is shared right away. Content a file has under its own key is copied
+-- inside S3 by jobs, each such file is a copy_items row until its objects are copied
+-- and its quota reservation committed, like an upload that arrived.
+
+CREATE TABLE copies (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    owner_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    object_type TEXT NOT NULL CHECK (object_type IN ('file', 'folder')),
+    -- The root of the copy, kept after it is deleted to report the copy finished
+    object_id UUID NOT NULL,
+    total_files INT NOT NULL,
+    total_bytes BIGINT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE copy_items (
+    file_id UUID PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+    copy_id UUID NOT NULL REFERENCES copies(id) ON DELETE CASCADE,
+    source_key TEXT NOT NULL,
+    -- Set when the source has previews, they are copied with the content
+    source_preview_id UUID,
+    size_in_bytes BIGINT NOT NULL
+);
+-- Progress counts what is left of a copy
+CREATE INDEX copy_items_copy_id_idx ON copy_items (copy_id) INCLUDE (size_in_bytes);
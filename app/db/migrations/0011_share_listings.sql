@@ -0,0 +1,68 @@
+-- Paginated shared-with-me and shared-by-me listings, see ShareServices.list_shares.
+--
+-- A page is read straight off an index in its sort order, from the keyset cursor of the
+-- previous page, so its cost doesn't grow with the number of shares. Sorting by name
+-- needs the name in the index: shares keep a copy of their object's name, filled on
+-- insert and followed on rename by the triggers below.
+
+ALTER TABLE shares ADD COLUMN name TEXT;
+UPDATE shares SET name = COALESCE(
+    (SELECT name FROM files WHERE files.id = shares.file_id),
+    (SELECT name FROM folders WHERE folders.id = shares.folder_id)
+);
+ALTER TABLE shares ALTER COLUMN name SET NOT NULL;
+
+CREATE OR REPLACE FUNCTION fill_share_name()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.file_id IS NOT NULL THEN
+        SELECT name INTO NEW.name FROM files WHERE id = NEW.file_id;
+    ELSE
+        SELECT name INTO NEW.name FROM folders WHERE id = NEW.folder_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_fill_share_name
+    BEFORE INSERT ON shares
+    FOR EACH ROW
+    EXECUTE FUNCTION fill_share_name();
+
+-- TG_ARGV[0] is the shares column pointing at the renamed object
+CREATE OR REPLACE FUNCTION rename_shares()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_ARGV[0] = 'file_id' THEN
+        UPDATE shares SET name = NEW.name WHERE file_id = NEW.id;
+    ELSE
+        UPDATE shares SET name = NEW.name WHERE folder_id = NEW.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_rename_file_shares
+    AFTER UPDATE OF name ON files
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION rename_shares('file_id');
+
+CREATE TRIGGER trigger_rename_folder_shares
+    AFTER UPDATE OF name ON folders
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION rename_shares('folder_id');
+
+-- One index per listing and sort order, covering what the page query reads from shares.
+-- They lead with the same columns as the indexes they replace, which user deletes cascade on.
+DROP INDEX shares_shared_with_idx;
+DROP INDEX shares_user_id_idx;
+CREATE INDEX shares_shared_with_shared_at_idx
+    ON shares (shared_with, shared_at, id) INCLUDE (user_id, file_id, folder_id, name);
+CREATE INDEX shares_shared_with_name_idx
+    ON shares (shared_with, name, id) INCLUDE (user_id, file_id, folder_id, shared_at);
+CREATE INDEX shares_user_id_shared_at_idx
+    ON shares (user_id, shared_at, id) INCLUDE (shared_with, file_id, folder_id, name);
+CREATE INDEX shares_user_id_name_idx
+    ON shares (user_id, name, id) INCLUDE (shared_with, file_id, folder_id, shared_at);
@@ -0,0 +1,19 @@
+-- Activity history of uploads, downloads, renames and shares, see app/services/activity_log.py.
+--
+-- Written behind the requests: events are buffered in each API process and copied in
+-- with COPY in batches, an event is visible in the feed once its batch is flushed.
+-- No foreign key on purpose, one deleted user must not fail the COPY of a whole batch.
+-- detail is the file or folder name, or the recipient's username for a share.
+
+CREATE TABLE activity (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    user_id UUID NOT NULL,
+    action TEXT NOT NULL CHECK (action IN ('upload', 'download', 'rename', 'share')),
+    object_type TEXT NOT NULL CHECK (object_type IN ('file', 'folder')),
+    object_id UUID NOT NULL,
+    detail TEXT,
+    occurred_at TIMESTAMP NOT NULL
+);
+
+-- The feed pages back from the newest event
+CREATE INDEX activity_user_id_id_idx ON activity (user_id, id);
@@ -0,0 +1,22 @@
+-- Revoked access tokens, see app/services/token_revocations.py.
+--
+-- A row either revokes one token by its jti (logout) or every token of a user issued
+-- before issued_before (logout everywhere). Each API process keeps the jtis in a Bloom
+-- filter and the cutoffs in memory, reading new rows by revoked_at, so checking a
+-- token only queries this table on a Bloom hit. A row is useless once every token it
+-- covers has expired, at expires_at, and is purged after that.
+
+CREATE TABLE token_revocations (
+    id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    jti UUID,
+    issued_before TIMESTAMPTZ,
+    expires_at TIMESTAMPTZ NOT NULL,
+    revoked_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    CHECK ((jti IS NULL) <> (issued_before IS NULL))
+);
+
+CREATE UNIQUE INDEX token_revocations_jti_idx ON token_revocations (jti) WHERE jti IS NOT NULL;
+CREATE INDEX token_revocations_user_id_idx ON token_revocations (user_id);
+CREATE INDEX token_revocations_revoked_at_idx ON token_revocations (revoked_at);
+CREATE INDEX token_revocations_expires_at_idx ON token_revocations (expires_at);
@@ -0,0 +1,15 @@
+-- C-collated name indexes for the next free copy name, see FileServices.highest_copy_sql.
+--
+-- Finding the highest 'photo(n).png' at a location reads the names starting with 'photo('.
+-- A prefix is only a btree range under byte order, and the name keys of 0002 use the
+-- database collation, so without these the regex ran over every name at the location.
+
+CREATE INDEX files_owner_root_name_c_idx
+    ON files (owner_id, (name COLLATE "C")) WHERE parent_folder_id IS NULL;
+CREATE INDEX files_owner_folder_name_c_idx
+    ON files (owner_id, parent_folder_id, (name COLLATE "C")) WHERE parent_folder_id IS NOT NULL;
+
+CREATE INDEX folders_owner_root_name_c_idx
+    ON folders (owner_id, (name COLLATE "C")) WHERE parent_folder_id IS NULL;
+CREATE INDEX folders_owner_folder_name_c_idx
+    ON folders (owner_id, parent_folder_id, (name COLLATE "C")) WHERE parent_folder_id IS NOT NULL;
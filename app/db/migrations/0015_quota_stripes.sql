@@ -0,0 +1,39 @@
+-- Available storage split into stripes, see QuotaServices.claim.
+--
+-- users.available_storage_in_bytes was a single row every charge and refund of a user
+-- updated, locked until the charging transaction committed, so a user's concurrent
+-- uploads queued on it one after another. The balance now lives in 8 rows per user.
+-- A charge takes a random stripe that holds enough and isn't locked, only a charge no
+-- free stripe covers locks them all to pool the balance and spread it again.
+-- Available storage is the sum of the user's stripes.
+
+CREATE TABLE quota_stripes (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    stripe SMALLINT NOT NULL,
+    available_bytes BIGINT NOT NULL,
+    PRIMARY KEY (user_id, stripe)
+);
+
+-- Stripe 0 takes the remainder, so the stripes always add up to the balance
+INSERT INTO quota_stripes (user_id, stripe, available_bytes)
+SELECT id, stripe, available_storage_in_bytes / 8
+    + CASE WHEN stripe = 0 THEN available_storage_in_bytes % 8 ELSE 0 END
+FROM users, generate_series(0, 7) AS stripe;
+
+ALTER TABLE users DROP COLUMN available_storage_in_bytes;
+
+-- Every new user starts with their whole quota available
+CREATE OR REPLACE FUNCTION create_quota_stripes()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO quota_stripes (user_id, stripe, available_bytes)
+    SELECT inserted.id, stripe, inserted.total_storage_in_bytes / 8
+        + CASE WHEN stripe = 0 THEN inserted.total_storage_in_bytes % 8 ELSE 0 END
+    FROM inserted, generate_series(0, 7) AS stripe;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_create_quota_stripes
+    AFTER INSERT ON users REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION create_quota_stripes();
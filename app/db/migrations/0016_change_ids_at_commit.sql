@@ -0,0 +1,87 @@
+-- Change ids allocated at commit, replacing users.last_change_id of 0007_change_log.sql.
+--
+-- Bumping users.last_change_id in the changing statement kept the user's row locked from
+-- their first change to commit, for the whole of a slow upload or copy transaction, and
+-- any other change of the user waited behind it. record_changes now only stages its rows
+-- in pending_changes. A deferred trigger fires once per transaction at commit, takes the
+-- ids from the user's counter in user_change_seq and moves the rows into changes. The
+-- counter stays locked only from there to the end of commit, which still makes a user's
+-- changes commit in id order.
+
+CREATE TABLE user_change_seq (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    last_change_id BIGINT NOT NULL
+);
+
+INSERT INTO user_change_seq (user_id, last_change_id)
+SELECT id, last_change_id FROM users WHERE last_change_id > 0;
+
+ALTER TABLE users DROP COLUMN last_change_id;
+
+-- No foreign key: a user deleted by the transaction still logs the deletes it cascades to
+CREATE TABLE pending_changes (
+    xact_id XID8 NOT NULL,
+    n BIGINT GENERATED ALWAYS AS IDENTITY,
+    user_id UUID NOT NULL,
+    kind TEXT NOT NULL,
+    object_type TEXT NOT NULL,
+    object_id UUID NOT NULL,
+    changed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (xact_id, n)
+);
+
+-- One row per transaction with pending changes, its insert queues the flush
+CREATE TABLE change_flushes (
+    xact_id XID8 PRIMARY KEY
+);
+
+CREATE OR REPLACE FUNCTION record_changes(
+    user_ids UUID[], kinds TEXT[], object_types TEXT[], object_ids UUID[]
+) RETURNS VOID AS $$
+BEGIN
+    IF cardinality(user_ids) > 0 THEN
+        INSERT INTO change_flushes (xact_id) VALUES (pg_current_xact_id())
+        ON CONFLICT DO NOTHING;
+        INSERT INTO pending_changes (xact_id, user_id, kind, object_type, object_id)
+        SELECT pg_current_xact_id(), entry.*
+        FROM unnest(user_ids, kinds, object_types, object_ids) AS entry;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION flush_pending_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM change_flushes WHERE xact_id = NEW.xact_id;
+    WITH entries AS (
+        DELETE FROM pending_changes WHERE xact_id = NEW.xact_id RETURNING *
+    ),
+    -- A user deleted by now has no counter left to bump, their changes go with them
+    counts AS (
+        SELECT entries.user_id, count(*) AS added
+        FROM entries JOIN users ON users.id = entries.user_id
+        GROUP BY entries.user_id
+    ),
+    -- Counters are locked in user order, so two committing transactions can't deadlock
+    bumped AS (
+        INSERT INTO user_change_seq (user_id, last_change_id)
+        SELECT user_id, added FROM counts ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+            SET last_change_id = user_change_seq.last_change_id + EXCLUDED.last_change_id
+        RETURNING user_id, last_change_id
+    )
+    INSERT INTO changes (user_id, id, kind, object_type, object_id, changed_at)
+    SELECT entries.user_id,
+           bumped.last_change_id - counts.added
+               + row_number() OVER (PARTITION BY entries.user_id ORDER BY entries.n),
+           entries.kind, entries.object_type, entries.object_id, entries.changed_at
+    FROM entries
+    JOIN counts ON counts.user_id = entries.user_id
+    JOIN bumped ON bumped.user_id = entries.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE CONSTRAINT TRIGGER trigger_flush_pending_changes
+    AFTER INSERT ON change_flushes DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION flush_pending_changes();
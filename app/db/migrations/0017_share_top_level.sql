@@ -0,0 +1,62 @@
+-- Shared-with-me only lists top level objects, see ShareServices.list_shares.
+--
+-- Whether a shared object sits at its owner's root was only known from the joined
+-- files and folders rows, so the page scan read the recipient's shares in index order
+-- and dropped nested ones after the join, however many came before a full page.
+-- Shares keep it in top_level, filled on insert and followed on move like their name,
+-- and the shared-with-me indexes carry it right after the recipient, so a page is read
+-- off the index from the cursor on again.
+
+ALTER TABLE shares ADD COLUMN top_level BOOLEAN;
+UPDATE shares SET top_level = COALESCE(
+    (SELECT parent_folder_id IS NULL FROM files WHERE files.id = shares.file_id),
+    (SELECT parent_folder_id IS NULL FROM folders WHERE folders.id = shares.folder_id)
+);
+ALTER TABLE shares ALTER COLUMN top_level SET NOT NULL;
+
+CREATE OR REPLACE FUNCTION fill_share_name()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.file_id IS NOT NULL THEN
+        SELECT name, parent_folder_id IS NULL INTO NEW.name, NEW.top_level
+        FROM files WHERE id = NEW.file_id;
+    ELSE
+        SELECT name, parent_folder_id IS NULL INTO NEW.name, NEW.top_level
+        FROM folders WHERE id = NEW.folder_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- TG_ARGV[0] is the shares column pointing at the moved object
+CREATE OR REPLACE FUNCTION move_shares()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_ARGV[0] = 'file_id' THEN
+        UPDATE shares SET top_level = NEW.parent_folder_id IS NULL WHERE file_id = NEW.id;
+    ELSE
+        UPDATE shares SET top_level = NEW.parent_folder_id IS NULL WHERE folder_id = NEW.id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_move_file_shares
+    AFTER UPDATE OF parent_folder_id ON files
+    FOR EACH ROW
+    WHEN ((OLD.parent_folder_id IS NULL) IS DISTINCT FROM (NEW.parent_folder_id IS NULL))
+    EXECUTE FUNCTION move_shares('file_id');
+
+CREATE TRIGGER trigger_move_folder_shares
+    AFTER UPDATE OF parent_folder_id ON folders
+    FOR EACH ROW
+    WHEN ((OLD.parent_folder_id IS NULL) IS DISTINCT FROM (NEW.parent_folder_id IS NULL))
+    EXECUTE FUNCTION move_shares('folder_id');
+
+-- Still leading with shared_with, which user deletes cascade on
+DROP INDEX shares_shared_with_shared_at_idx;
+DROP INDEX shares_shared_with_name_idx;
+CREATE INDEX shares_shared_with_shared_at_idx
+    ON shares (shared_with, top_level, shared_at, id) INCLUDE (user_id, file_id, folder_id, name);
+CREATE INDEX shares_shared_with_name_idx
+    ON shares (shared_with, top_level, name, id) INCLUDE (user_id, file_id, folder_id, shared_at);
@@ -0,0 +1,14 @@
+-- Deleting the source of a copy still in progress, see FileServices.release_copy_sources.
+--
+-- A copy job reads its source's objects under the source's own key, after the copy
+-- committed. Deleting the source queued those objects for deletion at once, so the
+-- delete job could run before the copy job, which then failed on every attempt until
+-- dead-lettered, leaving the copy reserved and hidden for good. Now the source's
+-- objects are left in place while a pending copy_items row reads them: the rows are
+-- flagged source_deleted instead, and whoever drops the last of them, the copy job or
+-- the removal of the copy, deletes the objects.
+
+ALTER TABLE copy_items ADD COLUMN source_deleted BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Removals look up the pending copies of their files by key
+CREATE INDEX copy_items_source_key_idx ON copy_items (source_key);
@@ -1,23 +1,52 @@
 from fastapi.security import OAuth2PasswordBearer
-from fastapi import Depends, HTTPException
-from .startup import secret_key, algorithm
+from fastapi import Depends, HTTPException, Header, Request
+from .startup import get_settings
 from typing import Annotated
+import hmac
 import jwt
+import os
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 
-async def get_token_and_decode(token: Annotated[str, Depends(oauth2_scheme)]) -> str:
+async def get_token_payload(
+    request: Request, token: Annotated[str, Depends(oauth2_scheme)]
+) -> dict:
+    """The decoded access token, 401 when it is invalid, expired or revoked."""
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    settings = get_settings()
     try:
-        payload = jwt.decode(token, secret_key, algorithms=[algorithm])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        return user_id
+        ## iat only orders tokens against logout everywhere, a worker whose clock is
+        ## a little behind the issuer's must not refuse them
+        payload = jwt.decode(
+            token,
+            settings.secret_key,
+            algorithms=[settings.algorithm],
+            options={"verify_iat": False},
+        )
     except jwt.PyJWTError:
         raise credentials_exception
+    if payload.get("sub") is None:
+        raise credentials_exception
+    ## In memory unless the token id hits the Bloom filter, see app/services/token_revocations.py
+    revocations = getattr(request.app.state, "token_revocations", None)
+    if revocations is not None and await revocations.is_revoked(payload):
+        raise credentials_exception
+    return payload
+
+
+async def get_token_and_decode(
+    payload: Annotated[dict, Depends(get_token_payload)],
+) -> str:
+    return payload["sub"]
+
+
+async def verify_admin_secret(x_admin_secret: Annotated[str, Header()]):
+    admin_secret = os.getenv("ADMIN_SECRET")
+    # Admin endpoints stay closed unless a secret is configured
+    if not admin_secret or not hmac.compare_digest(x_admin_secret, admin_secret):
+        raise HTTPException(status_code=403, detail="Forbidden")
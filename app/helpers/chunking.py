@@ -0,0 +1,75 @@
+from hashlib import sha256
+
+# Content-defined chunking (FastCDC): a boundary falls wherever the rolling gear hash of
+# the bytes before it matches a mask, so an edit only moves the boundaries around it and
+# every chunk outside the edit keeps its hash. Clients chunk with exactly these
+# parameters and gear table, the server only ever sees the manifest.
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+_MASK_64 = (1 << 64) - 1
+# Reproducible in any language: the first 8 bytes of sha256(i) for i in 0..255, big endian
+GEAR = tuple(int.from_bytes(sha256(bytes([i])).digest()[:8], "big") for i in range(256))
+
+
+def _mask(bits) -> int:
+    """A mask of that many one bits spread over the high half of the hash, as in FastCDC."""
+    mask, step = 0, 32 // bits
+    for i in range(bits):
+        mask |= 1 << (63 - i * step)
+    return mask
+
+
+def chunk_boundaries(
+    data: bytes,
+    min_size=MIN_CHUNK_SIZE,
+    avg_size=AVG_CHUNK_SIZE,
+    max_size=MAX_CHUNK_SIZE,
+):
+    """
+    Yields (offset, length) of every chunk of data.
+    Normalized chunking: a stricter mask before avg_size and a looser one after it
+    keep chunk sizes close to the average.
+    """
+    bits = avg_size.bit_length() - 1
+    mask_small, mask_large = _mask(bits + 2), _mask(bits - 2)
+
+    start, length = 0, len(data)
+    while start < length:
+        end = min(start + max_size, length)
+        if end - start <= min_size:
+            yield start, end - start
+            break
+
+        fingerprint = 0
+        normal = min(start + avg_size, end)
+        cut = end
+        i = start + min_size
+        while i < normal:
+            fingerprint = ((fingerprint << 1) + GEAR[data[i]]) & _MASK_64
+            i += 1
+            if not fingerprint & mask_small:
+                cut = i
+                break
+        else:
+            while i < end:
+                fingerprint = ((fingerprint << 1) + GEAR[data[i]]) & _MASK_64
+                i += 1
+                if not fingerprint & mask_large:
+                    cut = i
+                    break
+
+        yield start, cut - start
+        start = cut
+
+
+def chunk_manifest(data: bytes, **sizes) -> list[dict]:
+    """What a client sends to POST /file/{file_id}/versions for data."""
+    return [
+        {
+            "sha256": sha256(data[offset : offset + size]).hexdigest(),
+            "size_in_bytes": size,
+        }
+        for offset, size in chunk_boundaries(data, **sizes)
+    ]
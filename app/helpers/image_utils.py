@@ -0,0 +1,137 @@
+from io import BytesIO
+from .file_utils import get_ext
+
+# Every signature below fits in the first bytes of the object, a ranged GET is enough.
+# Linkers put the PE header of Windows executables within the first few hundred bytes.
+SNIFF_BYTES = 1024
+
+# Bounding boxes of the file previews, largest first
+THUMBNAIL_SIZES = (1024, 256, 64)
+PROFILE_PHOTO_SIZE = 400
+
+# (offset, signature, detected type)
+_SIGNATURES = (
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (0, b"BM", "bmp"),
+    (0, b"II*\x00", "tiff"),
+    (0, b"MM\x00*", "tiff"),
+    (0, b"\x00\x00\x01\x00", "ico"),
+    (0, b"%PDF-", "pdf"),
+    (0, b"PK\x03\x04", "zip"),
+    (0, b"\x7fELF", "executable"),
+    (0, b"\xcf\xfa\xed\xfe", "executable"),
+    (0, b"\xca\xfe\xba\xbe", "executable"),
+)
+
+# ISO base media brands (offset 4 'ftyp', brand at 8)
+_FTYP_BRANDS = {
+    b"heic": "heic",
+    b"heix": "heic",
+    b"mif1": "heic",
+    b"msf1": "heic",
+    b"avif": "avif",
+    b"isom": "mp4",
+    b"iso2": "mp4",
+    b"mp41": "mp4",
+    b"mp42": "mp4",
+    b"M4V ": "mp4",
+    b"qt  ": "mov",
+}
+
+# Extensions whose content has to match, anything else is only checked for executables
+_EXPECTED_TYPES = {
+    "jpg": {"jpeg"},
+    "jpeg": {"jpeg"},
+    "png": {"png"},
+    "gif": {"gif"},
+    "webp": {"webp"},
+    "bmp": {"bmp"},
+    "tif": {"tiff"},
+    "tiff": {"tiff"},
+    "ico": {"ico"},
+    "heic": {"heic"},
+    "heif": {"heic"},
+    "pdf": {"pdf"},
+}
+
+_EXECUTABLE_EXTENSIONS = {"exe", "dll", "so", "dylib", "app", "msi"}
+
+# Types Pillow decodes without plugins, the only ones that get previews
+PREVIEWABLE_TYPES = {"jpeg", "png", "gif", "webp", "bmp", "tiff"}
+
+
+def thumbnail_key(user_id, file_id, size) -> str:
+    return f"thumbnails/{user_id}/{file_id}/{size}.webp"
+
+
+def sniff_type(header: bytes) -> str | None:
+    """Content type from the magic bytes at the start of a file, None when unknown."""
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header[4:8] == b"ftyp":
+        return _FTYP_BRANDS.get(header[8:12])
+    for offset, signature, detected in _SIGNATURES:
+        if header[offset : offset + len(signature)] == signature:
+            return detected
+    if is_windows_executable(header):
+        return "executable"
+    return None
+
+
+def is_windows_executable(header: bytes) -> bool:
+    """
+    'MZ' alone starts plenty of text, a PE file also has 'PE\0\0' at the offset
+    stored at 0x3C (e_lfanew) of its DOS header.
+    """
+    if header[:2] != b"MZ" or len(header) < 0x40:
+        return False
+    pe_offset = int.from_bytes(header[0x3C:0x40], "little")
+    return header[pe_offset : pe_offset + 4] == b"PE\0\0"
+
+
+def is_acceptable(file_name, detected) -> bool:
+    """
+    A file named like an image or a PDF must really be one, and an executable
+    is only accepted under an executable extension.
+    """
+    ext = get_ext(file_name)
+    if detected == "executable":
+        return ext in _EXECUTABLE_EXTENSIONS
+    expected = _EXPECTED_TYPES.get(ext)
+    return expected is None or detected in expected
+
+
+def make_thumbnails(data: bytes, sizes=THUMBNAIL_SIZES, square=False) -> dict:
+    """
+    Decode the image once and derive every size from that one decode.
+    - JPEGs are decoded straight at the smallest DCT scale still covering the largest size
+    - Sizes are produced largest first, each from the previous one
+    - square crops to the centre instead of fitting the bounding box (profile photos)
+    Returns {size: webp bytes}.
+    """
+    from PIL import Image, ImageOps
+
+    sizes = sorted(sizes, reverse=True)
+    with Image.open(BytesIO(data)) as image:
+        image.draft("RGB", (sizes[0], sizes[0]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        thumbnails = {}
+        current = image
+        for size in sizes:
+            if square:
+                current = ImageOps.fit(current, (size, size), Image.Resampling.LANCZOS)
+            else:
+                ## exif_transpose already returned a copy, thumbnail() can work in place
+                current.thumbnail(
+                    (size, size), Image.Resampling.LANCZOS, reducing_gap=2.0
+                )
+            out = BytesIO()
+            current.save(out, "WEBP", quality=80, method=4)
+            thumbnails[size] = out.getvalue()
+    return thumbnails
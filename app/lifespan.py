@@ -1,22 +1,28 @@
 from contextlib import asynccontextmanager
-from .startup import (
-    DATABASE_URL,
-    pwd_context,
-    secret_key,
-    algorithm,
-    access_token_expire_minutes,
-    bucket_name,
-    region,
-)
+from .startup import load_settings, refresh_settings_periodically
 from .services.user_services import UserServices
 from .services.auth_services import AuthServices
 from .services.folder_services import FolderServices
-from .services.file_services import FileServices
+from .services.file_services import DELETE_OBJECTS_JOB, FileServices
 from .services.aws import AwsServices
 from .services.share_services import ShareServices
+from .services.quota_services import QuotaServices
+from .services.version_services import VersionServices
+from .services.copy_services import COPY_OBJECTS_JOB, CopyServices
+from .services.change_services import ChangeServices
+from .services.notifications import ChangeNotifier
+from .services.job_queue import JobQueue
+from .services.activity_log import ActivityLog
+from .services.interaction_tracker import InteractionTracker
+from .services.token_revocations import TokenRevocations
+from .services.query_tracer import QueryTracer, TracedConnection
+from .services.database import DatabaseRouter, WriteTokens
 from .routes.user_routes import create_user_routes
+from .routes.admin_routes import create_admin_routes
+import asyncio
 import asyncpg
 import logging
+import os
 
 # Module-level logger
 logger = logging.getLogger(__name__)
@@ -31,21 +37,110 @@ logging.basicConfig(
 
 @asynccontextmanager
 async def lifespan(app):
+    settings = await load_settings()
+
+    aws_services = AwsServices(
+        settings.region,
+        settings.bucket_name,
+        max_pool_connections=settings.s3_max_pool_connections,
+        max_concurrency=settings.s3_max_concurrency,
+        max_attempts=settings.s3_max_attempts,
+    )
+    # Build the S3 client in a thread while the pool connects, not on the first request
+    background_tasks = [
+        asyncio.create_task(asyncio.to_thread(aws_services.object_url_base))
+    ]
+
+    query_tracer = QueryTracer(
+        settings.slow_query_threshold_ms, settings.explain_sample_rate
+    )
+
+    async def create_pool(url):
+        return await asyncpg.create_pool(
+            url,
+            min_size=settings.db_pool_min_size,
+            max_size=settings.db_pool_max_size,
+            connection_class=TracedConnection,
+            init=query_tracer.setup_connection,
+        )
+
     try:
-        pool = await asyncpg.create_pool(DATABASE_URL)
-        logger.info("Database pool created")
+        pool = await create_pool(settings.database_url)
+        replica_pools = [await create_pool(url) for url in settings.db_replica_urls]
+        query_tracer.bind_pool(pool)
+        worker_metrics = app.state.worker_metrics
+        worker_metrics.bind_pool(pool)
+        logger.info(f"Database pool created with {len(replica_pools)} replicas")
     except Exception as exc:
         logger.error(f"Failed to create database pool: {exc}")
         raise
 
+    db = DatabaseRouter(
+        pool,
+        replica_pools,
+        WriteTokens.from_environment(),
+        max_replica_lag_s=settings.max_replica_lag_s,
+    )
+    if replica_pools:
+        background_tasks.append(asyncio.create_task(db.monitor_replication()))
+
     auth_services = AuthServices(
-        secret_key, algorithm, access_token_expire_minutes, pwd_context
+        settings.secret_key, settings.algorithm, settings.access_token_expire_minutes
+    )
+    ## Revoked tokens are checked in memory, loaded before the first request
+    token_revocations = TokenRevocations(
+        db,
+        settings.access_token_expire_minutes * 60,
+        capacity=int(os.getenv("REVOCATION_BLOOM_CAPACITY", "100000")),
+        refresh_interval_ms=int(os.getenv("REVOCATION_REFRESH_INTERVAL_MS", "1000")),
+    )
+    await token_revocations.rebuild()
+    app.state.token_revocations = token_revocations
+    background_tasks.append(asyncio.create_task(token_revocations.run()))
+    ## Activity is written behind the requests, in batches, see app/services/activity_log.py
+    activity_log = ActivityLog(
+        db,
+        max_pending=int(os.getenv("ACTIVITY_MAX_PENDING", "10000")),
+        batch_size=int(os.getenv("ACTIVITY_BATCH_SIZE", "500")),
+        flush_interval_ms=int(os.getenv("ACTIVITY_FLUSH_INTERVAL_MS", "200")),
     )
-    user_services = UserServices(pool, auth_services)
-    aws_services = AwsServices(region, bucket_name)
-    folder_services = FolderServices(pool)
-    file_services = FileServices(pool, folder_services, aws_services)
-    share_services = ShareServices(pool, file_services, folder_services)
+    background_tasks.append(asyncio.create_task(activity_log.run()))
+    ## Downloads and folder opens move last_interaction, coalesced per item
+    interaction_tracker = InteractionTracker(
+        db,
+        max_items=int(os.getenv("INTERACTION_MAX_ITEMS", "50000")),
+        flush_interval_ms=int(os.getenv("INTERACTION_FLUSH_INTERVAL_MS", "5000")),
+    )
+    background_tasks.append(asyncio.create_task(interaction_tracker.run()))
+    user_services = UserServices(db, auth_services)
+    folder_services = FolderServices(
+        db, aws_services, activity_log, interaction_tracker
+    )
+    quota_services = QuotaServices(db)
+    file_services = FileServices(
+        db,
+        folder_services,
+        aws_services,
+        quota_services,
+        activity_log,
+        interaction_tracker,
+    )
+    share_services = ShareServices(db, file_services, folder_services, activity_log)
+    version_services = VersionServices(db, file_services, aws_services, quota_services)
+    change_services = ChangeServices(db)
+    copy_services = CopyServices(db, folder_services, aws_services, quota_services)
+    ## One LISTEN connection per worker feeds every client connected to it
+    change_notifier = ChangeNotifier(settings.database_url, db)
+    background_tasks.append(asyncio.create_task(change_notifier.run()))
+    ## Every worker runs its share of the background jobs, see app/services/job_queue.py
+    job_queue = JobQueue(
+        db,
+        concurrency=int(os.getenv("JOB_WORKER_CONCURRENCY", "4")),
+        batch_size=int(os.getenv("JOB_BATCH_SIZE", "10")),
+    )
+    job_queue.register(DELETE_OBJECTS_JOB, file_services.delete_objects)
+    job_queue.register(COPY_OBJECTS_JOB, copy_services.copy_objects)
+    background_tasks.append(asyncio.create_task(job_queue.run()))
 
     user_routes = create_user_routes(
         user_services,
@@ -54,12 +149,54 @@ async def lifespan(app):
         aws_services,
         file_services,
         share_services,
+        version_services,
+        change_services,
+        change_notifier,
+        copy_services,
+        activity_log,
+        token_revocations,
     )
     app.include_router(user_routes)
+    admission = app.state.admission
+    admission.bind_db(db)
+    app.include_router(
+        create_admin_routes(query_tracer, worker_metrics, db, job_queue, admission)
+    )
+    background_tasks.append(asyncio.create_task(worker_metrics.publish_periodically()))
+    ## Refunds abandoned uploads and corrects drifted quotas, one worker at a time
+    background_tasks.append(
+        asyncio.create_task(
+            quota_services.maintain_periodically(
+                int(os.getenv("QUOTA_MAINTENANCE_INTERVAL_SECONDS", "300")),
+                int(os.getenv("QUOTA_RESERVATION_TTL_SECONDS", "3600")),
+            )
+        )
+    )
+
+    if os.getenv("ENVIRONMENT") == "production":
+
+        def apply_rotated_settings(new_settings):
+            auth_services.secret_key = new_settings.secret_key
+            auth_services.algorithm = new_settings.algorithm
+
+        background_tasks.append(
+            asyncio.create_task(
+                refresh_settings_periodically(
+                    int(os.getenv("SECRETS_REFRESH_SECONDS", "900")),
+                    apply_rotated_settings,
+                )
+            )
+        )
 
     yield
+    for task in background_tasks:
+        task.cancel()
+    worker_metrics.remove_snapshot()
+    await aws_services.close()
+    await activity_log.close()
+    await interaction_tracker.close()
     try:
-        await pool.close()
+        await db.close()
         logger.info("Database connection closed")
     except Exception as exc:
         logger.error(f"Error closing the database pool: {exc}")
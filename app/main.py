@@ -1,13 +1,40 @@
 from fastapi import FastAPI
 from .lifespan import lifespan
+from .services.worker_metrics import WorkerMetrics, WorkerMetricsMiddleware
+from .services.admission import AdmissionControl, AdmissionMiddleware
+from .services.deadlines import DeadlineMiddleware
 from fastapi.middleware.cors import CORSMiddleware
+import os
 
 app = FastAPI(lifespan=lifespan)
 
+
+## Mounted with the app instead of by lifespan, so it never depends on the pool being up
+@app.get("/health")
+def health_check():
+    return {"status": "healthy"}
+
+
+## Created here because middleware can't be added once lifespan runs
+app.state.worker_metrics = WorkerMetrics()
+app.state.admission = AdmissionControl(
+    max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "256")),
+    min_in_flight=int(os.getenv("ADMISSION_MIN_IN_FLIGHT", "4")),
+    target_wait_ms=int(os.getenv("ADMISSION_TARGET_WAIT_MS", "50")),
+)
+
+## Innermost first: a request's deadline starts once it is admitted, and 503s and
+## 504s still get CORS headers and are counted
+app.add_middleware(
+    DeadlineMiddleware, default_ms=int(os.getenv("REQUEST_DEADLINE_MS", "10000"))
+)
+app.add_middleware(AdmissionMiddleware, admission=app.state.admission)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://clouddrive.world"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
+app.add_middleware(WorkerMetricsMiddleware, metrics=app.state.worker_metrics)
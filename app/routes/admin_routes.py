@@ -0,0 +1,53 @@
+from typing import Annotated, Literal
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.dependencies import verify_admin_secret
+
+
+def create_admin_routes(
+    query_tracer, worker_metrics, db, job_queue, admission
+) -> APIRouter:
+    admin_routes = APIRouter(
+        prefix="/admin", dependencies=[Depends(verify_admin_secret)]
+    )
+
+    @admin_routes.get("/top-queries")
+    async def top_queries(
+        limit: Annotated[int, Query(ge=1, le=200)] = 20,
+        order_by: Literal["total_ms", "max_ms", "calls", "slow_calls"] = "total_ms",
+    ):
+        return {
+            "slow_query_threshold_ms": query_tracer.slow_query_threshold_ms,
+            "queries": query_tracer.top_queries(limit, order_by),
+        }
+
+    @admin_routes.delete("/top-queries")
+    async def reset_top_queries():
+        query_tracer.reset()
+        return {"status": "reset"}
+
+    @admin_routes.get("/workers")
+    async def workers():
+        return {
+            "served_by": worker_metrics.worker_id,
+            "workers": worker_metrics.all_workers(),
+        }
+
+    @admin_routes.get("/replication")
+    async def replication():
+        return db.replication_status()
+
+    @admin_routes.get("/admission")
+    async def admission_status():
+        return admission.status()
+
+    @admin_routes.get("/jobs")
+    async def jobs():
+        return await job_queue.status()
+
+    @admin_routes.post("/jobs/{job_id}/retry")
+    async def retry_job(job_id: int):
+        if not await job_queue.retry_dead(job_id):
+            raise HTTPException(status_code=404, detail="Dead job not found")
+        return {"status": "queued"}
+
+    return admin_routes
@@ -1,5 +1,6 @@
 from email.header import Header
 from typing import Annotated
+from uuid import UUID
 from fastapi import APIRouter, HTTPException, Depends, Query, Path, Header, Body
 from pygments.lexers import q
 
@@ -12,11 +13,22 @@ from app.schemas.schemas import (
     UpdateFolderName,
     RenameFile,
     Share,
+    BulkShare,
     SharedWithMeResponse,
+    SharedByMeResponse,
+    ShareListQuery,
+    UploadResults,
+    NewFileVersion,
+    ChangeFeedQuery,
+    ChangeFeed,
+    ActivityFeedQuery,
+    ActivityFeed,
+    CopyRequest,
+    CopyProgress,
 )
 from fastapi.security import OAuth2PasswordRequestForm
-from app.dependencies import get_token_and_decode
-from fastapi.responses import JSONResponse
+from app.dependencies import get_token_and_decode, get_token_payload
+from fastapi.responses import JSONResponse, StreamingResponse
 
 
 def create_user_routes(
@@ -26,6 +38,12 @@ def create_user_routes(
     aws_services,
     file_services,
     share_services,
+    version_services,
+    change_services,
+    change_notifier,
+    copy_services,
+    activity_log,
+    token_revocations,
 ) -> APIRouter:
     user_routes = APIRouter()
 
@@ -56,6 +74,16 @@ def create_user_routes(
             "token_type": "bearer",
         }
 
+    @user_routes.post("/logout")
+    async def logout(payload: Annotated[dict, Depends(get_token_payload)]):
+        await token_revocations.revoke_token(payload)
+        return {"message": "Logged out"}
+
+    @user_routes.post("/logout-all")
+    async def logout_everywhere(user_id: Annotated[str, Depends(get_token_and_decode)]):
+        await token_revocations.revoke_all(user_id)
+        return {"message": "Logged out on every device"}
+
     @user_routes.post("/drive")
     async def create_folder(
         user_id: Annotated[str, Depends(get_token_and_decode)],
@@ -73,7 +101,10 @@ def create_user_routes(
     ):
 
         data = await folder_services.retrieve_folder_content(
-            user_id, query.sort_by, query.order
+            user_id,
+            query.sort_by,
+            query.order,
+            thumbnail_size=query.thumbnail_size if query.thumbnails else None,
         )
         return data
 
@@ -85,10 +116,37 @@ def create_user_routes(
     ):
 
         data = await folder_services.retrieve_folder_content(
-            user_id, query.sort_by, query.order, folder_id
+            user_id,
+            query.sort_by,
+            query.order,
+            folder_id,
+            thumbnail_size=query.thumbnail_size if query.thumbnails else None,
         )
         return data
 
+    @user_routes.get("/changes", response_model=ChangeFeed)
+    async def get_changes(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        query: Annotated[ChangeFeedQuery, Query()],
+    ):
+        return await change_services.list_changes(user_id, query.cursor, query.limit)
+
+    @user_routes.get("/activity", response_model=ActivityFeed)
+    async def get_activity(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        query: Annotated[ActivityFeedQuery, Query()],
+    ):
+        return await activity_log.feed(user_id, query.before, query.limit)
+
+    @user_routes.get("/events")
+    async def get_events(user_id: Annotated[str, Depends(get_token_and_decode)]):
+        """Server-sent events telling the client when to call GET /changes."""
+        return StreamingResponse(
+            change_notifier.stream(user_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
     @user_routes.patch("/drive/{folder_id}")
     async def update_folder_name(
         user_id: Annotated[str, Depends(get_token_and_decode)],
@@ -126,6 +184,61 @@ def create_user_routes(
             user_id, file_id, rename_info.file_name, rename_info.folder_id
         )
 
+    @user_routes.delete("/file/{file_id}")
+    async def delete_file(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        file_id: Annotated[str, Path(min_length=36, max_length=36)],
+    ):
+        return await file_services.delete_file(user_id, file_id)
+
+    @user_routes.get("/file/{file_id}/versions")
+    async def list_file_versions(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        file_id: Annotated[str, Path(min_length=36, max_length=36)],
+    ):
+        return await version_services.list_versions(user_id, file_id)
+
+    @user_routes.post("/file/{file_id}/versions")
+    async def create_file_version(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        file_id: Annotated[str, Path(min_length=36, max_length=36)],
+        version: NewFileVersion,
+    ):
+        return await version_services.create_chunked_version(
+            user_id, file_id, version.chunks
+        )
+
+    @user_routes.post("/file/{file_id}/versions/{version_id}/commit")
+    async def commit_file_version(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        file_id: Annotated[str, Path(min_length=36, max_length=36)],
+        version_id: Annotated[str, Path(min_length=36, max_length=36)],
+    ):
+        return await version_services.commit_chunked_version(
+            user_id, file_id, version_id
+        )
+
+    @user_routes.post("/file/{file_id}/versions/{version_id}/restore")
+    async def restore_file_version(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        file_id: Annotated[str, Path(min_length=36, max_length=36)],
+        version_id: Annotated[str, Path(min_length=36, max_length=36)],
+    ):
+        return await version_services.restore_version(user_id, file_id, version_id)
+
+    @user_routes.post("/copy")
+    async def copy(
+        user_id: Annotated[str, Depends(get_token_and_decode)], copy_info: CopyRequest
+    ):
+        return await copy_services.copy(user_id, copy_info)
+
+    @user_routes.get("/copy/{copy_id}", response_model=CopyProgress)
+    async def copy_progress(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        copy_id: Annotated[str, Path(min_length=36, max_length=36)],
+    ):
+        return await copy_services.copy_progress(user_id, copy_id)
+
     @user_routes.post("/share")
     async def share(
         user_id: Annotated[str, Depends(get_token_and_decode)], share_info: Share
@@ -134,9 +247,25 @@ def create_user_routes(
             return await share_services.share_file(user_id, share_info)
         return await share_services.share_folder(user_id, share_info)
 
+    @user_routes.post("/share/bulk")
+    async def share_many(
+        user_id: Annotated[str, Depends(get_token_and_decode)], bulk: BulkShare
+    ):
+        return await share_services.share_many(user_id, bulk)
+
     @user_routes.get("/shared-with-me", response_model=SharedWithMeResponse)
-    async def share_with_me(user_id: Annotated[str, Depends(get_token_and_decode)]):
-        return await share_services.get_shared_with_me(user_id)
+    async def share_with_me(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        query: Annotated[ShareListQuery, Query()],
+    ):
+        return await share_services.get_shared_with_me(user_id, **query.model_dump())
+
+    @user_routes.get("/shared-by-me", response_model=SharedByMeResponse)
+    async def share_by_me(
+        user_id: Annotated[str, Depends(get_token_and_decode)],
+        query: Annotated[ShareListQuery, Query()],
+    ):
+        return await share_services.get_shared_by_me(user_id, **query.model_dump())
 
     @user_routes.post("/profile-photo")
     async def upload_profile_image(
@@ -153,10 +282,6 @@ def create_user_routes(
         await user_services.validate_if_user_has_profile_picture(user_id)
         return aws_services.generate_presigned_photo_download_url(user_id)
 
-    @user_routes.get("/health")
-    def health_check():
-        return {"status": "healthy"}
-
     @user_routes.get("/verify-token")
     async def verify_token(user_id: Annotated[str, Depends(get_token_and_decode)]):
         return {"status": "valid", "user_id": user_id}
@@ -168,4 +293,25 @@ def create_user_routes(
         await user_services.confirm_user_profile_picture(user_id, x_lambda_secret)
         return {"status": "success"}
 
+    @user_routes.post("/confirm-file-upload")
+    async def confirm_file_upload(
+        x_lambda_secret: Annotated[str, Header()],
+        file_ids: Annotated[list[UUID], Body(embed=True)],
+    ):
+        confirmed = await file_services.confirm_file_uploads(file_ids, x_lambda_secret)
+        return {"status": "success", "confirmed": confirmed}
+
+    @user_routes.post("/upload-results")
+    async def upload_results(
+        x_lambda_secret: Annotated[str, Header()], results: UploadResults
+    ):
+        outcome = await file_services.record_upload_results(
+            results.files, x_lambda_secret
+        )
+        if results.profile_photos:
+            await user_services.confirm_user_profile_pictures(
+                results.profile_photos, x_lambda_secret
+            )
+        return {"status": "success", **outcome}
+
     return user_routes
@@ -2,6 +2,7 @@ from pydantic import BaseModel, Field, EmailStr, SecretStr, model_validator
 from typing import Literal, Annotated, Optional
 from uuid import UUID
 from ..helpers.file_utils import is_allowed_extension
+from ..helpers.chunking import MAX_CHUNK_SIZE
 
 
 class RegisterUser(BaseModel):
@@ -29,12 +30,15 @@ class UploadFileInfo(BaseModel):
     Headers for file upload endpoint.
     folder_id: Optional, files can be uploaded to root.
     conflict: Optional, only needed when name collision detected.
+    sha256: Optional, hex digest of the content. Content the user already stored
+    is linked instead of uploaded again (no upload URL, instant_upload is true).
     """
 
     file_name: str = Field(min_length=3, max_length=50)
-    file_size_in_bytes: int
+    file_size_in_bytes: int = Field(gt=0)
     parent_folder_id: Optional[UUID] = None
     file_conflict: Optional[Literal["Replace", "Keep"]] = None
+    sha256: Optional[str] = Field(None, pattern=r"^[0-9a-fA-F]{64}$")
 
     @model_validator(mode="after")
     def validate_extension(self):
@@ -65,6 +69,7 @@ class FolderOrFileInfo(BaseModel):
     created_at: str
     last_interaction: str
     parent_folder_id: Optional[str] = None
+    thumbnail_url: Optional[str] = None  # Only with ?thumbnails=true, images only
 
 
 class UserInfo(BaseModel):
@@ -88,6 +93,8 @@ class FolderContents(BaseModel):
 class FolderContentQuery(BaseModel):
     sort_by: Literal["name", "created_at", "last_interaction"] = "last_interaction"
     order: Literal["DESC", "ASC"] = "ASC"
+    thumbnails: bool = False
+    thumbnail_size: Literal[64, 256, 1024] = 256
 
 
 class UpdateFolderName(BaseModel):
@@ -141,6 +148,70 @@ class Share(BaseModel):
         return self
 
 
+class BulkShare(BaseModel):
+    """Share every listed file and folder with every listed user, same permissions."""
+
+    usernames: list[Annotated[str, Field(min_length=3, max_length=15)]] = Field(
+        min_length=1, max_length=100
+    )
+    file_ids: list[UUID] = Field(default=[], max_length=1000)
+    folder_ids: list[UUID] = Field(default=[], max_length=1000)
+
+    read: bool = False
+    write: bool = False
+    delete: bool = False
+
+    @model_validator(mode="after")
+    def validate_items(self):
+        if not self.file_ids and not self.folder_ids:
+            raise ValueError("Bulk share requires file_ids or folder_ids")
+        if len(self.usernames) * (len(self.file_ids) + len(self.folder_ids)) > 10_000:
+            raise ValueError("Bulk share is limited to 10000 shares per request")
+        return self
+
+    @model_validator(mode="after")
+    def validate_permissions(self):
+        if not self.read and not self.write and not self.delete:
+            raise ValueError("Must grant at least one permission")
+        return self
+
+
+class CopyRequest(BaseModel):
+    """Copy a file or a folder with its subtree, into the root when no destination."""
+
+    copy_object_type: Literal["folder", "file"]
+    file_id: Optional[UUID] = None
+    folder_id: Optional[UUID] = None
+    destination_folder_id: Optional[UUID] = None
+
+    @model_validator(mode="after")
+    def validate_ids(self):
+        if self.copy_object_type == "file":
+            if self.file_id is None:
+                raise ValueError("File copy requires file_id")
+            if self.folder_id is not None:
+                raise ValueError("File copy cannot have folder_id")
+        else:
+            if self.folder_id is None:
+                raise ValueError("Folder copy requires folder_id")
+            if self.file_id is not None:
+                raise ValueError("Folder copy cannot have file_id")
+        return self
+
+
+class CopyProgress(BaseModel):
+    """The copied files are usable once done."""
+
+    copy_id: UUID
+    object_type: Literal["file", "folder"]
+    object_id: UUID
+    total_files: int
+    copied_files: int
+    total_bytes: int
+    copied_bytes: int
+    done: bool
+
+
 class SharedFileFolderResponse(BaseModel):
     shared_at: str
     delete: bool
@@ -155,3 +226,98 @@ class SharedFileFolderResponse(BaseModel):
 
 class SharedWithMeResponse(BaseModel):
     content: list[SharedFileFolderResponse]
+    next_cursor: Optional[str] = None
+
+
+class SharedByMeResponse(SharedWithMeResponse):
+    """Same shape, email is the recipient's."""
+
+
+class ShareListQuery(BaseModel):
+    """Pass next_cursor back as cursor with the same sort_by and order for the next page."""
+
+    sort_by: Literal["shared_at", "name"] = "shared_at"
+    order: Literal["DESC", "ASC"] = "DESC"
+    limit: int = Field(default=50, ge=1, le=200)
+    cursor: Optional[str] = Field(default=None, max_length=200)
+
+
+class ChangeFeedQuery(BaseModel):
+    cursor: int = Field(default=0, ge=0)
+    limit: int = Field(default=500, ge=1, le=1000)
+
+
+class ChangeEntry(BaseModel):
+    cursor: int
+    kind: Literal["created", "renamed", "moved", "uploaded", "deleted", "shared"]
+    object_type: Literal["file", "folder"]
+    object_id: UUID
+    changed_at: str
+    name: Optional[str]
+    parent_folder_id: Optional[UUID]
+    size_in_bytes: Optional[int]
+    type: Optional[str]
+
+
+class ChangeFeed(BaseModel):
+    """Pass cursor back to get the changes after this batch, has_more means don't wait."""
+
+    changes: list[ChangeEntry]
+    cursor: int
+    has_more: bool
+
+
+class ActivityFeedQuery(BaseModel):
+    before: Optional[int] = Field(default=None, ge=1)
+    limit: int = Field(default=50, ge=1, le=200)
+
+
+class ActivityEntry(BaseModel):
+    id: int
+    action: Literal["upload", "download", "rename", "share"]
+    object_type: Literal["file", "folder"]
+    object_id: UUID
+    detail: Optional[str]
+    occurred_at: str
+
+
+class ActivityFeed(BaseModel):
+    """Newest first, pass next_before back as before for older events."""
+
+    activity: list[ActivityEntry]
+    next_before: Optional[int]
+
+
+class ChunkInfo(BaseModel):
+    """One content-defined chunk, see app/helpers/chunking.py."""
+
+    sha256: str = Field(pattern=r"^[0-9a-fA-F]{64}$")
+    size_in_bytes: int = Field(gt=0, le=MAX_CHUNK_SIZE)
+
+
+class NewFileVersion(BaseModel):
+    """Manifest of a new version, the file's content is its chunks in order."""
+
+    chunks: list[ChunkInfo] = Field(min_length=1, max_length=100_000)
+
+
+class FileUploadResult(BaseModel):
+    """
+    One upload as seen by the thumbnail worker.
+    file_id: last segment of the object key, a blob id for deduplicated content.
+    detected_type: sniffed from the magic bytes, None when unknown.
+    """
+
+    file_id: UUID
+    detected_type: Optional[str] = None
+    has_thumbnails: bool = False
+
+
+class UploadResults(BaseModel):
+    """
+    Batched upload callback body.
+    profile_photos: users whose new profile photo passed validation.
+    """
+
+    files: list[FileUploadResult] = []
+    profile_photos: list[UUID] = []
@@ -0,0 +1,304 @@
+"""
+Multi-worker launcher.
+
+Binds the listening socket once and runs N uvicorn workers on it, each in its
+own process, so JWT decoding, bcrypt, validation and presigning use every core.
+
+    python -m app.serve --workers 4 --host 0.0.0.0 --port 8080
+
+- DB_CONNECTION_BUDGET (or --db-connections) is the total Postgres connection
+  budget, every worker's pool gets an equal share of what's left once each
+  worker's LISTEN connection and a spare worker for rolling restarts are set
+  aside, and the worker count is lowered when it can't give each worker one
+- SIGHUP restarts the workers one at a time, a replacement serves before the old
+  worker is asked to drain, so the socket never stops accepting
+- Workers that die are replaced, after a delay doubling with each quick crash of
+  the same slot so a worker failing at startup isn't respawned in a hot loop
+- SIGINT/SIGTERM drain everything and exit
+"""
+
+from multiprocessing.connection import wait
+from time import monotonic
+from .services.database import WRITE_TOKENS_SHM_ENV, WriteTokens
+import argparse
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+
+logger = logging.getLogger("app.serve")
+
+# Spawned workers import the app fresh, nothing from the supervisor leaks into them
+_spawn = multiprocessing.get_context("spawn")
+
+
+# Connections a worker holds outside its pool, the change notifier's LISTEN connection
+CONNECTIONS_OUTSIDE_POOL = 1
+# A rolling restart starts each replacement before its predecessor drains
+RESTART_SURGE_WORKERS = 1
+
+# A slot's first crash is replaced after this many seconds, each further one twice as late
+RESPAWN_BACKOFF_S = 1
+RESPAWN_BACKOFF_MAX_S = 60
+# A worker that served this long before dying starts its slot's backoff over
+RESPAWN_BACKOFF_RESET_S = 60
+
+
+def size_workers(connection_budget, workers) -> tuple[int, int]:
+    """
+    (workers, pool size) so every connection the workers open fits the budget,
+    during a rolling restart too. Each worker slot, the surge one included, takes
+    its pool plus CONNECTIONS_OUTSIDE_POOL. Replica pools are sized like the primary
+    one and hold no LISTEN connection, so each replica stays within the budget too.
+    Fewer workers than asked for when the budget can't give each a pool of one.
+    """
+    slot = 1 + CONNECTIONS_OUTSIDE_POOL
+    max_workers = connection_budget // slot - RESTART_SURGE_WORKERS
+    if max_workers < 1:
+        raise ValueError(
+            f"A budget of {connection_budget} connections can't run a single worker, "
+            f"it needs at least {slot * (1 + RESTART_SURGE_WORKERS)}"
+        )
+    workers = min(workers, max_workers)
+    pool_size = connection_budget // (workers + RESTART_SURGE_WORKERS)
+    return workers, pool_size - CONNECTIONS_OUTSIDE_POOL
+
+
+def worker_environment(worker_id, pool_max_size, metrics_dir, write_tokens_shm) -> dict:
+    pool_min_size = min(
+        int(os.getenv("DB_POOL_MIN_SIZE", pool_max_size)), pool_max_size
+    )
+    return {
+        "WORKER_ID": str(worker_id),
+        "WORKER_METRICS_DIR": metrics_dir,
+        "DB_POOL_MAX_SIZE": str(pool_max_size),
+        "DB_POOL_MIN_SIZE": str(pool_min_size),
+        # Read-your-writes tokens are shared, a user's next request may land on any worker
+        WRITE_TOKENS_SHM_ENV: write_tokens_shm,
+    }
+
+
+def run_worker(sock, env, ready, uvicorn_options):
+    """Worker process entry point, serves app.main:app on the inherited socket."""
+    os.environ.update(env)
+
+    import uvicorn
+
+    class Server(uvicorn.Server):
+        async def startup(self, sockets=None):
+            await super().startup(sockets=sockets)
+            if not self.should_exit:
+                ready.set()
+
+    config = uvicorn.Config("app.main:app", **uvicorn_options)
+    Server(config).run(sockets=[sock])
+
+
+class Worker:
+    def __init__(self, worker_id, process, ready, crashes=0):
+        self.worker_id = worker_id
+        self.process = process
+        self.ready = ready
+        self.started_at = monotonic()
+        # Quick crashes of the slot in a row, carried over to each replacement
+        self.crashes = crashes
+        # Set once the worker died, when its replacement is due
+        self.respawn_at = None
+
+
+class Supervisor:
+    def __init__(
+        self, sock, workers, pool_max_size, uvicorn_options, ready_timeout_s=60
+    ):
+        self.sock = sock
+        self.workers_count = workers
+        self.pool_max_size = pool_max_size
+        self.uvicorn_options = uvicorn_options
+        self.ready_timeout_s = ready_timeout_s
+        self.metrics_dir = tempfile.mkdtemp(prefix="clouddrive-workers-")
+        self.write_tokens_shm = WriteTokens.create_shared()
+        self.workers: list[Worker] = []
+        self.should_exit = False
+        self.should_restart = False
+
+    def spawn(self, worker_id, crashes=0) -> Worker:
+        ready = _spawn.Event()
+        env = worker_environment(
+            worker_id, self.pool_max_size, self.metrics_dir, self.write_tokens_shm.name
+        )
+        process = _spawn.Process(
+            target=run_worker,
+            args=(self.sock, env, ready, self.uvicorn_options),
+            name=f"worker-{worker_id}",
+        )
+        process.start()
+        logger.info(f"Started worker {worker_id} (pid {process.pid})")
+        return Worker(worker_id, process, ready, crashes)
+
+    def stop(self, worker, timeout_s=None):
+        """SIGTERM makes uvicorn stop accepting and drain in-flight requests."""
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.process.join(timeout_s)
+        if worker.process.is_alive():
+            logger.warning(
+                f"Worker {worker.worker_id} did not drain in time, killing it"
+            )
+            worker.process.kill()
+            worker.process.join()
+        self.remove_snapshot(worker)
+
+    def remove_snapshot(self, worker):
+        path = os.path.join(
+            self.metrics_dir, f"worker-{worker.worker_id}-{worker.process.pid}.json"
+        )
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def rolling_restart(self):
+        """Replace the workers one by one, each replacement is serving before its predecessor drains."""
+        logger.info("Rolling restart of all workers")
+        for index, old in enumerate(list(self.workers)):
+            if self.should_exit:
+                return
+            new = self.spawn(old.worker_id)
+            if not new.ready.wait(self.ready_timeout_s):
+                logger.error(
+                    f"Replacement for worker {old.worker_id} never became ready, keeping the old one"
+                )
+                self.stop(new, timeout_s=0)
+                continue
+            self.workers[index] = new
+            self.stop(
+                old, timeout_s=self.uvicorn_options.get("timeout_graceful_shutdown")
+            )
+
+    def replace_dead_workers(self):
+        """
+        Respawn dead workers once their slot's backoff ran out. A worker dying soon
+        after it started, on a bad deploy or a database it can't reach, doubles the
+        delay before the next one up to RESPAWN_BACKOFF_MAX_S.
+        """
+        now = monotonic()
+        for index, worker in enumerate(self.workers):
+            if worker.process.is_alive() or self.should_exit:
+                continue
+            if worker.respawn_at is None:
+                if now - worker.started_at >= RESPAWN_BACKOFF_RESET_S:
+                    worker.crashes = 0
+                worker.crashes += 1
+                delay = min(
+                    RESPAWN_BACKOFF_S * 2 ** (worker.crashes - 1), RESPAWN_BACKOFF_MAX_S
+                )
+                worker.respawn_at = now + delay
+                logger.error(
+                    f"Worker {worker.worker_id} exited with code {worker.process.exitcode}, "
+                    f"replacing it in {delay}s"
+                )
+                self.remove_snapshot(worker)
+            if now >= worker.respawn_at:
+                self.workers[index] = self.spawn(worker.worker_id, worker.crashes)
+
+    def handle_exit(self, signum, frame):
+        self.should_exit = True
+
+    def handle_restart(self, signum, frame):
+        self.should_restart = True
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.handle_exit)
+        signal.signal(signal.SIGTERM, self.handle_exit)
+        signal.signal(signal.SIGHUP, self.handle_restart)
+
+        self.workers = [
+            self.spawn(worker_id) for worker_id in range(self.workers_count)
+        ]
+        try:
+            while not self.should_exit:
+                if self.should_restart:
+                    self.should_restart = False
+                    self.rolling_restart()
+                ## A dead worker's sentinel stays ready until it's replaced
+                wait(
+                    [w.process.sentinel for w in self.workers if w.respawn_at is None],
+                    timeout=0.5,
+                )
+                self.replace_dead_workers()
+        finally:
+            logger.info("Shutting down workers")
+            for worker in self.workers:
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            for worker in self.workers:
+                self.stop(
+                    worker,
+                    timeout_s=self.uvicorn_options.get("timeout_graceful_shutdown"),
+                )
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
+            self.write_tokens_shm.close()
+            self.write_tokens_shm.unlink()
+            self.sock.close()
+
+
+def bind_socket(host, port, backlog) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+    )
+    parser.add_argument(
+        "--db-connections",
+        type=int,
+        default=int(os.getenv("DB_CONNECTION_BUDGET", "20")),
+        help="total Postgres connections shared by all workers",
+    )
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--graceful-timeout", type=int, default=30)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    args = parse_args(argv)
+    workers, pool_max_size = size_workers(args.db_connections, args.workers)
+    if workers < args.workers:
+        logger.warning(
+            f"A budget of {args.db_connections} database connections fits "
+            f"{workers} workers, not {args.workers}, raise DB_CONNECTION_BUDGET "
+            "to run more"
+        )
+    sock = bind_socket(args.host, args.port, args.backlog)
+    logger.info(
+        f"Serving on {args.host}:{args.port} with {workers} workers, "
+        f"{pool_max_size} pooled database connections each"
+    )
+    uvicorn_options = {
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "backlog": args.backlog,
+    }
+    Supervisor(sock, workers, pool_max_size, uvicorn_options).run()
+
+
+if __name__ == "__main__":
+    main()
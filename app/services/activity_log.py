@@ -0,0 +1,125 @@
+from collections import deque
+from datetime import datetime, timezone
+from itertools import islice
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("user_id", "action", "object_type", "object_id", "detail", "occurred_at")
+
+
+# noinspection SqlNoDataSourceInspection
+class ActivityLog:
+    """
+    Write-behind activity history, see app/db/migrations/0012_activity.sql.
+    Services record events into a bounded in-process buffer without a round trip, a
+    background task copies them in with COPY every flush_interval_ms or as soon as
+    batch_size are waiting. Past max_pending buffered events (the database is down or
+    can't keep up) new events are dropped and counted rather than slowing requests.
+    """
+
+    def __init__(self, db, max_pending=10_000, batch_size=500, flush_interval_ms=200):
+        self.db = db
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_ms / 1000
+        self.pending = deque()
+        self.written = 0
+        self.dropped = 0
+        self._batch_ready = asyncio.Event()
+        self._flushing = asyncio.Lock()
+
+    def record(self, user_id, action, object_type, object_id, detail=None) -> bool:
+        """Buffer one event, False when it was dropped."""
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(
+                    f"Activity buffer full, {self.dropped} events dropped so far"
+                )
+            return False
+        self.pending.append(
+            (
+                user_id,
+                action,
+                object_type,
+                object_id,
+                detail,
+                datetime.now(timezone.utc).replace(tzinfo=None),
+            )
+        )
+        if len(self.pending) >= self.batch_size:
+            self._batch_ready.set()
+        return True
+
+    async def flush(self) -> int:
+        """
+        Copy everything buffered in batches. A batch leaves the buffer only once its
+        COPY succeeded, a failed one is retried by the next flush.
+        Returns the number of events written.
+        """
+        written = 0
+        async with self._flushing:
+            while self.pending:
+                batch = list(islice(self.pending, self.batch_size))
+                try:
+                    async with self.db.acquire() as conn:
+                        await conn.copy_records_to_table(
+                            "activity", records=batch, columns=COLUMNS
+                        )
+                except Exception as exc:
+                    logger.error(f"Activity flush of {len(batch)} events failed: {exc}")
+                    break
+                for _ in batch:
+                    self.pending.popleft()
+                written += len(batch)
+        self.written += written
+        return written
+
+    async def run(self):
+        """Lifespan background task."""
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._batch_ready.wait(), timeout=self.flush_interval_s
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def close(self):
+        """Flush what's left on shutdown, once run() is cancelled."""
+        written = await self.flush()
+        if self.pending:
+            logger.error(f"{len(self.pending)} activity events lost on shutdown")
+        return written
+
+    async def feed(self, user_id, before=None, limit=50) -> dict:
+        """
+        The user's events, newest first. Pass next_before back as before for older ones,
+        None once there are no more.
+        """
+        async with self.db.acquire_read(user_id) as conn:
+            rows = await conn.fetch(
+                "SELECT id, action, object_type, object_id, detail, occurred_at "
+                "FROM activity WHERE user_id = $1 AND id < $2 ORDER BY id DESC LIMIT $3",
+                user_id,
+                before or 2**63 - 1,
+                limit + 1,
+            )
+        return {
+            "activity": [
+                {
+                    "id": row["id"],
+                    "action": row["action"],
+                    "object_type": row["object_type"],
+                    "object_id": str(row["object_id"]),
+                    "detail": row["detail"],
+                    "occurred_at": row["occurred_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                }
+                for row in rows[:limit]
+            ],
+            "next_before": rows[limit - 1]["id"] if len(rows) > limit else None,
+        }
@@ -0,0 +1,120 @@
+import json
+import math
+import time
+
+# Always admitted and never counted: probes, logins and the Lambda callbacks that
+# settle uploads, so overload can't fail health checks, lock users out or strand uploads
+EXEMPT_PATHS = frozenset(
+    {
+        "/health",
+        "/login",
+        "/confirm-file-upload",
+        "/upload-results",
+        "/confirm-profile-picture",
+    }
+)
+# Shed like the rest, but not counted once admitted: they stay open for minutes
+# without holding a database connection
+LONG_LIVED_PATHS = frozenset({"/events"})
+
+
+class AdmissionControl:
+    """
+    Adaptive concurrency limit for this worker's requests.
+    The limit shrinks by a quarter every adjust_interval_ms while getting a database
+    connection takes longer than target_wait_ms on average, and grows back by a tenth
+    once it doesn't, between min_in_flight and max_in_flight. Requests past the limit
+    are refused at once with 503 and Retry-After instead of queueing on the pool.
+    """
+
+    def __init__(
+        self,
+        max_in_flight=256,
+        min_in_flight=4,
+        target_wait_ms=50,
+        adjust_interval_ms=100,
+        exempt_paths=EXEMPT_PATHS,
+    ):
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.target_wait_ms = target_wait_ms
+        self.adjust_interval_s = adjust_interval_ms / 1000
+        self.exempt_paths = exempt_paths
+        self.db = None
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._adjusted_at = 0.0
+
+    def bind_db(self, db):
+        self.db = db
+
+    def adjust(self):
+        now = time.monotonic()
+        if self.db is None or now - self._adjusted_at < self.adjust_interval_s:
+            return
+        self._adjusted_at = now
+        if self.db.acquire_wait_ms > self.target_wait_ms:
+            self.limit = max(self.min_in_flight, self.limit * 3 // 4)
+        else:
+            self.limit = min(self.max_in_flight, self.limit + max(1, self.limit // 10))
+
+    def try_admit(self) -> bool:
+        self.adjust()
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def retry_after_s(self) -> int:
+        """About how long the pool takes to hand out a connection right now."""
+        wait_ms = self.db.acquire_wait_ms if self.db else 0
+        return min(30, max(1, math.ceil(wait_ms / 1000)))
+
+    def status(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "acquire_wait_ms": round(self.db.acquire_wait_ms, 3) if self.db else None,
+        }
+
+
+class AdmissionMiddleware:
+    """Plain ASGI middleware, refuses before routing so a refusal costs no connection."""
+
+    def __init__(self, app, admission: AdmissionControl):
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path")
+        if scope["type"] != "http" or path in self.admission.exempt_paths:
+            return await self.app(scope, receive, send)
+
+        if not self.admission.try_admit():
+            body = json.dumps({"detail": "Server overloaded, retry later"}).encode()
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(self.admission.retry_after_s()).encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        if path in LONG_LIVED_PATHS:
+            return await self.app(scope, receive, send)
+        self.admission.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.in_flight -= 1
@@ -1,13 +1,25 @@
 from datetime import datetime, timedelta, timezone
 import jwt
+import uuid
 
 
 class AuthServices:
-    def __init__(self, secret_key, algorithm, access_token_expire_minutes, pwd_context):
+    def __init__(
+        self, secret_key, algorithm, access_token_expire_minutes, pwd_context=None
+    ):
         self.secret_key = secret_key
         self.algorithm = algorithm
         self.access_token_expire_minutes = access_token_expire_minutes
-        self.pwd_context = pwd_context
+        self._pwd_context = pwd_context
+
+    @property
+    def pwd_context(self):
+        # passlib is only imported once the first password is hashed or checked
+        if self._pwd_context is None:
+            from passlib.context import CryptContext
+
+            self._pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        return self._pwd_context
 
     def hash_password(self, password) -> str:
         return self.pwd_context.hash(password)
@@ -16,9 +28,11 @@ class AuthServices:
         return self.pwd_context.verify(plain_password, hashed_password)
 
     def create_access_token(self, data: dict) -> str:
-        expires = datetime.now(timezone.utc) + timedelta(
-            minutes=self.access_token_expire_minutes
+        """jti names the token for logout, iat places it against logout everywhere."""
+        issued_at = datetime.now(timezone.utc)
+        expires = issued_at + timedelta(minutes=self.access_token_expire_minutes)
+        data.update(
+            {"exp": expires, "iat": issued_at.timestamp(), "jti": str(uuid.uuid4())}
         )
-        data.update({"exp": expires})
         encoded_jwt = jwt.encode(data, key=self.secret_key, algorithm=self.algorithm)
         return encoded_jwt
@@ -1,11 +1,146 @@
-import boto3
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+from ..helpers.image_utils import THUMBNAIL_SIZES, thumbnail_key
+from .deadlines import within_deadline
+import asyncio
+import base64
+import hashlib
+import hmac
+import threading
+import time
+
+# URLs of immutable objects (thumbnails, chunks) are signed as of the start of their
+# window and stay valid for two, so every response within a window hands out
+# byte-identical URLs the browser already has cached, and a URL is always good
+# for at least one window
+CACHEABLE_URL_WINDOW_S = 3600
+
+# Server-side copies above this size go in parts, copied concurrently with UploadPartCopy.
+# CopyObject itself stops at 5 GB.
+MULTIPART_COPY_THRESHOLD = 512 * 1024 * 1024
+COPY_PART_SIZE = 128 * 1024 * 1024
+
+
+def object_key(user_id, file_id, folder_id=None, blob_id=None) -> str:
+    """Where a file's content lives, shared content under its blob."""
+    if blob_id:
+        return f"files/{user_id}/blobs/{blob_id}"
+    if folder_id:
+        return f"files/{user_id}/{folder_id}/{file_id}"
+    return f"files/{user_id}/{file_id}"
+
+
+def chunk_key(user_id, chunk_id) -> str:
+    """A chunk of chunked file versions, see app/helpers/chunking.py."""
+    return f"files/{user_id}/chunks/{chunk_id}"
+
+
+def file_object_keys(removed, chunks=()) -> list:
+    """
+    The content and previews of removed files. removed rows carry owner_id, id,
+    parent_folder_id, blob_id and has_thumbnails, chunks rows owner_id and id.
+    """
+    keys = [chunk_key(row["owner_id"], row["id"]) for row in chunks]
+    for row in removed:
+        keys.append(
+            object_key(
+                row["owner_id"], row["id"], row["parent_folder_id"], row["blob_id"]
+            )
+        )
+        if row["has_thumbnails"]:
+            preview_id = row["blob_id"] or row["id"]
+            keys += [
+                thumbnail_key(row["owner_id"], preview_id, size)
+                for size in THUMBNAIL_SIZES
+            ]
+    return keys
 
 
 class AwsServices:
-    def __init__(self, region_name, bucket_name):
+    """
+    Presigning (no request to S3) goes through a boto3 client. Server-side operations
+    (deletes, HEADs) go through an aiobotocore client sharing one pool of
+    max_pool_connections HTTP connections, with at most max_concurrency requests in
+    flight and throttled requests retried with backoff by botocore's adaptive mode.
+    Made during a request, they end with it, see request_slot.
+    """
+
+    def __init__(
+        self,
+        region_name,
+        bucket_name,
+        max_pool_connections=50,
+        max_concurrency=32,
+        max_attempts=8,
+    ):
         self.region_name = region_name
         self.bucket_name = bucket_name
-        self.s3 = boto3.client("s3", region_name=self.region_name)
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = max_attempts
+        self._s3 = None
+        self._s3_lock = threading.Lock()
+        self._session = None
+        self._object_url_base = None
+        self._async_s3 = None
+        self._async_s3_exit = None
+        self._async_s3_lock = asyncio.Lock()
+        self._requests = asyncio.Semaphore(max_concurrency)
+        self.multipart_copy_threshold = MULTIPART_COPY_THRESHOLD
+        self.copy_part_size = COPY_PART_SIZE
+
+    @property
+    def s3(self):
+        """
+        S3 client built on first use, importing boto3 and loading its service
+        model costs more than the rest of startup. Lifespan warms it in a thread.
+        """
+        if self._s3 is None:
+            with self._s3_lock:
+                if self._s3 is None:
+                    import boto3
+
+                    self._session = boto3.session.Session(region_name=self.region_name)
+                    self._s3 = self._session.client("s3")
+        return self._s3
+
+    async def async_s3(self):
+        """The aiobotocore client, built on first use like the boto3 one."""
+        if self._async_s3 is None:
+            async with self._async_s3_lock:
+                if self._async_s3 is None:
+                    from aiobotocore.config import AioConfig
+                    from aiobotocore.session import get_session
+
+                    client = get_session().create_client(
+                        "s3",
+                        region_name=self.region_name,
+                        config=AioConfig(
+                            max_pool_connections=self.max_pool_connections,
+                            retries={
+                                "mode": "adaptive",
+                                "max_attempts": self.max_attempts,
+                            },
+                        ),
+                    )
+                    self._async_s3 = await client.__aenter__()
+                    self._async_s3_exit = client.__aexit__
+        return self._async_s3
+
+    @asynccontextmanager
+    async def request_slot(self):
+        """
+        One of the max_concurrency requests in flight. Waiting for it and the request
+        itself are cancelled once the request's deadline passes, if it has one.
+        """
+        async with within_deadline():
+            async with self._requests:
+                yield
+
+    async def close(self):
+        if self._async_s3 is not None:
+            await self._async_s3_exit(None, None, None)
+            self._async_s3 = None
 
     def generate_presigned_photo_upload_url(self, user_id, size):
         buffer = round(size * 1.05)
@@ -37,10 +172,34 @@ class AwsServices:
         return response
 
     def generate_presigned_upload_url(
-        self, user_id, size, file_name, parent_folder_id=None
+        self, user_id, size, file_name, parent_folder_id=None, blob_id=None, sha256=None
     ):
         buffer = round(size * 1.01)
-        if parent_folder_id:
+        if blob_id and sha256:
+            ## S3 refuses content that doesn't match the hash the blob is deduplicated by
+            checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+            response = self.s3.generate_presigned_post(
+                Bucket=self.bucket_name,
+                Key=object_key(user_id, file_name, blob_id=blob_id),
+                Fields={
+                    "x-amz-checksum-algorithm": "SHA256",
+                    "x-amz-checksum-sha256": checksum,
+                },
+                Conditions=[
+                    ["content-length-range", size, size],
+                    {"x-amz-checksum-algorithm": "SHA256"},
+                    {"x-amz-checksum-sha256": checksum},
+                ],
+                ExpiresIn=120,
+            )
+        elif blob_id:
+            response = self.s3.generate_presigned_post(
+                Bucket=self.bucket_name,
+                Key=object_key(user_id, file_name, blob_id=blob_id),
+                Conditions=[["content-length-range", size, buffer]],
+                ExpiresIn=120,
+            )
+        elif parent_folder_id:
             response = self.s3.generate_presigned_post(
                 Bucket=self.bucket_name,
                 Key=f"files/{user_id}/{parent_folder_id}/{file_name}",
@@ -57,27 +216,256 @@ class AwsServices:
         return response
 
     def generate_presigned_download_url(
-        self, user_id, file_id, file_name, folder_id=None
+        self, user_id, file_id, file_name, folder_id=None, blob_id=None
     ):
         filename = f"{file_name}"
-        if folder_id:
-            response = self.s3.generate_presigned_url(
-                "get_object",
-                Params={
-                    "Bucket": self.bucket_name,
-                    "Key": f"files/{user_id}/{folder_id}/{file_id}",
-                    "ResponseContentDisposition": f'attachment; filename="{filename}"',
-                },
-                ExpiresIn=60,
+        response = self.s3.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket_name,
+                "Key": object_key(user_id, file_id, folder_id, blob_id),
+                "ResponseContentDisposition": f'attachment; filename="{filename}"',
+            },
+            ExpiresIn=60,
+        )
+        return response
+
+    async def delete_objects(self, keys):
+        """
+        Delete objects by key, 1000 per request, the requests run concurrently.
+        Raises when S3 failed to delete any of them, deleting again is harmless.
+        """
+        s3 = await self.async_s3()
+
+        async def delete_batch(batch):
+            async with self.request_slot():
+                response = await s3.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+            ## Per key failures (SlowDown, InternalError) come back in a 200
+            return response.get("Errors", [])
+
+        errors = [
+            error
+            for batch_errors in await asyncio.gather(
+                *(
+                    delete_batch(keys[start : start + 1000])
+                    for start in range(0, len(keys), 1000)
+                )
             )
-        else:
-            response = self.s3.generate_presigned_url(
-                "get_object",
-                Params={
-                    "Bucket": self.bucket_name,
-                    "Key": f"files/{user_id}/{file_id}",
-                    "ResponseContentDisposition": f'attachment; filename="{filename}"',
+            for error in batch_errors
+        ]
+        if errors:
+            raise RuntimeError(
+                f"S3 failed to delete {len(errors)} objects, "
+                f"{errors[0]['Key']}: {errors[0]['Code']}"
+            )
+
+    def generate_presigned_thumbnail_urls(self, user_id, file_ids, size) -> dict:
+        """GET URLs for one size of many files' thumbnails, {file_id: url}."""
+        urls = self.presign_cacheable_get_urls(
+            [thumbnail_key(user_id, file_id, size) for file_id in file_ids]
+        )
+        return dict(zip(file_ids, urls))
+
+    def presign_cacheable_get_urls(self, keys) -> list:
+        """
+        GET URLs for many immutable objects, in order, empty without credentials.
+        Signed here in one batch with SigV4 query auth: the signing key is derived
+        once and each URL costs one HMAC, instead of a botocore request per object.
+        S3 refuses a URL once the session token it carries has expired, so with
+        temporary credentials the URLs expire with them, and are signed by botocore
+        for one window when their expiry isn't known.
+        """
+        if not keys:
+            return []
+        ## Resolved first, it builds the client and the session the credentials come from
+        scheme, host, path_prefix = self.object_url_base()
+        credentials = self._session.get_credentials()
+        if credentials is None:
+            return []
+        frozen = credentials.get_frozen_credentials()
+
+        window_start = (
+            int(time.time()) // CACHEABLE_URL_WINDOW_S * CACHEABLE_URL_WINDOW_S
+        )
+        expires_s = 2 * CACHEABLE_URL_WINDOW_S
+        if frozen.token:
+            ## Only botocore's refreshable credentials know when they expire
+            expiry = getattr(credentials, "_expiry_time", None)
+            if expiry is None:
+                return [
+                    self.s3.generate_presigned_url(
+                        "get_object",
+                        Params={"Bucket": self.bucket_name, "Key": key},
+                        ExpiresIn=CACHEABLE_URL_WINDOW_S,
+                    )
+                    for key in keys
+                ]
+            expires_s = min(expires_s, int(expiry.timestamp()) - window_start)
+        signed_at = datetime.fromtimestamp(window_start, timezone.utc)
+        amz_date = signed_at.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{amz_date[:8]}/{self.region_name}/s3/aws4_request"
+
+        signing_key = f"AWS4{frozen.secret_key}".encode()
+        for part in scope.split("/"):
+            signing_key = hmac.new(signing_key, part.encode(), hashlib.sha256).digest()
+
+        params = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{frozen.access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires_s),
+            "X-Amz-SignedHeaders": "host",
+        }
+        if frozen.token:
+            params["X-Amz-Security-Token"] = frozen.token
+        query = "&".join(
+            f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}"
+            for name, value in sorted(params.items())
+        )
+
+        urls = []
+        for key in keys:
+            path = path_prefix + quote(key, safe="/~")
+            canonical_request = (
+                f"GET\n{path}\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+            )
+            string_to_sign = (
+                f"AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n"
+                f"{hashlib.sha256(canonical_request.encode()).hexdigest()}"
+            )
+            signature = hmac.new(
+                signing_key, string_to_sign.encode(), hashlib.sha256
+            ).hexdigest()
+            urls.append(f"{scheme}://{host}{path}?{query}&X-Amz-Signature={signature}")
+        return urls
+
+    def generate_presigned_chunk_upload_urls(self, user_id, chunks) -> list:
+        """
+        One presigned POST per chunk, chunks being rows with id, sha256 (bytes)
+        and size_in_bytes. S3 checks each upload's size and SHA-256.
+        """
+        uploads = []
+        for chunk in chunks:
+            checksum = base64.b64encode(chunk["sha256"]).decode()
+            response = self.s3.generate_presigned_post(
+                Bucket=self.bucket_name,
+                Key=chunk_key(user_id, chunk["id"]),
+                Fields={
+                    "x-amz-checksum-algorithm": "SHA256",
+                    "x-amz-checksum-sha256": checksum,
                 },
-                ExpiresIn=60,
+                Conditions=[
+                    [
+                        "content-length-range",
+                        chunk["size_in_bytes"],
+                        chunk["size_in_bytes"],
+                    ],
+                    {"x-amz-checksum-algorithm": "SHA256"},
+                    {"x-amz-checksum-sha256": checksum},
+                ],
+                ExpiresIn=600,
             )
-        return response
+            response["sha256"] = chunk["sha256"].hex()
+            uploads.append(response)
+        return uploads
+
+    async def copy_object(self, source_key, destination_key, size_in_bytes):
+        """
+        Copy inside the bucket, the content never leaves S3. A large object is copied
+        in parts, all of them at once within the concurrency limit.
+        """
+        s3 = await self.async_s3()
+        source = {"Bucket": self.bucket_name, "Key": source_key}
+        if size_in_bytes <= self.multipart_copy_threshold:
+            async with self.request_slot():
+                await s3.copy_object(
+                    Bucket=self.bucket_name, Key=destination_key, CopySource=source
+                )
+            return
+
+        upload_id = (
+            await s3.create_multipart_upload(
+                Bucket=self.bucket_name, Key=destination_key
+            )
+        )["UploadId"]
+
+        async def copy_part(number, start):
+            end = min(start + self.copy_part_size, size_in_bytes) - 1
+            async with self.request_slot():
+                response = await s3.upload_part_copy(
+                    Bucket=self.bucket_name,
+                    Key=destination_key,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    CopySource=source,
+                    CopySourceRange=f"bytes={start}-{end}",
+                )
+            return {"PartNumber": number, "ETag": response["CopyPartResult"]["ETag"]}
+
+        try:
+            parts = await asyncio.gather(
+                *(
+                    copy_part(number, start)
+                    for number, start in enumerate(
+                        range(0, size_in_bytes, self.copy_part_size), start=1
+                    )
+                )
+            )
+            await s3.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=destination_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            ## Parts already copied are billed as storage until the upload is aborted
+            await asyncio.shield(
+                s3.abort_multipart_upload(
+                    Bucket=self.bucket_name, Key=destination_key, UploadId=upload_id
+                )
+            )
+            raise
+
+    async def missing_objects(self, keys) -> list:
+        """The keys that don't exist, one HEAD request each, run concurrently."""
+        from botocore.exceptions import ClientError
+
+        s3 = await self.async_s3()
+
+        async def is_missing(key):
+            async with self.request_slot():
+                try:
+                    await s3.head_object(Bucket=self.bucket_name, Key=key)
+                except ClientError as exc:
+                    if exc.response["Error"]["Code"] not in (
+                        "404",
+                        "NoSuchKey",
+                        "NotFound",
+                    ):
+                        raise
+                    return True
+            return False
+
+        missing = await asyncio.gather(*(is_missing(key) for key in keys))
+        return [key for key, is_gone in zip(keys, missing) if is_gone]
+
+    def object_url_base(self) -> tuple[str, str, str]:
+        """
+        (scheme, host, path prefix) of the bucket's objects, taken once from a URL
+        botocore presigns so custom endpoints and path-style addressing carry over.
+        """
+        if self._object_url_base is None:
+            probe = urlsplit(
+                self.s3.generate_presigned_url(
+                    "get_object", Params={"Bucket": self.bucket_name, "Key": "probe"}
+                )
+            )
+            self._object_url_base = (
+                probe.scheme,
+                probe.netloc,
+                probe.path.removesuffix("probe"),
+            )
+        return self._object_url_base
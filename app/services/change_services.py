@@ -0,0 +1,65 @@
+# noinspection SqlNoDataSourceInspection
+class ChangeServices:
+    """
+    Delta sync over the change log, see app/db/migrations/0007_change_log.sql
+    and 0016_change_ids_at_commit.sql.
+    A client keeps the cursor of its last batch and only ever reads the changes
+    after it, never the drive itself.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def list_changes(self, user_id, cursor=0, limit=500) -> dict:
+        """
+        The next batch of up to limit changes after cursor, compacted: an object changed
+        several times in the batch appears once, with its latest change and its current
+        name, location and size. Anything but 'deleted' is an upsert for the client,
+        the metadata is null when the object is gone by now.
+        """
+        async with self.db.acquire_read(user_id) as conn:
+            rows = await conn.fetch(
+                "WITH batch AS ("
+                "SELECT id, kind, object_type, object_id, changed_at FROM changes "
+                "WHERE user_id = $1 AND id > $2 ORDER BY id LIMIT $3), "
+                "latest AS ("
+                "SELECT DISTINCT ON (object_id) * FROM batch ORDER BY object_id, id DESC) "
+                "SELECT latest.id, latest.kind, latest.object_type, latest.object_id, "
+                "latest.changed_at, COALESCE(files.name, folders.name) AS name, "
+                "COALESCE(files.parent_folder_id, folders.parent_folder_id) AS parent_folder_id, "
+                "files.size_in_bytes, files.type, "
+                "(SELECT MAX(id) FROM batch) AS batch_end, "
+                "(SELECT last_change_id FROM user_change_seq WHERE user_id = $1) AS last_change_id "
+                "FROM latest "
+                "LEFT JOIN files ON latest.object_type = 'file' AND files.id = latest.object_id "
+                "LEFT JOIN folders ON latest.object_type = 'folder' AND folders.id = latest.object_id "
+                "ORDER BY latest.id",
+                user_id,
+                cursor,
+                limit,
+            )
+
+        if not rows:
+            return {"changes": [], "cursor": cursor, "has_more": False}
+        return {
+            "changes": [
+                {
+                    "cursor": row["id"],
+                    "kind": row["kind"],
+                    "object_type": row["object_type"],
+                    "object_id": str(row["object_id"]),
+                    "changed_at": row["changed_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                    "name": row["name"],
+                    "parent_folder_id": (
+                        str(row["parent_folder_id"])
+                        if row["parent_folder_id"]
+                        else None
+                    ),
+                    "size_in_bytes": row["size_in_bytes"],
+                    "type": row["type"],
+                }
+                for row in rows
+            ],
+            "cursor": rows[0]["batch_end"],
+            "has_more": rows[0]["batch_end"] < rows[0]["last_change_id"],
+        }
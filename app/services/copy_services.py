@@ -0,0 +1,386 @@
+from fastapi import HTTPException
+from asyncpg.exceptions import StringDataRightTruncationError, UniqueViolationError
+from ..helpers.image_utils import THUMBNAIL_SIZES, thumbnail_key
+from .aws import object_key
+from .file_services import DELETE_OBJECTS_JOB, FileServices
+from .job_queue import JobQueue
+import asyncio
+import re
+import uuid
+
+# Copies the S3 objects of copied files, {"copy_id": ..., "file_ids": [...]}
+COPY_OBJECTS_JOB = "copy_objects"
+
+# One job copies at most this many files or bytes, a big copy runs on many workers
+COPY_JOB_MAX_FILES = 50
+COPY_JOB_MAX_BYTES = 1024 * 1024 * 1024
+
+
+# noinspection SqlNoDataSourceInspection
+class CopyServices:
+    """
+    Server-side copies of files and folder subtrees, see app/db/migrations/0010_copies.sql.
+    The rows are copied set-based and charged at once in one transaction. Content in
+    blobs or chunks is referenced by the copy, content under a file's own key is copied
+    inside S3 by jobs, the client and the API never download any of it.
+    """
+
+    def __init__(self, db, folder_services, aws_services, quota_services):
+        self.db = db
+        self.folder_services = folder_services
+        self.aws_services = aws_services
+        self.quota_services = quota_services
+
+    @staticmethod
+    async def next_free_name(conn, table, user_id, parent_folder_id, name) -> str:
+        """
+        name if it isn't taken at the location, otherwise the next free 'stem(n).ext'
+        (files) or 'name(n)' (folders), one past the highest existing copy.
+        The caller holds the location's advisory lock for the name.
+        """
+        if table == "files":
+            stem, ext = FileServices.split_copy_suffix(name)
+            suffix = f".{ext}"
+        else:
+            stem, suffix = re.sub(r"\(\d+\)$", "", name), ""
+
+        if parent_folder_id:
+            location, args = "parent_folder_id = $5", (parent_folder_id,)
+        else:
+            location, args = "parent_folder_id IS NULL", ()
+        row = await conn.fetchrow(
+            f"SELECT EXISTS (SELECT 1 FROM {table} "
+            f"WHERE owner_id = $1 AND name = $4 AND {location}) AS taken, "
+            f"({FileServices.highest_copy_sql(table, location)}) AS n",
+            user_id,
+            stem,
+            FileServices.copy_pattern(stem, suffix),
+            name,
+            *args,
+        )
+        if not row["taken"]:
+            return name
+        return f"{stem}({(row['n'] or 0) + 1}){suffix}"
+
+    @staticmethod
+    async def subtree_folders(conn, user_id, folder_id) -> list:
+        """The folder and every folder below it, parents before their children."""
+        return await conn.fetch(
+            "WITH RECURSIVE subtree AS ("
+            "SELECT id, name, parent_folder_id, 0 AS depth FROM folders "
+            "WHERE id = $1 AND owner_id = $2 "
+            "UNION ALL "
+            "SELECT folders.id, folders.name, folders.parent_folder_id, subtree.depth + 1 "
+            "FROM folders JOIN subtree ON folders.parent_folder_id = subtree.id) "
+            "SELECT id, name, parent_folder_id FROM subtree ORDER BY depth",
+            folder_id,
+            user_id,
+        )
+
+    @staticmethod
+    async def copyable_files(conn, condition, *args) -> list:
+        """Files with their content, leaving out new files whose upload hasn't arrived."""
+        return await conn.fetch(
+            "SELECT files.id, files.name, files.size_in_bytes, files.type, "
+            "files.parent_folder_id, files.blob_id, files.has_thumbnails, "
+            "CASE WHEN file_versions.chunked THEN file_versions.id END AS chunked_version_id "
+            "FROM files LEFT JOIN file_versions ON file_versions.id = files.current_version_id "
+            f"WHERE {condition} AND NOT EXISTS ("
+            "SELECT 1 FROM quota_ledger WHERE quota_ledger.file_id = files.id "
+            "AND state = 'reserved' AND kind = 'new')",
+            *args,
+        )
+
+    async def copy(self, user_id, copy_info) -> dict:
+        """
+        Copy a file, or a folder with everything in it, into destination_folder_id
+        (root when None). The copy of the root takes the next free 'name(n)' when its
+        name is taken there. Returns the copy's id to follow its progress with.
+        """
+        destination = copy_info.destination_folder_id
+        await self.folder_services.verify_parent_folder_if_provided(
+            user_id, destination
+        )
+        if copy_info.copy_object_type == "file":
+            table, source_id = "files", copy_info.file_id
+        else:
+            table, source_id = "folders", copy_info.folder_id
+
+        async with self.db.acquire_write(user_id) as conn:
+            async with conn.transaction():
+                if table == "files":
+                    sources = await self.copyable_files(
+                        conn,
+                        "files.id = $1 AND files.owner_id = $2",
+                        source_id,
+                        user_id,
+                    )
+                    if not sources:
+                        raise HTTPException(
+                            status_code=404, detail="File not found or still uploading"
+                        )
+                    root_name, folders = sources[0]["name"], []
+                else:
+                    folders = await self.subtree_folders(conn, user_id, source_id)
+                    if not folders:
+                        raise HTTPException(status_code=404, detail="Folder not found")
+                    if destination and destination in {row["id"] for row in folders}:
+                        raise HTTPException(
+                            status_code=400,
+                            detail="A folder can't be copied into itself",
+                        )
+                    root_name = folders[0]["name"]
+                    sources = await self.copyable_files(
+                        conn,
+                        "files.parent_folder_id = ANY($1::uuid[])",
+                        [row["id"] for row in folders],
+                    )
+
+                ## Same lock as Keep uploads of the name, see FileServices.log_next_free_copy
+                stem = (
+                    "{}.{}".format(*FileServices.split_copy_suffix(root_name))
+                    if table == "files"
+                    else re.sub(r"\(\d+\)$", "", root_name)
+                )
+                await conn.execute(
+                    "SELECT pg_advisory_xact_lock(hashtextextended($1, 0))",
+                    f"{user_id}:{destination}:{stem}",
+                )
+                root_name = await self.next_free_name(
+                    conn, table, user_id, destination, root_name
+                )
+
+                new_ids = {row["id"]: uuid.uuid4() for row in [*folders, *sources]}
+                try:
+                    if folders:
+                        await conn.execute(
+                            "INSERT INTO folders (id, name, parent_folder_id, owner_id) "
+                            "SELECT id, name, parent_folder_id, $4 "
+                            "FROM unnest($1::uuid[], $2::text[], $3::uuid[]) "
+                            "AS copied(id, name, parent_folder_id)",
+                            [new_ids[row["id"]] for row in folders],
+                            [root_name] + [row["name"] for row in folders[1:]],
+                            [destination]
+                            + [new_ids[row["parent_folder_id"]] for row in folders[1:]],
+                            user_id,
+                        )
+                    await conn.execute(
+                        "INSERT INTO files (id, name, size_in_bytes, type, owner_id, "
+                        "parent_folder_id, blob_id, has_thumbnails) "
+                        "SELECT id, name, size_in_bytes, type, $7, parent_folder_id, blob_id, "
+                        "blob_id IS NOT NULL AND has_thumbnails "
+                        "FROM unnest($1::uuid[], $2::text[], $3::bigint[], $4::text[], "
+                        "$5::uuid[], $6::uuid[], $8::bool[]) "
+                        "AS copied(id, name, size_in_bytes, type, parent_folder_id, blob_id, "
+                        "has_thumbnails)",
+                        [new_ids[row["id"]] for row in sources],
+                        [root_name if not folders else row["name"] for row in sources],
+                        [row["size_in_bytes"] for row in sources],
+                        [row["type"] for row in sources],
+                        [
+                            new_ids.get(row["parent_folder_id"], destination)
+                            for row in sources
+                        ],
+                        [row["blob_id"] for row in sources],
+                        user_id,
+                        [row["has_thumbnails"] for row in sources],
+                    )
+                except StringDataRightTruncationError:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Unable to generate unique name. Please rename the copy.",
+                    )
+                except UniqueViolationError:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"'{root_name}' was just taken in this location, retry",
+                    )
+
+                ## Chunked content is shared, each copy gets a version 1 listing the same chunks
+                chunked = [row for row in sources if row["chunked_version_id"]]
+                if chunked:
+                    version_ids = [uuid.uuid4() for _ in chunked]
+                    await conn.execute(
+                        "INSERT INTO file_versions "
+                        "(id, file_id, number, size_in_bytes, chunked, committed) "
+                        "SELECT id, file_id, 1, size_in_bytes, TRUE, TRUE "
+                        "FROM unnest($1::uuid[], $2::uuid[], $3::bigint[]) "
+                        "AS copied(id, file_id, size_in_bytes)",
+                        version_ids,
+                        [new_ids[row["id"]] for row in chunked],
+                        [row["size_in_bytes"] for row in chunked],
+                    )
+                    await conn.execute(
+                        "INSERT INTO file_version_chunks (version_id, position, chunk_id) "
+                        "SELECT copied.id, file_version_chunks.position, file_version_chunks.chunk_id "
+                        "FROM unnest($1::uuid[], $2::uuid[]) AS copied(id, source_id) "
+                        "JOIN file_version_chunks ON file_version_chunks.version_id = copied.source_id",
+                        version_ids,
+                        [row["chunked_version_id"] for row in chunked],
+                    )
+                    await conn.execute(
+                        "UPDATE files SET current_version_id = copied.id "
+                        "FROM unnest($1::uuid[], $2::uuid[]) AS copied(id, file_id) "
+                        "WHERE files.id = copied.file_id",
+                        version_ids,
+                        [new_ids[row["id"]] for row in chunked],
+                    )
+
+                ## Content under the source's own key is copied by jobs, reserved until then
+                pending = [
+                    row
+                    for row in sources
+                    if not row["blob_id"] and not row["chunked_version_id"]
+                ]
+                pending_ids = {row["id"] for row in pending}
+                await self.quota_services.charge_new_files(
+                    conn,
+                    user_id,
+                    [new_ids[row["id"]] for row in sources],
+                    [row["size_in_bytes"] for row in sources],
+                    [row["id"] in pending_ids for row in sources],
+                )
+
+                copy_id = await conn.fetchval(
+                    "INSERT INTO copies (owner_id, object_type, object_id, total_files, total_bytes) "
+                    "VALUES ($1, $2, $3, $4, $5) RETURNING id",
+                    user_id,
+                    copy_info.copy_object_type,
+                    new_ids[source_id],
+                    len(sources),
+                    sum(row["size_in_bytes"] for row in sources),
+                )
+                if pending:
+                    await conn.execute(
+                        "INSERT INTO copy_items "
+                        "(file_id, copy_id, source_key, source_preview_id, size_in_bytes) "
+                        "SELECT file_id, $1, source_key, source_preview_id, size_in_bytes "
+                        "FROM unnest($2::uuid[], $3::text[], $4::uuid[], $5::bigint[]) "
+                        "AS copied(file_id, source_key, source_preview_id, size_in_bytes)",
+                        copy_id,
+                        [new_ids[row["id"]] for row in pending],
+                        [
+                            object_key(user_id, row["id"], row["parent_folder_id"])
+                            for row in pending
+                        ],
+                        [
+                            row["id"] if row["has_thumbnails"] else None
+                            for row in pending
+                        ],
+                        [row["size_in_bytes"] for row in pending],
+                    )
+                    for batch in self.job_batches(pending):
+                        await JobQueue.enqueue(
+                            conn,
+                            COPY_OBJECTS_JOB,
+                            {
+                                "copy_id": str(copy_id),
+                                "file_ids": [str(new_ids[row["id"]]) for row in batch],
+                            },
+                        )
+
+        return {
+            "copy_id": str(copy_id),
+            "object_id": str(new_ids[source_id]),
+            "name": root_name,
+            "total_files": len(sources),
+            "done": not pending,
+        }
+
+    @staticmethod
+    def job_batches(rows):
+        """Split files into jobs of at most COPY_JOB_MAX_FILES files or COPY_JOB_MAX_BYTES."""
+        batch, batch_bytes = [], 0
+        for row in rows:
+            if batch and (
+                len(batch) == COPY_JOB_MAX_FILES
+                or batch_bytes + row["size_in_bytes"] > COPY_JOB_MAX_BYTES
+            ):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(row)
+            batch_bytes += row["size_in_bytes"]
+        if batch:
+            yield batch
+
+    async def copy_objects(self, payload):
+        """
+        Job handler, copies the content and previews of a batch of files inside S3,
+        then commits their reservations like uploads that arrived. Files deleted in
+        the meantime took their items with them and are skipped.
+        """
+        async with self.db.acquire() as conn:
+            items = await conn.fetch(
+                "SELECT copy_items.file_id, copy_items.source_key, "
+                "copy_items.source_preview_id, copy_items.size_in_bytes, "
+                "files.owner_id, files.parent_folder_id FROM copy_items "
+                "JOIN files ON files.id = copy_items.file_id "
+                "WHERE copy_items.file_id = ANY($1::uuid[])",
+                payload["file_ids"],
+            )
+        if not items:
+            return
+
+        copies = []
+        for item in items:
+            copies.append(
+                self.aws_services.copy_object(
+                    item["source_key"],
+                    object_key(
+                        item["owner_id"], item["file_id"], item["parent_folder_id"]
+                    ),
+                    item["size_in_bytes"],
+                )
+            )
+            if item["source_preview_id"]:
+                copies += [
+                    self.aws_services.copy_object(
+                        thumbnail_key(
+                            item["owner_id"], item["source_preview_id"], size
+                        ),
+                        thumbnail_key(item["owner_id"], item["file_id"], size),
+                        0,
+                    )
+                    for size in THUMBNAIL_SIZES
+                ]
+        await asyncio.gather(*copies)
+
+        file_ids = [item["file_id"] for item in items]
+        ## Committed first, a retry after a failure in between copies again and finishes
+        await self.quota_services.commit(file_ids)
+        async with self.db.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "UPDATE files SET has_thumbnails = TRUE WHERE id = ANY($1::uuid[])",
+                    [item["file_id"] for item in items if item["source_preview_id"]],
+                )
+                keys = await FileServices.release_copy_sources(conn, file_ids)
+                if keys:
+                    await JobQueue.enqueue(conn, DELETE_OBJECTS_JOB, {"keys": keys})
+        for owner_id in {item["owner_id"] for item in items}:
+            self.db.record_write(owner_id)
+
+    async def copy_progress(self, user_id, copy_id) -> dict:
+        """How much of a copy is done, its files are usable once done."""
+        async with self.db.acquire_read(user_id) as conn:
+            row = await conn.fetchrow(
+                "SELECT copies.object_type, copies.object_id, copies.total_files, "
+                "copies.total_bytes, count(copy_items.file_id) AS remaining_files, "
+                "COALESCE(SUM(copy_items.size_in_bytes), 0) AS remaining_bytes "
+                "FROM copies LEFT JOIN copy_items ON copy_items.copy_id = copies.id "
+                "WHERE copies.id = $1 AND copies.owner_id = $2 GROUP BY copies.id",
+                copy_id,
+                user_id,
+            )
+        if row is None:
+            raise HTTPException(status_code=404, detail="Copy not found")
+        return {
+            "copy_id": copy_id,
+            "object_type": row["object_type"],
+            "object_id": str(row["object_id"]),
+            "total_files": row["total_files"],
+            "copied_files": row["total_files"] - row["remaining_files"],
+            "total_bytes": row["total_bytes"],
+            "copied_bytes": row["total_bytes"] - row["remaining_bytes"],
+            "done": row["remaining_files"] == 0,
+        }
@@ -0,0 +1,252 @@
+from contextlib import asynccontextmanager
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import time
+import asyncpg
+from .deadlines import DeadlineExceeded, remaining_s
+
+logger = logging.getLogger(__name__)
+
+# Environment variable the launcher uses to hand every worker the same token table
+WRITE_TOKENS_SHM_ENV = "DB_WRITE_TOKENS_SHM"
+
+# Weight of the latest sample in DatabaseRouter.acquire_wait_ms
+ACQUIRE_WAIT_ALPHA = 0.2
+
+
+def parse_lsn(lsn) -> int:
+    """'16/B374D848' -> integer position in the WAL."""
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class WriteTokens:
+    """
+    Time of each user's latest committed write, used for read-your-writes.
+    A fixed table of float64 slots indexed by a hash of the user id: collisions can
+    only make a read go to the primary when it didn't need to, never the reverse.
+    With a shared memory name every worker of the launcher reads and writes the same table.
+    """
+
+    def __init__(self, slots=65536, shm_name=None):
+        self._shm = None
+        if shm_name:
+            self._shm = shared_memory.SharedMemory(name=shm_name)
+            # Attaching registers the segment for cleanup at exit, only the launcher owns it
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+            buffer = self._shm.buf
+        else:
+            buffer = bytearray(slots * 8)
+        self.slots = memoryview(buffer).cast("d")
+
+    @classmethod
+    def from_environment(cls) -> "WriteTokens":
+        return cls(shm_name=os.getenv(WRITE_TOKENS_SHM_ENV))
+
+    @classmethod
+    def create_shared(cls, slots=65536) -> shared_memory.SharedMemory:
+        """Called once by the launcher, the owner unlinks it on exit."""
+        shm = shared_memory.SharedMemory(create=True, size=slots * 8)
+        shm.buf[:] = bytes(slots * 8)
+        return shm
+
+    def _slot(self, user_id) -> int:
+        digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % len(self.slots)
+
+    def record(self, user_id, at=None):
+        self.slots[self._slot(user_id)] = at if at is not None else time.time()
+
+    def last_write(self, user_id) -> float:
+        return self.slots[self._slot(user_id)]
+
+    def close(self):
+        self.slots.release()
+        if self._shm:
+            self._shm.close()
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        # Wall clock time up to which every primary commit is known to be replayed here
+        self.caught_up_through = 0.0
+
+
+class DatabaseRouter:
+    """
+    Primary pool plus optional read replicas, used by the services as `self.db`.
+    - acquire() always gives a primary connection
+    - acquire_write(user_id) is acquire() that also records the user's write token
+    - acquire_read(user_id) gives a replica that has replayed that user's latest write,
+      or the primary when no replica is both caught up and within max_replica_lag_s
+
+    Replica progress is polled in the background: the primary's WAL position is
+    sampled with its wall clock time, and a replica that has replayed past a sample
+    is caught up through that time.
+
+    acquire_wait_ms is a moving average of how long getting a connection took, the
+    load signal admission control sheds requests on.
+    """
+
+    def __init__(
+        self,
+        primary,
+        replicas=(),
+        write_tokens=None,
+        max_replica_lag_s=2.0,
+        lag_check_interval_s=0.25,
+    ):
+        self.primary = primary
+        self.replicas = [
+            Replica(f"replica-{i}", pool) for i, pool in enumerate(replicas)
+        ]
+        self.write_tokens = write_tokens or WriteTokens()
+        self.max_replica_lag_s = max_replica_lag_s
+        self.lag_check_interval_s = lag_check_interval_s
+        self.routed_reads = {"replica": 0, "primary": 0}
+        self.acquire_wait_ms = 0.0
+        self._round_robin = itertools.count()
+        self._primary_samples = deque(
+            maxlen=max(2, int(max_replica_lag_s / lag_check_interval_s) + 2)
+        )
+
+    def observe_acquire_wait(self, started):
+        wait_ms = (time.perf_counter() - started) * 1000
+        self.acquire_wait_ms += (wait_ms - self.acquire_wait_ms) * ACQUIRE_WAIT_ALPHA
+
+    async def acquire_from(self, pool):
+        """A connection of pool, waited for no longer than the request's deadline."""
+        started = time.perf_counter()
+        timeout = remaining_s()
+        try:
+            return await pool.acquire(timeout=timeout)
+        except TimeoutError as exc:
+            if timeout is None:
+                raise
+            raise DeadlineExceeded from exc
+        finally:
+            self.observe_acquire_wait(started)
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = await self.acquire_from(self.primary)
+        try:
+            yield conn
+        finally:
+            await self.primary.release(conn)
+
+    @asynccontextmanager
+    async def acquire_write(self, user_id):
+        async with self.acquire() as conn:
+            yield conn
+        # Recorded once the connection is released, after the caller's transaction committed
+        self.write_tokens.record(user_id)
+
+    def record_write(self, user_id):
+        """For writes made on behalf of a user by someone else, like a share they receive."""
+        self.write_tokens.record(user_id)
+
+    def pick_replica(self, user_id) -> Replica | None:
+        if not self.replicas:
+            return None
+        not_before = max(
+            time.time() - self.max_replica_lag_s,
+            self.write_tokens.last_write(user_id),
+        )
+        eligible = [r for r in self.replicas if r.caught_up_through >= not_before]
+        if not eligible:
+            return None
+        return eligible[next(self._round_robin) % len(eligible)]
+
+    @asynccontextmanager
+    async def acquire_read(self, user_id):
+        replica = self.pick_replica(user_id)
+        if replica is not None:
+            try:
+                conn = await self.acquire_from(replica.pool)
+            except DeadlineExceeded:
+                raise
+            except (OSError, asyncpg.PostgresError) as exc:
+                logger.warning(
+                    f"{replica.name} unavailable, reading from primary: {exc}"
+                )
+                replica.caught_up_through = 0.0
+            else:
+                self.routed_reads["replica"] += 1
+                try:
+                    yield conn
+                finally:
+                    await replica.pool.release(conn)
+                return
+
+        self.routed_reads["primary"] += 1
+        async with self.acquire() as conn:
+            yield conn
+
+    async def check_replication(self):
+        """Samples the primary's WAL position and credits each replica with its replay progress."""
+        sampled_at = time.time()
+        primary_lsn = parse_lsn(
+            await self.primary.fetchval("SELECT pg_current_wal_lsn()::text")
+        )
+        self._primary_samples.append((sampled_at, primary_lsn))
+
+        for replica in self.replicas:
+            try:
+                row = await replica.pool.fetchrow(
+                    "SELECT pg_is_in_recovery() AS standby, "
+                    "pg_last_wal_replay_lsn()::text AS replayed"
+                )
+            except (OSError, asyncpg.PostgresError) as exc:
+                logger.warning(f"Replication check failed for {replica.name}: {exc}")
+                continue
+
+            if not row["standby"]:
+                # Not a streaming standby (local setups point it at the primary)
+                replica.caught_up_through = sampled_at
+                continue
+
+            replayed = parse_lsn(row["replayed"]) if row["replayed"] else 0
+            for at, lsn in reversed(self._primary_samples):
+                if replayed >= lsn:
+                    replica.caught_up_through = max(replica.caught_up_through, at)
+                    break
+
+    async def monitor_replication(self):
+        """Lifespan background task, only needed when replicas are configured."""
+        while True:
+            try:
+                await self.check_replication()
+            except Exception as exc:
+                logger.error(f"Replication check failed: {exc}")
+            await asyncio.sleep(self.lag_check_interval_s)
+
+    def replication_status(self) -> dict:
+        now = time.time()
+        return {
+            "max_replica_lag_s": self.max_replica_lag_s,
+            "routed_reads": dict(self.routed_reads),
+            "replicas": [
+                {
+                    "name": replica.name,
+                    "lag_s": (
+                        round(now - replica.caught_up_through, 3)
+                        if replica.caught_up_through
+                        else None
+                    ),
+                }
+                for replica in self.replicas
+            ],
+        }
+
+    async def close(self):
+        for replica in self.replicas:
+            await replica.pool.close()
+        await self.primary.close()
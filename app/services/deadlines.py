@@ -0,0 +1,119 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import asyncio
+import json
+import time
+
+# Monotonic time by which the current request must be done, None outside requests.
+# Tasks a request spawns copy it with the rest of the context.
+_deadline: ContextVar = ContextVar("deadline", default=None)
+
+DEFAULT_BUDGET_MS = 10_000
+
+# (method, path prefix, budget in ms), the first match wins, None means no deadline.
+# Batch endpoints touch many rows per call, the event stream stays open for good.
+ROUTE_BUDGETS_MS = (
+    ("GET", "/events", None),
+    ("POST", "/copy", 30_000),
+    ("POST", "/share/bulk", 30_000),
+    ("POST", "/upload-results", 30_000),
+    ("POST", "/confirm-file-upload", 30_000),
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request ran out of time, answered with 504."""
+
+
+def remaining_s() -> float | None:
+    """Seconds left before the current deadline, None without one."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded
+    return remaining
+
+
+def set_deadline(budget_s):
+    """Starts a deadline budget_s from now, returns the token to reset it with."""
+    return _deadline.set(None if budget_s is None else time.monotonic() + budget_s)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+@asynccontextmanager
+async def within_deadline():
+    """Cancels the block when the current deadline passes, raising DeadlineExceeded."""
+    timeout = asyncio.timeout(remaining_s())
+    try:
+        async with timeout:
+            yield
+    except TimeoutError as exc:
+        if timeout.expired():
+            raise DeadlineExceeded from exc
+        raise
+
+
+def budget_for(method, path, default_ms=DEFAULT_BUDGET_MS) -> float | None:
+    for route_method, prefix, budget_ms in ROUTE_BUDGETS_MS:
+        if method == route_method and path.startswith(prefix):
+            return None if budget_ms is None else budget_ms / 1000
+    return default_ms / 1000
+
+
+class DeadlineMiddleware:
+    """
+    Plain ASGI middleware giving each request its route's budget. Statements and
+    S3 requests take what's left as their timeout (see TracedConnection and
+    AwsServices.request_slot), the request is cancelled, its connections released,
+    and 504 sent once the budget is spent.
+    """
+
+    def __init__(self, app, default_ms=DEFAULT_BUDGET_MS):
+        self.app = app
+        self.default_ms = default_ms
+        self.timed_out = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        budget_s = budget_for(scope["method"], scope["path"], self.default_ms)
+        if budget_s is None:
+            return await self.app(scope, receive, send)
+
+        started = False
+
+        async def send_tracking_start(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        token = set_deadline(budget_s)
+        timeout = asyncio.timeout(budget_s)
+        try:
+            async with timeout:
+                await self.app(scope, receive, send_tracking_start)
+        except TimeoutError as exc:
+            if not (timeout.expired() or isinstance(exc, DeadlineExceeded)):
+                raise
+            self.timed_out += 1
+            if started:
+                raise
+            body = json.dumps({"detail": "Request took too long"}).encode()
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 504,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+        finally:
+            reset_deadline(token)
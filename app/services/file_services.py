@@ -1,17 +1,48 @@
+import logging
+import os
 import re
 from ..schemas.schemas import UploadFileInfo
 from fastapi import HTTPException
+from asyncpg.exceptions import StringDataRightTruncationError, UniqueViolationError
 from ..helpers.file_utils import allowed_extensions
+from ..helpers.image_utils import THUMBNAIL_SIZES, is_acceptable, thumbnail_key
+from .aws import chunk_key, file_object_keys, object_key
+from .job_queue import JobQueue
+from .version_services import VersionServices
+
+logger = logging.getLogger(__name__)
+
+# Deletes the S3 objects of removed files, {"keys": [...]}
+DELETE_OBJECTS_JOB = "delete_objects"
 
 
 class FileServices:
-    def __init__(self, db, folder_services, aws_services):
+    def __init__(
+        self,
+        db,
+        folder_services,
+        aws_services,
+        quota_services,
+        activity_log=None,
+        interaction_tracker=None,
+    ):
         self.db = db
         self.folder_services = folder_services
         self.aws_services = aws_services
+        self.quota_services = quota_services
+        self.activity_log = activity_log
+        self.interaction_tracker = interaction_tracker
+
+    def record_uploads(self, uploads):
+        """Activity of content that arrived, uploads rows carry owner_id, id and name."""
+        if self.activity_log:
+            for row in uploads:
+                self.activity_log.record(
+                    row["owner_id"], "upload", "file", row["id"], row["name"]
+                )
 
     async def verify_file_existence_ownership(self, user_id, file_id):
-        async with self.db.acquire() as conn:
+        async with self.db.acquire_read(user_id) as conn:
             row = await conn.fetchrow(
                 "SELECT name FROM files WHERE owner_id = $1 AND id = $2",
                 user_id,
@@ -21,126 +52,143 @@ class FileServices:
                 return str(row["name"])
             return False
 
-    async def is_file_name_taken(
-        self, user_id, file_name, parent_folder_id=None
-    ) -> bool:
-        async with self.db.acquire() as conn:
-            if parent_folder_id:
-                row = await conn.fetchrow(
-                    "SELECT name FROM files WHERE owner_id = $1 AND parent_folder_id = $2 AND name = $3",
-                    user_id,
-                    parent_folder_id,
-                    file_name,
-                )
-            else:
-                row = await conn.fetchrow(
-                    "SELECT name FROM files WHERE owner_id = $1 AND parent_folder_id IS NULL AND name = $2",
-                    user_id,
-                    file_name,
-                )
-            return row is not None
-
     async def temp_log_file_to_be_verified(
         self, user_id, parent_folder_id, file_name, size_in_bytes, file_type
-    ) -> str:
+    ) -> str | None:
         """
         Create temporary file record before S3 upload for verification tracking.
 
-        - Logs file metadata to reserve storage space (deducts from available_storage_in_bytes)
+        - Logs file metadata and reserves its storage in the quota ledger, same transaction
         - Returns file UUID to use as immutable S3 key (enables renames without breaking storage)
-        - Lambda trigger will set confirmed_upload=TRUE when file arrives in S3
-        - Unconfirmed files can be cleaned up later if upload fails
+        - Returns None when the name is already taken at that location
+        - The upload callback commits the reservation when the file arrives in S3
+        - Unconfirmed files are deleted and refunded once their reservation expires
         """
-        if parent_folder_id:
-            async with self.db.acquire() as conn:
+        async with self.db.acquire_write(user_id) as conn:
+            async with conn.transaction():
                 row = await conn.fetchrow(
                     "INSERT INTO files (name, size_in_bytes, type, owner_id, parent_folder_id) "
-                    "VALUES ($1, $2, $3, $4, $5) RETURNING id",
+                    "VALUES ($1, $2, $3, $4, $5) ON CONFLICT DO NOTHING RETURNING id",
                     file_name,
                     size_in_bytes,
                     file_type,
                     user_id,
                     parent_folder_id,
                 )
-        else:
-            async with self.db.acquire() as conn:
-                row = await conn.fetchrow(
-                    "INSERT INTO files (name, size_in_bytes, type, owner_id) "
-                    "VALUES ($1, $2, $3, $4) RETURNING id",
-                    file_name,
-                    size_in_bytes,
-                    file_type,
-                    user_id,
+                if row is None:
+                    return None
+                await self.quota_services.reserve(
+                    conn, user_id, row["id"], size_in_bytes
                 )
 
         return str(row["id"])
 
+    @staticmethod
     async def get_existing_file_uuid_and_size(
-        self, user_id, parent_folder_id, file_name
+        conn, user_id, parent_folder_id, file_name
     ) -> tuple[str, int] | None:
-        """Update existing file metadata for replacement, returns file UUID"""
-        async with self.db.acquire() as conn:
-            if parent_folder_id:
-                row = await conn.fetchrow(
-                    "SELECT id, size_in_bytes FROM files "
-                    "WHERE owner_id = $1 AND name = $2 AND parent_folder_id = $3 ",
-                    user_id,
-                    file_name,
-                    parent_folder_id,
-                )
-            else:
-                row = await conn.fetchrow(
-                    "SELECT id, size_in_bytes FROM files WHERE owner_id = $1 AND name = $2 AND "
-                    "parent_folder_id IS NULL",
-                    user_id,
-                    file_name,
-                )
+        """File being replaced, locked until the caller's transaction reserves its new size"""
+        if parent_folder_id:
+            row = await conn.fetchrow(
+                "SELECT id, size_in_bytes FROM files "
+                "WHERE owner_id = $1 AND name = $2 AND parent_folder_id = $3 FOR UPDATE",
+                user_id,
+                file_name,
+                parent_folder_id,
+            )
+        else:
+            row = await conn.fetchrow(
+                "SELECT id, size_in_bytes FROM files WHERE owner_id = $1 AND name = $2 AND "
+                "parent_folder_id IS NULL FOR UPDATE",
+                user_id,
+                file_name,
+            )
 
-            return (str(row["id"]), row["size_in_bytes"]) if row else None
+        return (str(row["id"]), row["size_in_bytes"]) if row else None
 
     async def upload_an_new_file(self, file: UploadFileInfo, user_id) -> dict:
-        await self.check_if_user_has_enough_space(user_id, file.file_size_in_bytes)
         ext = file.file_name.rsplit(".", 1)[1]
 
         await self.folder_services.verify_parent_folder_if_provided(
             user_id, file.parent_folder_id
         )
 
-        if await self.is_file_name_taken(
-            user_id, file.file_name, file.parent_folder_id
-        ):
+        ##this is actually the file id, but we do use it as the name of the file in s3
+        name_s3_id = await self.temp_log_file_to_be_verified(
+            user_id, file.parent_folder_id, file.file_name, file.file_size_in_bytes, ext
+        )
+        if name_s3_id is None:
             raise HTTPException(
                 status_code=409,
                 detail="File already exists use FILE-CONFLICT parameter to solve",
             )
-            ##this is actually the file id, but we do use it as the name of the file in s3
-        name_s3_id = await self.temp_log_file_to_be_verified(
-            user_id, file.parent_folder_id, file.file_name, file.file_size_in_bytes, ext
-        )
 
-        return self.aws_services.generate_presigned_upload_url(
-            user_id, file.file_size_in_bytes, name_s3_id, file.parent_folder_id
-        )
+        return await self.link_or_upload_content(user_id, name_s3_id, file)
 
     async def replace_existing_file(self, file: UploadFileInfo, user_id) -> dict:
+        """
+        Upload step of a new version of a file, its current content stays as the
+        previous version. The content goes to a blob, linked right away when the
+        client sent the hash of content the user already stored.
+        """
         await self.folder_services.verify_parent_folder_if_provided(
             user_id, file.parent_folder_id
         )
 
-        existing = await self.get_existing_file_uuid_and_size(
-            user_id, file.parent_folder_id, file.file_name
-        )
+        async with self.db.acquire_write(user_id) as conn:
+            async with conn.transaction():
+                existing = await self.get_existing_file_uuid_and_size(
+                    conn, user_id, file.parent_folder_id, file.file_name
+                )
 
-        if not existing:
-            raise HTTPException(status_code=404, detail="File not found")
-        name_s3_id, bytes_size = existing
+                if not existing:
+                    raise HTTPException(status_code=404, detail="File not found")
+                name_s3_id, bytes_size = existing
+
+                await VersionServices.ensure_base_version(conn, name_s3_id)
+                blob = None
+                if file.sha256:
+                    blob = await self.claim_blob(
+                        conn,
+                        user_id,
+                        bytes.fromhex(file.sha256),
+                        file.file_size_in_bytes,
+                    )
+                if blob is None:
+                    blob = await conn.fetchrow(
+                        "INSERT INTO blobs (owner_id, size_in_bytes) VALUES ($1, $2) "
+                        "RETURNING id, stored, has_thumbnails",
+                        user_id,
+                        file.file_size_in_bytes,
+                    )
+                version_id = await VersionServices.add_version(
+                    conn,
+                    name_s3_id,
+                    file.file_size_in_bytes,
+                    blob["id"],
+                    has_thumbnails=blob["has_thumbnails"],
+                )
 
-        if file.file_size_in_bytes > bytes_size:
-            size_difference = file.file_size_in_bytes - bytes_size
-            await self.check_if_user_has_enough_space(user_id, size_difference)
+                ## Only growth is charged, a smaller file is refunded once it arrives
+                await self.quota_services.reserve(
+                    conn, user_id, name_s3_id, file.file_size_in_bytes, bytes_size
+                )
+                if blob["stored"]:
+                    await VersionServices.commit_versions(conn, [version_id])
 
+        if blob["stored"]:
+            await self.quota_services.commit([name_s3_id])
+            self.record_uploads(
+                [{"owner_id": user_id, "id": name_s3_id, "name": file.file_name}]
+            )
+            return {"file_id": name_s3_id, "instant_upload": True}
         return self.aws_services.generate_presigned_upload_url(
-            user_id, file.file_size_in_bytes, name_s3_id, file.parent_folder_id
+            user_id,
+            file.file_size_in_bytes,
+            name_s3_id,
+            file.parent_folder_id,
+            blob_id=str(blob["id"]),
+            sha256=file.sha256,
         )
 
     async def keep_both_files(self, file: UploadFileInfo, user_id) -> dict:
@@ -148,73 +196,498 @@ class FileServices:
             user_id, file.parent_folder_id
         )
 
-        await self.check_if_user_has_enough_space(user_id, file.file_size_in_bytes)
-        ext = file.file_name.rsplit(".", 1)[1]
-        new_name = self.generate_unique_filename(file.file_name)
+        stem, ext = self.split_copy_suffix(file.file_name)
 
-        attempts = 0
-        max_attempts = 10
+        s3_file_id = await self.log_next_free_copy(
+            user_id, file.parent_folder_id, stem, ext, file.file_size_in_bytes
+        )
 
-        while await self.is_file_name_taken(user_id, new_name, file.parent_folder_id):
-            attempts += 1
-            if attempts >= max_attempts:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Unable to generate unique filename. Please rename your file.",
-                )
-            new_name = self.generate_unique_filename(new_name)
+        return await self.link_or_upload_content(user_id, s3_file_id, file)
 
-        s3_file_id = await self.temp_log_file_to_be_verified(
-            user_id, file.parent_folder_id, new_name, file.file_size_in_bytes, ext
+    @staticmethod
+    async def claim_blob(conn, user_id, digest, size_in_bytes):
+        """
+        Blob of that content for the caller to reference inside its transaction:
+        a stored one, or a new one the caller uploads to. None while an upload of that
+        content is still on its way, linking to content that may never arrive would
+        leave the file empty.
+        """
+        ## Locked so the last reference can't be dropped while this one is added
+        blob = await conn.fetchrow(
+            "SELECT id, stored, has_thumbnails FROM blobs "
+            "WHERE owner_id = $1 AND sha256 = $2 AND size_in_bytes = $3 FOR UPDATE",
+            user_id,
+            digest,
+            size_in_bytes,
         )
+        if blob is None:
+            return await conn.fetchrow(
+                "INSERT INTO blobs (owner_id, sha256, size_in_bytes) "
+                "VALUES ($1, $2, $3) ON CONFLICT DO NOTHING "
+                "RETURNING id, stored, has_thumbnails",
+                user_id,
+                digest,
+                size_in_bytes,
+            )
+        return blob if blob["stored"] else None
+
+    async def link_or_upload_content(self, user_id, file_id, file: UploadFileInfo):
+        """
+        Upload step of a new file, deduplicated per owner when the client sent its SHA-256.
+        - Content the user already stored: the file links to it and is committed, no upload
+        - Unknown content goes to a new blob that later files with the hash link to
+        - Content of that hash still uploading: a plain upload
+        """
+        if file.sha256:
+            async with self.db.acquire_write(user_id) as conn:
+                async with conn.transaction():
+                    blob = await self.claim_blob(
+                        conn,
+                        user_id,
+                        bytes.fromhex(file.sha256),
+                        file.file_size_in_bytes,
+                    )
+                    if blob:
+                        await conn.execute(
+                            "UPDATE files SET blob_id = $1, has_thumbnails = $2 WHERE id = $3",
+                            blob["id"],
+                            blob["has_thumbnails"],
+                            file_id,
+                        )
+
+            if blob and blob["stored"]:
+                await self.quota_services.commit([file_id])
+                self.record_uploads(
+                    [{"owner_id": user_id, "id": file_id, "name": file.file_name}]
+                )
+                return {"file_id": file_id, "instant_upload": True}
+            if blob:
+                return self.aws_services.generate_presigned_upload_url(
+                    user_id,
+                    file.file_size_in_bytes,
+                    file_id,
+                    file.parent_folder_id,
+                    blob_id=str(blob["id"]),
+                    sha256=file.sha256,
+                )
 
         return self.aws_services.generate_presigned_upload_url(
-            user_id, file.file_size_in_bytes, s3_file_id, file.parent_folder_id
+            user_id, file.file_size_in_bytes, file_id, file.parent_folder_id
         )
 
     @staticmethod
-    def generate_unique_filename(file_name):
+    def split_copy_suffix(file_name) -> tuple[str, str]:
         """
-        Generate unique filename by incrementing number (e.g., 'photo (1).png' → 'photo (2).png').
-        Matches last '(number)' before extension. If no match, adds ' (1)' before extension.
+        Split a filename into the stem shared by all its copies and its extension.
+        'photo(3).png' and 'photo.png' both give ('photo', 'png').
         """
-        pattern = r"(\(\d+\))\.\w+"
-        match = re.search(pattern, file_name)
-
-        if match:
-            uncut_name = match.group(1)
-            cut_left_parenthesis = uncut_name.split("(", 1)[1]
-            cut_right_parenthesis = cut_left_parenthesis.rsplit(")", 1)[0]
-            number = int(cut_right_parenthesis)
-            new_number = number + 1
-            return file_name.replace(f"({number})", f"({new_number})")
-        else:
-            name, ext = file_name.rsplit(".", 1)
-            return name + f"(1).{ext}"
+        name, ext = file_name.rsplit(".", 1)
+        return re.sub(r"\(\d+\)$", "", name), ext
+
+    @staticmethod
+    def copy_pattern(stem, suffix) -> str:
+        """Regex matching 'stem(n)suffix' and capturing n."""
+        return rf"^{re.escape(stem)}\((\d+)\){re.escape(suffix)}$"
+
+    @staticmethod
+    def highest_copy_sql(table, location) -> str:
+        """
+        SELECT of n, the highest 'stem(n)suffix' among the owner's names at location,
+        with $1 the owner, $2 the stem and $3 its copy_pattern().
+        - The C-collated range on 'stem(' is a range scan of the name index from
+          app/db/migrations/0014_name_prefix_indexes.sql, the regex only checks it
+        - n is numeric, so a name like 'photo(99999999999).png' can't overflow it
+        """
+        return (
+            f"SELECT MAX(substring(name FROM $3)::numeric) AS n FROM {table} "
+            f"WHERE owner_id = $1 AND {location} "
+            "AND name COLLATE \"C\" >= $2 || '(' AND name COLLATE \"C\" < $2 || ')' "
+            "AND name ~ $3"
+        )
+
+    async def log_next_free_copy(
+        self, user_id, parent_folder_id, stem, ext, size_in_bytes
+    ) -> str:
+        """
+        Register a 'stem(n).ext' copy with n one past the highest existing copy.
+        - One statement reads the highest copy at the location and inserts the row
+        - A transaction level advisory lock per (owner, location, name) serializes
+          concurrent Keep uploads, so two requests can never pick the same n, a plain
+          upload that takes the name first is a 409
+        - Its storage is reserved in the same transaction
+        Returns the file UUID used as S3 key.
+        """
+        suffix = f".{ext}"
+        lock_key = f"{user_id}:{parent_folder_id}:{stem}.{ext}"
+        location = (
+            "parent_folder_id = $7" if parent_folder_id else "parent_folder_id IS NULL"
+        )
+
+        async with self.db.acquire_write(user_id) as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "SELECT pg_advisory_xact_lock(hashtextextended($1, 0))", lock_key
+                )
+                try:
+                    row = await conn.fetchrow(
+                        f"WITH copies AS ({self.highest_copy_sql('files', location)}) "
+                        "INSERT INTO files (name, size_in_bytes, type, owner_id, parent_folder_id) "
+                        "SELECT $2 || '(' || (COALESCE(n, 0) + 1) || ')' || $4, $5, $6, $1, $7::uuid "
+                        "FROM copies RETURNING id",
+                        user_id,
+                        stem,
+                        self.copy_pattern(stem, suffix),
+                        suffix,
+                        size_in_bytes,
+                        ext,
+                        parent_folder_id,
+                    )
+                except StringDataRightTruncationError:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Unable to generate unique filename. Please rename your file.",
+                    )
+                except UniqueViolationError:
+                    ## A plain upload of that very name doesn't take the lock
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"'{stem}' copies were just taken in this location, retry",
+                    )
+                await self.quota_services.reserve(
+                    conn, user_id, row["id"], size_in_bytes
+                )
+
+        return str(row["id"])
+
+    async def confirm_file_uploads(self, file_ids, x_lambda_secret) -> int:
+        """Upload callback, commits the quota reservations of the files that arrived in S3."""
+        if x_lambda_secret != os.getenv("LAMBDA_SECRET"):
+            raise HTTPException(status_code=403, detail="Forbidden")
 
-    async def check_if_user_has_enough_space(self, user_id, file_size_in_bytes):
         async with self.db.acquire() as conn:
-            row = await conn.fetchrow(
-                "SELECT available_storage_in_bytes FROM users WHERE id = $1", user_id
+            uploads = await self.resolve_uploads(conn, file_ids)
+        if not uploads:
+            return 0
+        committed = await self.quota_services.commit([row["id"] for row in uploads])
+        await self.settle_content(uploads, previewed=[])
+        self.record_uploads(uploads)
+        return committed
+
+    async def record_upload_results(self, results, x_lambda_secret) -> dict:
+        """
+        Thumbnail worker callback, one call for a whole batch of uploads.
+        - Content that doesn't match the file's name is removed and refunded, a new
+          version of an existing file is dropped and the file keeps its content
+        - Everything else is committed, previews are flagged for the listings
+        Returns the rejected ids so the worker deletes their objects.
+        """
+        if x_lambda_secret != os.getenv("LAMBDA_SECRET"):
+            raise HTTPException(status_code=403, detail="Forbidden")
+
+        async with self.db.acquire() as conn:
+            uploads = await self.resolve_uploads(
+                conn, [result.file_id for result in results]
+            )
+        by_upload_id = {row["upload_id"]: row for row in uploads}
+
+        accepted, rejected, previewed = [], [], []
+        for result in results:
+            upload = by_upload_id.get(result.file_id)
+            if upload is None:
+                continue  # deleted while the worker had it
+            if not is_acceptable(upload["name"], result.detected_type):
+                rejected.append(upload)
+                continue
+            accepted.append(upload)
+            if result.has_thumbnails:
+                previewed.append(upload["upload_id"])
+
+        committed = 0
+        if accepted:
+            committed = await self.quota_services.commit(
+                [row["id"] for row in accepted]
             )
-        if file_size_in_bytes > row["available_storage_in_bytes"]:
-            raise HTTPException(status_code=403, detail="User doesnt have enough space")
+            await self.settle_content(accepted, previewed)
+            self.record_uploads(accepted)
+        if rejected:
+            await self.remove_files(
+                [row["id"] for row in rejected if not row["version_id"]]
+            )
+            await self.drop_versions([row for row in rejected if row["version_id"]])
+        return {
+            "committed": committed,
+            "rejected_file_ids": [str(row["upload_id"]) for row in rejected],
+        }
+
+    @staticmethod
+    async def resolve_uploads(conn, upload_ids) -> list:
+        """
+        Files behind the ids upload callbacks report, the last segment of the object key:
+        a file id, or the id of a blob whose content was still on its way, for a new
+        file or for a new version of one.
+        """
+        return await conn.fetch(
+            "SELECT id AS upload_id, id, owner_id, name, NULL::uuid AS blob_id, "
+            "NULL::uuid AS version_id FROM files WHERE id = ANY($1::uuid[]) "
+            "UNION ALL "
+            "SELECT blobs.id, files.id, files.owner_id, files.name, blobs.id, NULL FROM blobs "
+            "JOIN files ON files.blob_id = blobs.id "
+            "WHERE blobs.id = ANY($1::uuid[]) AND NOT blobs.stored "
+            "UNION ALL "
+            "SELECT blobs.id, files.id, files.owner_id, files.name, blobs.id, file_versions.id "
+            "FROM blobs "
+            "JOIN file_versions ON file_versions.blob_id = blobs.id AND NOT file_versions.committed "
+            "JOIN files ON files.id = file_versions.file_id "
+            "WHERE blobs.id = ANY($1::uuid[]) AND NOT blobs.stored",
+            list(upload_ids),
+        )
+
+    async def settle_content(self, uploads, previewed):
+        """
+        Mark arrived blobs stored so new files link to them, and make arrived
+        versions current.
+        """
+        blob_ids = [row["blob_id"] for row in uploads if row["blob_id"]]
+        version_ids = [row["version_id"] for row in uploads if row["version_id"]]
+
+        async with self.db.acquire() as conn:
+            async with conn.transaction():
+                if blob_ids:
+                    await conn.execute(
+                        "UPDATE blobs SET stored = TRUE, has_thumbnails = (id = ANY($2::uuid[])) "
+                        "WHERE id = ANY($1::uuid[])",
+                        blob_ids,
+                        previewed,
+                    )
+                if version_ids:
+                    await VersionServices.commit_versions(conn, version_ids, previewed)
+                await conn.execute(
+                    "UPDATE files SET has_thumbnails = (COALESCE(blob_id, id) = ANY($2::uuid[])) "
+                    "WHERE id = ANY($1::uuid[])",
+                    [row["id"] for row in uploads],
+                    previewed,
+                )
+
+    async def drop_versions(self, uploads):
+        """Rejected new versions: refund their reservations, the files keep their content."""
+        if not uploads:
+            return
+        async with self.db.acquire() as conn:
+            async with conn.transaction():
+                await self.quota_services.release_replacements(
+                    conn, [row["id"] for row in uploads]
+                )
+                ## The blob never stored goes with its only reference
+                await conn.execute(
+                    "DELETE FROM file_versions WHERE id = ANY($1::uuid[]) AND NOT committed",
+                    [row["version_id"] for row in uploads],
+                )
+
+    @staticmethod
+    async def collect_orphaned_blobs(conn, blob_ids) -> list:
+        """Drop stored blobs nothing references anymore, returns them for their objects."""
+        if not blob_ids:
+            return []
+        return await conn.fetch(
+            "DELETE FROM blobs WHERE id = ANY($1::uuid[]) AND ref_count = 0 "
+            "RETURNING owner_id, NULL::uuid AS id, NULL::uuid AS parent_folder_id, "
+            "id AS blob_id, has_thumbnails",
+            list(set(blob_ids)),
+        )
+
+    @staticmethod
+    async def collect_orphaned_chunks(conn, chunk_ids) -> list:
+        """Drop stored chunks no version references anymore, returns owner_id and id."""
+        if not chunk_ids:
+            return []
+        return await conn.fetch(
+            "DELETE FROM chunks WHERE id = ANY($1::uuid[]) AND ref_count = 0 "
+            "RETURNING owner_id, id",
+            chunk_ids,
+        )
+
+    async def remove_files(self, file_ids) -> list:
+        """
+        Delete files with their refunds and versions, then every object nothing
+        references anymore: a file's own content, or blobs and chunks whose last
+        reference went with it.
+        Returns the removed rows.
+        """
+        if not file_ids:
+            return []
+        async with self.db.acquire() as conn:
+            async with conn.transaction():
+                versions = await conn.fetch(
+                    "SELECT file_id, blob_id, chunked FROM file_versions "
+                    "WHERE file_id = ANY($1::uuid[])",
+                    file_ids,
+                )
+                chunk_ids = await conn.fetch(
+                    "SELECT DISTINCT chunk_id FROM file_version_chunks "
+                    "JOIN file_versions ON file_versions.id = file_version_chunks.version_id "
+                    "WHERE file_versions.file_id = ANY($1::uuid[])",
+                    file_ids,
+                )
+                released = await self.release_copy_sources(conn, file_ids)
+                removed = await self.quota_services.remove_files(conn, file_ids)
+                orphans = await self.collect_orphaned_blobs(
+                    conn,
+                    [row["blob_id"] for row in [*removed, *versions] if row["blob_id"]],
+                )
+                orphaned_chunks = await self.collect_orphaned_chunks(
+                    conn, [row["chunk_id"] for row in chunk_ids]
+                )
+                ## A file has content under its own key until replaced, then as version 1
+                versioned = {row["file_id"] for row in versions}
+                own_content = {
+                    row["file_id"]
+                    for row in versions
+                    if not row["blob_id"] and not row["chunked"]
+                }
+                own = [
+                    row
+                    for row in removed
+                    if (not row["blob_id"] and row["id"] not in versioned)
+                    or row["id"] in own_content
+                ]
+                held = await self.hold_copy_sources(
+                    conn,
+                    [
+                        object_key(row["owner_id"], row["id"], row["parent_folder_id"])
+                        for row in own
+                    ],
+                )
+                keys = released + file_object_keys(
+                    [
+                        row
+                        for row in own
+                        if object_key(
+                            row["owner_id"], row["id"], row["parent_folder_id"]
+                        )
+                        not in held
+                    ]
+                    + orphans,
+                    orphaned_chunks,
+                )
+                ## Queued with the deletion, the objects go once it commits, retried until they do
+                if keys:
+                    await JobQueue.enqueue(conn, DELETE_OBJECTS_JOB, {"keys": keys})
+        for owner_id in {row["owner_id"] for row in removed}:
+            self.db.record_write(owner_id)
+        return removed
+
+    @staticmethod
+    async def hold_copy_sources(conn, keys) -> set:
+        """
+        The keys among the removed files' own content that pending copies still read.
+        Their objects stay until the copies are done with them, see release_copy_sources.
+        """
+        if not keys:
+            return set()
+        rows = await conn.fetch(
+            "UPDATE copy_items SET source_deleted = TRUE WHERE file_id IN ("
+            "SELECT file_id FROM copy_items WHERE source_key = ANY($1::text[]) "
+            "ORDER BY file_id FOR UPDATE) RETURNING source_key",
+            keys,
+        )
+        return {row["source_key"] for row in rows}
+
+    @staticmethod
+    async def release_copy_sources(conn, file_ids) -> list:
+        """
+        Drop the copy_items of copied or removed files, returns the objects of their
+        sources that were deleted meanwhile and that no other pending copy reads.
+        Every copy_items row of those sources is locked in file_id order first, so the
+        last one out sees the others gone and two of them can't deadlock.
+        """
+        sources = await conn.fetch(
+            "SELECT copy_items.file_id, copy_items.source_key, copy_items.source_deleted, "
+            "copy_items.source_preview_id, copies.owner_id FROM copy_items "
+            "JOIN copies ON copies.id = copy_items.copy_id "
+            "WHERE copy_items.source_key IN ("
+            "SELECT source_key FROM copy_items WHERE file_id = ANY($1::uuid[])) "
+            "ORDER BY copy_items.file_id FOR UPDATE OF copy_items",
+            file_ids,
+        )
+        if not sources:
+            return []
+        await conn.execute(
+            "DELETE FROM copy_items WHERE file_id = ANY($1::uuid[])", file_ids
+        )
+        released = {str(file_id) for file_id in file_ids}
+        still_read = {
+            row["source_key"] for row in sources if str(row["file_id"]) not in released
+        }
+        keys = {}
+        for row in sources:
+            if row["source_deleted"] and row["source_key"] not in still_read:
+                keys[row["source_key"]] = None
+                if row["source_preview_id"]:
+                    for size in THUMBNAIL_SIZES:
+                        keys[
+                            thumbnail_key(
+                                row["owner_id"], row["source_preview_id"], size
+                            )
+                        ] = None
+        return list(keys)
+
+    async def delete_objects(self, payload):
+        """Job handler, S3 cleanup after the rows are gone."""
+        await self.aws_services.delete_objects(payload["keys"])
+
+    async def delete_file(self, user_id, file_id):
+        if not await self.verify_file_existence_ownership(user_id, file_id):
+            raise HTTPException(status_code=404, detail="File not found")
+        await self.remove_files([file_id])
+        return {"message": "File deleted"}
 
     async def get_file_metadata_for_download(self, file_id):
         async with self.db.acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT name, parent_folder_id FROM files WHERE id = $1", file_id
+                "SELECT name, parent_folder_id, files.blob_id, "
+                "CASE WHEN file_versions.chunked THEN file_versions.id END AS chunked_version_id "
+                "FROM files LEFT JOIN file_versions ON file_versions.id = files.current_version_id "
+                "WHERE files.id = $1",
+                file_id,
             )
-        return row["name"], row["parent_folder_id"]
+            chunks = []
+            if row["chunked_version_id"]:
+                chunks = await VersionServices.chunks_of(
+                    conn, row["chunked_version_id"]
+                )
+        return row["name"], row["parent_folder_id"], row["blob_id"], chunks
 
     async def get_user_presigned_download_url(self, user_id, file_id):
         """
         Generate presigned download URL for user's file.
         Verifies ownership and returns URL with proper filename.
+        Content stored as chunks gives the URLs of its chunks in order instead, they
+        stay byte-identical for an hour so the client's cache serves unchanged chunks.
         Raises 404 if file doesn't exist or user doesn't own it.
         """
         if await self.verify_file_existence_ownership(user_id, file_id):
-            name, folder_id = await self.get_file_metadata_for_download(file_id)
+            name, folder_id, blob_id, chunks = (
+                await self.get_file_metadata_for_download(file_id)
+            )
+            if self.activity_log:
+                self.activity_log.record(user_id, "download", "file", file_id, name)
+            if self.interaction_tracker:
+                self.interaction_tracker.touch("file", file_id)
+            if chunks:
+                urls = self.aws_services.presign_cacheable_get_urls(
+                    [chunk_key(user_id, chunk["id"]) for chunk in chunks]
+                )
+                return {
+                    "file_name": name,
+                    "chunks": [
+                        {"url": url, "size_in_bytes": chunk["size_in_bytes"]}
+                        for url, chunk in zip(urls, chunks)
+                    ],
+                }
+            if blob_id:
+                return self.aws_services.generate_presigned_download_url(
+                    user_id, file_id, name, folder_id, blob_id=blob_id
+                )
             return self.aws_services.generate_presigned_download_url(
                 user_id, file_id, name, folder_id
             )
@@ -240,7 +713,7 @@ class FileServices:
     async def rename_file(self, user_id, file_id, file_name, parent_folder_id):
         """
         Rename file after verifying ownership and checking for name conflicts.
-        Verifies file ownership, checks if new name is taken at location, updates display name.
+        Verifies file ownership, updates display name, a name taken at the location is a 409.
         Returns success message on completion.
         """
 
@@ -260,19 +733,24 @@ class FileServices:
         _, ext = old_name.rsplit(".", 1)  # No check needed  all files have extensions
         adjusted_name = f"{file_name}.{ext}"
 
-        # 4. Check for naming conflicts
-        if await self.is_file_name_taken(user_id, adjusted_name, parent_folder_id):
+        # 4. Update filename, the unique name index reports conflicts
+        try:
+            async with self.db.acquire_write(user_id) as conn:
+                renamed = await conn.fetchval(
+                    "UPDATE files SET name = $1 WHERE id = $2 AND name <> $1 RETURNING id",
+                    adjusted_name,
+                    file_id,
+                )
+        except UniqueViolationError:
+            renamed = None
+        if renamed is None:
             raise HTTPException(
                 status_code=409,
                 detail=f"File '{adjusted_name}' already exists in this location",
             )
 
-        # 5. Update filename
-        async with self.db.acquire() as conn:
-            await conn.execute(
-                "UPDATE files SET name = $1 WHERE id = $2", adjusted_name, file_id
-            )
-
+        if self.activity_log:
+            self.activity_log.record(user_id, "rename", "file", file_id, adjusted_name)
         return {"message": f"File renamed to '{adjusted_name}'"}
 
     async def share(self, user_id, share_info):
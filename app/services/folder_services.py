@@ -1,14 +1,20 @@
 from fastapi import HTTPException
+from asyncpg.exceptions import UniqueViolationError
 from ..helpers.file_utils import format_db_returning_objects
 
 
 # noinspection SqlNoDataSourceInspection
 class FolderServices:
-    def __init__(self, db):
+    def __init__(
+        self, db, aws_services=None, activity_log=None, interaction_tracker=None
+    ):
         self.db = db
+        self.aws_services = aws_services
+        self.activity_log = activity_log
+        self.interaction_tracker = interaction_tracker
 
     async def verify_folder_existence_ownership(self, user_id, folder_id) -> str | bool:
-        async with self.db.acquire() as conn:
+        async with self.db.acquire_read(user_id) as conn:
             row = await conn.fetchrow(
                 "SELECT name FROM folders WHERE owner_id = $1 AND id = $2",
                 user_id,
@@ -18,27 +24,6 @@ class FolderServices:
                 return str(row["name"])
             return False
 
-    async def check_if_folder_name_in_use_at_location(
-        self, user_id, folder_name, parent_folder_id=None
-    ) -> str | bool:
-        async with self.db.acquire() as conn:
-            if parent_folder_id:
-                row = await conn.fetchrow(
-                    "SELECT name FROM folders WHERE name = $1 AND parent_folder_id = $2 AND owner_id = $3",
-                    folder_name,
-                    parent_folder_id,
-                    user_id,
-                )
-            else:
-                row = await conn.fetchrow(
-                    "SELECT name FROM folders WHERE name = $1 AND parent_folder_id IS NULL AND owner_id = $2",
-                    folder_name,
-                    user_id,
-                )
-            if row:
-                return str(row["name"])
-            return False
-
     async def register_folder(self, folder_name, parent_folder_id, user_id) -> str:
         """
         Create new folder after validating parent folder existence and uniqueness at location.
@@ -46,57 +31,66 @@ class FolderServices:
         """
         await self.verify_parent_folder_if_provided(user_id, parent_folder_id)
 
-        if await self.check_if_folder_name_in_use_at_location(
-            user_id, folder_name, parent_folder_id
-        ):
-            raise HTTPException(
-                status_code=409,
-                detail=f"Folder '{folder_name}' already exists in this location",
-            )
-
-        async with self.db.acquire() as conn:
+        ## The unique name indexes decide, a taken name inserts nothing
+        async with self.db.acquire_write(user_id) as conn:
             row = await conn.fetchrow(
                 "INSERT INTO folders (name, parent_folder_id, owner_id)"
-                "VALUES ($1, $2, $3) RETURNING name",
+                "VALUES ($1, $2, $3) ON CONFLICT DO NOTHING RETURNING name",
                 folder_name,
                 parent_folder_id,
                 user_id,
             )
-            return str(row["name"])
+        if row is None:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Folder '{folder_name}' already exists in this location",
+            )
+        return str(row["name"])
 
-    async def retrieve_folder_content(self, user_id, sort_by, order, location=None):
+    async def retrieve_folder_content(
+        self, user_id, sort_by, order, location=None, thumbnail_size=None
+    ):
         """
         Retrieve files and folders at specified location (or root if None).
         Uses UNION query to merge and sort files/folders together.
         User info only included when retrieving root directory.
+        With a thumbnail_size, files that have previews carry a signed thumbnail_url.
+        Opening a folder counts as an interaction with it.
         """
-        async with self.db.acquire() as conn:
+        ## Checked before acquiring, it takes its own connection and nesting can exhaust small pools
+        await self.verify_parent_folder_if_provided(user_id, location)
+        if location and self.interaction_tracker:
+            self.interaction_tracker.touch("folder", location)
+
+        async with self.db.acquire_read(user_id) as conn:
             async with conn.transaction():
 
                 if not location:
                     user_data = await conn.fetchrow(
-                        "SELECT username, email, available_storage_in_bytes, "
-                        "total_storage_in_bytes "
+                        "SELECT username, email, total_storage_in_bytes, "
+                        "(SELECT SUM(available_bytes) FROM quota_stripes WHERE user_id = $1)::bigint "
+                        "AS available_storage_in_bytes "
                         "FROM users WHERE id = $1",
                         user_id,
                     )
 
                     data = await conn.fetch(
-                        "SELECT id, name, created_at, last_interaction, size_in_bytes, type "
+                        "SELECT id, name, created_at, last_interaction, size_in_bytes, type, has_thumbnails, "
+                        "COALESCE(blob_id, id) AS preview_id "
                         "FROM files WHERE owner_id = $1 AND parent_folder_id IS NULL "
                         "UNION ALL "
-                        "SELECT id, name, created_at, last_interaction, NULL as size, NULL as type "
+                        "SELECT id, name, created_at, last_interaction, NULL as size, NULL as type, FALSE, NULL "
                         "FROM folders WHERE owner_id = $1 AND parent_folder_id IS NULL "
                         f"ORDER BY {sort_by} {order}",
                         user_id,
                     )
                 else:
-                    await self.verify_parent_folder_if_provided(user_id, location)
                     data = await conn.fetch(
-                        "SELECT id, name, created_at, last_interaction, size_in_bytes, type, parent_folder_id "
+                        "SELECT id, name, created_at, last_interaction, size_in_bytes, type, parent_folder_id, has_thumbnails, "
+                        "COALESCE(blob_id, id) AS preview_id "
                         "FROM files WHERE owner_id = $1 AND parent_folder_id = $2 "
                         "UNION ALL "
-                        "SELECT id, name, created_at, last_interaction, NULL as size_in_bytes, NULL as type, parent_folder_id "
+                        "SELECT id, name, created_at, last_interaction, NULL as size_in_bytes, NULL as type, parent_folder_id, FALSE, NULL "
                         "FROM folders WHERE owner_id = $1 and parent_folder_id = $2 "
                         f"ORDER BY {sort_by} {order}",
                         user_id,
@@ -112,6 +106,9 @@ class FolderServices:
             formated_folder_files_list_of_records = format_db_returning_objects(
                 folder_files_list_of_records
             )
+            self.attach_thumbnail_urls(
+                user_id, formated_folder_files_list_of_records, thumbnail_size
+            )
 
             if not location:
                 return {
@@ -120,24 +117,49 @@ class FolderServices:
                 }
             return {"files_and_folders": formated_folder_files_list_of_records}
 
+    def attach_thumbnail_urls(self, user_id, items, thumbnail_size):
+        """
+        One signing batch for the whole listing, no request per preview.
+        Previews live under the blob of shared or versioned content, else the file id.
+        """
+        preview_ids = {}
+        for item in items:
+            preview_id = item.pop("preview_id")
+            if item.pop("has_thumbnails"):
+                preview_ids[item["id"]] = str(preview_id)
+        if not (thumbnail_size and preview_ids and self.aws_services):
+            return
+        urls = self.aws_services.generate_presigned_thumbnail_urls(
+            user_id, list(set(preview_ids.values())), thumbnail_size
+        )
+        for item in items:
+            item["thumbnail_url"] = urls.get(preview_ids.get(item["id"]))
+
     async def rename_folder(self, user_id, parent_folder_id, folder_id, new_name):
         """
         Rename a folder if owned by the user and the new name is not already taken in the same location.
         """
         if await self.verify_folder_existence_ownership(user_id, folder_id):
-            if await self.check_if_folder_name_in_use_at_location(
-                user_id, new_name, parent_folder_id
-            ):
+            ## The folder's current name counts as taken too, the unique index reports the rest
+            try:
+                async with self.db.acquire_write(user_id) as conn:
+                    renamed = await conn.fetchval(
+                        "UPDATE folders SET name = $1 WHERE id = $2 AND name <> $1 RETURNING id",
+                        new_name,
+                        folder_id,
+                    )
+            except UniqueViolationError:
+                renamed = None
+            if renamed is None:
                 raise HTTPException(
                     status_code=409,
                     detail=f"Folder '{new_name}' already exists in this location",
                 )
 
-            async with self.db.acquire() as conn:
-                await conn.execute(
-                    "UPDATE folders SET name = $1 WHERE id = $2", new_name, folder_id
+            if self.activity_log:
+                self.activity_log.record(
+                    user_id, "rename", "folder", folder_id, new_name
                 )
-
             return {"message": f"Folder renamed to: '{new_name}' "}
         raise HTTPException(status_code=404, detail="Folder doesn't exist")
 
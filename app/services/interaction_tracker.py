@@ -0,0 +1,93 @@
+from datetime import datetime, timezone
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+TABLES = {"file": "files", "folder": "folders"}
+
+
+# noinspection SqlNoDataSourceInspection
+class InteractionTracker:
+    """
+    Coalesced last_interaction updates for downloaded files and opened folders.
+    Services touch items in memory without a round trip, only the latest touch of each
+    item is kept, and a background task writes them every flush_interval_ms with one
+    UPDATE per table whatever the traffic. Past max_items distinct items waiting (the
+    database is down or can't keep up) new items are dropped and counted, an item
+    already waiting is still moved forward.
+    """
+
+    def __init__(self, db, max_items=50_000, flush_interval_ms=5_000):
+        self.db = db
+        self.max_items = max_items
+        self.flush_interval_s = flush_interval_ms / 1000
+        self.pending = {object_type: {} for object_type in TABLES}
+        self.written = 0
+        self.dropped = 0
+        self._flushing = asyncio.Lock()
+
+    def touch(self, object_type, object_id) -> bool:
+        """Note an interaction with a file or folder now, False when it was dropped."""
+        touched = self.pending[object_type]
+        object_id = str(object_id)
+        if object_id not in touched and len(touched) >= self.max_items:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(
+                    f"Interaction tracker full, {self.dropped} touches dropped so far"
+                )
+            return False
+        touched[object_id] = datetime.now(timezone.utc)
+        return True
+
+    async def flush(self) -> int:
+        """
+        Write every waiting touch, one statement per table. A touch never moves
+        last_interaction back, a failed table keeps its touches for the next flush
+        unless newer ones arrived meanwhile. Returns the number of rows updated.
+        """
+        written = 0
+        async with self._flushing:
+            for object_type, table in TABLES.items():
+                touched = self.pending[object_type]
+                if not touched:
+                    continue
+                self.pending[object_type] = {}
+                ## Sorted so concurrent workers lock common rows in the same order
+                object_ids = sorted(touched)
+                try:
+                    async with self.db.acquire() as conn:
+                        result = await conn.execute(
+                            f"UPDATE {table} SET last_interaction = touched.at "
+                            "FROM unnest($1::uuid[], $2::timestamptz[]) AS touched(id, at) "
+                            f"WHERE {table}.id = touched.id "
+                            f"AND {table}.last_interaction < touched.at",
+                            object_ids,
+                            [touched[object_id] for object_id in object_ids],
+                        )
+                except Exception as exc:
+                    logger.error(
+                        f"Interaction flush of {len(touched)} {table} failed: {exc}"
+                    )
+                    ## Touches made during the flush are newer, they win
+                    touched.update(self.pending[object_type])
+                    self.pending[object_type] = touched
+                    continue
+                written += int(result.split()[-1])
+        self.written += written
+        return written
+
+    async def run(self):
+        """Lifespan background task."""
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            await self.flush()
+
+    async def close(self):
+        """Flush what's left on shutdown, once run() is cancelled."""
+        written = await self.flush()
+        waiting = sum(len(touched) for touched in self.pending.values())
+        if waiting:
+            logger.error(f"{waiting} interactions lost on shutdown")
+        return written
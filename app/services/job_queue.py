@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+
+# noinspection SqlNoDataSourceInspection
+class JobQueue:
+    """
+    Postgres-backed background jobs, see app/db/migrations/0009_jobs.sql.
+    Every API process runs concurrency workers, each claiming up to batch_size due jobs
+    at a time and running them side by side, their lease extended for as long as they
+    run. A connection is only held to claim, to extend leases and to record results,
+    never while a handler runs. Delivery is at least once, handlers must be idempotent.
+    """
+
+    def __init__(
+        self,
+        db,
+        concurrency=4,
+        batch_size=10,
+        poll_interval_s=1.0,
+        lease_s=300.0,
+        backoff_base_s=2.0,
+        backoff_max_s=3600.0,
+    ):
+        self.db = db
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval_s = poll_interval_s
+        self.lease_s = lease_s
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.handlers = {}
+        self.completed = 0
+        self.failed = 0
+
+    def register(self, kind, handler):
+        """handler is an async function of the job's payload."""
+        self.handlers[kind] = handler
+
+    @staticmethod
+    async def enqueue(conn, kind, payload, delay_s=0, max_attempts=5):
+        """Queue a job inside the caller's transaction, it only exists if that commits."""
+        return await conn.fetchval(
+            "INSERT INTO jobs (kind, payload, max_attempts, run_at) "
+            "VALUES ($1, $2::jsonb, $3, NOW() + make_interval(secs => $4)) RETURNING id",
+            kind,
+            json.dumps(payload),
+            max_attempts,
+            float(delay_s),
+        )
+
+    async def claim(self) -> list:
+        async with self.db.acquire() as conn:
+            rows = await conn.fetch(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, "
+                "locked_until = NOW() + make_interval(secs => $2) "
+                "WHERE id IN ("
+                "SELECT id FROM jobs WHERE state = 'queued' AND run_at <= NOW() "
+                "ORDER BY run_at LIMIT $1 FOR UPDATE SKIP LOCKED) "
+                "RETURNING id, kind, payload, attempts",
+                self.batch_size,
+                self.lease_s,
+            )
+        return [
+            {
+                "id": row["id"],
+                "kind": row["kind"],
+                "payload": json.loads(row["payload"]),
+                "attempts": row["attempts"],
+            }
+            for row in rows
+        ]
+
+    def backoff_s(self, attempts) -> float:
+        """Exponential in the attempts made, with jitter so failed batches spread out."""
+        delay = min(self.backoff_base_s * 2 ** (attempts - 1), self.backoff_max_s)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def run_job(self, job):
+        """None when the job is done, its error otherwise."""
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            return f"No handler for job kind {job['kind']!r}"
+        try:
+            await handler(job["payload"])
+        except Exception as exc:
+            logger.warning(
+                f"Job {job['id']} ({job['kind']}) failed, attempt {job['attempts']}: {exc}"
+            )
+            return f"{type(exc).__name__}: {exc}"
+        return None
+
+    async def extend_leases(self, jobs):
+        """Keep the lease of claimed jobs from running out until cancelled."""
+        while True:
+            await asyncio.sleep(self.lease_s / 3)
+            try:
+                async with self.db.acquire() as conn:
+                    await conn.execute(
+                        "UPDATE jobs SET locked_until = NOW() + make_interval(secs => $3) "
+                        "FROM unnest($1::bigint[], $2::int[]) AS claimed(id, attempts) "
+                        "WHERE jobs.id = claimed.id AND jobs.attempts = claimed.attempts "
+                        "AND jobs.state = 'running'",
+                        [job["id"] for job in jobs],
+                        [job["attempts"] for job in jobs],
+                        self.lease_s,
+                    )
+            except Exception as exc:
+                logger.error(f"Job lease extension failed: {exc}")
+
+    async def finish(self, done, failures):
+        """
+        Drop done jobs, requeue failed ones after their backoff or dead-letter them.
+        Only the attempt that claimed a job records it: once its lease ran out and the
+        job was claimed again, a late result is ignored.
+        """
+        async with self.db.acquire() as conn:
+            async with conn.transaction():
+                if done:
+                    await conn.execute(
+                        "DELETE FROM jobs USING unnest($1::bigint[], $2::int[]) "
+                        "AS claimed(id, attempts) "
+                        "WHERE jobs.id = claimed.id AND jobs.attempts = claimed.attempts "
+                        "AND jobs.state = 'running'",
+                        [job["id"] for job in done],
+                        [job["attempts"] for job in done],
+                    )
+                if failures:
+                    dead = await conn.fetch(
+                        "UPDATE jobs SET "
+                        "state = CASE WHEN jobs.attempts >= max_attempts THEN 'dead' ELSE 'queued' END, "
+                        "run_at = NOW() + make_interval(secs => failed.delay_s), "
+                        "last_error = failed.error, locked_until = NULL "
+                        "FROM unnest($1::bigint[], $2::int[], $3::float8[], $4::text[]) "
+                        "AS failed(id, attempts, delay_s, error) "
+                        "WHERE jobs.id = failed.id AND jobs.attempts = failed.attempts "
+                        "AND jobs.state = 'running' "
+                        "RETURNING jobs.id, jobs.kind, jobs.state",
+                        [job["id"] for job, _ in failures],
+                        [job["attempts"] for job, _ in failures],
+                        [self.backoff_s(job["attempts"]) for job, _ in failures],
+                        [error for _, error in failures],
+                    )
+                    for row in dead:
+                        if row["state"] == "dead":
+                            logger.error(
+                                f"Job {row['id']} ({row['kind']}) moved to the dead-letter queue"
+                            )
+        self.completed += len(done)
+        self.failed += len(failures)
+
+    async def work_once(self) -> int:
+        """Claim one batch and run its jobs concurrently, returns the number claimed."""
+        jobs = await self.claim()
+        if not jobs:
+            return 0
+        heartbeat = asyncio.create_task(self.extend_leases(jobs))
+        try:
+            errors = await asyncio.gather(*(self.run_job(job) for job in jobs))
+        finally:
+            heartbeat.cancel()
+        done = [job for job, error in zip(jobs, errors) if error is None]
+        failures = [(job, error) for job, error in zip(jobs, errors) if error]
+        await self.finish(done, failures)
+        return len(jobs)
+
+    async def requeue_expired(self) -> int:
+        """Jobs whose worker died mid-run, their attempt counts as failed."""
+        async with self.db.acquire() as conn:
+            result = await conn.execute(
+                "UPDATE jobs SET "
+                "state = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'queued' END, "
+                "run_at = NOW(), locked_until = NULL, last_error = 'Lease expired' "
+                "WHERE state = 'running' AND locked_until < NOW()"
+            )
+        return int(result.split()[-1])
+
+    async def worker(self):
+        while True:
+            try:
+                claimed = await self.work_once()
+            except Exception as exc:
+                logger.error(f"Job worker failed: {exc}")
+                claimed = 0
+            if claimed < self.batch_size:
+                ## Jittered so idle workers don't poll in lockstep
+                await asyncio.sleep(self.poll_interval_s * random.uniform(0.5, 1.5))
+
+    async def sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.lease_s / 2)
+            try:
+                if requeued := await self.requeue_expired():
+                    logger.warning(f"Requeued {requeued} jobs with an expired lease")
+            except Exception as exc:
+                logger.error(f"Job lease sweep failed: {exc}")
+
+    async def run(self):
+        """Lifespan background task."""
+        await asyncio.gather(
+            self.sweep_periodically(),
+            *(self.worker() for _ in range(self.concurrency)),
+        )
+
+    async def status(self) -> dict:
+        """Outstanding jobs per kind and state, with the dead-lettered ones."""
+        async with self.db.acquire() as conn:
+            counts = await conn.fetch(
+                "SELECT kind, state, count(*) AS jobs FROM jobs GROUP BY kind, state "
+                "ORDER BY kind, state"
+            )
+            dead = await conn.fetch(
+                "SELECT id, kind, payload, attempts, last_error, created_at FROM jobs "
+                "WHERE state = 'dead' ORDER BY id LIMIT 100"
+            )
+        return {
+            "concurrency": self.concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "counts": [dict(row) for row in counts],
+            "dead": [
+                {
+                    "id": row["id"],
+                    "kind": row["kind"],
+                    "payload": json.loads(row["payload"]),
+                    "attempts": row["attempts"],
+                    "last_error": row["last_error"],
+                    "created_at": row["created_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                }
+                for row in dead
+            ],
+        }
+
+    async def retry_dead(self, job_id) -> bool:
+        """Give a dead-lettered job a fresh set of attempts."""
+        async with self.db.acquire() as conn:
+            result = await conn.execute(
+                "UPDATE jobs SET state = 'queued', attempts = 0, run_at = NOW() "
+                "WHERE id = $1 AND state = 'dead'",
+                job_id,
+            )
+        return result == "UPDATE 1"
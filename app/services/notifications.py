@@ -0,0 +1,153 @@
+from collections import deque
+from contextlib import contextmanager
+import asyncio
+import asyncpg
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sent by the trigger of app/db/migrations/0008_change_notifications.sql
+CHANGES_CHANNEL = "drive_changes"
+
+
+class Subscription:
+    """
+    One connected client. Its buffer is bounded: a client too slow to drain it loses
+    its oldest events, never anything it needs, since every event carries the
+    latest cursor and GET /changes returns everything up to it.
+    """
+
+    __slots__ = ("events", "ready")
+
+    def __init__(self, buffer_size):
+        self.events = deque(maxlen=buffer_size)
+        self.ready = asyncio.Event()
+
+    def push(self, event):
+        self.events.append(event)
+        self.ready.set()
+
+    async def next_events(self, timeout_s) -> list:
+        """
+        Buffered events, waiting up to timeout_s for some. Empty on timeout.
+        Timed out by a timer handle, wait_for would add a task per idle client.
+        """
+        if not self.events:
+            timer = asyncio.get_running_loop().call_later(timeout_s, self.ready.set)
+            try:
+                await self.ready.wait()
+            finally:
+                timer.cancel()
+        self.ready.clear()
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+
+class ChangeNotifier:
+    """
+    Fans the change log's NOTIFYs out to the clients connected to this worker.
+    One dedicated LISTEN connection per worker whatever the number of clients, and an
+    idle client costs a small buffer, no connection, no task of its own here.
+    """
+
+    def __init__(
+        self, dsn, db=None, buffer_size=32, health_check_s=30.0, reconnect_delay_s=1.0
+    ):
+        self.dsn = dsn
+        self.db = db
+        self.buffer_size = buffer_size
+        self.health_check_s = health_check_s
+        self.reconnect_delay_s = reconnect_delay_s
+        self.subscribers = {}
+        self.delivered = 0
+        self.listening = asyncio.Event()
+
+    @contextmanager
+    def subscribe(self, user_id):
+        subscription = Subscription(self.buffer_size)
+        self.subscribers.setdefault(user_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscriptions = self.subscribers.get(user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[user_id]
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self.subscribers.values())
+
+    def dispatch(self, payload):
+        """One NOTIFY: {"user_id", "cursor", "kinds"}, for that user's clients only."""
+        event = json.loads(payload)
+        user_id = event.pop("user_id")
+        if self.db is not None:
+            ## The client fetches GET /changes next, it mustn't hit a replica behind this change
+            self.db.record_write(user_id)
+        for subscription in self.subscribers.get(user_id, ()):
+            subscription.push(event)
+            self.delivered += 1
+
+    async def stream(self, user_id, keepalive_s=25.0):
+        """
+        Server-sent events for one client: a 'changes' event with the cursor to fetch
+        GET /changes up to, 'resync' when notifications may have been missed, and a
+        comment line every keepalive_s so proxies keep the connection open.
+        """
+        with self.subscribe(user_id) as subscription:
+            yield "retry: 5000\n\n"
+            while True:
+                events = await subscription.next_events(keepalive_s)
+                if not events:
+                    yield ": keepalive\n\n"
+                for event in events:
+                    kind = "resync" if event.get("resync") else "changes"
+                    yield f"event: {kind}\ndata: {json.dumps(event)}\n\n"
+
+    def broadcast(self, event):
+        for subscriptions in self.subscribers.values():
+            for subscription in subscriptions:
+                subscription.push(event)
+
+    async def run(self):
+        """
+        Lifespan background task. The connection is checked every health_check_s,
+        a silent one may be dead. On reconnect every client is told to resync,
+        NOTIFYs sent in between are lost.
+        """
+        connected_before = False
+        while True:
+            conn = None
+            lost = asyncio.Event()
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(
+                    CHANGES_CHANNEL,
+                    lambda _conn, _pid, _channel, payload: self.dispatch(payload),
+                )
+                if connected_before:
+                    self.broadcast({"resync": True})
+                connected_before = True
+                self.listening.set()
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), self.health_check_s)
+                    except asyncio.TimeoutError:
+                        await conn.fetchval("SELECT 1", timeout=self.health_check_s)
+                logger.warning("Change listener connection lost, reconnecting")
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                asyncpg.PostgresError,
+                asyncpg.InterfaceError,
+            ) as exc:
+                logger.warning(f"Change listener failed, reconnecting: {exc}")
+            finally:
+                self.listening.clear()
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+            await asyncio.sleep(self.reconnect_delay_s)
@@ -0,0 +1,221 @@
+from contextvars import ContextVar
+from .deadlines import DeadlineExceeded, remaining_s, reset_deadline, set_deadline
+import asyncio
+import json
+import logging
+import random
+import re
+import sys
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Frame of the code that issued the statement currently running on this task.
+# Read lazily by the query logger, the stack is only walked for slow queries.
+_query_origin: ContextVar = ContextVar("query_origin", default=None)
+
+_WHITESPACE = re.compile(r"\s+")
+_SERVICES_PACKAGE = "app.services."
+
+
+class TracedConnection(asyncpg.Connection):
+    """
+    Connection class that remembers which frame issued each statement.
+    asyncpg dispatches query loggers with call_soon, which copies the current
+    context, so the QueryTracer can attribute a slow query to its service method.
+    Statements without a timeout of their own get what's left of the request's
+    deadline, asyncpg cancels them server side when it passes.
+    """
+
+    async def _traced(self, method, origin, args, kwargs):
+        token = _query_origin.set(origin)
+        try:
+            if kwargs.get("timeout") is None:
+                kwargs["timeout"] = remaining_s()
+                if kwargs["timeout"] is not None:
+                    try:
+                        return await method(*args, **kwargs)
+                    except TimeoutError as exc:
+                        raise DeadlineExceeded from exc
+            return await method(*args, **kwargs)
+        finally:
+            _query_origin.reset(token)
+
+    async def execute(self, query, *args, **kwargs):
+        return await self._traced(
+            super().execute, sys._getframe(1), (query, *args), kwargs
+        )
+
+    async def executemany(self, command, args, **kwargs):
+        return await self._traced(
+            super().executemany, sys._getframe(1), (command, args), kwargs
+        )
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self._traced(
+            super().fetch, sys._getframe(1), (query, *args), kwargs
+        )
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self._traced(
+            super().fetchrow, sys._getframe(1), (query, *args), kwargs
+        )
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self._traced(
+            super().fetchval, sys._getframe(1), (query, *args), kwargs
+        )
+
+    async def reset(self, *, timeout=None):
+        ## The pool resets a released connection, even past the deadline of its request
+        token = set_deadline(None)
+        try:
+            return await super().reset(timeout=timeout)
+        finally:
+            reset_deadline(token)
+
+
+def calling_service_method(frame) -> str:
+    """Walk up from the issuing frame to the first method defined in app.services."""
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith(_SERVICES_PACKAGE) and module != __name__:
+            code = frame.f_code
+            return f"{module.rsplit('.', 1)[1]}.{code.co_qualname}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class _RollbackExplain(Exception):
+    pass
+
+
+class QueryStats:
+    __slots__ = (
+        "query",
+        "calls",
+        "slow_calls",
+        "total_ms",
+        "max_ms",
+        "sources",
+        "plan",
+    )
+
+    def __init__(self, query):
+        self.query = query
+        self.calls = 0
+        self.slow_calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.sources = set()
+        self.plan = None
+
+    def as_dict(self) -> dict:
+        return {
+            "query": self.query,
+            "calls": self.calls,
+            "slow_calls": self.slow_calls,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "sources": sorted(self.sources),
+            "plan": self.plan,
+        }
+
+
+class QueryTracer:
+    """
+    Times every statement through asyncpg's query logger hook.
+    - Statements slower than slow_query_threshold_ms are logged with their service method
+    - A sampled share of slow SELECTs gets an EXPLAIN (ANALYZE, BUFFERS) captured in the background
+    - Everything is aggregated per statement text for the admin "top queries" report
+    """
+
+    def __init__(
+        self,
+        slow_query_threshold_ms=200,
+        explain_sample_rate=0.1,
+        max_tracked_queries=500,
+        max_concurrent_explains=2,
+    ):
+        self.slow_query_threshold_ms = slow_query_threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.max_tracked_queries = max_tracked_queries
+        self.max_concurrent_explains = max_concurrent_explains
+        self.stats: dict[str, QueryStats] = {}
+        self.pool = None
+        self._explain_tasks = set()
+
+    async def setup_connection(self, conn):
+        """Pool init hook, registers the query logger on every new connection."""
+        conn.add_query_logger(self.log_query)
+
+    def bind_pool(self, pool):
+        """EXPLAIN runs on its own pooled connection, never on the traced one."""
+        self.pool = pool
+
+    def log_query(self, record):
+        if record.query.lstrip()[:7].upper() == "EXPLAIN":
+            return
+
+        elapsed_ms = record.elapsed * 1000
+        query = _WHITESPACE.sub(" ", record.query).strip()
+        stats = self.stats.get(query)
+        if stats is None:
+            if len(self.stats) >= self.max_tracked_queries:
+                return
+            stats = self.stats[query] = QueryStats(query)
+
+        stats.calls += 1
+        stats.total_ms += elapsed_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+
+        if elapsed_ms < self.slow_query_threshold_ms:
+            return
+
+        source = calling_service_method(_query_origin.get())
+        stats.slow_calls += 1
+        stats.sources.add(source)
+        logger.warning(f"Slow query ({elapsed_ms:.1f} ms) in {source}: {query}")
+
+        if self.should_explain(record):
+            task = asyncio.get_running_loop().create_task(
+                self.capture_plan(stats, record.query, record.args)
+            )
+            self._explain_tasks.add(task)
+            task.add_done_callback(self._explain_tasks.discard)
+
+    def should_explain(self, record) -> bool:
+        # ANALYZE executes the statement, so only read queries are ever explained.
+        # Multi-statement scripts (like the pool's reset query) can't be prepared.
+        return (
+            self.pool is not None
+            and record.exception is None
+            and record.query.lstrip()[:6].upper() == "SELECT"
+            and ";" not in record.query.strip().rstrip(";")
+            and len(self._explain_tasks) < self.max_concurrent_explains
+            and random.random() < self.explain_sample_rate
+        )
+
+    async def capture_plan(self, stats, query, args):
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    plan = await conn.fetchval(
+                        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *args
+                    )
+                    # Never keep side effects from a function called by the query
+                    raise _RollbackExplain
+        except _RollbackExplain:
+            stats.plan = json.loads(plan)
+        except Exception as exc:
+            logger.error(f"Failed to capture plan for slow query: {exc}")
+
+    def top_queries(self, limit=20, order_by="total_ms") -> list[dict]:
+        ranked = sorted(
+            self.stats.values(), key=lambda s: getattr(s, order_by), reverse=True
+        )
+        return [stats.as_dict() for stats in ranked[:limit]]
+
+    def reset(self):
+        self.stats.clear()
@@ -0,0 +1,356 @@
+from fastapi import HTTPException
+from asyncpg.exceptions import UniqueViolationError
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Only one worker at a time runs the expiry sweep and reconciliation
+MAINTENANCE_LOCK_KEY = 4_180_200_234
+
+# Ends a statement whose refunds CTE holds (user_id, refund) rows: each refund is
+# added to one of the user's stripes, picked at random
+CREDIT_REFUNDS = (
+    "credited AS MATERIALIZED ("
+    "SELECT refunds.user_id, refunds.refund, (SELECT stripe FROM quota_stripes "
+    "WHERE quota_stripes.user_id = refunds.user_id ORDER BY random() LIMIT 1) AS stripe "
+    "FROM refunds WHERE refunds.refund <> 0), "
+    "refunded AS ("
+    "UPDATE quota_stripes SET available_bytes = available_bytes + credited.refund "
+    "FROM credited WHERE quota_stripes.user_id = credited.user_id "
+    "AND quota_stripes.stripe = credited.stripe) "
+)
+
+
+# noinspection SqlNoDataSourceInspection
+class QuotaServices:
+    """
+    Storage quota ledger, see app/db/migrations/0003_quota_ledger.sql.
+    Available storage is split into stripes (0015_quota_stripes.sql), charged in the
+    same short transaction as the ledger change, so concurrent uploads of one user
+    each lock a different stripe instead of all queueing on the same row.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    async def claim(conn, user_id, size_in_bytes) -> bool:
+        """
+        Take size_in_bytes from the user's available storage inside the caller's
+        transaction, False when it doesn't fit. A negative size is a refund.
+        - One UPDATE takes it from a random stripe that holds enough and that no
+          other transaction has locked, so it never waits
+        - When they are all locked, it waits on one of them instead, the balance is
+          checked again once it is released
+        - When no stripe holds enough, all the user's stripes are locked in order,
+          pooled, charged and spread evenly again
+        A transaction claims once at most, pooling while it holds a stripe could deadlock.
+        """
+        if size_in_bytes == 0:
+            return True
+        if size_in_bytes < 0:
+            await conn.execute(
+                "UPDATE quota_stripes SET available_bytes = available_bytes - $2 "
+                "WHERE user_id = $1 AND stripe = (SELECT stripe FROM quota_stripes "
+                "WHERE user_id = $1 ORDER BY random() LIMIT 1)",
+                user_id,
+                size_in_bytes,
+            )
+            return True
+
+        ## Postgres keeps the lock on a stripe found short once it is locked, the
+        ## savepoint lets go of those before locking all stripes in order
+        await conn.execute("SAVEPOINT quota_claim")
+        for skip_locked in ("FOR UPDATE SKIP LOCKED", ""):
+            claimed = await conn.fetchval(
+                "UPDATE quota_stripes SET available_bytes = available_bytes - $2 "
+                "WHERE user_id = $1 AND available_bytes >= $2 AND stripe = "
+                "(SELECT stripe FROM quota_stripes WHERE user_id = $1 "
+                f"AND available_bytes >= $2 ORDER BY random() LIMIT 1 {skip_locked}) "
+                "RETURNING stripe",
+                user_id,
+                size_in_bytes,
+            )
+            if claimed is not None:
+                return True
+        await conn.execute("ROLLBACK TO SAVEPOINT quota_claim")
+
+        stripes = await conn.fetch(
+            "SELECT available_bytes FROM quota_stripes WHERE user_id = $1 "
+            "ORDER BY stripe FOR UPDATE",
+            user_id,
+        )
+        available = sum(row["available_bytes"] for row in stripes)
+        if not stripes or available < size_in_bytes:
+            return False
+        await QuotaServices.spread(conn, user_id, available - size_in_bytes)
+        return True
+
+    @staticmethod
+    async def spread(conn, user_id, available_bytes):
+        """Set the user's available storage, evenly over their stripes, which the caller holds."""
+        await conn.execute(
+            "UPDATE quota_stripes SET available_bytes = $2 / stripes.n "
+            "+ CASE WHEN stripe = 0 THEN $2 % stripes.n ELSE 0 END "
+            "FROM (SELECT count(*) AS n FROM quota_stripes WHERE user_id = $1) stripes "
+            "WHERE user_id = $1",
+            user_id,
+            available_bytes,
+        )
+
+    @staticmethod
+    async def reserve(conn, user_id, file_id, size_in_bytes, previous_bytes=None):
+        """
+        Charge an upload inside the caller's transaction, raises 403 when it doesn't fit.
+        previous_bytes is None for a new file, otherwise the size being replaced:
+        a replacement is only charged for what it grows by. A reservation still pending
+        for the file is superseded, a replaced one is refunded, a new one stays charged
+        through its files row.
+        """
+        ## claim takes a negative size for a refund, an upload must never pass one
+        if size_in_bytes < 0:
+            raise HTTPException(status_code=422, detail="Invalid file size")
+        superseded = await conn.fetch(
+            "UPDATE quota_ledger SET settled_at = NOW(), "
+            "state = CASE kind WHEN 'new' THEN 'committed' ELSE 'released' END "
+            "WHERE file_id = $1 AND state = 'reserved' "
+            "RETURNING CASE kind WHEN 'new' THEN 0 ELSE charged_bytes END AS refund",
+            file_id,
+        )
+        refund = sum(row["refund"] for row in superseded)
+
+        if previous_bytes is None:
+            kind, previous_bytes, charge = "new", 0, size_in_bytes
+        else:
+            kind, charge = "replace", max(0, size_in_bytes - previous_bytes)
+
+        if not await QuotaServices.claim(conn, user_id, charge - refund):
+            raise HTTPException(status_code=403, detail="User doesnt have enough space")
+        try:
+            await conn.execute(
+                "INSERT INTO quota_ledger (user_id, file_id, kind, bytes, previous_bytes, charged_bytes) "
+                "VALUES ($1, $2, $3, $4, $5, $6)",
+                user_id,
+                file_id,
+                kind,
+                size_in_bytes,
+                previous_bytes,
+                charge,
+            )
+        except UniqueViolationError:
+            raise HTTPException(
+                status_code=409, detail="An upload for this file is already in progress"
+            )
+
+    @staticmethod
+    async def charge_new_files(conn, user_id, file_ids, sizes, pending):
+        """
+        Charge many new files at once inside the caller's transaction, one claim
+        for their total, raises 403 when it doesn't fit. A pending file is
+        reserved until its content arrives, the others are committed right away.
+        """
+        if not file_ids:
+            return
+        if any(size < 0 for size in sizes):
+            raise HTTPException(status_code=422, detail="Invalid file size")
+        if not await QuotaServices.claim(conn, user_id, sum(sizes)):
+            raise HTTPException(status_code=403, detail="User doesnt have enough space")
+        await conn.execute(
+            "INSERT INTO quota_ledger (user_id, file_id, kind, state, bytes, charged_bytes, settled_at) "
+            "SELECT $1, added.file_id, 'new', "
+            "CASE WHEN added.pending THEN 'reserved' ELSE 'committed' END, added.size, added.size, "
+            "CASE WHEN added.pending THEN NULL ELSE NOW() END "
+            "FROM unnest($2::uuid[], $3::bigint[], $4::bool[]) AS added(file_id, size, pending)",
+            user_id,
+            list(file_ids),
+            list(sizes),
+            list(pending),
+        )
+
+    async def commit(self, file_ids) -> int:
+        """
+        Settle the pending reservations of uploads that arrived, in one statement.
+        A replacement takes its new size and is refunded if the file shrank.
+        Returns how many reservations were committed.
+        """
+        async with self.db.acquire() as conn:
+            return await conn.fetchval(
+                "WITH settled AS ("
+                "UPDATE quota_ledger SET state = 'committed', settled_at = NOW() "
+                "WHERE file_id = ANY($1::uuid[]) AND state = 'reserved' "
+                "RETURNING user_id, file_id, bytes, charged_bytes - (bytes - previous_bytes) AS refund), "
+                "resized AS ("
+                "UPDATE files SET size_in_bytes = settled.bytes FROM settled "
+                "WHERE files.id = settled.file_id AND files.size_in_bytes <> settled.bytes), "
+                "refunds AS ("
+                "SELECT user_id, SUM(refund) AS refund FROM settled GROUP BY user_id), "
+                f"{CREDIT_REFUNDS}"
+                "SELECT count(*) FROM settled",
+                list(file_ids),
+            )
+
+    @staticmethod
+    async def remove_files(conn, file_ids) -> list:
+        """
+        Delete files rows and refund everything they held: the stored size plus the
+        charge of a pending replacement. Returns the removed rows.
+        """
+        return await conn.fetch(
+            "WITH settled AS ("
+            "UPDATE quota_ledger SET state = 'released', settled_at = NOW() "
+            "WHERE file_id = ANY($1::uuid[]) AND state = 'reserved' "
+            "RETURNING file_id, kind, charged_bytes), "
+            "removed AS ("
+            "DELETE FROM files WHERE id = ANY($1::uuid[]) "
+            "RETURNING id, owner_id, size_in_bytes, parent_folder_id, blob_id, has_thumbnails), "
+            "refunds AS ("
+            "SELECT removed.owner_id AS user_id, SUM(removed.size_in_bytes + "
+            "CASE WHEN settled.kind = 'replace' THEN settled.charged_bytes ELSE 0 END) AS refund "
+            "FROM removed LEFT JOIN settled ON settled.file_id = removed.id "
+            "GROUP BY removed.owner_id), "
+            f"{CREDIT_REFUNDS}"
+            "SELECT id, owner_id, parent_folder_id, blob_id, has_thumbnails FROM removed",
+            list(file_ids),
+        )
+
+    @staticmethod
+    async def release_replacements(conn, file_ids) -> int:
+        """Refund the pending replacements of files that keep their current content."""
+        return await conn.fetchval(
+            "WITH released AS ("
+            "UPDATE quota_ledger SET state = 'released', settled_at = NOW() "
+            "WHERE file_id = ANY($1::uuid[]) AND state = 'reserved' AND kind = 'replace' "
+            "RETURNING user_id, charged_bytes), "
+            "refunds AS ("
+            "SELECT user_id, SUM(charged_bytes) AS refund FROM released GROUP BY user_id), "
+            f"{CREDIT_REFUNDS}"
+            "SELECT count(*) FROM released",
+            list(file_ids),
+        )
+
+    @staticmethod
+    async def release_expired(conn, reservation_ttl_s, batch_size=500) -> int:
+        """
+        Refund one batch of reservations whose upload never arrived, oldest first.
+        An abandoned new file's row is deleted, a replaced file keeps its old content.
+        """
+        return await conn.fetchval(
+            "WITH expired AS ("
+            "UPDATE quota_ledger SET state = 'released', settled_at = NOW() "
+            "WHERE id IN ("
+            "SELECT id FROM quota_ledger WHERE state = 'reserved' "
+            "AND created_at < NOW() - make_interval(secs => $1) "
+            "ORDER BY created_at LIMIT $2 FOR UPDATE SKIP LOCKED) "
+            "RETURNING user_id, file_id, kind, charged_bytes), "
+            "abandoned AS ("
+            "DELETE FROM files USING expired "
+            "WHERE files.id = expired.file_id AND expired.kind = 'new'), "
+            "refunds AS ("
+            "SELECT user_id, SUM(charged_bytes) AS refund FROM expired GROUP BY user_id), "
+            f"{CREDIT_REFUNDS}"
+            "SELECT count(*) FROM expired",
+            float(reservation_ttl_s),
+            batch_size,
+        )
+
+    @staticmethod
+    async def reconcile_batch(conn, after_user_id=None, batch_size=500):
+        """
+        Recompute available storage for the next batch of users after after_user_id.
+        Users with a stripe locked right now (an upload being charged) are skipped,
+        the next pass gets them. Returns (last user id of the batch, users corrected),
+        the id is None once every user has been visited.
+        """
+        async with conn.transaction():
+            batch = await conn.fetch(
+                "SELECT id FROM users WHERE ($1::uuid IS NULL OR id > $1) "
+                "ORDER BY id LIMIT $2",
+                after_user_id,
+                batch_size,
+            )
+            if not batch:
+                return None, 0
+            ## Locked first, the sums below then see every charge committed before the lock
+            locked = await conn.fetch(
+                "WITH locked AS ("
+                "SELECT user_id FROM quota_stripes WHERE user_id = ANY($1::uuid[]) "
+                "FOR UPDATE SKIP LOCKED) "
+                "SELECT user_id FROM locked GROUP BY user_id HAVING count(*) = ("
+                "SELECT count(*) FROM quota_stripes WHERE quota_stripes.user_id = locked.user_id)",
+                [row["id"] for row in batch],
+            )
+            corrected = await conn.fetch(
+                "WITH expected AS ("
+                "SELECT users.id, (users.total_storage_in_bytes "
+                "- COALESCE(stored.bytes, 0) - COALESCE(pending.bytes, 0))::bigint AS available "
+                "FROM users "
+                "LEFT JOIN (SELECT owner_id, SUM(size_in_bytes) AS bytes FROM files "
+                "WHERE owner_id = ANY($1::uuid[]) GROUP BY owner_id) stored "
+                "ON stored.owner_id = users.id "
+                "LEFT JOIN (SELECT user_id, SUM(charged_bytes) AS bytes FROM quota_ledger "
+                "WHERE user_id = ANY($1::uuid[]) AND state = 'reserved' AND kind = 'replace' "
+                "GROUP BY user_id) pending "
+                "ON pending.user_id = users.id "
+                "WHERE users.id = ANY($1::uuid[])), "
+                "drifted AS ("
+                "SELECT expected.id, expected.available, count(*) AS stripes "
+                "FROM expected JOIN quota_stripes ON quota_stripes.user_id = expected.id "
+                "GROUP BY expected.id, expected.available "
+                "HAVING SUM(quota_stripes.available_bytes) <> expected.available), "
+                "spread AS ("
+                "UPDATE quota_stripes SET available_bytes = drifted.available / drifted.stripes "
+                "+ CASE WHEN quota_stripes.stripe = 0 THEN drifted.available % drifted.stripes ELSE 0 END "
+                "FROM drifted WHERE quota_stripes.user_id = drifted.id) "
+                "SELECT id FROM drifted",
+                [row["user_id"] for row in locked],
+            )
+        for row in corrected:
+            logger.warning(f"Reconciled drifted storage quota of user {row['id']}")
+        return batch[-1]["id"], len(corrected)
+
+    async def run_maintenance(self, reservation_ttl_s, batch_size=500) -> dict | None:
+        """One expiry sweep plus one reconciliation pass, None if another worker is on it."""
+        async with self.db.acquire() as conn:
+            if not await conn.fetchval(
+                "SELECT pg_try_advisory_lock($1)", MAINTENANCE_LOCK_KEY
+            ):
+                return None
+            try:
+                released = 0
+                while True:
+                    count = await self.release_expired(
+                        conn, reservation_ttl_s, batch_size
+                    )
+                    released += count
+                    if count < batch_size:
+                        break
+
+                reconciled, after_user_id = 0, None
+                while True:
+                    after_user_id, count = await self.reconcile_batch(
+                        conn, after_user_id, batch_size
+                    )
+                    reconciled += count
+                    if after_user_id is None:
+                        break
+            finally:
+                await conn.execute(
+                    "SELECT pg_advisory_unlock($1)", MAINTENANCE_LOCK_KEY
+                )
+        return {"released": released, "reconciled": reconciled}
+
+    async def maintain_periodically(self, interval_s, reservation_ttl_s):
+        """Lifespan background task."""
+        while True:
+            await asyncio.sleep(interval_s)
+            try:
+                result = await self.run_maintenance(reservation_ttl_s)
+            except Exception as exc:
+                logger.error(f"Quota maintenance failed: {exc}")
+                continue
+            if result and (result["released"] or result["reconciled"]):
+                logger.info(
+                    f"Quota maintenance released {result['released']} reservations, "
+                    f"corrected {result['reconciled']} users"
+                )
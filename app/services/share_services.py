@@ -1,14 +1,18 @@
+from datetime import datetime
 from fastapi import HTTPException
-from asyncpg.exceptions import UniqueViolationError
 from ..helpers.file_utils import format_db_returning_objects
+import base64
+import json
+import uuid
 
 
 # noinspection SqlNoDataSourceInspection
 class ShareServices:
-    def __init__(self, db, file_services, folder_services):
+    def __init__(self, db, file_services, folder_services, activity_log=None):
         self.db = db
         self.file_services = file_services
         self.folder_services = folder_services
+        self.activity_log = activity_log
 
     async def share_file(self, user_id, share_info):
         """Share a file with another user."""
@@ -20,7 +24,7 @@ class ShareServices:
         if not filename:
             raise HTTPException(status_code=404, detail="File not found")
 
-        async with self.db.acquire() as conn:
+        async with self.db.acquire_write(user_id) as conn:
             # Get receiver user
             receiver = await conn.fetchrow(
                 "SELECT id FROM users WHERE username = $1", share_info.username
@@ -39,33 +43,37 @@ class ShareServices:
                 )
 
             # Create share with permissions (same connection)
-            try:
-                async with conn.transaction():
-                    share_record = await conn.fetchrow(
-                        "INSERT INTO shares (user_id, shared_with, file_id) "
-                        "VALUES ($1, $2, $3) RETURNING id",
-                        user_id,
-                        receiver_id,
-                        share_info.file_id,
-                    )
-
-                    share_id = str(share_record["id"])
-
-                    await conn.execute(
-                        "INSERT INTO permissions (share_id, read, write, delete) "
-                        "VALUES ($1, $2, $3, $4) RETURNING id",
-                        share_id,
-                        share_info.read,
-                        share_info.write,
-                        share_info.delete,
-                    )
-
-                return {
-                    "message": f"File {filename} successfully shared with user {share_info.username}"
-                }
+            async with conn.transaction():
+                share_record = await conn.fetchrow(
+                    "INSERT INTO shares (user_id, shared_with, file_id) "
+                    "VALUES ($1, $2, $3) ON CONFLICT DO NOTHING RETURNING id",
+                    user_id,
+                    receiver_id,
+                    share_info.file_id,
+                )
+                if share_record is None:
+                    raise HTTPException(status_code=409, detail="Already shared")
+
+                share_id = str(share_record["id"])
+
+                await conn.execute(
+                    "INSERT INTO permissions (share_id, read, write, delete) "
+                    "VALUES ($1, $2, $3, $4) RETURNING id",
+                    share_id,
+                    share_info.read,
+                    share_info.write,
+                    share_info.delete,
+                )
+            # The receiver's shared-with-me listing must show it right away
+            self.db.record_write(receiver_id)
+            if self.activity_log:
+                self.activity_log.record(
+                    user_id, "share", "file", share_info.file_id, share_info.username
+                )
 
-            except UniqueViolationError:
-                raise HTTPException(status_code=409, detail="Already shared")
+            return {
+                "message": f"File {filename} successfully shared with user {share_info.username}"
+            }
 
     async def share_folder(self, user_id, share_info):
         """Share a folder with another user."""
@@ -75,9 +83,9 @@ class ShareServices:
 
         if not response:
             raise HTTPException(status_code=404, detail="Folder not found")
-        foldername = str(response["filename"])
+        foldername = response
 
-        async with self.db.acquire() as conn:
+        async with self.db.acquire_write(user_id) as conn:
             receiver = await conn.fetchrow(
                 "SELECT id FROM users WHERE username = $1", share_info.username
             )
@@ -93,59 +101,213 @@ class ShareServices:
                     status_code=400, detail="Cannot share with yourself"
                 )
 
-            try:
-                async with conn.transaction():
-                    share_record = await conn.fetchrow(
-                        "INSERT INTO shares (user_id, shared_with, folder_id) "
-                        "VALUES ($1, $2, $3) RETURNING id",
-                        user_id,
-                        receiver_id,
-                        share_info.folder_id,
-                    )
-
-                    share_id = str(share_record["id"])
-
-                    await conn.execute(
-                        "INSERT INTO permissions (share_id, read, write, delete) "
-                        "VALUES ($1, $2, $3, $4) RETURNING id",
-                        share_id,
-                        share_info.read,
-                        share_info.write,
-                        share_info.delete,
-                    )
-
-                return {
-                    "message": f"folder {foldername} successfully shared with user {share_info.username}"
-                }
+            async with conn.transaction():
+                share_record = await conn.fetchrow(
+                    "INSERT INTO shares (user_id, shared_with, folder_id) "
+                    "VALUES ($1, $2, $3) ON CONFLICT DO NOTHING RETURNING id",
+                    user_id,
+                    receiver_id,
+                    share_info.folder_id,
+                )
+                if share_record is None:
+                    raise HTTPException(status_code=409, detail="Already shared")
 
-            except UniqueViolationError:
-                raise HTTPException(status_code=409, detail="Already shared")
+                share_id = str(share_record["id"])
 
-    async def get_shared_with_me(self, user_id):
-        # Get share records
-        async with self.db.acquire() as conn:
-            share_info = await conn.fetch(
-                "SELECT shares.shared_at, "
-                'permissions."delete", permissions."write", permissions."read",'
-                "files.id, files.name, files.size_in_bytes, files.type, "
-                "users.email "
-                "FROM shares "
-                "JOIN permissions ON permissions.share_id = shares.id "
-                "JOIN files ON files.id = shares.file_id "
-                "JOIN users ON users.id = files.owner_id "
-                "WHERE shares.shared_with = $1 AND files.parent_folder_id IS NULL "
+                await conn.execute(
+                    "INSERT INTO permissions (share_id, read, write, delete) "
+                    "VALUES ($1, $2, $3, $4) RETURNING id",
+                    share_id,
+                    share_info.read,
+                    share_info.write,
+                    share_info.delete,
+                )
+            # The receiver's shared-with-me listing must show it right away
+            self.db.record_write(receiver_id)
+            if self.activity_log:
+                self.activity_log.record(
+                    user_id,
+                    "share",
+                    "folder",
+                    share_info.folder_id,
+                    share_info.username,
+                )
+
+            return {
+                "message": f"folder {foldername} successfully shared with user {share_info.username}"
+            }
+
+    async def share_many(self, user_id, bulk):
+        """
+        Share many files and folders with many users in one transaction, a fixed
+        number of statements whatever the size of the batch. Pairs already shared
+        are reported and skipped, unknown usernames too. Items the user doesn't own
+        fail the whole batch with 404.
+        """
+        usernames = list(dict.fromkeys(bulk.usernames))
+        file_ids = list(dict.fromkeys(bulk.file_ids))
+        folder_ids = list(dict.fromkeys(bulk.folder_ids))
+
+        async with self.db.acquire_write(user_id) as conn:
+            owned = await conn.fetch(
+                "SELECT id FROM files WHERE owner_id = $1 AND id = ANY($2::uuid[]) "
                 "UNION ALL "
-                "SELECT shares.shared_at, "
+                "SELECT id FROM folders WHERE owner_id = $1 AND id = ANY($3::uuid[])",
+                user_id,
+                file_ids,
+                folder_ids,
+            )
+            missing = {*file_ids, *folder_ids} - {row["id"] for row in owned}
+            if missing:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Not found: {', '.join(sorted(map(str, missing)))}",
+                )
+
+            receivers = await conn.fetch(
+                "SELECT id, username FROM users WHERE username = ANY($1::text[])",
+                usernames,
+            )
+            if any(str(row["id"]) == str(user_id) for row in receivers):
+                raise HTTPException(
+                    status_code=400, detail="Cannot share with yourself"
+                )
+            names = {row["id"]: row["username"] for row in receivers}
+
+            ## One row per (receiver, item), a pair already shared inserts nothing
+            items = [(file_id, None) for file_id in file_ids] + [
+                (None, folder_id) for folder_id in folder_ids
+            ]
+            shared = await conn.fetch(
+                "WITH inserted AS ("
+                "INSERT INTO shares (user_id, shared_with, file_id, folder_id) "
+                "SELECT $1, receiver.id, item.file_id, item.folder_id "
+                "FROM unnest($2::uuid[]) AS receiver(id) "
+                "CROSS JOIN unnest($3::uuid[], $4::uuid[]) AS item(file_id, folder_id) "
+                "ON CONFLICT DO NOTHING RETURNING id, shared_with, file_id, folder_id), "
+                "granted AS ("
+                "INSERT INTO permissions (share_id, read, write, delete) "
+                "SELECT id, $5, $6, $7 FROM inserted) "
+                "SELECT shared_with, file_id, folder_id FROM inserted",
+                user_id,
+                list(names),
+                [file_id for file_id, _ in items],
+                [folder_id for _, folder_id in items],
+                bulk.read,
+                bulk.write,
+                bulk.delete,
+            )
+
+        done = {
+            (row["shared_with"], row["file_id"] or row["folder_id"]) for row in shared
+        }
+        for receiver_id in {row["shared_with"] for row in shared}:
+            # The receivers' shared-with-me listings must show them right away
+            self.db.record_write(str(receiver_id))
+        if self.activity_log:
+            for row in shared:
+                self.activity_log.record(
+                    user_id,
+                    "share",
+                    "file" if row["file_id"] else "folder",
+                    row["file_id"] or row["folder_id"],
+                    names[row["shared_with"]],
+                )
+
+        return {
+            "shared": len(shared),
+            "already_shared": [
+                {
+                    "username": username,
+                    "object_type": "file" if file_id else "folder",
+                    "object_id": str(file_id or folder_id),
+                }
+                for receiver_id, username in names.items()
+                for file_id, folder_id in items
+                if (receiver_id, file_id or folder_id) not in done
+            ],
+            "unknown_users": [
+                username for username in usernames if username not in names.values()
+            ],
+        }
+
+    @staticmethod
+    def encode_cursor(sort_by, row) -> str:
+        value = row[sort_by]
+        if sort_by == "shared_at":
+            value = value.isoformat()
+        key = json.dumps([sort_by, value, str(row["share_id"])])
+        return base64.urlsafe_b64encode(key.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(sort_by, cursor) -> tuple:
+        """(sort value, share id) after which the next page starts, 400 if malformed."""
+        try:
+            cursor_sort_by, value, share_id = json.loads(
+                base64.urlsafe_b64decode(cursor.encode())
+            )
+            if cursor_sort_by != sort_by:
+                raise ValueError(cursor_sort_by)
+            if sort_by == "shared_at":
+                value = datetime.fromisoformat(value)
+            return value, uuid.UUID(share_id)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    async def list_shares(
+        self,
+        user_id,
+        received,
+        sort_by="shared_at",
+        order="DESC",
+        cursor=None,
+        limit=50,
+    ) -> dict:
+        """
+        One page of the shares the user received (received=True) or made, in
+        (sort_by, share id) order. The page is read off the matching shares index from
+        the cursor on, its cost stays the same however many shares there are.
+        email is the other user's: the owner's for received shares, the recipient's
+        otherwise. Pass next_cursor back for the next page, None on the last one.
+        """
+        if received:
+            ## Only top level items, like the drive's root lists them
+            user_column, other_column = "shared_with", "user_id"
+            visible = "AND shares.top_level "
+        else:
+            user_column, other_column, visible = "user_id", "shared_with", ""
+        args = [user_id, limit + 1]
+        after = ""
+        if cursor:
+            args += self.decode_cursor(sort_by, cursor)
+            after = f"AND (shares.{sort_by}, shares.id) {'<' if order == 'DESC' else '>'} ($3, $4) "
+
+        async with self.db.acquire_read(user_id) as conn:
+            rows = await conn.fetch(
+                "SELECT shares.id AS share_id, shares.shared_at, shares.name, "
                 'permissions."delete", permissions."write", permissions."read", '
-                "folders.id, folders.name, NULL as size_in_bytes, NULL as type, "
+                "COALESCE(files.id, folders.id) AS id, files.size_in_bytes, files.type, "
                 "users.email "
                 "FROM shares "
                 "JOIN permissions ON permissions.share_id = shares.id "
-                "JOIN folders ON folders.id = shares.folder_id "
-                "JOIN users ON users.id = folders.owner_id "
-                "WHERE shares.shared_with = $1 AND folders.parent_folder_id IS NULL ",
-                user_id,
+                "LEFT JOIN files ON files.id = shares.file_id "
+                "LEFT JOIN folders ON folders.id = shares.folder_id "
+                f"JOIN users ON users.id = shares.{other_column} "
+                f"WHERE shares.{user_column} = $1 {visible}{after}"
+                f"ORDER BY shares.{sort_by} {order}, shares.id {order} LIMIT $2",
+                *args,
             )
-        data = [dict(record) for record in share_info]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(sort_by, rows[-1])
+        data = [dict(record) for record in rows]
         formated_data = format_db_returning_objects(data)
-        return {"content": formated_data}
+        return {"content": formated_data, "next_cursor": next_cursor}
+
+    async def get_shared_with_me(self, user_id, **page):
+        return await self.list_shares(user_id, True, **page)
+
+    async def get_shared_by_me(self, user_id, **page):
+        return await self.list_shares(user_id, False, **page)
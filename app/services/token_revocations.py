@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+import asyncio
+import hashlib
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rows are read again this far back on every refresh, so a revocation whose
+# transaction committed after a later one was read is still picked up
+REFRESH_OVERLAP = timedelta(seconds=5)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class BloomFilter:
+    """
+    Set membership with false positives at about error_rate up to capacity keys,
+    never false negatives. Positions come from one blake2b digest by double hashing.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+# noinspection SqlNoDataSourceInspection
+class TokenRevocations:
+    """
+    Access token revocation, see app/db/migrations/0013_token_revocations.sql.
+    Revoked token ids sit in a Bloom filter and logout-everywhere cutoffs in a dict,
+    both in memory, so checking a token needs no database call unless its id hits
+    the filter. A background task reads new revocations every refresh_interval_ms
+    and rebuilds both every rebuild_interval_s, dropping expired ones. Revocations
+    made by this worker apply at once, those of other workers after the next refresh.
+    """
+
+    def __init__(
+        self,
+        db,
+        token_lifetime_s,
+        capacity=100_000,
+        error_rate=0.01,
+        refresh_interval_ms=1000,
+        rebuild_interval_s=3600,
+    ):
+        self.db = db
+        self.token_lifetime_s = token_lifetime_s
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval_s = refresh_interval_ms / 1000
+        self.rebuild_interval_s = rebuild_interval_s
+        self.bloom = BloomFilter(capacity, error_rate)
+        ## user id -> tokens issued before this are revoked
+        self.cutoffs = {}
+        self.read_through = EPOCH
+        self.lookups = 0
+        self._rebuilt_at = 0.0
+
+    def apply(self, rows):
+        """Add revocation rows read from the table."""
+        for row in rows:
+            if row["jti"] is not None:
+                self.bloom.add(str(row["jti"]))
+            else:
+                self.cut_off(str(row["user_id"]), row["issued_before"])
+            self.read_through = max(self.read_through, row["revoked_at"])
+
+    def cut_off(self, user_id, issued_before):
+        cutoff = self.cutoffs.get(user_id)
+        if cutoff is None or issued_before > cutoff:
+            self.cutoffs[user_id] = issued_before
+
+    async def rebuild(self):
+        """Reload every revocation still in force into a fresh filter, purging expired ones."""
+        async with self.db.acquire() as conn:
+            await conn.execute("DELETE FROM token_revocations WHERE expires_at < NOW()")
+            rows = await conn.fetch(
+                "SELECT jti, user_id, issued_before, revoked_at FROM token_revocations "
+                "WHERE expires_at >= NOW()"
+            )
+        revoked_ids = sum(1 for row in rows if row["jti"] is not None)
+        self.bloom = BloomFilter(max(self.capacity, 2 * revoked_ids), self.error_rate)
+        self.cutoffs = {}
+        self.read_through = EPOCH
+        self.apply(rows)
+        self._rebuilt_at = time.monotonic()
+
+    async def refresh(self):
+        """Add the revocations made since the last read."""
+        async with self.db.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT jti, user_id, issued_before, revoked_at FROM token_revocations "
+                "WHERE revoked_at > $1",
+                self.read_through - REFRESH_OVERLAP,
+            )
+        self.apply(rows)
+
+    async def run(self):
+        """Lifespan background task, rebuild() has run once at startup."""
+        while True:
+            await asyncio.sleep(self.refresh_interval_s)
+            try:
+                if time.monotonic() - self._rebuilt_at >= self.rebuild_interval_s:
+                    await self.rebuild()
+                else:
+                    await self.refresh()
+            except Exception as exc:
+                logger.error(f"Token revocation refresh failed: {exc}")
+
+    async def is_revoked(self, payload) -> bool:
+        """payload is a decoded access token, checked against memory first."""
+        cutoff = self.cutoffs.get(payload["sub"])
+        if cutoff is not None and payload.get("iat", 0) < cutoff.timestamp():
+            return True
+        jti = payload.get("jti")
+        if jti is None or jti not in self.bloom:
+            return False
+        self.lookups += 1
+        async with self.db.acquire() as conn:
+            return await conn.fetchval(
+                "SELECT EXISTS (SELECT 1 FROM token_revocations WHERE jti = $1)", jti
+            )
+
+    async def revoke_token(self, payload):
+        """Logout, revokes the token until it expires."""
+        jti = payload.get("jti")
+        if jti is None:
+            raise HTTPException(
+                status_code=400,
+                detail="This token can't be revoked alone, log out everywhere",
+            )
+        async with self.db.acquire_write(payload["sub"]) as conn:
+            await conn.execute(
+                "INSERT INTO token_revocations (user_id, jti, expires_at) "
+                "VALUES ($1, $2, $3) ON CONFLICT DO NOTHING",
+                payload["sub"],
+                jti,
+                datetime.fromtimestamp(payload["exp"], timezone.utc),
+            )
+        self.bloom.add(jti)
+
+    async def revoke_all(self, user_id):
+        """Logout everywhere, revokes every token issued to the user until now."""
+        issued_before = datetime.now(timezone.utc)
+        async with self.db.acquire_write(user_id) as conn:
+            await conn.execute(
+                "INSERT INTO token_revocations (user_id, issued_before, expires_at) "
+                "VALUES ($1, $2, $3)",
+                user_id,
+                issued_before,
+                issued_before + timedelta(seconds=self.token_lifetime_s),
+            )
+        self.cut_off(str(user_id), issued_before)
@@ -32,43 +32,53 @@ class UserServices:
         self, username: str, email: str, password: SecretStr
     ) -> str:
         """
-        Complete user registration flow: verify availability, hash password, create user.
-        Returns the new user's ID.
+        Complete user registration flow: hash password, create user unless the
+        username or email is taken. Returns the new user's ID.
         """
-        async with self.db.acquire() as conn:
-            # Check if username or email already exists
-            existing = await conn.fetchrow(
-                "SELECT * FROM users WHERE username = $1 OR email = $2", username, email
-            )
-            if existing:
-                raise HTTPException(
-                    status_code=409, detail="credentials already in use"
-                )
-
-            # Hash password
-            hashed_password = self.auth_services.hash_password(
-                password.get_secret_value()
-            )
+        # Hash password
+        hashed_password = self.auth_services.hash_password(password.get_secret_value())
 
-            # Create user
+        # Create user, the unique username and email constraints reject taken credentials
+        async with self.db.acquire() as conn:
             row = await conn.fetchrow(
-                "INSERT INTO users (username, email, password) VALUES ($1, $2, $3) RETURNING id",
+                "INSERT INTO users (username, email, password) VALUES ($1, $2, $3) "
+                "ON CONFLICT DO NOTHING RETURNING id",
                 username,
                 email,
                 hashed_password,
             )
 
-            return str(row["id"])  # Return user ID, let route handle response
+        if row is None:
+            raise HTTPException(status_code=409, detail="credentials already in use")
+
+        return str(row["id"])  # Return user ID, let route handle response
 
     async def confirm_user_profile_picture(self, user_id, x_lambda_secret):
         if x_lambda_secret != os.getenv("LAMBDA_SECRET"):
             raise HTTPException(status_code=403, detail="Forbidden")
 
+        async with self.db.acquire_write(user_id) as conn:
+            await conn.execute(
+                "UPDATE users SET has_profile_picture = TRUE WHERE id = $1", user_id
+            )
+
+    async def confirm_user_profile_pictures(self, user_ids, x_lambda_secret):
+        """Batched form of confirm_user_profile_picture, for the thumbnail worker."""
+        if x_lambda_secret != os.getenv("LAMBDA_SECRET"):
+            raise HTTPException(status_code=403, detail="Forbidden")
+
         async with self.db.acquire() as conn:
-            await conn.execute("UPDATE users SET has_profile_picture = TRUE WHERE id = $1", user_id)
+            await conn.execute(
+                "UPDATE users SET has_profile_picture = TRUE WHERE id = ANY($1::uuid[])",
+                user_ids,
+            )
+        for user_id in user_ids:
+            self.db.record_write(user_id)
 
     async def validate_if_user_has_profile_picture(self, user_id):
-        async with self.db.acquire() as conn:
-            row = await conn.fetchrow("SELECT has_profile_picture FROM users WHERE id = $1", user_id)
+        async with self.db.acquire_read(user_id) as conn:
+            row = await conn.fetchrow(
+                "SELECT has_profile_picture FROM users WHERE id = $1", user_id
+            )
             if not row["has_profile_picture"]:
                 raise HTTPException(status_code=404, detail="User has no profile picture")
\ No newline at end of file
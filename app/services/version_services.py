@@ -0,0 +1,284 @@
+from fastapi import HTTPException
+from .aws import chunk_key
+
+
+# noinspection SqlNoDataSourceInspection
+class VersionServices:
+    """
+    Version history of files, see app/db/migrations/0006_file_versions.sql.
+    A new version never overwrites an object: a whole replacement is uploaded as a new
+    blob, a chunked one only uploads the chunks its owner doesn't store yet, and a
+    restore only copies references.
+    """
+
+    def __init__(self, db, file_services, aws_services, quota_services):
+        self.db = db
+        self.file_services = file_services
+        self.aws_services = aws_services
+        self.quota_services = quota_services
+
+    @staticmethod
+    async def ensure_base_version(conn, file_id):
+        """Snapshot the content a file has before its first replacement as version 1."""
+        version_id = await conn.fetchval(
+            "INSERT INTO file_versions "
+            "(file_id, number, size_in_bytes, blob_id, has_thumbnails, committed) "
+            "SELECT id, 1, size_in_bytes, blob_id, has_thumbnails, TRUE FROM files "
+            "WHERE id = $1 AND current_version_id IS NULL RETURNING id",
+            file_id,
+        )
+        if version_id:
+            await conn.execute(
+                "UPDATE files SET current_version_id = $1 WHERE id = $2",
+                version_id,
+                file_id,
+            )
+
+    @staticmethod
+    async def add_version(
+        conn, file_id, size_in_bytes, blob_id=None, chunked=False, has_thumbnails=False
+    ):
+        """
+        Pending version numbered after the file's last one, the caller holds the file's
+        row lock. A version still pending is dropped, the newest upload wins the same
+        way its quota reservation supersedes the previous one.
+        """
+        await conn.execute(
+            "DELETE FROM file_versions WHERE file_id = $1 AND NOT committed", file_id
+        )
+        return await conn.fetchval(
+            "INSERT INTO file_versions "
+            "(file_id, number, size_in_bytes, blob_id, chunked, has_thumbnails) "
+            "SELECT $1, COALESCE(MAX(number), 0) + 1, $2, $3, $4, $5 "
+            "FROM file_versions WHERE file_id = $1 RETURNING id",
+            file_id,
+            size_in_bytes,
+            blob_id,
+            chunked,
+            has_thumbnails,
+        )
+
+    @staticmethod
+    async def commit_versions(conn, version_ids, previewed=()):
+        """
+        Make arrived versions their files' current content, in one statement.
+        previewed are the blob ids the thumbnail worker made previews of.
+        """
+        await conn.execute(
+            "WITH versions AS ("
+            "UPDATE file_versions SET committed = TRUE, "
+            "has_thumbnails = has_thumbnails OR blob_id = ANY($2::uuid[]) "
+            "WHERE id = ANY($1::uuid[]) AND NOT committed "
+            "RETURNING id, file_id, blob_id, has_thumbnails) "
+            "UPDATE files SET current_version_id = versions.id, blob_id = versions.blob_id, "
+            "has_thumbnails = versions.has_thumbnails FROM versions "
+            "WHERE files.id = versions.file_id",
+            list(version_ids),
+            list(previewed),
+        )
+
+    @staticmethod
+    async def chunks_of(conn, version_id) -> list:
+        return await conn.fetch(
+            "SELECT chunks.id, chunks.size_in_bytes FROM file_version_chunks "
+            "JOIN chunks ON chunks.id = file_version_chunks.chunk_id "
+            "WHERE version_id = $1 ORDER BY position",
+            version_id,
+        )
+
+    async def verify_ownership(self, user_id, file_id):
+        if not await self.file_services.verify_file_existence_ownership(
+            user_id, file_id
+        ):
+            raise HTTPException(status_code=404, detail="File not found")
+
+    async def create_chunked_version(self, user_id, file_id, chunks) -> dict:
+        """
+        New version from a chunk manifest. Chunks the owner already stores are reused,
+        the response only has upload URLs for the rest, then POST .../commit.
+        A manifest made only of known chunks is committed right away.
+        """
+        await self.verify_ownership(user_id, file_id)
+        hashes = [bytes.fromhex(chunk.sha256) for chunk in chunks]
+        sizes = [chunk.size_in_bytes for chunk in chunks]
+        total_size = sum(sizes)
+
+        async with self.db.acquire_write(user_id) as conn:
+            async with conn.transaction():
+                previous_size = await conn.fetchval(
+                    "SELECT size_in_bytes FROM files WHERE id = $1 FOR UPDATE", file_id
+                )
+                if previous_size is None:
+                    raise HTTPException(status_code=404, detail="File not found")
+                await self.ensure_base_version(conn, file_id)
+                version_id = await self.add_version(
+                    conn, file_id, total_size, chunked=True
+                )
+
+                await conn.execute(
+                    "INSERT INTO chunks (owner_id, sha256, size_in_bytes) "
+                    "SELECT $1, sha256, size_in_bytes FROM unnest($2::bytea[], $3::int[]) "
+                    "AS manifest(sha256, size_in_bytes) ON CONFLICT DO NOTHING",
+                    user_id,
+                    hashes,
+                    sizes,
+                )
+                rows = await conn.fetch(
+                    "SELECT id, sha256, size_in_bytes, stored FROM chunks "
+                    "WHERE owner_id = $1 AND sha256 = ANY($2::bytea[])",
+                    user_id,
+                    hashes,
+                )
+                by_hash = {row["sha256"]: row for row in rows}
+                if any(
+                    by_hash[digest]["size_in_bytes"] != size
+                    for digest, size in zip(hashes, sizes)
+                ):
+                    raise HTTPException(
+                        status_code=400, detail="Chunk sizes don't match their hashes"
+                    )
+
+                await conn.execute(
+                    "INSERT INTO file_version_chunks (version_id, position, chunk_id) "
+                    "SELECT $1, position, chunk_id FROM unnest($2::uuid[]) "
+                    "WITH ORDINALITY AS manifest(chunk_id, position)",
+                    version_id,
+                    [by_hash[digest]["id"] for digest in hashes],
+                )
+                ## Charged like any replacement, for what the file grows by
+                await self.quota_services.reserve(
+                    conn, user_id, file_id, total_size, previous_size
+                )
+
+                missing = [row for row in by_hash.values() if not row["stored"]]
+                if not missing:
+                    await self.commit_versions(conn, [version_id])
+
+        if not missing:
+            await self.quota_services.commit([file_id])
+            return {"version_id": str(version_id), "committed": True, "uploads": []}
+
+        return {
+            "version_id": str(version_id),
+            "committed": False,
+            "uploads": self.aws_services.generate_presigned_chunk_upload_urls(
+                user_id, missing
+            ),
+        }
+
+    async def commit_chunked_version(self, user_id, file_id, version_id) -> dict:
+        """Once every new chunk is in S3, make the version current."""
+        await self.verify_ownership(user_id, file_id)
+
+        async with self.db.acquire_write(user_id) as conn:
+            pending = await conn.fetch(
+                "SELECT DISTINCT chunks.id FROM file_versions "
+                "JOIN file_version_chunks ON file_version_chunks.version_id = file_versions.id "
+                "JOIN chunks ON chunks.id = file_version_chunks.chunk_id "
+                "WHERE file_versions.id = $1 AND file_versions.file_id = $2 "
+                "AND NOT file_versions.committed AND file_versions.chunked "
+                "AND NOT chunks.stored",
+                version_id,
+                file_id,
+            )
+            chunk_ids = [row["id"] for row in pending]
+            missing = await self.aws_services.missing_objects(
+                [chunk_key(user_id, chunk_id) for chunk_id in chunk_ids]
+            )
+            if missing:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"{len(missing)} chunks haven't been uploaded yet",
+                )
+
+            async with conn.transaction():
+                ## Locked like every other change of the file's content
+                await conn.execute(
+                    "SELECT 1 FROM files WHERE id = $1 FOR UPDATE", file_id
+                )
+                pending_version = await conn.fetchval(
+                    "SELECT id FROM file_versions WHERE id = $1 AND file_id = $2 "
+                    "AND chunked AND NOT committed",
+                    version_id,
+                    file_id,
+                )
+                if pending_version is None:
+                    raise HTTPException(
+                        status_code=404, detail="No pending version to commit"
+                    )
+                await conn.execute(
+                    "UPDATE chunks SET stored = TRUE WHERE id = ANY($1::uuid[])",
+                    chunk_ids,
+                )
+                await self.commit_versions(conn, [version_id])
+
+        await self.quota_services.commit([file_id])
+        return {"version_id": str(version_id), "committed": True}
+
+    async def list_versions(self, user_id, file_id) -> list:
+        """Committed versions, newest first. Empty until the file's first replacement."""
+        await self.verify_ownership(user_id, file_id)
+
+        async with self.db.acquire_read(user_id) as conn:
+            rows = await conn.fetch(
+                "SELECT file_versions.id, number, file_versions.size_in_bytes, "
+                "file_versions.created_at, file_versions.id = files.current_version_id AS current "
+                "FROM file_versions JOIN files ON files.id = file_versions.file_id "
+                "WHERE file_versions.file_id = $1 AND committed ORDER BY number DESC",
+                file_id,
+            )
+        return [
+            {
+                "id": str(row["id"]),
+                "number": row["number"],
+                "size_in_bytes": row["size_in_bytes"],
+                "created_at": row["created_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                "current": row["current"],
+            }
+            for row in rows
+        ]
+
+    async def restore_version(self, user_id, file_id, version_id) -> dict:
+        """
+        Make an earlier version current again as a new version with the same content.
+        Nothing is uploaded or copied, the new version references the same blob or chunks.
+        """
+        await self.verify_ownership(user_id, file_id)
+
+        async with self.db.acquire_write(user_id) as conn:
+            async with conn.transaction():
+                current_size = await conn.fetchval(
+                    "SELECT size_in_bytes FROM files WHERE id = $1 FOR UPDATE", file_id
+                )
+                source = await conn.fetchrow(
+                    "SELECT size_in_bytes, blob_id, chunked, has_thumbnails "
+                    "FROM file_versions WHERE id = $1 AND file_id = $2 AND committed",
+                    version_id,
+                    file_id,
+                )
+                if current_size is None or source is None:
+                    raise HTTPException(status_code=404, detail="Version not found")
+
+                restored_id = await self.add_version(
+                    conn,
+                    file_id,
+                    source["size_in_bytes"],
+                    source["blob_id"],
+                    source["chunked"],
+                    source["has_thumbnails"],
+                )
+                if source["chunked"]:
+                    await conn.execute(
+                        "INSERT INTO file_version_chunks (version_id, position, chunk_id) "
+                        "SELECT $1, position, chunk_id FROM file_version_chunks "
+                        "WHERE version_id = $2",
+                        restored_id,
+                        version_id,
+                    )
+                await self.quota_services.reserve(
+                    conn, user_id, file_id, source["size_in_bytes"], current_size
+                )
+                await self.commit_versions(conn, [restored_id])
+
+        await self.quota_services.commit([file_id])
+        return {"version_id": str(restored_id)}
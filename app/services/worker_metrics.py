@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerMetrics:
+    """
+    Request counters for this worker process.
+    When the launcher sets WORKER_METRICS_DIR every worker publishes a JSON snapshot there,
+    so whichever worker answers /admin/workers can report on all of them.
+    """
+
+    def __init__(self, worker_id=None, metrics_dir=None, publish_interval_s=5):
+        self.worker_id = worker_id or os.getenv("WORKER_ID", "0")
+        self.metrics_dir = metrics_dir or os.getenv("WORKER_METRICS_DIR")
+        self.publish_interval_s = publish_interval_s
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self.pool = None
+        self.requests = 0
+        self.in_flight = 0
+        self.server_errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def bind_pool(self, pool):
+        self.pool = pool
+
+    def request_started(self):
+        self.in_flight += 1
+
+    def request_finished(self, status_code, elapsed_ms):
+        self.in_flight -= 1
+        self.requests += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if status_code >= 500:
+            self.server_errors += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "pid": self.pid,
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "server_errors": self.server_errors,
+            "mean_ms": (
+                round(self.total_ms / self.requests, 3) if self.requests else 0.0
+            ),
+            "max_ms": round(self.max_ms, 3),
+            "pool_size": self.pool.get_size() if self.pool else None,
+            "pool_idle": self.pool.get_idle_size() if self.pool else None,
+            "pool_max_size": self.pool.get_max_size() if self.pool else None,
+            "published_at": time.time(),
+        }
+
+    def snapshot_path(self) -> str:
+        # The pid keeps a replacement worker and the one it replaces apart during restarts
+        return os.path.join(
+            self.metrics_dir, f"worker-{self.worker_id}-{self.pid}.json"
+        )
+
+    def publish(self):
+        if not self.metrics_dir:
+            return
+        path = self.snapshot_path()
+        tmp_path = f"{path}.{self.pid}.tmp"
+        try:
+            with open(tmp_path, "w") as fh:
+                json.dump(self.snapshot(), fh)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            logger.warning(f"Could not publish worker metrics: {exc}")
+
+    async def publish_periodically(self):
+        while True:
+            self.publish()
+            await asyncio.sleep(self.publish_interval_s)
+
+    def all_workers(self) -> list[dict]:
+        """Latest snapshot of every worker, this one always fresh."""
+        if not self.metrics_dir:
+            return [self.snapshot()]
+
+        self.publish()
+        workers = []
+        for entry in sorted(os.listdir(self.metrics_dir)):
+            if not entry.startswith("worker-") or not entry.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.metrics_dir, entry)) as fh:
+                    workers.append(json.load(fh))
+            except (OSError, ValueError):
+                continue  # replaced or removed while we were reading
+        return workers
+
+    def remove_snapshot(self):
+        if self.metrics_dir:
+            try:
+                os.remove(self.snapshot_path())
+            except FileNotFoundError:
+                pass
+
+
+class WorkerMetricsMiddleware:
+    """Plain ASGI middleware, BaseHTTPMiddleware costs a task per request."""
+
+    def __init__(self, app, metrics: WorkerMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+        worker_id = self.metrics.worker_id.encode()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-worker-id", worker_id),
+                ]
+            await send(message)
+
+        self.metrics.request_started()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.request_finished(
+                status_code, (time.perf_counter() - start) * 1000
+            )
@@ -1,9 +1,12 @@
+from dataclasses import dataclass
 from dotenv import load_dotenv
-from passlib.context import CryptContext
+import asyncio
+import logging
 import os
 import json
-import boto3
-from aws_secretsmanager_caching import SecretCache, SecretCacheConfig
+import time
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
@@ -21,6 +24,8 @@ env_vars = [
     "REGION",
 ]
 
+SECRET_ID = "CloudDriveEnvVars"
+
 
 ## Helper function to corroborate the env vars exist
 def verify_presence_of_all_env_vars(source=None):
@@ -33,46 +38,195 @@ def verify_presence_of_all_env_vars(source=None):
         raise ValueError(f"Missing env vars: {', '.join(missing)}")
 
 
-## Verify if we are inside production environment
-if os.getenv("ENVIRONMENT") == "production":
-    ## If true then collect env from aws secret manager, and we load the resulting json response
-    client = boto3.client("secretsmanager", region_name="us-east-1")
-    cache_config = SecretCacheConfig()
-    cache = SecretCache(config=cache_config, client=client)
-    secrets_json = cache.get_secret_string("CloudDriveEnvVars")
-    env_creds = json.loads(secrets_json)
+@dataclass(frozen=True)
+class Settings:
+    database: str
+    db_user: str
+    password: str
+    host: str
+    port: str
+    secret_key: str
+    algorithm: str
+    access_token_expire_minutes: int
+    bucket_name: str
+    region: str
+    ## Optional tuning knobs, always read from the process environment
+    slow_query_threshold_ms: float = 200
+    explain_sample_rate: float = 0.1
+    db_pool_min_size: int = 10
+    db_pool_max_size: int = 10
+    db_replica_urls: tuple = ()
+    max_replica_lag_s: float = 2.0
+    s3_max_pool_connections: int = 50
+    s3_max_concurrency: int = 32
+    s3_max_attempts: int = 8
+
+    @property
+    def database_url(self) -> str:
+        return f"postgresql://{self.db_user}:{self.password}@{self.host}:{self.port}/{self.database}"
+
 
+def build_settings(source) -> Settings:
     ## Integrity verification step
-    verify_presence_of_all_env_vars(env_creds)
-
-    database = env_creds["DATABASE"]
-    db_user = env_creds["DB_USER"]
-    password = env_creds["DATABASE_PASSWORD"]
-    host = env_creds["HOST"]
-    port = env_creds["PORT"]
-    secret_key = env_creds["SECRET_KEY"]
-    algorithm = env_creds["ALGORITHM"]
-    access_token_expire_minutes = int(env_creds["ACCESS_TOKEN_EXPIRE_MINUTES"])
-    bucket_name = env_creds["BUCKET_NAME"]
-    region = env_creds["REGION"]
+    verify_presence_of_all_env_vars(source)
+
+    db_pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    return Settings(
+        database=source["DATABASE"],
+        db_user=source["DB_USER"],
+        password=source["DATABASE_PASSWORD"],
+        host=source["HOST"],
+        port=source["PORT"],
+        secret_key=source["SECRET_KEY"],
+        algorithm=source["ALGORITHM"],
+        access_token_expire_minutes=int(source["ACCESS_TOKEN_EXPIRE_MINUTES"]),
+        bucket_name=source["BUCKET_NAME"],
+        region=source["REGION"],
+        slow_query_threshold_ms=float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200")),
+        explain_sample_rate=float(os.getenv("EXPLAIN_SAMPLE_RATE", "0.1")),
+        db_pool_min_size=int(
+            os.getenv("DB_POOL_MIN_SIZE", str(min(10, db_pool_max_size)))
+        ),
+        db_pool_max_size=db_pool_max_size,
+        ## Replica URLs carry credentials, so the secrets payload may provide them too
+        db_replica_urls=tuple(
+            url.strip()
+            for url in (
+                source.get("DB_REPLICA_URLS") or os.getenv("DB_REPLICA_URLS", "")
+            ).split(",")
+            if url.strip()
+        ),
+        max_replica_lag_s=float(os.getenv("DB_MAX_REPLICA_LAG_S", "2")),
+        s3_max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50")),
+        s3_max_concurrency=int(os.getenv("S3_MAX_CONCURRENCY", "32")),
+        s3_max_attempts=int(os.getenv("S3_MAX_ATTEMPTS", "8")),
+    )
+
+
+_settings: Settings | None = None
+_secrets_client = None
+
+
+def get_settings() -> Settings:
+    if _settings is None:
+        raise RuntimeError("Settings not loaded, await load_settings() first")
+    return _settings
+
+
+async def load_settings() -> Settings:
+    """
+    Load configuration once per process, called from lifespan instead of at import.
+    Production reads the Secrets Manager payload, from the encrypted on-disk cache
+    when a fresh copy exists, otherwise with an async fetch that refills the cache.
+    """
+    global _settings
+
+    ## Verify if we are inside production environment
+    if os.getenv("ENVIRONMENT") == "production":
+        env_creds = read_secrets_cache()
+        if env_creds is None:
+            env_creds = await fetch_secrets()
+            write_secrets_cache(env_creds)
+        apply_runtime_secrets(env_creds)
+        _settings = build_settings(env_creds)
+    else:
+        _settings = build_settings(os.environ)
+
+    return _settings
+
+
+async def fetch_secrets() -> dict:
+    """Fetch the secrets JSON without blocking the event loop, boto3 is imported on first use."""
+
+    def fetch():
+        global _secrets_client
+        if _secrets_client is None:
+            import boto3
+
+            _secrets_client = boto3.client("secretsmanager", region_name="us-east-1")
+        return _secrets_client.get_secret_value(SecretId=SECRET_ID)["SecretString"]
+
+    return json.loads(await asyncio.to_thread(fetch))
+
+
+def apply_runtime_secrets(env_creds):
+    ## Secrets read per request through os.getenv
     os.environ["LAMBDA_SECRET"] = env_creds["LAMBDA_SECRET"]
+    if env_creds.get("ADMIN_SECRET"):
+        os.environ["ADMIN_SECRET"] = env_creds["ADMIN_SECRET"]
 
-else:
-    ## Integrity verification step
-    verify_presence_of_all_env_vars()
 
-    database = os.getenv("DATABASE")
-    db_user = os.getenv("DB_USER")  # renamed for clarity
-    password = os.getenv("DATABASE_PASSWORD")
-    host = os.getenv("HOST")
-    port = os.getenv("PORT")
-    secret_key = os.getenv("SECRET_KEY")
-    algorithm = os.getenv("ALGORITHM")
-    access_token_expire_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
-    bucket_name = os.getenv("BUCKET_NAME")
-    region = os.getenv("REGION")
+def _secrets_cache_cipher():
+    """
+    Fernet cipher for the optional on-disk cache.
+    Enabled only when SECRETS_CACHE_PATH and SECRETS_CACHE_KEY are set and cryptography is installed.
+    """
+    if not os.getenv("SECRETS_CACHE_PATH") or not os.getenv("SECRETS_CACHE_KEY"):
+        return None
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        logger.warning("Secrets cache disabled, cryptography is not installed")
+        return None
+    return Fernet(os.getenv("SECRETS_CACHE_KEY"))
+
+
+def read_secrets_cache() -> dict | None:
+    cipher = _secrets_cache_cipher()
+    if cipher is None:
+        return None
+
+    path = os.getenv("SECRETS_CACHE_PATH")
+    ttl_seconds = int(os.getenv("SECRETS_CACHE_TTL_SECONDS", "3600"))
+    try:
+        if time.time() - os.path.getmtime(path) > ttl_seconds:
+            return None
+        with open(path, "rb") as fh:
+            return json.loads(cipher.decrypt(fh.read()))
+    except FileNotFoundError:
+        return None
+    except Exception as exc:
+        ## A corrupt or undecryptable cache only costs a fetch
+        logger.warning(f"Ignoring unreadable secrets cache: {exc}")
+        return None
+
+
+def write_secrets_cache(env_creds):
+    cipher = _secrets_cache_cipher()
+    if cipher is None:
+        return
+
+    path = os.getenv("SECRETS_CACHE_PATH")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(cipher.encrypt(json.dumps(env_creds).encode()))
+        os.replace(tmp_path, path)  # readers never see a half written file
+    except OSError as exc:
+        logger.warning(f"Could not write secrets cache: {exc}")
+
 
+async def refresh_settings_periodically(interval_seconds, on_change=None):
+    """
+    Background task, refetches the production secrets every interval_seconds.
+    Rotated values replace the current Settings and on_change(settings) is called.
+    """
+    global _settings
 
-DATABASE_URL = f"postgresql://{db_user}:{password}@{host}:{port}/{database}"
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            env_creds = await fetch_secrets()
+            settings = build_settings(env_creds)
+        except Exception as exc:
+            logger.error(f"Failed to refresh secrets, keeping current ones: {exc}")
+            continue
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        write_secrets_cache(env_creds)
+        apply_runtime_secrets(env_creds)
+        if settings != _settings:
+            _settings = settings
+            logger.info("Secrets rotated")
+            if on_change:
+                on_change(settings)
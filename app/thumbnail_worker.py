@@ -0,0 +1,387 @@
+"""
+Thumbnail and validation worker.
+
+Consumes the S3 upload notifications of an SQS queue, tells every upload's real
+type from its magic bytes, stores WebP previews of images and reports a whole
+batch of results to the API in one callback (POST /upload-results).
+
+    python -m app.thumbnail_worker --queue-url https://sqs... --api-url http://backend:8080
+
+- Only the first bytes of an object are read to sniff its type, an object is
+  downloaded whole only when a preview will be made from it
+- Each image is decoded once and every preview size comes from that decode
+- Decoding and encoding run in a process pool (--processes, all cores by default),
+  S3 transfers in a thread pool around it
+- Messages are deleted once the API accepted their results, a crash or a failed
+  callback means the batch is delivered again, results are idempotent
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import unquote_plus
+from .helpers.image_utils import (
+    PREVIEWABLE_TYPES,
+    PROFILE_PHOTO_SIZE,
+    SNIFF_BYTES,
+    THUMBNAIL_SIZES,
+    make_thumbnails,
+    sniff_type,
+    thumbnail_key,
+)
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import urllib.request
+
+logger = logging.getLogger("app.thumbnail_worker")
+
+# Previews are immutable, a new upload gets new keys only through a new file id
+PREVIEW_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class UploadEvent:
+    """One object created in the bucket, keyed like the presigned uploads."""
+
+    def __init__(self, key, size=None):
+        self.key = key
+        self.size = size
+        self.kind = None
+        self.user_id = None
+        self.file_id = None
+
+        parts = key.split("/")
+        if parts[0] == "files" and len(parts) in (3, 4) and parts[2] != "chunks":
+            # files/{user_id}/{file_id}, files/{user_id}/{folder_id}/{file_id}
+            # or files/{user_id}/blobs/{blob_id}, the API resolves a blob id to its file.
+            # Chunks of chunked versions are parts of a file, nothing to sniff
+            self.kind, self.user_id, self.file_id = "file", parts[1], parts[-1]
+        elif parts[:2] == ["profile_photos", "original"] and len(parts) == 4:
+            self.kind, self.user_id = "profile_photo", parts[2]
+
+
+def parse_s3_notification(body) -> list[UploadEvent]:
+    """UploadEvents of an S3 event notification, test events and other keys give none."""
+    message = json.loads(body)
+    events = []
+    for record in message.get("Records", []):
+        if not record.get("eventName", "").startswith("ObjectCreated:"):
+            continue
+        s3_object = record["s3"]["object"]
+        event = UploadEvent(unquote_plus(s3_object["key"]), s3_object.get("size"))
+        if event.kind:
+            events.append(event)
+    return events
+
+
+class SqsEventSource:
+    def __init__(self, sqs, queue_url):
+        self.sqs = sqs
+        self.queue_url = queue_url
+
+    def receive(self, wait_time_s) -> list[tuple[str, list[UploadEvent]]]:
+        response = self.sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=wait_time_s,
+        )
+        return [
+            (message["ReceiptHandle"], parse_s3_notification(message["Body"]))
+            for message in response.get("Messages", [])
+        ]
+
+    def ack(self, receipts):
+        for start in range(0, len(receipts), 10):
+            self.sqs.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(i), "ReceiptHandle": receipt}
+                    for i, receipt in enumerate(receipts[start : start + 10])
+                ],
+            )
+
+
+class ApiCallback:
+    """Posts a batch of results to the API, retried a few times before giving up."""
+
+    def __init__(self, api_url, lambda_secret, timeout_s=10, attempts=3):
+        self.url = f"{api_url.rstrip('/')}/upload-results"
+        self.lambda_secret = lambda_secret
+        self.timeout_s = timeout_s
+        self.attempts = attempts
+
+    def __call__(self, payload) -> dict:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode(),
+            headers={
+                "Content-Type": "application/json",
+                "X-Lambda-Secret": self.lambda_secret or "",
+            },
+            method="POST",
+        )
+        for attempt in range(1, self.attempts + 1):
+            try:
+                with urllib.request.urlopen(
+                    request, timeout=self.timeout_s
+                ) as response:
+                    return json.loads(response.read())
+            except OSError as exc:
+                if attempt == self.attempts:
+                    raise
+                logger.warning(f"Upload results callback failed ({exc}), retrying")
+                time.sleep(0.5 * 2**attempt)
+
+
+class ThumbnailWorker:
+    def __init__(
+        self,
+        s3,
+        bucket_name,
+        post_results,
+        processes=None,
+        batch_size=50,
+        flush_interval_s=2.0,
+    ):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.post_results = post_results
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.decode_pool = ProcessPoolExecutor(
+            self.processes, mp_context=multiprocessing.get_context("spawn")
+        )
+        # Enough transfers in flight to keep every decoding process busy
+        self.io_pool = ThreadPoolExecutor(self.processes * 4)
+        self.pending = {"files": [], "profile_photos": []}
+        self.pending_receipts = []
+        self.last_flush = time.monotonic()
+        self.should_exit = False
+
+    def read_header(self, event) -> bytes:
+        if event.size == 0:
+            return b""
+        response = self.s3.get_object(
+            Bucket=self.bucket_name, Key=event.key, Range=f"bytes=0-{SNIFF_BYTES - 1}"
+        )
+        return response["Body"].read()
+
+    def read(self, key) -> bytes:
+        return self.s3.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()
+
+    def put_preview(self, key, body):
+        self.s3.put_object(
+            Bucket=self.bucket_name,
+            Key=key,
+            Body=body,
+            ContentType="image/webp",
+            CacheControl=PREVIEW_CACHE_CONTROL,
+        )
+
+    def previews(self, key, sizes, square=False) -> dict | None:
+        """Decoded in the process pool, None for an image Pillow can't read."""
+        data = self.read(key)
+        try:
+            return self.decode_pool.submit(
+                make_thumbnails, data, sizes, square
+            ).result()
+        except Exception as exc:
+            logger.warning(f"Could not decode {key}: {exc}")
+            return None
+
+    def handle(self, event) -> dict | None:
+        """Runs in the I/O pool, returns the event's result or None for nothing to report."""
+        detected = sniff_type(self.read_header(event))
+
+        if event.kind == "profile_photo":
+            thumbnails = None
+            if detected in PREVIEWABLE_TYPES:
+                thumbnails = self.previews(
+                    event.key, (PROFILE_PHOTO_SIZE,), square=True
+                )
+            if thumbnails is None:
+                logger.warning(f"Rejected profile photo of user {event.user_id}")
+                self.s3.delete_object(Bucket=self.bucket_name, Key=event.key)
+                return None
+            self.s3.put_object(
+                Bucket=self.bucket_name,
+                Key=f"profile_photos/resized/{event.user_id}/photo",
+                Body=thumbnails[PROFILE_PHOTO_SIZE],
+                ContentType="image/webp",
+            )
+            return {"profile_photo": event.user_id}
+
+        thumbnails = None
+        if detected in PREVIEWABLE_TYPES:
+            thumbnails = self.previews(event.key, THUMBNAIL_SIZES)
+            for size, body in (thumbnails or {}).items():
+                self.put_preview(
+                    thumbnail_key(event.user_id, event.file_id, size), body
+                )
+        return {
+            "file_id": event.file_id,
+            "detected_type": detected,
+            "has_thumbnails": thumbnails is not None,
+            "user_id": event.user_id,
+            "key": event.key,
+        }
+
+    def process(self, messages):
+        """Handle every event of the received messages concurrently and queue the results."""
+        handled = [
+            (receipt, [self.io_pool.submit(self.handle, event) for event in events])
+            for receipt, events in messages
+        ]
+        for receipt, futures in handled:
+            try:
+                results = [future.result() for future in futures]
+            except Exception as exc:
+                # Not acknowledged, SQS delivers the message again
+                logger.error(f"Failed to process an upload notification: {exc}")
+                continue
+            for result in results:
+                if result is None:
+                    continue
+                if "profile_photo" in result:
+                    self.pending["profile_photos"].append(result["profile_photo"])
+                else:
+                    self.pending["files"].append(result)
+            self.pending_receipts.append(receipt)
+
+    def should_flush(self) -> bool:
+        queued = len(self.pending["files"]) + len(self.pending["profile_photos"])
+        return bool(self.pending_receipts) and (
+            queued >= self.batch_size
+            or time.monotonic() - self.last_flush >= self.flush_interval_s
+        )
+
+    def flush(self, source):
+        """One callback for every queued result, then the objects it rejected are deleted."""
+        files = self.pending["files"]
+        if files or self.pending["profile_photos"]:
+            response = self.post_results(
+                {
+                    "files": [
+                        {
+                            key: result[key]
+                            for key in ("file_id", "detected_type", "has_thumbnails")
+                        }
+                        for result in files
+                    ],
+                    "profile_photos": self.pending["profile_photos"],
+                }
+            )
+            rejected = set(response.get("rejected_file_ids", []))
+            for result in files:
+                if result["file_id"] in rejected:
+                    self.io_pool.submit(self.delete_upload, result)
+
+        source.ack(self.pending_receipts)
+        self.pending = {"files": [], "profile_photos": []}
+        self.pending_receipts = []
+        self.last_flush = time.monotonic()
+
+    def delete_upload(self, result):
+        keys = [result["key"]]
+        if result["has_thumbnails"]:
+            keys += [
+                thumbnail_key(result["user_id"], result["file_id"], size)
+                for size in THUMBNAIL_SIZES
+            ]
+        self.s3.delete_objects(
+            Bucket=self.bucket_name,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+
+    def receive_round(self, source) -> list:
+        """Messages for about two events per process, waiting long only when idle."""
+        messages = []
+        events = 0
+        while events < self.processes * 2:
+            wait_time_s = 0 if messages or self.pending_receipts else 20
+            received = source.receive(wait_time_s)
+            if not received:
+                break
+            messages += received
+            events += sum(len(message_events) for _, message_events in received)
+        return messages
+
+    def run(self, source):
+        while not self.should_exit:
+            messages = self.receive_round(source)
+            self.process(messages)
+            if self.should_flush():
+                try:
+                    self.flush(source)
+                except OSError as exc:
+                    # Unacknowledged, the queue redelivers them once their visibility times out
+                    logger.error(f"Dropping a batch of results for redelivery: {exc}")
+                    self.pending = {"files": [], "profile_photos": []}
+                    self.pending_receipts = []
+        if self.pending_receipts:
+            self.flush(source)
+
+    def handle_exit(self, signum, frame):
+        self.should_exit = True
+
+    def close(self):
+        self.io_pool.shutdown()
+        self.decode_pool.shutdown()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--queue-url", default=os.getenv("THUMBNAIL_QUEUE_URL"))
+    parser.add_argument(
+        "--api-url", default=os.getenv("API_URL", "http://127.0.0.1:8080")
+    )
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--flush-interval", type=float, default=2.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    args = parse_args(argv)
+    if not args.queue_url:
+        raise SystemExit("--queue-url or THUMBNAIL_QUEUE_URL is required")
+
+    from .startup import load_settings
+    import boto3
+
+    ## Same configuration as the API, production reads LAMBDA_SECRET from Secrets Manager
+    settings = asyncio.run(load_settings())
+    worker = ThumbnailWorker(
+        boto3.client("s3", region_name=settings.region),
+        settings.bucket_name,
+        ApiCallback(args.api_url, os.getenv("LAMBDA_SECRET")),
+        processes=args.processes,
+        batch_size=args.batch_size,
+        flush_interval_s=args.flush_interval,
+    )
+    signal.signal(signal.SIGINT, worker.handle_exit)
+    signal.signal(signal.SIGTERM, worker.handle_exit)
+
+    logger.info(
+        f"Consuming {args.queue_url} with {worker.processes} decoding processes"
+    )
+    try:
+        worker.run(
+            SqsEventSource(
+                boto3.client("sqs", region_name=settings.region), args.queue_url
+            )
+        )
+    finally:
+        worker.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Job queue throughput benchmark.
+
+Queues --jobs jobs and drains them with one JobQueue per simulated API process,
+each running --concurrency workers, reporting jobs/sec for every combination of
+concurrency and batch size. --job-ms makes each job wait that long, like an S3 call.
+
+    python benchmarks/jobs/bench_jobs.py --jobs 5000 --concurrency 1 4 16 --output jobs.json
+"""
+
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_ROOT)
+
+from app.db.migrate import apply_migrations  # noqa: E402
+from app.services.database import DatabaseRouter  # noqa: E402
+from app.services.job_queue import JobQueue  # noqa: E402
+
+BENCH_JOB = "benchmark"
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def measure(pool, jobs, processes, concurrency, batch_size, job_ms) -> dict:
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO jobs (kind, payload) "
+            "SELECT $1, jsonb_build_object('n', n) FROM generate_series(1, $2) AS n",
+            BENCH_JOB,
+            jobs,
+        )
+
+    async def handler(payload):
+        if job_ms:
+            await asyncio.sleep(job_ms / 1000)
+
+    queues = []
+    for _ in range(processes):
+        queue = JobQueue(
+            DatabaseRouter(pool),
+            concurrency=concurrency,
+            batch_size=batch_size,
+            poll_interval_s=0.05,
+        )
+        queue.register(BENCH_JOB, handler)
+        queues.append(queue)
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(queue.run()) for queue in queues]
+    try:
+        while sum(queue.completed for queue in queues) < jobs:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM jobs WHERE kind = $1", BENCH_JOB)
+
+    return {
+        "processes": processes,
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 3),
+        "jobs_per_second": round(jobs / elapsed, 1),
+    }
+
+
+async def run(args) -> dict:
+    import asyncpg
+
+    workers = args.processes * max(args.concurrency)
+    pool = await asyncpg.create_pool(
+        args.database_url, min_size=1, max_size=min(workers + 1, args.max_connections)
+    )
+    try:
+        async with pool.acquire() as conn:
+            await apply_migrations(conn)
+        runs = []
+        for concurrency in args.concurrency:
+            for batch_size in args.batch_size:
+                result = await measure(
+                    pool,
+                    args.jobs,
+                    args.processes,
+                    concurrency,
+                    batch_size,
+                    args.job_ms,
+                )
+                print(
+                    f"concurrency={concurrency} batch_size={batch_size} "
+                    f"{result['jobs_per_second']} jobs/s",
+                    file=sys.stderr,
+                )
+                runs.append(result)
+    finally:
+        await pool.close()
+    return runs
+
+
+def main(args):
+    report = {
+        "benchmark": "jobs",
+        "commit": args.commit or current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "jobs": args.jobs,
+            "processes": args.processes,
+            "job_ms": args.job_ms,
+        },
+        "runs": asyncio.run(run(args)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output)
+    else:
+        print(output)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--jobs", type=int, default=5000)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--job-ms", type=float, default=0)
+    parser.add_argument("--max-connections", type=int, default=50)
+    parser.add_argument("--commit", help="label to store instead of git HEAD")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+    return args
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,90 @@
+"""
+Compares two load benchmark reports produced by run_load.py.
+
+    python benchmarks/load/compare.py baseline.json candidate.json --threshold 10
+
+Prints the change per concurrency level and endpoint, and exits non-zero when
+throughput drops or p95/p99 latency grows by more than the threshold percent.
+"""
+
+import argparse
+import json
+import sys
+
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+GATED_LATENCY_METRICS = ("p95_ms", "p99_ms")
+
+
+def change_pct(old, new):
+    if not old or new is None:
+        return None
+    return round((new - old) / old * 100, 2)
+
+
+def compare(baseline, candidate, threshold):
+    regressions = []
+    rows = []
+    baseline_levels = {level["concurrency"]: level for level in baseline["levels"]}
+
+    for level in candidate["levels"]:
+        old_level = baseline_levels.get(level["concurrency"])
+        if old_level is None:
+            continue
+        for endpoint, new in level["endpoints"].items():
+            old = old_level["endpoints"].get(endpoint)
+            if old is None:
+                continue
+            row = {
+                "concurrency": level["concurrency"],
+                "endpoint": endpoint,
+                "throughput_rps": change_pct(
+                    old["throughput_rps"], new["throughput_rps"]
+                ),
+            }
+            for metric in LATENCY_METRICS:
+                row[metric] = change_pct(old[metric], new[metric])
+            rows.append(row)
+
+            if row["throughput_rps"] is not None and row["throughput_rps"] < -threshold:
+                regressions.append((row, "throughput_rps"))
+            for metric in GATED_LATENCY_METRICS:
+                if row[metric] is not None and row[metric] > threshold:
+                    regressions.append((row, metric))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two load reports")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10, help="percent")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.candidate) as fh:
+        candidate = json.load(fh)
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    print(f"{baseline['commit']} -> {candidate['commit']} (change in %)")
+    print(f"{'conc':>5} {'endpoint':<18} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for row in rows:
+        print(
+            f"{row['concurrency']:>5} {row['endpoint']:<18} "
+            + " ".join(
+                f"{row[m] if row[m] is not None else '-':>8}"
+                for m in ("throughput_rps",) + LATENCY_METRICS
+            )
+        )
+
+    for row, metric in regressions:
+        print(
+            f"REGRESSION {row['endpoint']} @ {row['concurrency']}: "
+            f"{metric} changed {row[metric]}%",
+            file=sys.stderr,
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+#!/bin/sh
+# Brings up the local stack, runs the load benchmark and tears everything down.
+# Usage: benchmarks/load/run.sh results.json [extra run_load.py args]
+set -e
+
+HERE="$(cd "$(dirname "$0")" && pwd)"
+OUTPUT="${1:-load-results.json}"
+[ "$#" -gt 0 ] && shift
+
+docker compose -f "$HERE/docker-compose.yml" up -d --build --wait
+trap 'docker compose -f "$HERE/docker-compose.yml" down -v' EXIT
+
+python "$HERE/run_load.py" --base-url http://localhost:8000 --output "$OUTPUT" "$@"
@@ -0,0 +1,320 @@
+"""
+End-to-end load benchmark for the CloudDrive API.
+
+Drives a weighted mix of login, listing, upload admission, download URL and
+share calls at each requested concurrency level, then writes throughput and
+p50/p95/p99 latency per endpoint as JSON so runs can be compared across commits.
+
+    python benchmarks/load/run_load.py --base-url http://localhost:8000 \
+        --concurrency 1 8 32 64 --duration 30 --output results.json
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from uuid import uuid4
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+import httpx
+
+# Relative weight of each operation in the traffic mix
+DEFAULT_MIX = {
+    "login": 5,
+    "list_root": 25,
+    "list_folder": 15,
+    "upload_admission": 15,
+    "download_url": 25,
+    "share": 15,
+}
+
+PASSWORD = "bench_password"
+
+
+@dataclass
+class BenchUser:
+    username: str
+    token: str = ""
+    folder_ids: list = field(default_factory=list)
+    file_ids: list = field(default_factory=list)
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+@dataclass
+class EndpointStats:
+    latencies_ms: list = field(default_factory=list)
+    errors: int = 0
+    shed: int = 0
+
+    def summary(self, duration_s) -> dict:
+        ordered = sorted(self.latencies_ms)
+        return {
+            "count": len(ordered),
+            "errors": self.errors,
+            "shed": self.shed,
+            "throughput_rps": round(len(ordered) / duration_s, 2),
+            "p50_ms": percentile(ordered, 50),
+            "p95_ms": percentile(ordered, 95),
+            "p99_ms": percentile(ordered, 99),
+            "max_ms": round(ordered[-1], 3) if ordered else None,
+        }
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile over an already sorted list."""
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return round(ordered[rank], 3)
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def wait_until_healthy(client, timeout_s=120):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("API never became healthy")
+
+
+async def login(client, user):
+    response = await client.post(
+        "/login", data={"username": user.username, "password": PASSWORD}
+    )
+    response.raise_for_status()
+    user.token = response.json()["access_token"]
+    return response
+
+
+async def admit_upload(client, user, parent_folder_id=None):
+    body = {
+        "file_name": f"bench-{uuid4().hex[:16]}.png",
+        "file_size_in_bytes": random.randint(10_000, 5_000_000),
+    }
+    if parent_folder_id:
+        body["parent_folder_id"] = parent_folder_id
+    return await client.post("/file", json=body, headers=user.headers)
+
+
+async def seed(client, users_count, folders_per_user, files_per_user, run_id):
+    """Registers users and gives each one folders and files to list, download and share."""
+    users = []
+    for index in range(users_count):
+        user = BenchUser(username=f"b{run_id}{index}")
+        response = await client.post(
+            "/user",
+            json={
+                "username": user.username,
+                "email": f"{user.username}@example.com",
+                "password": PASSWORD,
+            },
+        )
+        response.raise_for_status()
+        await login(client, user)
+
+        for folder_index in range(folders_per_user):
+            name = f"folder-{folder_index}"
+            response = await client.post(
+                "/drive", json={"folder_name": name}, headers=user.headers
+            )
+            response.raise_for_status()
+
+        listing = (await client.get("/drive", headers=user.headers)).json()
+        user.folder_ids = [
+            entry["id"]
+            for entry in listing["files_and_folders"]
+            if entry["size_in_bytes"] is None
+        ]
+        for _ in range(files_per_user):
+            (await admit_upload(client, user)).raise_for_status()
+
+        listing = (await client.get("/drive", headers=user.headers)).json()
+        user.file_ids = [
+            entry["id"]
+            for entry in listing["files_and_folders"]
+            if entry["size_in_bytes"] is not None
+        ]
+        users.append(user)
+    return users
+
+
+async def run_operation(client, operation, user, users):
+    """Issues one request, returns the response so the caller can classify it."""
+    if operation == "login":
+        return await login(client, user)
+    if operation == "list_root":
+        return await client.get(
+            "/drive", params={"sort_by": "name"}, headers=user.headers
+        )
+    if operation == "list_folder":
+        folder_id = random.choice(user.folder_ids)
+        return await client.get(f"/drive/{folder_id}", headers=user.headers)
+    if operation == "upload_admission":
+        parent = random.choice(user.folder_ids + [None])
+        return await admit_upload(client, user, parent)
+    if operation == "download_url":
+        return await client.get(
+            f"/file/{random.choice(user.file_ids)}", headers=user.headers
+        )
+    if operation == "share":
+        receiver = random.choice([u for u in users if u is not user])
+        return await client.post(
+            "/share",
+            json={
+                "share_object_type": "file",
+                "file_id": random.choice(user.file_ids),
+                "username": receiver.username,
+                "read": True,
+            },
+            headers=user.headers,
+        )
+    raise ValueError(f"Unknown operation {operation}")
+
+
+# Statuses that are a normal business outcome of the operation, not a failure
+EXPECTED_STATUSES = {"share": {200, 409}}
+
+
+async def run_level(client, users, mix, concurrency, duration_s, warmup_s):
+    operations = list(mix)
+    weights = [mix[op] for op in operations]
+    stats = {op: EndpointStats() for op in operations}
+    recording_from = time.monotonic() + warmup_s
+    stop_at = recording_from + duration_s
+
+    async def worker():
+        while (now := time.monotonic()) < stop_at:
+            operation = random.choices(operations, weights)[0]
+            user = random.choice(users)
+            start = time.perf_counter()
+            shed = False
+            try:
+                response = await run_operation(client, operation, user, users)
+                ok = response.status_code in EXPECTED_STATUSES.get(operation, {200})
+                shed = response.status_code == 503 and "retry-after" in response.headers
+            except httpx.HTTPError:
+                ok = False
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if now < recording_from:
+                continue
+            if shed:
+                ## Refused by admission control, kept out of the latencies and errors
+                stats[operation].shed += 1
+            elif ok:
+                stats[operation].latencies_ms.append(elapsed_ms)
+            else:
+                stats[operation].errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    endpoints = {op: stats[op].summary(duration_s) for op in operations}
+    total = sum(entry["count"] for entry in endpoints.values())
+    all_latencies = sorted(ms for s in stats.values() for ms in s.latencies_ms)
+    return {
+        "concurrency": concurrency,
+        "duration_s": duration_s,
+        "total_requests": total,
+        "total_errors": sum(entry["errors"] for entry in endpoints.values()),
+        "total_shed": sum(entry["shed"] for entry in endpoints.values()),
+        "throughput_rps": round(total / duration_s, 2),
+        "p50_ms": percentile(all_latencies, 50),
+        "p95_ms": percentile(all_latencies, 95),
+        "p99_ms": percentile(all_latencies, 99),
+        "endpoints": endpoints,
+    }
+
+
+async def main(args):
+    random.seed(args.seed)
+    mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+    limits = httpx.Limits(
+        max_connections=max(args.concurrency), max_keepalive_connections=None
+    )
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=args.request_timeout
+    ) as client:
+        await wait_until_healthy(client)
+        users = await seed(
+            client,
+            args.users,
+            args.folders_per_user,
+            args.files_per_user,
+            run_id=uuid4().hex[:6],
+        )
+
+        levels = []
+        for concurrency in args.concurrency:
+            result = await run_level(
+                client, users, mix, concurrency, args.duration, args.warmup
+            )
+            levels.append(result)
+            print(
+                f"concurrency={concurrency:>4} rps={result['throughput_rps']:>9} "
+                f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+                f"p99={result['p99_ms']}ms errors={result['total_errors']} "
+                f"shed={result['total_shed']}",
+                file=sys.stderr,
+            )
+
+    report = {
+        "benchmark": "load",
+        "commit": args.commit or current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "base_url": args.base_url,
+            "mix": mix,
+            "users": args.users,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "seed": args.seed,
+        },
+        "levels": levels,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output)
+    else:
+        print(output)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=3, help="unrecorded seconds")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--folders-per-user", type=int, default=5)
+    parser.add_argument("--files-per-user", type=int, default=20)
+    parser.add_argument("--request-timeout", type=float, default=30)
+    parser.add_argument("--mix", help='JSON weights, e.g. {"list_root": 1}')
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--commit", help="label to store instead of git HEAD")
+    parser.add_argument("--output", help="write the JSON report here")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
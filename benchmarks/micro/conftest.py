@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+import random
+import pytest
+
+random.seed(7)
+
+NAMES = [
+    "photo.png",
+    "vacation_2024_beach_sunset.JPG",
+    "report(3).pdf",
+    "archive.tar.gz",
+    "notes",
+    "Dockerfile",
+    "budget-final-v2.xlsx",
+    "song.flac",
+    "weird.name.with.many.dots.md",
+    "binary.unknownext",
+]
+
+
+def make_listing_rows(count, in_folder=False):
+    """Rows shaped like the asyncpg records retrieve_folder_content converts to dicts."""
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    parent = uuid4()
+    rows = []
+    for index in range(count):
+        is_file = index % 4 != 0
+        row = {
+            "id": uuid4(),
+            "name": f"item-{index}.png" if is_file else f"folder-{index}",
+            "created_at": now - timedelta(minutes=index),
+            "last_interaction": now - timedelta(seconds=index),
+            "size_in_bytes": random.randint(1, 10**9) if is_file else None,
+            "type": "png" if is_file else None,
+        }
+        if in_folder:
+            row["parent_folder_id"] = parent
+        rows.append(row)
+    return rows
+
+
+@pytest.fixture(params=[50, 500, 5000], ids=lambda n: f"{n}_rows")
+def listing_rows(request):
+    return make_listing_rows(request.param, in_folder=True)
+
+
+@pytest.fixture
+def file_names():
+    # A listing or bulk request worth of names, mixed extensions and shapes
+    return [random.choice(NAMES) for _ in range(1000)]
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    # Keep stored baselines small, comparisons only need the summary stats
+    for bench in output_json["benchmarks"]:
+        bench["stats"].pop("data", None)
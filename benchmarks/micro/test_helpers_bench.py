@@ -0,0 +1,39 @@
+from app.helpers.file_utils import (
+    format_db_returning_objects,
+    get_ext,
+    is_allowed_extension,
+)
+from app.services.file_services import FileServices
+
+
+def test_format_db_returning_objects(benchmark, listing_rows):
+    # The helper normalizes in place, so every round gets a fresh copy
+    def fresh_rows():
+        return ([dict(row) for row in listing_rows],), {}
+
+    result = benchmark.pedantic(
+        format_db_returning_objects, setup=fresh_rows, rounds=300, warmup_rounds=5
+    )
+    assert isinstance(result[0]["id"], str)
+
+
+def test_get_ext(benchmark, file_names):
+    result = benchmark(lambda: [get_ext(name) for name in file_names])
+    assert len(result) == len(file_names)
+
+
+def test_is_allowed_extension(benchmark, file_names):
+    result = benchmark(lambda: [is_allowed_extension(name) for name in file_names])
+    assert True in result
+
+
+def test_split_copy_suffix_original(benchmark):
+    assert benchmark(FileServices.split_copy_suffix, "photo.png") == ("photo", "png")
+
+
+def test_split_copy_suffix_numbered_copy(benchmark):
+    name = "vacation_2024_beach_sunset(41).jpeg"
+    assert benchmark(FileServices.split_copy_suffix, name) == (
+        "vacation_2024_beach_sunset",
+        "jpeg",
+    )
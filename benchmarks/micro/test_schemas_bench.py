@@ -0,0 +1,44 @@
+from app.helpers.file_utils import format_db_returning_objects
+from app.schemas.schemas import FolderContents, Share, UploadFileInfo
+from .conftest import make_listing_rows
+from uuid import uuid4
+import pytest
+
+
+def test_upload_file_info_validation(benchmark):
+    payload = {
+        "file_name": "vacation_2024_beach_sunset.jpeg",
+        "file_size_in_bytes": 4_812_331,
+        "parent_folder_id": str(uuid4()),
+        "file_conflict": "Keep",
+    }
+    model = benchmark(UploadFileInfo.model_validate, payload)
+    assert model.file_conflict == "Keep"
+
+
+def test_share_validation(benchmark):
+    payload = {
+        "share_object_type": "folder",
+        "username": "receiver_user",
+        "read": True,
+        "write": True,
+        "folder_id": str(uuid4()),
+    }
+    model = benchmark(Share.model_validate, payload)
+    assert model.folder_id is not None
+
+
+@pytest.mark.parametrize("count", [50, 500, 5000], ids=lambda n: f"{n}_rows")
+def test_folder_contents_validation(benchmark, count):
+    # Same payload the /drive routes hand to response_model=FolderContents
+    payload = {
+        "user": {
+            "username": "test_user",
+            "email": "test@test.com",
+            "available_storage_in_bytes": 5_000_000_000,
+            "total_storage_in_bytes": 5_368_709_120,
+        },
+        "files_and_folders": format_db_returning_objects(make_listing_rows(count)),
+    }
+    model = benchmark(FolderContents.model_validate, payload)
+    assert len(model.files_and_folders) == count
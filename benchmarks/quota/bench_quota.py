@@ -0,0 +1,156 @@
+"""
+Concurrent quota charges of a single user.
+
+Runs --concurrency tasks that each charge one upload after another for the same user,
+each charge in its own transaction held open --hold-ms longer, like the files and
+ledger inserts around it. Reports charges/sec and latency with the user's balance in
+1 stripe (one hot row, as before striping) and in the stripes the migration creates.
+
+    python benchmarks/quota/bench_quota.py --concurrency 1 8 32 --output quota.json
+"""
+
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_ROOT)
+
+from app.db.migrate import apply_migrations  # noqa: E402
+from app.services.quota_services import QuotaServices  # noqa: E402
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def create_user(pool, stripes) -> uuid.UUID:
+    """A user with a balance no run can spend, in only the first `stripes` stripes."""
+    name = f"bench{uuid.uuid4().hex[:10]}"
+    async with pool.acquire() as conn:
+        user_id = await conn.fetchval(
+            "INSERT INTO users (username, email, password, total_storage_in_bytes) "
+            "VALUES ($1, $2, 'x', $3) RETURNING id",
+            name,
+            f"{name}@bench.local",
+            2**60,
+        )
+        if stripes:
+            await conn.execute(
+                "DELETE FROM quota_stripes WHERE user_id = $1 AND stripe >= $2",
+                user_id,
+                stripes,
+            )
+            await QuotaServices.spread(conn, user_id, 2**60)
+    return user_id
+
+
+async def measure(pool, stripes, concurrency, charges, hold_ms) -> dict:
+    user_id = await create_user(pool, stripes)
+    latencies = []
+
+    async def charge_many(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    assert await QuotaServices.claim(conn, user_id, 1024)
+                    if hold_ms:
+                        await asyncio.sleep(hold_ms / 1000)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(charge_many(charges // concurrency) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM users WHERE id = $1", user_id)
+
+    latencies.sort()
+    return {
+        "stripes": stripes or "all",
+        "concurrency": concurrency,
+        "charges_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+async def run(args) -> list:
+    import asyncpg
+
+    pool = await asyncpg.create_pool(
+        args.database_url, min_size=1, max_size=max(args.concurrency) + 1
+    )
+    try:
+        async with pool.acquire() as conn:
+            await apply_migrations(conn)
+        runs = []
+        for concurrency in args.concurrency:
+            ## 1 stripe is the single balance row every charge used to lock
+            for stripes in (1, None):
+                result = await measure(
+                    pool, stripes, concurrency, args.charges, args.hold_ms
+                )
+                print(
+                    f"stripes={result['stripes']} concurrency={concurrency} "
+                    f"{result['charges_per_second']} charges/s p95={result['p95_ms']}ms",
+                    file=sys.stderr,
+                )
+                runs.append(result)
+    finally:
+        await pool.close()
+    return runs
+
+
+def main(args):
+    report = {
+        "benchmark": "quota",
+        "commit": args.commit or current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {"charges": args.charges, "hold_ms": args.hold_ms},
+        "runs": asyncio.run(run(args)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output)
+    else:
+        print(output)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--charges", type=int, default=2000)
+    parser.add_argument("--hold-ms", type=float, default=2)
+    parser.add_argument("--commit", help="label to store instead of git HEAD")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+    return args
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,174 @@
+"""
+Worker scaling benchmark for the multi-worker launcher.
+
+Starts `python -m app.serve` with 1, 2, 4 ... N workers on the same database,
+drives the load mix at a concurrency proportional to the worker count and
+reports throughput per level together with the scaling efficiency against
+the single worker run (1.0 is perfectly linear).
+
+    python -m benchmarks.scaling.run_scaling --workers 1 2 4 --output scaling.json
+
+Needs the same env vars as the API and a database reachable from them.
+"""
+
+from datetime import datetime, timezone
+from uuid import uuid4
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import httpx
+from benchmarks.load.run_load import current_commit, run_level, seed, wait_until_healthy
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Request handling that is CPU bound in the API process, what extra workers should scale
+CPU_MIX = {
+    "list_root": 30,
+    "list_folder": 15,
+    "upload_admission": 20,
+    "download_url": 35,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_all_workers(base_url, workers, timeout_s=120):
+    """
+    Every worker tags its responses, wait until each one has answered /health.
+    Keep-alive is off so each probe is a new connection the kernel can hand to any worker.
+    """
+    seen = set()
+    deadline = asyncio.get_running_loop().time() + timeout_s
+    limits = httpx.Limits(max_keepalive_connections=0)
+    while len(seen) < workers:
+        if asyncio.get_running_loop().time() > deadline:
+            raise RuntimeError(f"Only workers {sorted(seen)} became healthy")
+        async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+            responses = await asyncio.gather(
+                *(client.get("/health") for _ in range(4 * workers)),
+                return_exceptions=True,
+            )
+        seen.update(
+            r.headers.get("x-worker-id")
+            for r in responses
+            if isinstance(r, httpx.Response) and r.status_code == 200
+        )
+        await asyncio.sleep(0.2)
+
+
+def start_server(workers, port, db_connections) -> subprocess.Popen:
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "app.serve",
+            "--workers",
+            str(workers),
+            "--port",
+            str(port),
+            "--db-connections",
+            str(db_connections),
+        ],
+        cwd=REPO_ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def run_with_workers(args, workers, users):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(workers, port, args.db_connections)
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(
+            base_url=base_url, limits=limits, timeout=30
+        ) as client:
+            await wait_until_healthy(client)
+            await wait_for_all_workers(base_url, workers)
+            if not users:
+                users.extend(
+                    await seed(client, args.users, 3, 10, run_id=uuid4().hex[:6])
+                )
+            return await run_level(
+                client,
+                users,
+                CPU_MIX,
+                args.concurrency_per_worker * workers,
+                args.duration,
+                args.warmup,
+            )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def main(args):
+    users = []
+    levels = []
+    for workers in args.workers:
+        result = await run_with_workers(args, workers, users)
+        result["workers"] = workers
+        levels.append(result)
+
+    single = levels[0]["throughput_rps"] / args.workers[0]
+    for level in levels:
+        level["rps_per_worker"] = round(level["throughput_rps"] / level["workers"], 2)
+        level["scaling_efficiency"] = (
+            round(level["rps_per_worker"] / single, 3) if single else None
+        )
+        print(
+            f"workers={level['workers']:>3} rps={level['throughput_rps']:>9} "
+            f"efficiency={level['scaling_efficiency']} p99={level['p99_ms']}ms "
+            f"errors={level['total_errors']}",
+            file=sys.stderr,
+        )
+
+    report = {
+        "benchmark": "scaling",
+        "commit": args.commit or current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "cpu_count": os.cpu_count(),
+            "mix": CPU_MIX,
+            "users": args.users,
+            "db_connections": args.db_connections,
+            "concurrency_per_worker": args.concurrency_per_worker,
+            "duration_s": args.duration,
+        },
+        "levels": levels,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output)
+    else:
+        print(output)
+    return report
+
+
+def parse_args(argv=None):
+    cpus = os.cpu_count() or 1
+    default_workers = [n for n in (1, 2, 4, 8, 16, 32) if n < cpus] + [cpus]
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers)
+    parser.add_argument("--concurrency-per-worker", type=int, default=16)
+    parser.add_argument("--db-connections", type=int, default=4 * cpus)
+    parser.add_argument("--duration", type=float, default=20, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=3, help="unrecorded seconds")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--commit", help="label to store instead of git HEAD")
+    parser.add_argument("--output", help="write the JSON report here")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,131 @@
+"""
+Cold start benchmark for the CloudDrive API.
+
+Measures how long `import app.main` takes in a fresh interpreter and how long
+a fresh uvicorn process needs before /health first answers 200, repeated a few
+times, and writes the medians as JSON so runs can be compared across commits.
+
+    python benchmarks/startup/bench_startup.py --runs 5 --output startup.json
+"""
+
+from datetime import datetime, timezone
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import app.main; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=REPO_ROOT, text=True
+    )
+    return float(output.strip().splitlines()[-1]) * 1000
+
+
+def measure_first_healthy_response(timeout_s) -> float:
+    """Spawns uvicorn and polls /health, returns ms from spawn to the first 200."""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        cwd=REPO_ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout_s:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {server.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - start) * 1000
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.005)
+        raise RuntimeError("API never became healthy")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summarize(samples) -> dict:
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "min_ms": round(min(samples), 3),
+        "max_ms": round(max(samples), 3),
+        "samples_ms": [round(sample, 3) for sample in samples],
+    }
+
+
+def main(args):
+    import_ms = [measure_import() for _ in range(args.runs)]
+    healthy_ms = [
+        measure_first_healthy_response(args.timeout) for _ in range(args.runs)
+    ]
+
+    report = {
+        "benchmark": "startup",
+        "commit": args.commit or current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {"runs": args.runs, "environment": os.getenv("ENVIRONMENT")},
+        "import_app": summarize(import_ms),
+        "first_healthy_response": summarize(healthy_ms),
+    }
+    print(
+        f"import={report['import_app']['median_ms']}ms "
+        f"first 200={report['first_healthy_response']['median_ms']}ms",
+        file=sys.stderr,
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output)
+    else:
+        print(output)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds per start")
+    parser.add_argument("--commit", help="label to store instead of git HEAD")
+    parser.add_argument("--output", help="write the JSON report here")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,141 @@
+"""
+Thumbnail throughput benchmark.
+
+Generates synthetic camera-sized JPEGs and runs make_thumbnails over them in a
+process pool of 1, 2, 4 ... N processes, reporting images/sec and images/sec per
+core next to a naive baseline that decodes the full image once per preview size.
+
+    python benchmarks/thumbnails/bench_thumbnails.py --images 40 --output thumbnails.json
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_ROOT)
+
+from app.helpers.image_utils import THUMBNAIL_SIZES, make_thumbnails  # noqa: E402
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def synthetic_jpeg(width, height, seed) -> bytes:
+    """Noise over a gradient, compresses about like a photo."""
+    from PIL import Image
+
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed % 20)
+    image = Image.merge("RGB", (gradient, noise, gradient.rotate(180)))
+    out = BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def naive_thumbnails(data, sizes=THUMBNAIL_SIZES) -> dict:
+    """Full decode per size, what a one-resize-per-call pipeline costs."""
+    from PIL import Image
+
+    thumbnails = {}
+    for size in sizes:
+        with Image.open(BytesIO(data)) as image:
+            image = image.convert("RGB")
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            out = BytesIO()
+            image.save(out, "WEBP", quality=80, method=4)
+            thumbnails[size] = out.getvalue()
+    return thumbnails
+
+
+def measure(function, images, processes) -> dict:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(processes, mp_context=context) as pool:
+        ## Warm the workers up, the spawn and the Pillow import aren't per image costs
+        list(pool.map(function, images[:processes]))
+        start = time.perf_counter()
+        list(pool.map(function, images))
+        elapsed = time.perf_counter() - start
+    per_second = len(images) / elapsed
+    return {
+        "processes": processes,
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(per_second, 2),
+        "images_per_second_per_core": round(per_second / processes, 2),
+    }
+
+
+def main(args):
+    images = [
+        synthetic_jpeg(args.width, args.height, seed) for seed in range(args.images)
+    ]
+    counts = sorted({1, *args.processes})
+
+    report = {
+        "benchmark": "thumbnails",
+        "commit": args.commit or current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "images": args.images,
+            "width": args.width,
+            "height": args.height,
+            "sizes": list(THUMBNAIL_SIZES),
+            "cpu_count": os.cpu_count(),
+        },
+        "naive": measure(naive_thumbnails, images, 1),
+        "single_decode": [measure(make_thumbnails, images, n) for n in counts],
+    }
+    for run in report["single_decode"]:
+        print(
+            f"processes={run['processes']} {run['images_per_second']} images/s "
+            f"({run['images_per_second_per_core']}/core)",
+            file=sys.stderr,
+        )
+    print(
+        f"naive, 1 process: {report['naive']['images_per_second']} images/s",
+        file=sys.stderr,
+    )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output)
+    else:
+        print(output)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        nargs="+",
+        default=[n for n in (1, 2, 4, 8, 16) if n <= (os.cpu_count() or 1)],
+    )
+    parser.add_argument("--commit", help="label to store instead of git HEAD")
+    parser.add_argument("--output", help="write the JSON report here")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -9,7 +9,14 @@ from app.schemas.schemas import RegisterUser, FolderCreationBody
 from app.services.user_services import UserServices
 from app.services.auth_services import AuthServices
 from app.services.file_services import FileServices
+from app.services.quota_services import QuotaServices
+from app.services.version_services import VersionServices
+from app.services.change_services import ChangeServices
+from app.services.copy_services import CopyServices
+from app.services.share_services import ShareServices
 from app.services.aws import AwsServices
+from app.services.database import DatabaseRouter
+from app.db.migrate import apply_migrations
 import os
 
 ## Env variable loading
@@ -43,17 +50,27 @@ async def db_pool():
     """Created once per session"""
     pool = await asyncpg.create_pool(testing_database)
     logger.info("Database pool created")
+    async with pool.acquire() as conn:
+        await apply_migrations(conn)
     yield pool
     await pool.close()
     logger.info("Database connection closed")
 
 
+@pytest.fixture(scope="session")
+def db(db_pool):
+    """Router the services get in production, here without replicas"""
+    return DatabaseRouter(db_pool)
+
+
 @pytest_asyncio.fixture(autouse=True)
 async def clean_db(db_pool):
     """Runs before each test"""
     async with db_pool.acquire() as conn:
         await conn.execute(
-            "TRUNCATE users, files, folders, shares, permissions CASCADE"
+            "TRUNCATE users, files, folders, shares, permissions, quota_ledger, blobs, "
+            "file_versions, chunks, changes, jobs, copies, copy_items, activity, "
+            "token_revocations, quota_stripes, user_change_seq CASCADE"
         )
     yield
 
@@ -65,22 +82,52 @@ def aws_services():
 
 
 @pytest.fixture(scope="session")
-def folder_services(db_pool):
+def folder_services(db, aws_services):
     """Created once per session"""
-    return FolderServices(db_pool)
+    return FolderServices(db, aws_services)
 
 
 ## Services modules instances for testing
 @pytest.fixture(scope="session")
-def file_services(db_pool, folder_services, aws_services):
+def file_services(db, folder_services, aws_services, quota_services):
     """Create FileServices instance for testing."""
-    return FileServices(db_pool, folder_services, aws_services)
+    return FileServices(db, folder_services, aws_services, quota_services)
+
+
+@pytest.fixture(scope="session")
+def version_services(db, file_services, aws_services, quota_services):
+    """Created once per session"""
+    return VersionServices(db, file_services, aws_services, quota_services)
+
+
+@pytest.fixture(scope="session")
+def change_services(db):
+    """Created once per session"""
+    return ChangeServices(db)
+
+
+@pytest.fixture(scope="session")
+def copy_services(db, folder_services, aws_services, quota_services):
+    """Created once per session"""
+    return CopyServices(db, folder_services, aws_services, quota_services)
+
+
+@pytest.fixture(scope="session")
+def share_services(db, file_services, folder_services):
+    """Created once per session"""
+    return ShareServices(db, file_services, folder_services)
+
+
+@pytest.fixture(scope="session")
+def quota_services(db):
+    """Created once per session"""
+    return QuotaServices(db)
 
 
 @pytest.fixture(scope="session")
-def user_services(db_pool, auth_services):
+def user_services(db, auth_services):
     """Created once per session"""
-    return UserServices(db_pool, auth_services)
+    return UserServices(db, auth_services)
 
 
 @pytest.fixture(scope="session")
@@ -0,0 +1,98 @@
+from app.schemas.schemas import UploadFileInfo
+from app.services.activity_log import ActivityLog
+from app.services.file_services import FileServices
+from unittest.mock import Mock
+import asyncio
+import os
+import uuid
+
+
+async def test_service_activity_is_flushed_to_the_feed(
+    db,
+    db_pool,
+    folder_services,
+    aws_services,
+    quota_services,
+    user_services,
+    valid_user_data,
+):
+    """Test that uploads, downloads and renames show up newest first once flushed."""
+    activity_log = ActivityLog(db)
+    file_services = FileServices(
+        db, folder_services, aws_services, quota_services, activity_log
+    )
+    aws_services.generate_presigned_upload_url = Mock(return_value={"url": "u"})
+    aws_services.generate_presigned_download_url = Mock(return_value="u")
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await file_services.upload_an_new_file(
+        UploadFileInfo(file_name="notes.txt", file_size_in_bytes=10), user_id
+    )
+    async with db_pool.acquire() as conn:
+        file_id = await conn.fetchval("SELECT id FROM files")
+    await file_services.confirm_file_uploads([file_id], os.getenv("LAMBDA_SECRET"))
+    await file_services.get_user_presigned_download_url(user_id, str(file_id))
+    await file_services.rename_file(user_id, str(file_id), "todo", None)
+
+    assert (await activity_log.feed(user_id))["activity"] == []
+    assert await activity_log.flush() == 3
+
+    first = await activity_log.feed(user_id, limit=2)
+    rest = await activity_log.feed(user_id, first["next_before"], limit=2)
+    events = first["activity"] + rest["activity"]
+    assert [(event["action"], event["detail"]) for event in events] == [
+        ("rename", "todo.txt"),
+        ("download", "notes.txt"),
+        ("upload", "notes.txt"),
+    ]
+    assert {event["object_id"] for event in events} == {str(file_id)}
+    assert rest["next_before"] is None
+
+
+async def test_events_past_the_buffer_limit_are_dropped(db, db_pool):
+    """Test that a full buffer drops new events instead of growing."""
+    activity_log = ActivityLog(db, max_pending=3)
+
+    recorded = [
+        activity_log.record(uuid.uuid4(), "download", "file", uuid.uuid4())
+        for _ in range(5)
+    ]
+
+    assert recorded == [True, True, True, False, False]
+    assert activity_log.dropped == 2
+    assert await activity_log.flush() == 3
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM activity") == 3
+
+
+async def test_failed_flush_keeps_the_events_for_the_next_one(db, db_pool):
+    """Test that events stay buffered while the database can't take them."""
+    activity_log = ActivityLog(db)
+    activity_log.record(uuid.uuid4(), "share", "folder", uuid.uuid4(), "friend")
+    activity_log.db = Mock(acquire=Mock(side_effect=OSError("down")))
+
+    assert await activity_log.flush() == 0
+    assert len(activity_log.pending) == 1
+
+    activity_log.db = db
+    assert await activity_log.flush() == 1
+    assert len(activity_log.pending) == 0
+
+
+async def test_full_batch_is_flushed_before_the_interval(db):
+    """Test that batch_size waiting events are written without waiting for the timer."""
+    activity_log = ActivityLog(db, batch_size=2, flush_interval_ms=60_000)
+    task = asyncio.create_task(activity_log.run())
+    try:
+        for _ in range(2):
+            activity_log.record(uuid.uuid4(), "download", "file", uuid.uuid4())
+        for _ in range(100):
+            if activity_log.written:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert activity_log.written == 2
@@ -0,0 +1,112 @@
+from app.services.admission import AdmissionControl, AdmissionMiddleware
+from app.services.database import DatabaseRouter
+from types import SimpleNamespace
+import asyncio
+import asyncpg
+import os
+import time
+
+
+async def request(app, path):
+    """Status code and Retry-After of one request through the ASGI app."""
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "path": path}, None, send)
+    headers = dict(sent[0]["headers"])
+    return sent[0]["status"], headers.get(b"retry-after")
+
+
+async def respond(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def test_limit_shrinks_while_the_pool_is_slow_and_grows_back():
+    """Test that the limit follows the pool wait between its bounds."""
+    db = SimpleNamespace(acquire_wait_ms=500.0)
+    admission = AdmissionControl(
+        max_in_flight=100, min_in_flight=4, target_wait_ms=50, adjust_interval_ms=0
+    )
+    admission.bind_db(db)
+
+    for _ in range(20):
+        admission.adjust()
+    assert admission.limit == 4
+
+    db.acquire_wait_ms = 10.0
+    admission.adjust()
+    assert admission.limit == 5
+    for _ in range(100):
+        admission.adjust()
+    assert admission.limit == 100
+
+
+async def test_requests_past_the_limit_are_refused_but_exempt_ones_pass():
+    """Test that a full worker answers 503 with Retry-After, except on exempt paths."""
+    admission = AdmissionControl(max_in_flight=1, min_in_flight=1)
+    admission.bind_db(SimpleNamespace(acquire_wait_ms=2500.0))
+    release = asyncio.Event()
+
+    async def app(scope, receive, send):
+        if scope["path"] == "/drive":
+            await release.wait()
+        await respond(scope, receive, send)
+
+    middleware = AdmissionMiddleware(app, admission)
+    held = asyncio.create_task(request(middleware, "/drive"))
+    await asyncio.sleep(0)
+
+    assert await request(middleware, "/file/1") == (503, b"3")
+    assert await request(middleware, "/health") == (200, None)
+    assert await request(middleware, "/upload-results") == (200, None)
+    release.set()
+    assert await held == (200, None)
+    assert admission.in_flight == 0
+    assert (admission.admitted, admission.rejected) == (1, 1)
+
+
+async def test_tail_latency_stays_bounded_under_overload():
+    """
+    Test that offered four times what a two connection pool serves, admitted requests
+    don't queue behind the backlog: it is refused instead.
+    """
+    pool = await asyncpg.create_pool(
+        os.getenv("TESTING_DATABASE"), min_size=2, max_size=2
+    )
+    db = DatabaseRouter(pool)
+    admission = AdmissionControl(
+        max_in_flight=64, min_in_flight=2, target_wait_ms=20, adjust_interval_ms=10
+    )
+    admission.bind_db(db)
+
+    async def app(scope, receive, send):
+        async with db.acquire() as conn:
+            await conn.execute("SELECT pg_sleep(0.02)")
+        await respond(scope, receive, send)
+
+    middleware = AdmissionMiddleware(app, admission)
+
+    async def timed(path):
+        started = time.perf_counter()
+        status, _ = await request(middleware, path)
+        return status, time.perf_counter() - started
+
+    ## About 400 requests a second for a second, the pool serves about 100
+    try:
+        tasks = []
+        for _ in range(400):
+            tasks.append(asyncio.create_task(timed("/drive")))
+            await asyncio.sleep(0.0025)
+        results = await asyncio.gather(*tasks)
+    finally:
+        await pool.close()
+
+    admitted = sorted(elapsed for status, elapsed in results if status == 200)
+    refused = [elapsed for status, elapsed in results if status == 503]
+    assert len(admitted) + len(refused) == 400
+    assert refused and max(refused) < 0.01
+    ## Unshed, the last requests would wait behind ~300 others, about 3 seconds
+    assert admitted[int(len(admitted) * 0.99)] < 1.0
@@ -0,0 +1,230 @@
+from app.services.aws import AwsServices
+from app.services.deadlines import DeadlineExceeded, reset_deadline, set_deadline
+import httpx
+import threading
+import time
+import uuid
+import pytest
+import pytest_asyncio
+
+SLOW_DOWN = (
+    b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>SlowDown</Code>'
+    b"<Message>Please reduce your request rate.</Message></Error>"
+)
+
+
+@pytest.fixture(scope="module")
+def s3_stand_in():
+    """
+    moto's S3 on a local port. Answers the next throttle_next requests with
+    503 SlowDown, takes latency_s per request and keeps the most requests it ever
+    had in flight at once.
+    """
+    from moto.server import create_backend_app
+    from werkzeug.serving import make_server
+
+    s3_app = create_backend_app("s3")
+    state = {
+        "throttle_next": 0,
+        "latency_s": 0,
+        "requests": 0,
+        "in_flight": 0,
+        "max_in_flight": 0,
+    }
+    lock = threading.Lock()
+
+    def app(environ, start_response):
+        with lock:
+            state["requests"] += 1
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            throttled = state["throttle_next"] > 0
+            if throttled:
+                state["throttle_next"] -= 1
+        try:
+            time.sleep(state["latency_s"])
+            if throttled:
+                start_response("503 Slow Down", [("Content-Type", "application/xml")])
+                return [SLOW_DOWN]
+            return s3_app(environ, start_response)
+        finally:
+            with lock:
+                state["in_flight"] -= 1
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", state
+    server.shutdown()
+    thread.join()
+
+
+@pytest_asyncio.fixture
+async def s3(s3_stand_in, monkeypatch):
+    """AwsServices pointed at the stand-in, with a fresh bucket."""
+    endpoint, state = s3_stand_in
+    monkeypatch.setenv("AWS_ENDPOINT_URL_S3", endpoint)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("AWS_SESSION_TOKEN", raising=False)
+    aws_services = AwsServices("us-east-1", f"bucket-{uuid.uuid4()}", max_concurrency=4)
+    aws_services.s3.create_bucket(Bucket=aws_services.bucket_name)
+    state.update(max_in_flight=0, latency_s=0)
+    yield aws_services, state
+    await aws_services.close()
+
+
+def put(aws_services, *keys):
+    for key in keys:
+        aws_services.s3.put_object(Bucket=aws_services.bucket_name, Key=key, Body=b"x")
+
+
+async def test_heads_and_deletes_run_against_the_bucket(s3):
+    """Test that missing objects are found and deleted ones are gone."""
+    aws_services, _ = s3
+    put(aws_services, "files/a", "files/b")
+
+    assert await aws_services.missing_objects(["files/a", "files/b", "files/c"]) == [
+        "files/c"
+    ]
+    await aws_services.delete_objects(["files/a", "files/b"])
+
+    assert await aws_services.missing_objects(["files/a", "files/b"]) == [
+        "files/a",
+        "files/b",
+    ]
+
+
+async def test_throttled_requests_are_retried(s3):
+    """Test that 503 SlowDown answers are retried until S3 accepts the request."""
+    aws_services, state = s3
+    put(aws_services, "files/a")
+    state["throttle_next"] = 2
+    before = state["requests"]
+
+    assert await aws_services.missing_objects(["files/a"]) == []
+
+    assert state["requests"] - before == 3
+
+
+async def test_requests_in_flight_are_capped(s3):
+    """Test that many HEADs share the connection pool at max_concurrency at most."""
+    aws_services, state = s3
+    keys = [f"files/{n}" for n in range(40)]
+    state["latency_s"] = 0.02
+
+    assert await aws_services.missing_objects(keys) == keys
+
+    assert 1 < state["max_in_flight"] <= 4
+
+
+async def test_large_deletes_are_split_into_requests_of_1000_keys(s3):
+    """Test that 2500 keys go out as three DeleteObjects requests."""
+    aws_services, state = s3
+    before = state["requests"]
+
+    await aws_services.delete_objects([f"files/{n}" for n in range(2500)])
+
+    assert state["requests"] - before == 3
+
+
+async def test_presigned_urls_still_reach_the_objects(s3):
+    """Test that presigned uploads and batch-signed GET URLs work against the bucket."""
+    aws_services, _ = s3
+    upload = aws_services.generate_presigned_upload_url("user", 5, "file")
+
+    response = httpx.post(
+        upload["url"], data=upload["fields"], files={"file": b"hello"}
+    )
+    assert response.status_code in (200, 204)
+    (url,) = aws_services.presign_cacheable_get_urls(["files/user/file"])
+
+    assert httpx.get(url).content == b"hello"
+
+
+async def test_urls_signed_with_a_session_token_expire_with_it(s3):
+    """Test that temporary credentials cap the URLs' lifetime at their own expiry."""
+    from botocore.credentials import RefreshableCredentials
+    from datetime import datetime, timedelta, timezone
+    from urllib.parse import parse_qs, urlsplit
+
+    aws_services, _ = s3
+    put(aws_services, "files/a")
+    expiry = datetime.now(timezone.utc) + timedelta(minutes=20)
+    credentials = RefreshableCredentials.create_from_metadata(
+        {
+            "access_key": "testing",
+            "secret_key": "testing",
+            "token": "session-token",
+            "expiry_time": expiry.isoformat(),
+        },
+        refresh_using=None,
+        method="sts-assume-role",
+    )
+    aws_services.object_url_base()
+    aws_services._session.get_credentials = lambda: credentials
+
+    (url,) = aws_services.presign_cacheable_get_urls(["files/a"])
+
+    query = parse_qs(urlsplit(url).query)
+    signed_at = datetime.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ")
+    signed_until = signed_at.replace(tzinfo=timezone.utc) + timedelta(
+        seconds=int(query["X-Amz-Expires"][0])
+    )
+    assert signed_until == expiry.replace(microsecond=0)
+    assert query["X-Amz-Security-Token"] == ["session-token"]
+    assert httpx.get(url).content == b"x"
+
+
+async def test_urls_are_signed_by_botocore_when_the_token_expiry_is_unknown(
+    s3, monkeypatch
+):
+    """Test that a session token from the environment gets URLs of one window."""
+    from urllib.parse import parse_qs, urlsplit
+
+    aws_services, _ = s3
+    put(aws_services, "files/a")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "session-token")
+    aws_services = AwsServices("us-east-1", aws_services.bucket_name)
+
+    (url,) = aws_services.presign_cacheable_get_urls(["files/a"])
+
+    query = parse_qs(urlsplit(url).query)
+    assert 3590 < int(query["Expires"][0]) - time.time() <= 3600
+    assert query["x-amz-security-token"] == ["session-token"]
+    assert httpx.get(url).content == b"x"
+
+
+async def test_large_objects_are_copied_in_parts(s3):
+    """Test that an object above the threshold is copied part by part, byte for byte."""
+    aws_services, state = s3
+    aws_services.multipart_copy_threshold = 5 * 1024 * 1024
+    aws_services.copy_part_size = 5 * 1024 * 1024
+    data = bytes(range(256)) * (48 * 1024)
+    aws_services.s3.put_object(
+        Bucket=aws_services.bucket_name, Key="files/a", Body=data
+    )
+    before = state["requests"]
+
+    await aws_services.copy_object("files/a", "files/b", len(data))
+    await aws_services.copy_object("files/a", "files/small", 0)
+
+    ## Create, three parts and complete, then one CopyObject
+    assert state["requests"] - before == 6
+    copied = aws_services.s3.get_object(Bucket=aws_services.bucket_name, Key="files/b")
+    assert copied["Body"].read() == data
+
+
+async def test_requests_are_cancelled_at_the_request_deadline(s3):
+    """Test that a HEAD still running when the deadline passes is abandoned."""
+    aws_services, state = s3
+    state["latency_s"] = 1
+    token = set_deadline(0.2)
+    started = time.perf_counter()
+    try:
+        with pytest.raises(DeadlineExceeded):
+            await aws_services.missing_objects(["files/slow"])
+    finally:
+        reset_deadline(token)
+
+    assert time.perf_counter() - started < 0.8
@@ -0,0 +1,173 @@
+from fastapi import HTTPException
+from app.schemas.schemas import Share, UploadFileInfo
+from app.services.share_services import ShareServices
+from unittest.mock import Mock
+import asyncio
+import os
+import pytest
+
+
+@pytest.fixture
+def uploads(file_services):
+    file_services.aws_services.generate_presigned_upload_url = Mock(
+        return_value={"url": "u"}
+    )
+
+
+async def test_feed_returns_each_changed_object_once(
+    db_pool,
+    change_services,
+    file_services,
+    folder_services,
+    user_services,
+    valid_user_data,
+    uploads,
+):
+    """Test that creates, uploads and renames come back compacted, with current names."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await folder_services.register_folder("docs", None, user_id)
+    await file_services.upload_an_new_file(
+        UploadFileInfo(file_name="notes.txt", file_size_in_bytes=10), user_id
+    )
+    async with db_pool.acquire() as conn:
+        file_id = str(await conn.fetchval("SELECT id FROM files"))
+    await file_services.confirm_file_uploads([file_id], os.getenv("LAMBDA_SECRET"))
+    await file_services.rename_file(user_id, file_id, "todo", None)
+
+    feed = await change_services.list_changes(user_id)
+
+    assert [(c["object_type"], c["kind"], c["name"]) for c in feed["changes"]] == [
+        ("folder", "created", "docs"),
+        ("file", "renamed", "todo.txt"),
+    ]
+    assert feed["cursor"] == 4 and feed["has_more"] is False
+
+
+async def test_cursor_only_returns_what_changed_since(
+    db_pool,
+    change_services,
+    file_services,
+    folder_services,
+    user_services,
+    valid_user_data,
+    uploads,
+):
+    """Test that syncing after one change reads that change only."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    for n in range(5):
+        await folder_services.register_folder(f"folder{n}", None, user_id)
+    cursor = (await change_services.list_changes(user_id))["cursor"]
+
+    await file_services.upload_an_new_file(
+        UploadFileInfo(file_name="notes.txt", file_size_in_bytes=10), user_id
+    )
+    feed = await change_services.list_changes(user_id, cursor)
+
+    assert [(c["kind"], c["name"]) for c in feed["changes"]] == [
+        ("created", "notes.txt")
+    ]
+    assert (await change_services.list_changes(user_id, feed["cursor"])) == {
+        "changes": [],
+        "cursor": feed["cursor"],
+        "has_more": False,
+    }
+
+
+async def test_batches_page_through_the_log(
+    change_services, folder_services, user_services, valid_user_data
+):
+    """Test that a limited batch says there is more and the next one picks up after it."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    for n in range(5):
+        await folder_services.register_folder(f"folder{n}", None, user_id)
+
+    first = await change_services.list_changes(user_id, limit=3)
+    second = await change_services.list_changes(user_id, first["cursor"], limit=3)
+
+    assert first["has_more"] is True and second["has_more"] is False
+    assert [c["name"] for c in first["changes"] + second["changes"]] == [
+        f"folder{n}" for n in range(5)
+    ]
+
+
+async def test_shares_and_deletes_reach_the_right_feeds(
+    db,
+    db_pool,
+    change_services,
+    file_services,
+    folder_services,
+    user_services,
+    valid_user_data,
+    uploads,
+):
+    """Test that a share is logged for its recipient and a delete for the owner."""
+    share_services = ShareServices(db, file_services, folder_services)
+    owner = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    friend = await user_services.register_new_user(
+        "friend", "friend@test.com", valid_user_data.password
+    )
+    await file_services.upload_an_new_file(
+        UploadFileInfo(file_name="notes.txt", file_size_in_bytes=10), owner
+    )
+    async with db_pool.acquire() as conn:
+        file_id = str(await conn.fetchval("SELECT id FROM files"))
+    await share_services.share_file(
+        owner,
+        Share(share_object_type="file", username="friend", read=True, file_id=file_id),
+    )
+    await file_services.delete_file(owner, file_id)
+
+    shared = (await change_services.list_changes(friend))["changes"]
+    owned = (await change_services.list_changes(owner))["changes"]
+
+    assert [(c["kind"], c["object_id"]) for c in shared] == [("shared", file_id)]
+    assert [(c["kind"], c["name"]) for c in owned] == [("deleted", None)]
+
+
+async def test_rolled_back_changes_are_not_logged(
+    change_services, file_services, user_services, valid_user_data, uploads
+):
+    """Test that a file refused for quota leaves nothing in the log."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+
+    with pytest.raises(HTTPException):
+        await file_services.upload_an_new_file(
+            UploadFileInfo(file_name="huge.txt", file_size_in_bytes=10**12), user_id
+        )
+
+    assert (await change_services.list_changes(user_id))["changes"] == []
+
+
+async def test_open_change_doesnt_hold_up_the_users_other_changes(
+    db_pool, change_services, folder_services, user_services, valid_user_data
+):
+    """Test that ids are taken at commit, in commit order, without waiting on each other."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "INSERT INTO folders (name, owner_id) VALUES ('slow', $1)", user_id
+            )
+            await asyncio.wait_for(
+                folder_services.register_folder("fast", None, user_id), timeout=5
+            )
+
+    feed = await change_services.list_changes(user_id)
+
+    assert [(c["cursor"], c["name"]) for c in feed["changes"]] == [
+        (1, "fast"),
+        (2, "slow"),
+    ]
+    assert feed["has_more"] is False
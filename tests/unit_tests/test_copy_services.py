@@ -0,0 +1,306 @@
+from fastapi import HTTPException
+from app.helpers.image_utils import THUMBNAIL_SIZES, thumbnail_key
+from app.schemas.schemas import CopyRequest, UploadFileInfo
+from app.services.copy_services import COPY_OBJECTS_JOB
+from app.services.file_services import DELETE_OBJECTS_JOB
+from app.services.job_queue import JobQueue
+from unittest.mock import AsyncMock, Mock, call
+import os
+import pytest
+
+
+@pytest.fixture
+def s3_calls(copy_services, monkeypatch):
+    aws_services = copy_services.aws_services
+    monkeypatch.setattr(
+        aws_services, "generate_presigned_upload_url", Mock(return_value={"url": "u"})
+    )
+    monkeypatch.setattr(aws_services, "copy_object", AsyncMock())
+    return aws_services
+
+
+async def stored_file(file_services, db_pool, user_id, name, size, folder_id=None):
+    """An uploaded and confirmed file, returns its id."""
+    await file_services.upload_an_new_file(
+        UploadFileInfo(
+            file_name=name, file_size_in_bytes=size, parent_folder_id=folder_id
+        ),
+        user_id,
+    )
+    async with db_pool.acquire() as conn:
+        file_id = await conn.fetchval("SELECT id FROM files WHERE name = $1", name)
+    await file_services.confirm_file_uploads([file_id], os.getenv("LAMBDA_SECRET"))
+    return file_id
+
+
+async def folder_id_of(db_pool, name):
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("SELECT id FROM folders WHERE name = $1", name)
+
+
+async def available_bytes(db_pool, user_id):
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT SUM(available_bytes) FROM quota_stripes WHERE user_id = $1", user_id
+        )
+
+
+@pytest.fixture
+async def drive(
+    db_pool, user_services, folder_services, file_services, valid_user_data, s3_calls
+):
+    """
+    user/
+      docs/ a.txt (100)
+        old/ b.txt (200, with previews)
+        draft.txt (never uploaded)
+    """
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await folder_services.register_folder("docs", None, user_id)
+    docs = await folder_id_of(db_pool, "docs")
+    await folder_services.register_folder("old", docs, user_id)
+    old = await folder_id_of(db_pool, "old")
+    a = await stored_file(file_services, db_pool, user_id, "a.txt", 100, docs)
+    b = await stored_file(file_services, db_pool, user_id, "b.txt", 200, old)
+    async with db_pool.acquire() as conn:
+        await conn.execute("UPDATE files SET has_thumbnails = TRUE WHERE id = $1", b)
+    await file_services.upload_an_new_file(
+        UploadFileInfo(
+            file_name="draft.txt", file_size_in_bytes=50, parent_folder_id=docs
+        ),
+        user_id,
+    )
+    return {"user_id": user_id, "docs": docs, "old": old, "a": a, "b": b}
+
+
+async def test_folder_subtree_is_copied_and_charged_once(
+    db, db_pool, copy_services, drive, s3_calls
+):
+    """Test that a folder copy duplicates the tree, charges it and copies objects in a job."""
+    user_id = drive["user_id"]
+    before = await available_bytes(db_pool, user_id)
+
+    response = await copy_services.copy(
+        user_id, CopyRequest(copy_object_type="folder", folder_id=drive["docs"])
+    )
+
+    assert response["name"] == "docs(1)"
+    assert response["total_files"] == 2
+    assert await available_bytes(db_pool, user_id) == before - 300
+    async with db_pool.acquire() as conn:
+        copied = await conn.fetch(
+            "SELECT files.id, files.name, files.has_thumbnails, folders.name AS folder "
+            "FROM files JOIN folders ON folders.id = files.parent_folder_id "
+            "WHERE files.id <> ALL($1::uuid[]) ORDER BY files.name",
+            [drive["a"], drive["b"]],
+        )
+        parent = await conn.fetchval(
+            "SELECT parent.name FROM folders JOIN folders parent "
+            "ON parent.id = folders.parent_folder_id "
+            "WHERE folders.name = 'old' AND folders.id <> $1",
+            drive["old"],
+        )
+    assert [
+        (row["name"], row["folder"]) for row in copied if row["name"] != "draft.txt"
+    ] == [
+        ("a.txt", "docs(1)"),
+        ("b.txt", "old"),
+    ]
+    assert parent == "docs(1)"
+    progress = await copy_services.copy_progress(user_id, response["copy_id"])
+    assert (progress["copied_files"], progress["done"]) == (0, False)
+
+    job_queue = JobQueue(db)
+    job_queue.register(COPY_OBJECTS_JOB, copy_services.copy_objects)
+    assert await job_queue.work_once() == 1
+
+    new_a, new_b = [row["id"] for row in copied if row["name"] != "draft.txt"]
+    new_folder = await folder_id_of(db_pool, "docs(1)")
+    async with db_pool.acquire() as conn:
+        new_old = await conn.fetchval(
+            "SELECT id FROM folders WHERE name = 'old' AND id <> $1", drive["old"]
+        )
+        reserved = await conn.fetchval(
+            "SELECT count(*) FROM quota_ledger WHERE state = 'reserved'"
+        )
+        previews = await conn.fetchval(
+            "SELECT has_thumbnails FROM files WHERE id = $1", new_b
+        )
+    copies = s3_calls.copy_object.await_args_list
+    assert (
+        call(
+            f"files/{user_id}/{drive['docs']}/{drive['a']}",
+            f"files/{user_id}/{new_folder}/{new_a}",
+            100,
+        )
+        in copies
+    )
+    assert (
+        call(
+            f"files/{user_id}/{drive['old']}/{drive['b']}",
+            f"files/{user_id}/{new_old}/{new_b}",
+            200,
+        )
+        in copies
+    )
+    assert len(copies) == 2 + len(THUMBNAIL_SIZES)
+    ## Only the never-uploaded draft is left pending
+    assert reserved == 1
+    assert previews is True
+    progress = await copy_services.copy_progress(user_id, response["copy_id"])
+    assert progress["copied_bytes"] == progress["total_bytes"] == 300
+    assert progress["done"] is True
+
+
+async def test_shared_content_is_copied_without_s3(
+    db_pool, copy_services, file_services, user_services, valid_user_data, s3_calls
+):
+    """Test that a file backed by a blob is copied at once by referencing it."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await file_services.upload_an_new_file(
+        UploadFileInfo(
+            file_name="report.pdf", file_size_in_bytes=100, sha256="ab" * 32
+        ),
+        user_id,
+    )
+    async with db_pool.acquire() as conn:
+        blob_id = await conn.fetchval("SELECT id FROM blobs")
+        file_id = await conn.fetchval("SELECT id FROM files")
+    await file_services.confirm_file_uploads([blob_id], os.getenv("LAMBDA_SECRET"))
+
+    response = await copy_services.copy(
+        user_id, CopyRequest(copy_object_type="file", file_id=file_id)
+    )
+
+    assert response["name"] == "report(1).pdf"
+    assert response["done"] is True
+    s3_calls.copy_object.assert_not_awaited()
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT ref_count FROM blobs") == 2
+        assert await conn.fetchval("SELECT count(*) FROM jobs") == 0
+
+
+async def test_copy_that_doesnt_fit_is_refused(db_pool, copy_services, drive):
+    """Test that a copy larger than the available storage copies nothing."""
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE quota_stripes SET available_bytes = CASE stripe WHEN 0 THEN 299 ELSE 0 END"
+        )
+
+    with pytest.raises(HTTPException) as exc:
+        await copy_services.copy(
+            drive["user_id"],
+            CopyRequest(copy_object_type="folder", folder_id=drive["docs"]),
+        )
+
+    assert exc.value.status_code == 403
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM folders") == 2
+        assert await conn.fetchval("SELECT count(*) FROM copies") == 0
+
+
+async def test_folder_cannot_be_copied_into_itself(copy_services, drive):
+    """Test that copying a folder below itself is a 400."""
+    with pytest.raises(HTTPException) as exc:
+        await copy_services.copy(
+            drive["user_id"],
+            CopyRequest(
+                copy_object_type="folder",
+                folder_id=drive["docs"],
+                destination_folder_id=drive["old"],
+            ),
+        )
+
+    assert exc.value.status_code == 400
+
+
+async def test_copy_counts_on_from_a_copy_number_beyond_int(
+    db_pool, copy_services, drive
+):
+    """Test that the copy's name follows a sibling numbered past the integer range."""
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO folders (name, owner_id) VALUES ('docs(99999999999)', $1)",
+            drive["user_id"],
+        )
+
+    response = await copy_services.copy(
+        drive["user_id"],
+        CopyRequest(copy_object_type="folder", folder_id=drive["docs"]),
+    )
+
+    assert response["name"] == "docs(100000000000)"
+
+
+@pytest.fixture
+def s3_objects(s3_calls, monkeypatch):
+    """Deleted keys in order, copying a deleted source fails like S3's NoSuchKey."""
+    deleted = []
+
+    async def copy_object(source_key, destination_key, size_in_bytes):
+        if source_key in deleted:
+            raise OSError(f"NoSuchKey: {source_key}")
+
+    async def delete_objects(keys):
+        deleted.extend(keys)
+
+    monkeypatch.setattr(s3_calls, "copy_object", AsyncMock(side_effect=copy_object))
+    monkeypatch.setattr(s3_calls, "delete_objects", delete_objects)
+    return deleted
+
+
+async def test_source_deleted_before_its_copy_ran_goes_once_copied(
+    db, db_pool, copy_services, file_services, drive, s3_objects
+):
+    """Test that deleting a copy's source keeps its object until the copy job copied it."""
+    user_id = drive["user_id"]
+    source_key = f"files/{user_id}/{drive['docs']}/{drive['a']}"
+    response = await copy_services.copy(
+        user_id, CopyRequest(copy_object_type="file", file_id=drive["a"])
+    )
+    await file_services.delete_file(user_id, str(drive["a"]))
+
+    job_queue = JobQueue(db, batch_size=1)
+    job_queue.register(COPY_OBJECTS_JOB, copy_services.copy_objects)
+    job_queue.register(DELETE_OBJECTS_JOB, file_services.delete_objects)
+    ## Any delete job goes first, like one retried while the copy waits its turn
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE jobs SET run_at = run_at - interval '1 minute' WHERE kind = $1",
+            DELETE_OBJECTS_JOB,
+        )
+    while await job_queue.work_once():
+        pass
+
+    assert s3_objects == [source_key]
+    assert (await copy_services.copy_progress(user_id, response["copy_id"]))["done"]
+    assert (await job_queue.status())["counts"] == []
+
+
+async def test_removing_a_pending_copy_releases_its_deleted_source(
+    db, db_pool, copy_services, file_services, drive, s3_objects
+):
+    """Test that the source's objects go with the last pending copy that read them."""
+    user_id = drive["user_id"]
+    source_key = f"files/{user_id}/{drive['old']}/{drive['b']}"
+    await copy_services.copy(
+        user_id, CopyRequest(copy_object_type="file", file_id=drive["b"])
+    )
+    await file_services.delete_file(user_id, str(drive["b"]))
+    async with db_pool.acquire() as conn:
+        copy_id = await conn.fetchval("SELECT file_id FROM copy_items")
+
+    await file_services.delete_file(user_id, str(copy_id))
+
+    job_queue = JobQueue(db)
+    job_queue.register(DELETE_OBJECTS_JOB, file_services.delete_objects)
+    while await job_queue.work_once():
+        pass
+    assert source_key in s3_objects
+    assert {
+        thumbnail_key(user_id, drive["b"], size) for size in THUMBNAIL_SIZES
+    } <= set(s3_objects)
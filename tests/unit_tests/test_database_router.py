@@ -0,0 +1,128 @@
+from app.services.database import DatabaseRouter, WriteTokens, parse_lsn
+from app.services.folder_services import FolderServices
+import asyncio
+import asyncpg
+import pytest
+import pytest_asyncio
+import os
+
+testing_replica_database = os.getenv("TESTING_REPLICA_DATABASE")
+
+requires_replica = pytest.mark.skipif(
+    not testing_replica_database,
+    reason="TESTING_REPLICA_DATABASE not set (streaming standby of TESTING_DATABASE)",
+)
+
+
+@pytest_asyncio.fixture
+async def replica_pool():
+    pool = await asyncpg.create_pool(testing_replica_database, min_size=1, max_size=2)
+    yield pool
+    await pool.execute("SELECT pg_wal_replay_resume()")
+    await pool.close()
+
+
+async def wait_until_replica_caught_up(router, user_id, timeout_s=10):
+    for _ in range(int(timeout_s / 0.05)):
+        await router.check_replication()
+        if router.pick_replica(user_id):
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError("Replica never caught up")
+
+
+def test_parse_lsn():
+    assert parse_lsn("0/3000060") == 0x3000060
+    assert parse_lsn("16/B374D848") == (0x16 << 32) + 0xB374D848
+
+
+def test_write_tokens_are_shared_between_attached_tables():
+    shm = WriteTokens.create_shared(slots=1024)
+    try:
+        first = WriteTokens(shm_name=shm.name)
+        second = WriteTokens(shm_name=shm.name)
+
+        first.record("some-user", at=123.0)
+
+        assert second.last_write("some-user") == 123.0
+        assert second.last_write("someone-else") == 0.0
+        first.close()
+        second.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+async def test_reads_go_to_primary_until_a_replica_is_known_caught_up(db_pool):
+    # The primary standing in for a replica always counts as caught up once checked
+    router = DatabaseRouter(db_pool, [db_pool])
+    assert router.pick_replica("user") is None
+
+    await router.check_replication()
+
+    assert router.pick_replica("user") is router.replicas[0]
+
+
+async def test_own_writes_are_read_from_primary_until_replicated(db_pool):
+    router = DatabaseRouter(db_pool, [db_pool])
+    await router.check_replication()
+
+    async with router.acquire_write("writer"):
+        pass
+
+    assert router.pick_replica("writer") is None
+    assert router.pick_replica("bystander") is router.replicas[0]
+
+    await router.check_replication()
+    assert router.pick_replica("writer") is router.replicas[0]
+
+
+async def test_lagging_replica_is_skipped_for_everyone(db_pool):
+    router = DatabaseRouter(db_pool, [db_pool], max_replica_lag_s=0.05)
+    await router.check_replication()
+
+    await asyncio.sleep(0.1)
+
+    assert router.pick_replica("bystander") is None
+    async with router.acquire_read("bystander"):
+        pass
+    assert router.routed_reads == {"replica": 0, "primary": 1}
+
+
+@requires_replica
+async def test_folder_listing_reads_its_own_write_through_a_real_replica(
+    db_pool, replica_pool, user_services, valid_user_data
+):
+    router = DatabaseRouter(db_pool, [replica_pool])
+    folder_services = FolderServices(router)
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await wait_until_replica_caught_up(router, user_id)
+
+    await folder_services.register_folder("fresh", None, user_id)
+    content = await folder_services.retrieve_folder_content(user_id, "name", "ASC")
+
+    assert [f["name"] for f in content["files_and_folders"]] == ["fresh"]
+    assert router.routed_reads["primary"] == 1
+
+    await wait_until_replica_caught_up(router, user_id)
+    content = await folder_services.retrieve_folder_content(user_id, "name", "ASC")
+
+    assert [f["name"] for f in content["files_and_folders"]] == ["fresh"]
+    assert router.routed_reads["replica"] == 1
+
+
+@requires_replica
+async def test_paused_replica_falls_back_to_primary(db_pool, replica_pool):
+    router = DatabaseRouter(db_pool, [replica_pool], max_replica_lag_s=0.3)
+    await wait_until_replica_caught_up(router, "bystander")
+
+    await replica_pool.execute("SELECT pg_wal_replay_pause()")
+    async with db_pool.acquire() as conn:
+        await conn.execute("SELECT txid_current()")  # new WAL the replica won't replay
+    await asyncio.sleep(0.4)
+    await router.check_replication()
+
+    assert router.pick_replica("bystander") is None
+    assert router.replication_status()["replicas"][0]["lag_s"] > 0.3
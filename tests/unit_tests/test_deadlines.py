@@ -0,0 +1,101 @@
+from app.services.database import DatabaseRouter
+from app.services.deadlines import (
+    DeadlineExceeded,
+    DeadlineMiddleware,
+    remaining_s,
+    reset_deadline,
+    set_deadline,
+)
+from app.services.query_tracer import TracedConnection
+import asyncio
+import asyncpg
+import os
+import pytest
+import pytest_asyncio
+import time
+
+
+@pytest_asyncio.fixture
+async def traced_pool():
+    """One connection, as the API's pools make them."""
+    pool = await asyncpg.create_pool(
+        os.getenv("TESTING_DATABASE"),
+        min_size=1,
+        max_size=1,
+        connection_class=TracedConnection,
+    )
+    yield pool
+    await pool.close()
+
+
+async def request(app, method, path):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": method, "path": path}, None, send)
+    return sent[0]["status"]
+
+
+async def test_statement_is_cancelled_and_its_connection_reused(traced_pool):
+    """Test that a statement running past the deadline is cancelled server side."""
+    db = DatabaseRouter(traced_pool)
+    token = set_deadline(0.2)
+    started = time.perf_counter()
+    try:
+        with pytest.raises(DeadlineExceeded):
+            async with db.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("SELECT pg_sleep(5)")
+    finally:
+        reset_deadline(token)
+
+    assert time.perf_counter() - started < 1
+    async with db.acquire() as conn:
+        assert not await conn.fetchval(
+            "SELECT count(*) FROM pg_stat_activity WHERE query = 'SELECT pg_sleep(5)' "
+            "AND state = 'active'"
+        )
+        assert not conn.is_in_transaction()
+
+
+async def test_waiting_for_a_connection_stops_at_the_deadline(traced_pool):
+    """Test that a request doesn't queue on a busy pool past its deadline."""
+    db = DatabaseRouter(traced_pool)
+    async with db.acquire():
+        token = set_deadline(0.1)
+        try:
+            with pytest.raises(DeadlineExceeded):
+                async with db.acquire():
+                    pass
+        finally:
+            reset_deadline(token)
+    assert db.acquire_wait_ms > 0
+
+
+async def test_middleware_answers_504_once_the_budget_is_spent():
+    """Test that the route's budget applies and a slow request ends in 504."""
+    budgets = {}
+
+    async def app(scope, receive, send):
+        budgets[scope["path"]] = remaining_s()
+        if scope["path"] == "/slow":
+            await asyncio.sleep(5)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = DeadlineMiddleware(app, default_ms=100)
+    started = time.perf_counter()
+
+    assert await request(middleware, "GET", "/slow") == 504
+    assert time.perf_counter() - started < 1
+    assert await request(middleware, "GET", "/drive") == 200
+    assert await request(middleware, "GET", "/events") == 200
+    assert await request(middleware, "POST", "/copy") == 200
+
+    assert 0 < budgets["/drive"] <= 0.1
+    assert budgets["/events"] is None
+    assert 0.1 < budgets["/copy"] <= 30
+    assert middleware.timed_out == 1
+    assert remaining_s() is None
@@ -1,6 +1,10 @@
 from fastapi import HTTPException
 from app.schemas.schemas import UploadFileInfo, RegisterUser
+from app.services.file_services import DELETE_OBJECTS_JOB
 from unittest.mock import patch, Mock
+import asyncio
+import json
+import os
 import pytest
 
 
@@ -423,3 +427,322 @@ async def test_rename_file_fails_when_ext_is_included_available_400(
 
     ## reason for png extension is that extension is inherited from previous name
     assert exc_info.value.status_code == 400
+
+
+async def test_keep_both_skips_past_many_existing_copies(
+    db_pool,
+    file_services,
+    user_services,
+    valid_user_data,
+    mock_s3_response,
+    valid_folder_data_no_parent,
+):
+    """Test that keep-both picks the next suffix even with 50 existing copies."""
+    file_services.aws_services.generate_presigned_upload_url = Mock(
+        return_value=mock_s3_response
+    )
+
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await file_services.folder_services.register_folder(
+        valid_folder_data_no_parent.folder_name, None, user_id
+    )
+
+    async with db_pool.acquire() as conn:
+        folder_id = await conn.fetchval(
+            "SELECT id FROM folders WHERE owner_id = $1", user_id
+        )
+        await conn.executemany(
+            "INSERT INTO files (name, size_in_bytes, type, owner_id, parent_folder_id) "
+            "VALUES ($1, 10, 'png', $2, $3)",
+            [("photo.png", user_id, folder_id)]
+            + [(f"photo({n}).png", user_id, folder_id) for n in range(1, 51)],
+        )
+
+    replica = UploadFileInfo(
+        file_name="photo(7).png", file_size_in_bytes=230, parent_folder_id=folder_id
+    )
+    await file_services.keep_both_files(replica, user_id)
+
+    async with db_pool.acquire() as conn:
+        newest = await conn.fetchval(
+            "SELECT name FROM files WHERE owner_id = $1 ORDER BY created_at DESC, name DESC LIMIT 1",
+            user_id,
+        )
+        total = await conn.fetchval(
+            "SELECT COUNT(*) FROM files WHERE owner_id = $1", user_id
+        )
+
+    assert total == 52
+    assert newest == "photo(51).png"
+
+
+async def test_keep_both_past_a_copy_number_beyond_int(
+    db_pool, file_services, user_services, valid_user_data, mock_s3_response
+):
+    """Test that keep-both counts on from copy numbers too large for an integer."""
+    file_services.aws_services.generate_presigned_upload_url = Mock(
+        return_value=mock_s3_response
+    )
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    async with db_pool.acquire() as conn:
+        await conn.executemany(
+            "INSERT INTO files (name, size_in_bytes, type, owner_id) "
+            "VALUES ($1, 10, 'png', $2)",
+            [("photo.png", user_id), ("photo(99999999999).png", user_id)],
+        )
+
+    await file_services.keep_both_files(
+        UploadFileInfo(file_name="photo.png", file_size_in_bytes=230), user_id
+    )
+
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM files WHERE name = 'photo(100000000000).png')"
+        )
+
+
+async def test_keep_both_losing_its_name_to_a_plain_upload_is_a_conflict(
+    db_pool,
+    file_services,
+    user_services,
+    valid_user_data,
+    mock_s3_response,
+    monkeypatch,
+):
+    """Test that a copy name taken meanwhile by an upload without the lock is a 409."""
+    monkeypatch.setattr(
+        file_services.aws_services,
+        "generate_presigned_upload_url",
+        Mock(return_value=mock_s3_response),
+    )
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO files (name, size_in_bytes, type, owner_id) "
+            "VALUES ('photo.png', 10, 'png', $1)",
+            user_id,
+        )
+
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "INSERT INTO files (name, size_in_bytes, type, owner_id) "
+                "VALUES ('photo(1).png', 10, 'png', $1)",
+                user_id,
+            )
+            keep_both = asyncio.create_task(
+                file_services.keep_both_files(
+                    UploadFileInfo(file_name="photo.png", file_size_in_bytes=230),
+                    user_id,
+                )
+            )
+            await asyncio.sleep(0.5)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await keep_both
+    assert exc_info.value.status_code == 409
+
+
+async def test_concurrent_keep_both_never_collide(
+    db_pool,
+    file_services,
+    user_services,
+    valid_user_data,
+    valid_file_upload,
+    mock_s3_response,
+):
+    """Test that concurrent keep-both uploads at root each get a distinct name."""
+    file_services.aws_services.generate_presigned_upload_url = Mock(
+        return_value=mock_s3_response
+    )
+
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await file_services.upload_an_new_file(valid_file_upload, user_id)
+
+    await asyncio.gather(
+        *(file_services.keep_both_files(valid_file_upload, user_id) for _ in range(8))
+    )
+
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch("SELECT name FROM files WHERE owner_id = $1", user_id)
+
+    names = {row["name"] for row in rows}
+    assert len(rows) == 9
+    assert names == {"photo.png"} | {f"photo({n}).png" for n in range(1, 9)}
+
+
+@pytest.fixture
+def hashed_upload():
+    """Upload request carrying the SHA-256 of its content."""
+    return UploadFileInfo(
+        file_name="report.pdf", file_size_in_bytes=100, sha256="ab" * 32
+    )
+
+
+@pytest.fixture
+def s3_calls(file_services, mock_s3_response):
+    aws_services = file_services.aws_services
+    aws_services.generate_presigned_upload_url = Mock(return_value=mock_s3_response)
+    aws_services.generate_presigned_download_url = Mock(return_value="url")
+    return aws_services
+
+
+async def queued_deletions(db_pool) -> list:
+    """Keys of the S3 objects queued for deletion."""
+    async with db_pool.acquire() as conn:
+        payloads = await conn.fetch(
+            "SELECT payload FROM jobs WHERE kind = $1 ORDER BY id", DELETE_OBJECTS_JOB
+        )
+    return [key for row in payloads for key in json.loads(row["payload"])["keys"]]
+
+
+async def stored_blob(file_services, db_pool, user_id, upload):
+    """Uploads the content once and confirms it, returns the blob id."""
+    await file_services.upload_an_new_file(upload, user_id)
+    async with db_pool.acquire() as conn:
+        blob_id = await conn.fetchval("SELECT id FROM blobs")
+    await file_services.confirm_file_uploads([blob_id], os.getenv("LAMBDA_SECRET"))
+    return blob_id
+
+
+async def test_known_content_is_linked_instead_of_uploaded(
+    db_pool, file_services, user_services, valid_user_data, hashed_upload, s3_calls
+):
+    """Test that a second upload of the same content needs no upload and shares the object."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    blob_id = await stored_blob(file_services, db_pool, user_id, hashed_upload)
+    assert s3_calls.generate_presigned_upload_url.call_args.kwargs == {
+        "blob_id": str(blob_id),
+        "sha256": hashed_upload.sha256,
+    }
+
+    response = await file_services.keep_both_files(hashed_upload, user_id)
+
+    assert response["instant_upload"] is True
+    assert s3_calls.generate_presigned_upload_url.call_count == 1
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT ref_count FROM blobs") == 2
+        assert (
+            await conn.fetchval(
+                "SELECT count(*) FROM quota_ledger WHERE state = 'reserved'"
+            )
+            == 0
+        )
+    await file_services.get_user_presigned_download_url(user_id, response["file_id"])
+    assert s3_calls.generate_presigned_download_url.call_args.kwargs == {
+        "blob_id": blob_id
+    }
+
+
+async def test_content_still_uploading_is_not_linked(
+    db_pool, file_services, user_services, valid_user_data, hashed_upload, s3_calls
+):
+    """Test that a file never links to content that hasn't arrived yet."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await file_services.upload_an_new_file(hashed_upload, user_id)
+
+    response = await file_services.keep_both_files(hashed_upload, user_id)
+
+    assert "instant_upload" not in response
+    assert s3_calls.generate_presigned_upload_url.call_args.kwargs == {}
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT ref_count FROM blobs") == 1
+
+
+async def test_object_is_deleted_with_its_last_reference(
+    db_pool, file_services, user_services, valid_user_data, hashed_upload, s3_calls
+):
+    """Test that deleting files drops references and only the last one removes the object."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    blob_id = await stored_blob(file_services, db_pool, user_id, hashed_upload)
+    copy = await file_services.keep_both_files(hashed_upload, user_id)
+    async with db_pool.acquire() as conn:
+        original = await conn.fetchval("SELECT id FROM files WHERE name = 'report.pdf'")
+
+    await file_services.delete_file(user_id, str(original))
+    assert await queued_deletions(db_pool) == []
+
+    await file_services.delete_file(user_id, copy["file_id"])
+    assert await queued_deletions(db_pool) == [f"files/{user_id}/blobs/{blob_id}"]
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM blobs") == 0
+        assert (
+            await conn.fetchval(
+                "SELECT (SELECT SUM(available_bytes) FROM quota_stripes) = total_storage_in_bytes FROM users"
+            )
+            is True
+        )
+
+
+async def test_replacing_shared_content_keeps_it_as_a_version(
+    db_pool, file_services, user_services, valid_user_data, hashed_upload, s3_calls
+):
+    """Test that a replacement goes to a new blob and the shared one stays version 1."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    blob_id = await stored_blob(file_services, db_pool, user_id, hashed_upload)
+    copy = await file_services.keep_both_files(hashed_upload, user_id)
+
+    replacement = UploadFileInfo(
+        file_name="report(1).pdf", file_size_in_bytes=50, file_conflict="Replace"
+    )
+    await file_services.replace_existing_file(replacement, user_id)
+    new_blob_id = s3_calls.generate_presigned_upload_url.call_args.kwargs["blob_id"]
+    assert new_blob_id != str(blob_id)
+
+    await file_services.confirm_file_uploads([new_blob_id], os.getenv("LAMBDA_SECRET"))
+
+    async with db_pool.acquire() as conn:
+        current = await conn.fetchrow(
+            "SELECT blob_id, size_in_bytes FROM files WHERE id = $1", copy["file_id"]
+        )
+        versions = await conn.fetch(
+            "SELECT number, blob_id FROM file_versions ORDER BY number"
+        )
+        assert str(current["blob_id"]) == new_blob_id
+        assert current["size_in_bytes"] == 50
+        assert [(row["number"], row["blob_id"]) for row in versions] == [
+            (1, blob_id),
+            (2, current["blob_id"]),
+        ]
+        assert (
+            await conn.fetchval("SELECT ref_count FROM blobs WHERE id = $1", blob_id)
+            == 2
+        )
+    assert await queued_deletions(db_pool) == []
+
+
+async def test_deleting_someone_elses_file_is_404(
+    db_pool, file_services, user_services, valid_user_data, valid_file_upload, s3_calls
+):
+    """Test that only the owner can delete a file."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    other_id = await user_services.register_new_user(
+        "intruder", "intruder@test.com", valid_user_data.password
+    )
+    await file_services.upload_an_new_file(valid_file_upload, user_id)
+    async with db_pool.acquire() as conn:
+        file_id = await conn.fetchval("SELECT id FROM files")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await file_services.delete_file(other_id, str(file_id))
+
+    assert exc_info.value.status_code == 404
+    assert await queued_deletions(db_pool) == []
@@ -1,6 +1,12 @@
 from app.schemas.schemas import RegisterUser
+from app.services.folder_services import FolderServices
+from app.services.database import DatabaseRouter
+from app.services.aws import AwsServices
 from fastapi import HTTPException
+import asyncio
+import asyncpg
 import pytest
+import os
 
 
 async def test_register_folder_at_root_succeeds(
@@ -219,6 +225,34 @@ async def test_retrieve_content_from_folder_works(
     assert data["files_and_folders"][0]["name"] == folder_name
 
 
+async def test_retrieve_folder_content_fits_in_a_single_connection_pool(
+    user_services, valid_user_data, folder_services, valid_folder_data_no_parent
+):
+    """Per-worker pools can be tiny, listing a folder must never hold two connections at once."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await folder_services.register_folder(
+        valid_folder_data_no_parent.folder_name, None, user_id
+    )
+    root = await folder_services.retrieve_folder_content(user_id, "name", "ASC")
+    folder_id = root["files_and_folders"][0]["id"]
+
+    pool = await asyncpg.create_pool(
+        os.getenv("TESTING_DATABASE"), min_size=1, max_size=1
+    )
+    try:
+        data = await asyncio.wait_for(
+            FolderServices(DatabaseRouter(pool)).retrieve_folder_content(
+                user_id, "name", "ASC", location=folder_id
+            ),
+            timeout=5,
+        )
+    finally:
+        await pool.close()
+    assert data["files_and_folders"] == []
+
+
 async def test_rename_folder_at_root_succeeds(
     folder_services,
     valid_user_data,
@@ -375,3 +409,40 @@ async def test_verify_folder_ownership_returns_false_for_wrong_user(
     )
 
     assert result == False
+
+
+async def test_listing_embeds_one_batch_of_thumbnail_urls(
+    db, valid_user_data, user_services, db_pool, monkeypatch
+):
+    """Previewed files get a signed URL, identical across listings in the same window."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "AKIDEXAMPLE")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "secret")
+    folder_services = FolderServices(db, AwsServices("eu-west-2", "bucket"))
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO files (name, size_in_bytes, type, owner_id, has_thumbnails) "
+            "VALUES ('a.png', 1, 'png', $1, TRUE), ('b.pdf', 1, 'pdf', $1, FALSE)",
+            user_id,
+        )
+    await folder_services.register_folder("Photos", None, user_id)
+
+    listings = [
+        await folder_services.retrieve_folder_content(
+            user_id, "name", "ASC", thumbnail_size=256
+        )
+        for _ in range(2)
+    ]
+
+    items = listings[0]["files_and_folders"]
+    assert [item["name"] for item in items] == ["Photos", "a.png", "b.pdf"]
+    assert (
+        f"/thumbnails/{user_id}/{items[1]['id']}/256.webp?" in items[1]["thumbnail_url"]
+    )
+    assert items[0]["thumbnail_url"] is None and items[2]["thumbnail_url"] is None
+    assert listings[1]["files_and_folders"] == items
+
+    plain = await folder_services.retrieve_folder_content(user_id, "name", "ASC")
+    assert all("thumbnail_url" not in item for item in plain["files_and_folders"])
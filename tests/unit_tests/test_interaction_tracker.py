@@ -0,0 +1,99 @@
+from app.schemas.schemas import UploadFileInfo
+from app.services.file_services import FileServices
+from app.services.folder_services import FolderServices
+from app.services.interaction_tracker import InteractionTracker
+from unittest.mock import Mock
+import os
+import uuid
+
+
+async def test_downloads_and_opens_reorder_the_listing_once_flushed(
+    db, db_pool, aws_services, quota_services, user_services, valid_user_data
+):
+    """Test that touches are coalesced per item and move the last_interaction sort."""
+    tracker = InteractionTracker(db)
+    folder_services = FolderServices(db, aws_services, interaction_tracker=tracker)
+    file_services = FileServices(
+        db, folder_services, aws_services, quota_services, interaction_tracker=tracker
+    )
+    aws_services.generate_presigned_upload_url = Mock(return_value={"url": "u"})
+    aws_services.generate_presigned_download_url = Mock(return_value="u")
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await folder_services.register_folder("archive", None, user_id)
+    for name in ("a.txt", "b.txt"):
+        await file_services.upload_an_new_file(
+            UploadFileInfo(file_name=name, file_size_in_bytes=10), user_id
+        )
+    async with db_pool.acquire() as conn:
+        ids = dict(await conn.fetch("SELECT name, id FROM files"))
+        archive = await conn.fetchval("SELECT id FROM folders")
+        await conn.execute(
+            "UPDATE files SET last_interaction = NOW() - interval '1 day'"
+        )
+        await conn.execute(
+            "UPDATE folders SET last_interaction = NOW() - interval '2 days'"
+        )
+    await file_services.confirm_file_uploads(
+        list(ids.values()), os.getenv("LAMBDA_SECRET")
+    )
+
+    async def listing():
+        content = await folder_services.retrieve_folder_content(
+            user_id, "last_interaction", "DESC"
+        )
+        return [item["name"] for item in content["files_and_folders"]]
+
+    assert (await listing())[-1] == "archive"
+    for _ in range(3):
+        await file_services.get_user_presigned_download_url(user_id, str(ids["a.txt"]))
+    await folder_services.retrieve_folder_content(
+        user_id, "name", "ASC", location=str(archive)
+    )
+    assert len(tracker.pending["file"]) == len(tracker.pending["folder"]) == 1
+    assert (await listing())[-1] == "archive"
+
+    assert await tracker.flush() == 2
+
+    assert await listing() == ["archive", "a.txt", "b.txt"]
+    assert tracker.pending == {"file": {}, "folder": {}}
+
+
+async def test_touches_never_move_last_interaction_back(
+    db, db_pool, folder_services, user_services, valid_user_data
+):
+    """Test that a touch older than the stored value updates nothing."""
+    tracker = InteractionTracker(db)
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await folder_services.register_folder("docs", None, user_id)
+    async with db_pool.acquire() as conn:
+        folder_id = await conn.fetchval("SELECT id FROM folders")
+    tracker.touch("folder", folder_id)
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE folders SET last_interaction = NOW() + interval '1 hour'"
+        )
+
+    assert await tracker.flush() == 0
+    assert tracker.written == 0
+
+
+async def test_failed_flush_keeps_touches_and_full_tracker_drops(db, monkeypatch):
+    """Test that touches survive a failed flush and new items past the limit are dropped."""
+    tracker = InteractionTracker(db, max_items=2)
+    first, second = uuid.uuid4(), uuid.uuid4()
+
+    assert tracker.touch("file", first)
+    assert tracker.touch("file", second)
+    assert not tracker.touch("file", uuid.uuid4())
+    assert tracker.touch("file", first)
+    assert tracker.dropped == 1
+
+    monkeypatch.setattr(
+        db, "acquire", Mock(side_effect=ConnectionError("database unavailable"))
+    )
+    assert await tracker.flush() == 0
+    assert set(tracker.pending["file"]) == {str(first), str(second)}
@@ -0,0 +1,195 @@
+from app.schemas.schemas import UploadFileInfo
+from app.services.file_services import DELETE_OBJECTS_JOB
+from app.services.job_queue import JobQueue
+from unittest.mock import AsyncMock, Mock
+import asyncio
+import pytest
+
+
+class Rollback(Exception):
+    pass
+
+
+async def test_jobs_only_exist_if_their_transaction_commits(db, db_pool):
+    """Test that a job enqueued in a rolled back transaction never runs."""
+    job_queue = JobQueue(db)
+    handler = AsyncMock()
+    job_queue.register("noop", handler)
+
+    with pytest.raises(Rollback):
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                await JobQueue.enqueue(conn, "noop", {"n": 1})
+                raise Rollback()
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            await JobQueue.enqueue(conn, "noop", {"n": 2})
+
+    assert await job_queue.work_once() == 1
+    handler.assert_awaited_once_with({"n": 2})
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM jobs") == 0
+
+
+async def test_failing_jobs_back_off_then_go_to_the_dead_letter_queue(db, db_pool):
+    """Test that a failure is retried after a delay and dead-lettered after max_attempts."""
+    job_queue = JobQueue(db, backoff_base_s=0)
+    handler = AsyncMock(side_effect=OSError("S3 is down"))
+    job_queue.register("flaky", handler)
+    async with db_pool.acquire() as conn:
+        job_id = await JobQueue.enqueue(conn, "flaky", {}, max_attempts=3)
+
+    for _ in range(5):
+        await job_queue.work_once()
+
+    assert handler.await_count == 3
+    status = await job_queue.status()
+    assert [(job["id"], job["attempts"]) for job in status["dead"]] == [(job_id, 3)]
+    assert status["dead"][0]["last_error"] == "OSError: S3 is down"
+
+    handler.side_effect = None
+    assert await job_queue.retry_dead(job_id) is True
+    assert await job_queue.work_once() == 1
+    assert (await job_queue.status())["counts"] == []
+
+
+async def test_backoff_grows_exponentially_up_to_its_cap(db):
+    """Test that each attempt waits about twice as long as the previous one."""
+    job_queue = JobQueue(db, backoff_base_s=2, backoff_max_s=60)
+
+    delays = [job_queue.backoff_s(attempts) for attempts in range(1, 8)]
+
+    for attempts, delay in enumerate(delays, start=1):
+        ceiling = min(2 * 2 ** (attempts - 1), 60)
+        assert ceiling / 2 <= delay <= ceiling
+
+
+async def test_concurrent_workers_run_each_job_once(db, db_pool):
+    """Test that workers claiming side by side never run the same job twice."""
+    job_queue = JobQueue(db, concurrency=8, batch_size=5, poll_interval_s=0.01)
+    ran = []
+
+    async def handler(payload):
+        await asyncio.sleep(0)
+        ran.append(payload["n"])
+
+    job_queue.register("count", handler)
+    async with db_pool.acquire() as conn:
+        for n in range(200):
+            await JobQueue.enqueue(conn, "count", {"n": n})
+
+    task = asyncio.create_task(job_queue.run())
+    try:
+        for _ in range(500):
+            if len(ran) >= 200:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert sorted(ran) == list(range(200))
+
+
+async def test_jobs_of_a_dead_worker_are_requeued(db, db_pool):
+    """Test that a job whose lease ran out is claimed again."""
+    job_queue = JobQueue(db, lease_s=0)
+    async with db_pool.acquire() as conn:
+        await JobQueue.enqueue(conn, "noop", {})
+    assert len(await job_queue.claim()) == 1
+
+    assert await job_queue.requeue_expired() == 1
+    job_queue.register("noop", AsyncMock())
+    assert await job_queue.work_once() == 1
+
+
+async def test_jobs_of_a_batch_run_side_by_side(db, db_pool):
+    """Test that a claimed batch runs concurrently, not one job after another."""
+    job_queue = JobQueue(db, batch_size=3)
+    started = []
+    all_started = asyncio.Event()
+
+    async def handler(payload):
+        started.append(payload["n"])
+        if len(started) == 3:
+            all_started.set()
+        await all_started.wait()
+
+    job_queue.register("wait", handler)
+    async with db_pool.acquire() as conn:
+        for n in range(3):
+            await JobQueue.enqueue(conn, "wait", {"n": n})
+
+    assert await asyncio.wait_for(job_queue.work_once(), timeout=5) == 3
+    assert (await job_queue.status())["counts"] == []
+
+
+async def test_lease_is_extended_while_a_job_runs(db, db_pool):
+    """Test that a handler running past the lease isn't taken for a dead worker's."""
+    job_queue = JobQueue(db, lease_s=0.3)
+    release = asyncio.Event()
+
+    async def handler(payload):
+        await release.wait()
+
+    job_queue.register("slow", handler)
+    async with db_pool.acquire() as conn:
+        await JobQueue.enqueue(conn, "slow", {})
+
+    task = asyncio.create_task(job_queue.work_once())
+    await asyncio.sleep(1)
+    assert await job_queue.requeue_expired() == 0
+    release.set()
+
+    assert await task == 1
+    assert (await job_queue.status())["counts"] == []
+
+
+async def test_result_of_an_expired_attempt_is_ignored(db, db_pool):
+    """Test that a job claimed again after its lease ran out is only finished by its new attempt."""
+    job_queue = JobQueue(db, lease_s=0)
+    async with db_pool.acquire() as conn:
+        await JobQueue.enqueue(conn, "noop", {})
+    [first] = await job_queue.claim()
+    assert await job_queue.requeue_expired() == 1
+    job_queue.lease_s = 300
+    [second] = await job_queue.claim()
+
+    await job_queue.finish([first], [])
+    await job_queue.finish([], [(first, "late failure")])
+
+    async with db_pool.acquire() as conn:
+        job = await conn.fetchrow("SELECT state, attempts, last_error FROM jobs")
+    assert dict(job) == {
+        "state": "running",
+        "attempts": 2,
+        "last_error": "Lease expired",
+    }
+
+    await job_queue.finish([second], [])
+    assert (await job_queue.status())["counts"] == []
+
+
+async def test_deleted_files_objects_are_removed_by_a_job(
+    db, db_pool, file_services, user_services, valid_user_data
+):
+    """Test that deleting a file queues its objects and the job deletes them from S3."""
+    aws_services = file_services.aws_services
+    aws_services.generate_presigned_upload_url = Mock(return_value={"url": "u"})
+    aws_services.delete_objects = AsyncMock()
+    job_queue = JobQueue(db)
+    job_queue.register(DELETE_OBJECTS_JOB, file_services.delete_objects)
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    await file_services.upload_an_new_file(
+        UploadFileInfo(file_name="notes.txt", file_size_in_bytes=10), user_id
+    )
+    async with db_pool.acquire() as conn:
+        file_id = await conn.fetchval("SELECT id FROM files")
+
+    await file_services.delete_file(user_id, str(file_id))
+    aws_services.delete_objects.assert_not_awaited()
+    assert await job_queue.work_once() == 1
+
+    aws_services.delete_objects.assert_awaited_once_with([f"files/{user_id}/{file_id}"])
@@ -0,0 +1,36 @@
+from app.db.migrate import apply_migrations, discover_migrations
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_migrations_are_applied_once(db_pool):
+    """The session already migrated the test database, a second run is a no-op."""
+    async with db_pool.acquire() as conn:
+        assert await apply_migrations(conn) == []
+        versions = await conn.fetch("SELECT version FROM schema_migrations")
+
+    assert {row["version"] for row in versions} == {
+        m.version for m in discover_migrations()
+    }
+
+
+@pytest.mark.asyncio
+async def test_pending_migration_is_applied_and_recorded(db_pool, tmp_path):
+    (tmp_path / "9001_scratch.sql").write_text(
+        "CREATE TABLE migration_scratch (id INT)"
+    )
+    async with db_pool.acquire() as conn:
+        try:
+            assert await apply_migrations(conn, tmp_path) == ["9001_scratch"]
+            assert await apply_migrations(conn, tmp_path) == []
+            assert await conn.fetchval("SELECT to_regclass('migration_scratch')")
+        finally:
+            await conn.execute("DROP TABLE IF EXISTS migration_scratch")
+            await conn.execute("DELETE FROM schema_migrations WHERE version = '9001'")
+
+
+def test_duplicate_versions_are_rejected(tmp_path):
+    (tmp_path / "0001_a.sql").write_text("SELECT 1")
+    (tmp_path / "0001_b.sql").write_text("SELECT 1")
+    with pytest.raises(ValueError):
+        discover_migrations(tmp_path)
@@ -0,0 +1,87 @@
+from app.services.notifications import ChangeNotifier, Subscription
+import asyncio
+import json
+import os
+import tracemalloc
+import pytest_asyncio
+
+
+@pytest_asyncio.fixture
+async def listening_notifier():
+    notifier = ChangeNotifier(os.getenv("TESTING_DATABASE"), health_check_s=1.0)
+    task = asyncio.create_task(notifier.run())
+    await asyncio.wait_for(notifier.listening.wait(), 10)
+    yield notifier
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def test_committed_changes_reach_the_owners_clients(
+    listening_notifier, folder_services, user_services, valid_user_data
+):
+    """Test that a change is pushed with its cursor, to its owner's clients only."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    other_id = await user_services.register_new_user(
+        "other", "other@test.com", valid_user_data.password
+    )
+
+    with (
+        listening_notifier.subscribe(user_id) as mine,
+        listening_notifier.subscribe(other_id) as theirs,
+    ):
+        await folder_services.register_folder("docs", None, user_id)
+        events = await mine.next_events(timeout_s=5)
+
+        assert events == [{"cursor": 1, "kinds": ["created"]}]
+        assert await theirs.next_events(timeout_s=0.1) == []
+    assert listening_notifier.subscriber_count() == 0
+
+
+async def test_slow_clients_keep_only_their_newest_events():
+    """Test that a client's buffer is bounded and the newest cursor always survives."""
+    subscription = Subscription(buffer_size=4)
+    for cursor in range(1, 101):
+        subscription.push({"cursor": cursor})
+
+    events = await subscription.next_events(timeout_s=1)
+
+    assert [event["cursor"] for event in events] == [97, 98, 99, 100]
+    assert await subscription.next_events(timeout_s=0.01) == []
+
+
+async def test_ten_thousand_idle_subscribers_stay_cheap():
+    """Test that idle SSE streams cost a few KB each and an event only touches its user's."""
+    notifier = ChangeNotifier("unused", buffer_size=32)
+    received = []
+
+    async def client(user_id):
+        async for message in notifier.stream(user_id, keepalive_s=300):
+            received.append((user_id, message))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    clients = [asyncio.create_task(client(f"user-{i}")) for i in range(10_000)]
+    for _ in range(3):
+        await asyncio.sleep(0)
+    per_client = (tracemalloc.get_traced_memory()[0] - before) / len(clients)
+    tracemalloc.stop()
+
+    try:
+        assert notifier.subscriber_count() == 10_000
+        assert per_client < 8 * 1024
+        received.clear()  # the retry lines every stream starts with
+
+        notifier.dispatch(json.dumps({"user_id": "user-42", "cursor": 7, "kinds": []}))
+        await asyncio.sleep(0.01)
+
+        assert notifier.delivered == 1
+        assert received == [
+            ("user-42", 'event: changes\ndata: {"cursor": 7, "kinds": []}\n\n')
+        ]
+    finally:
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+    assert notifier.subscriber_count() == 0
@@ -0,0 +1,276 @@
+from unittest.mock import AsyncMock, Mock
+from pydantic import SecretStr
+from app.schemas.schemas import (
+    UploadFileInfo,
+    Share,
+    BulkShare,
+    ChunkInfo,
+    CopyRequest,
+)
+from app.services.database import DatabaseRouter
+from app.services.folder_services import FolderServices
+from app.services.file_services import DELETE_OBJECTS_JOB, FileServices
+from app.services.share_services import ShareServices
+from app.services.quota_services import QuotaServices
+from app.services.user_services import UserServices
+from app.services.version_services import VersionServices
+from app.services.change_services import ChangeServices
+from app.services.copy_services import COPY_OBJECTS_JOB, CopyServices
+from app.services.job_queue import JobQueue
+from app.services.activity_log import ActivityLog
+from app.services.interaction_tracker import InteractionTracker
+from app.services.token_revocations import TokenRevocations
+from datetime import datetime
+import asyncpg
+import json
+import jwt
+import os
+import pytest
+import pytest_asyncio
+import time
+import uuid
+
+APP_TABLES = {
+    "users",
+    "files",
+    "folders",
+    "shares",
+    "permissions",
+    "quota_ledger",
+    "blobs",
+    "file_versions",
+    "file_version_chunks",
+    "chunks",
+    "changes",
+    "jobs",
+    "copies",
+    "copy_items",
+    "activity",
+    "token_revocations",
+    "quota_stripes",
+    "user_change_seq",
+}
+
+
+@pytest_asyncio.fixture
+async def captured_queries():
+    """Every statement the services send, with its arguments."""
+    queries = {}
+
+    async def capture(conn):
+        conn.add_query_logger(
+            lambda record: queries.setdefault(record.query, record.args)
+        )
+
+    pool = await asyncpg.create_pool(
+        os.getenv("TESTING_DATABASE"), min_size=1, max_size=2, init=capture
+    )
+    yield pool, queries
+    await pool.close()
+
+
+async def exercise_services(pool, auth_services, aws_services, monkeypatch):
+    db = DatabaseRouter(pool)
+    folder_services = FolderServices(db)
+    quota_services = QuotaServices(db)
+    file_services = FileServices(db, folder_services, aws_services, quota_services)
+    share_services = ShareServices(db, file_services, folder_services)
+    user_services = UserServices(db, auth_services)
+    version_services = VersionServices(db, file_services, aws_services, quota_services)
+    ## Undone after the test, aws_services lives for the whole session
+    for name, mock in (
+        ("generate_presigned_upload_url", Mock(return_value={"url": "u"})),
+        ("generate_presigned_download_url", Mock(return_value="u")),
+        ("generate_presigned_chunk_upload_urls", Mock(return_value=[])),
+        ("missing_objects", AsyncMock(return_value=[])),
+        ("copy_object", AsyncMock()),
+    ):
+        monkeypatch.setattr(aws_services, name, mock)
+
+    owner = await user_services.register_new_user(
+        "owner", "owner@test.com", SecretStr("pw123")
+    )
+    await user_services.register_new_user(
+        "friend", "friend@test.com", SecretStr("pw123")
+    )
+    await user_services.get_user_id_and_password("owner")
+    await user_services.get_user_id_and_password("owner@test.com")
+
+    await folder_services.register_folder("docs", None, owner)
+    root_folders = await folder_services.retrieve_folder_content(owner, "name", "ASC")
+    docs = root_folders["files_and_folders"][0]["id"]
+    await folder_services.register_folder("nested", docs, owner)
+    await folder_services.rename_folder(owner, None, docs, "papers")
+
+    for parent in (None, docs):
+        upload = UploadFileInfo(
+            file_name="photo.png", file_size_in_bytes=10, parent_folder_id=parent
+        )
+        await file_services.upload_an_new_file(upload, owner)
+        await file_services.keep_both_files(upload, owner)
+        await file_services.replace_existing_file(upload, owner)
+        await folder_services.retrieve_folder_content(
+            owner, "last_interaction", "DESC", parent
+        )
+
+    content = await folder_services.retrieve_folder_content(owner, "name", "ASC", docs)
+    file_id = next(
+        item["id"] for item in content["files_and_folders"] if item.get("type")
+    )
+    await file_services.rename_file(owner, file_id, "renamed", docs)
+    await file_services.confirm_file_uploads([file_id], os.getenv("LAMBDA_SECRET"))
+    async with pool.acquire() as conn:
+        await quota_services.release_expired(conn, reservation_ttl_s=0)
+        await quota_services.reconcile_batch(conn)
+        await quota_services.reconcile_batch(conn, owner)
+    await file_services.get_user_presigned_download_url(owner, file_id)
+
+    hashed = UploadFileInfo(
+        file_name="scan.pdf", file_size_in_bytes=10, sha256="ab" * 32
+    )
+    await file_services.upload_an_new_file(hashed, owner)
+    async with pool.acquire() as conn:
+        blob_id = await conn.fetchval("SELECT id FROM blobs WHERE sha256 IS NOT NULL")
+    await file_services.confirm_file_uploads([blob_id], os.getenv("LAMBDA_SECRET"))
+    instant = await file_services.keep_both_files(hashed, owner)
+    await file_services.delete_file(owner, instant["file_id"])
+
+    chunks = [ChunkInfo(sha256=f"{n:064x}", size_in_bytes=10) for n in range(3)]
+    chunked = await version_services.create_chunked_version(owner, file_id, chunks)
+    await version_services.commit_chunked_version(owner, file_id, chunked["version_id"])
+    versions = await version_services.list_versions(owner, file_id)
+    await version_services.restore_version(owner, file_id, versions[-1]["id"])
+    await file_services.get_user_presigned_download_url(owner, file_id)
+
+    copy_services = CopyServices(db, folder_services, aws_services, quota_services)
+    plain = UploadFileInfo(
+        file_name="plain.txt", file_size_in_bytes=10, parent_folder_id=docs
+    )
+    await file_services.upload_an_new_file(plain, owner)
+    async with pool.acquire() as conn:
+        plain_id = await conn.fetchval(
+            "SELECT id FROM files WHERE owner_id = $1 AND parent_folder_id = $2 "
+            "AND name = 'plain.txt'",
+            owner,
+            docs,
+        )
+    await file_services.confirm_file_uploads([plain_id], os.getenv("LAMBDA_SECRET"))
+    folder_copy = await copy_services.copy(
+        owner, CopyRequest(copy_object_type="folder", folder_id=docs)
+    )
+    await copy_services.copy(
+        owner,
+        CopyRequest(
+            copy_object_type="file", file_id=file_id, destination_folder_id=docs
+        ),
+    )
+    await copy_services.copy_progress(owner, folder_copy["copy_id"])
+
+    await share_services.share_file(
+        owner,
+        Share(share_object_type="file", username="friend", read=True, file_id=file_id),
+    )
+    await share_services.share_folder(
+        owner,
+        Share(share_object_type="folder", username="friend", read=True, folder_id=docs),
+    )
+    await share_services.share_many(
+        owner,
+        BulkShare(
+            usernames=["friend"], file_ids=[file_id], folder_ids=[docs], read=True
+        ),
+    )
+    friend = (await user_services.get_user_id_and_password("friend"))["id"]
+    await share_services.get_shared_with_me(str(friend))
+    for sort_by in ("shared_at", "name"):
+        cursor = share_services.encode_cursor(
+            sort_by,
+            {"shared_at": datetime.now(), "name": "m", "share_id": uuid.uuid4()},
+        )
+        for order in ("ASC", "DESC"):
+            for list_shares, user_id in (
+                (share_services.get_shared_with_me, str(friend)),
+                (share_services.get_shared_by_me, owner),
+            ):
+                await list_shares(user_id, sort_by=sort_by, order=order)
+                await list_shares(user_id, sort_by=sort_by, order=order, cursor=cursor)
+
+    feed = await ChangeServices(db).list_changes(owner, limit=5)
+    await ChangeServices(db).list_changes(owner, feed["cursor"])
+
+    activity = await ActivityLog(db).feed(owner, limit=1)
+    await ActivityLog(db).feed(owner, activity["next_before"] or 1)
+
+    interaction_tracker = InteractionTracker(db)
+    interaction_tracker.touch("file", file_id)
+    interaction_tracker.touch("folder", docs)
+    await interaction_tracker.flush()
+
+    token_revocations = TokenRevocations(db, 1800)
+    token = jwt.decode(
+        auth_services.create_access_token({"sub": owner}),
+        options={"verify_signature": False},
+    )
+    await token_revocations.revoke_token(token)
+    await token_revocations.revoke_all(owner)
+    await token_revocations.rebuild()
+    await token_revocations.refresh()
+    await token_revocations.is_revoked({**token, "iat": time.time()})
+
+    job_queue = JobQueue(db)
+    job_queue.register(DELETE_OBJECTS_JOB, AsyncMock(side_effect=OSError("down")))
+    job_queue.register("noop", AsyncMock())
+    job_queue.register(COPY_OBJECTS_JOB, copy_services.copy_objects)
+    async with pool.acquire() as conn:
+        await JobQueue.enqueue(conn, "noop", {})
+    await job_queue.work_once()
+    await job_queue.requeue_expired()
+    await job_queue.retry_dead(0)
+
+    await user_services.confirm_user_profile_picture(owner, os.getenv("LAMBDA_SECRET"))
+    await user_services.validate_if_user_has_profile_picture(owner)
+
+
+def seq_scanned_tables(plan) -> set:
+    tables = set()
+    if plan.get("Node Type") == "Seq Scan" and plan["Relation Name"] in APP_TABLES:
+        tables.add(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        tables |= seq_scanned_tables(child)
+    return tables
+
+
+@pytest.mark.asyncio
+async def test_no_service_query_needs_a_sequential_scan(
+    db_pool, captured_queries, auth_services, aws_services, monkeypatch
+):
+    """
+    With sequential scans priced out the planner still falls back to one when no
+    index can serve a query, so any Seq Scan left in a plan is a missing index.
+    """
+    pool, queries = captured_queries
+    await exercise_services(pool, auth_services, aws_services, monkeypatch)
+
+    statements = {
+        query: args
+        for query, args in queries.items()
+        if query.lstrip()[:6].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE")
+        and ";" not in query.strip().rstrip(";")
+    }
+    assert len(statements) > 10
+
+    missing_indexes = {}
+    async with db_pool.acquire() as conn:
+        for query, args in statements.items():
+            tr = conn.transaction()
+            await tr.start()
+            try:
+                await conn.execute("SET LOCAL enable_seqscan = off")
+                plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+            finally:
+                await tr.rollback()
+            tables = seq_scanned_tables(json.loads(plan)[0]["Plan"])
+            if tables:
+                missing_indexes[query] = sorted(tables)
+
+    assert missing_indexes == {}
@@ -0,0 +1,89 @@
+from app.services.query_tracer import QueryTracer, TracedConnection
+from app.services.folder_services import FolderServices
+from app.services.database import DatabaseRouter
+from types import SimpleNamespace
+import asyncio
+import asyncpg
+import pytest_asyncio
+import os
+
+testing_database = os.getenv("TESTING_DATABASE")
+
+
+@pytest_asyncio.fixture
+async def traced_pool():
+    """Pool wired like production, with every query counted as slow and explained."""
+    tracer = QueryTracer(slow_query_threshold_ms=0, explain_sample_rate=1)
+    pool = await asyncpg.create_pool(
+        testing_database,
+        min_size=1,
+        max_size=3,
+        connection_class=TracedConnection,
+        init=tracer.setup_connection,
+    )
+    tracer.bind_pool(pool)
+    yield pool, tracer
+    await pool.close()
+
+
+def fake_record(query, elapsed, exception=None):
+    return SimpleNamespace(query=query, args=(), elapsed=elapsed, exception=exception)
+
+
+async def test_fast_queries_are_counted_but_not_flagged_slow():
+    tracer = QueryTracer(slow_query_threshold_ms=100, explain_sample_rate=0)
+
+    tracer.log_query(fake_record("SELECT 1", 0.005))
+    tracer.log_query(fake_record("SELECT   1", 0.015))
+
+    [report] = tracer.top_queries()
+    assert report["query"] == "SELECT 1"
+    assert report["calls"] == 2
+    assert report["slow_calls"] == 0
+    assert report["max_ms"] == 15
+
+
+async def test_top_queries_are_ranked_by_total_time():
+    tracer = QueryTracer(slow_query_threshold_ms=1000, explain_sample_rate=0)
+
+    for _ in range(5):
+        tracer.log_query(fake_record("SELECT id FROM files", 0.01))
+    tracer.log_query(fake_record("SELECT id FROM folders", 0.2))
+
+    report = tracer.top_queries(limit=1)
+    assert [entry["query"] for entry in report] == ["SELECT id FROM folders"]
+
+    report = tracer.top_queries(order_by="calls")
+    assert report[0]["query"] == "SELECT id FROM files"
+
+
+async def test_slow_query_is_attributed_to_service_method(
+    traced_pool, user_services, valid_user_data
+):
+    pool, tracer = traced_pool
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+
+    await FolderServices(DatabaseRouter(pool)).retrieve_folder_content(
+        user_id, "name", "ASC"
+    )
+    await asyncio.sleep(0)  # query loggers run on the next loop iteration
+
+    sources = {source for entry in tracer.top_queries() for source in entry["sources"]}
+    assert "folder_services.FolderServices.retrieve_folder_content" in sources
+
+
+async def test_sampled_slow_select_captures_explain_plan(traced_pool):
+    pool, tracer = traced_pool
+
+    async with pool.acquire() as conn:
+        await conn.fetch("SELECT id FROM users WHERE username = $1", "nobody")
+    await asyncio.sleep(0)
+    await asyncio.gather(*tracer._explain_tasks)
+
+    entry = next(
+        e for e in tracer.top_queries() if e["query"].startswith("SELECT id FROM users")
+    )
+    assert entry["plan"][0]["Plan"]["Node Type"]
+    assert "Shared Hit Blocks" in entry["plan"][0]["Plan"]
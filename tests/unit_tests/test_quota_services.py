@@ -0,0 +1,302 @@
+from fastapi import HTTPException
+from pydantic import ValidationError
+from app.schemas.schemas import FileUploadResult, UploadFileInfo
+from app.services.quota_services import MAINTENANCE_LOCK_KEY, QuotaServices
+from unittest.mock import Mock
+import asyncio
+import os
+import pytest
+import uuid
+
+
+@pytest.fixture
+def presign(file_services):
+    file_services.aws_services.generate_presigned_upload_url = Mock(
+        return_value={"url": "https://mock-bucket.s3.amazonaws.com/", "fields": {}}
+    )
+
+
+@pytest.fixture
+async def user_id(user_services, valid_user_data, db_pool):
+    """User with a 1000 byte quota."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE users SET total_storage_in_bytes = 1000 WHERE id = $1", user_id
+        )
+        await QuotaServices.spread(conn, user_id, 1000)
+    return user_id
+
+
+async def available(db_pool, user_id) -> int:
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT SUM(available_bytes) FROM quota_stripes WHERE user_id = $1", user_id
+        )
+
+
+async def file_id_by_name(db_pool, name) -> str:
+    async with db_pool.acquire() as conn:
+        return str(await conn.fetchval("SELECT id FROM files WHERE name = $1", name))
+
+
+def upload(name, size, conflict=None):
+    return UploadFileInfo(
+        file_name=name, file_size_in_bytes=size, file_conflict=conflict
+    )
+
+
+async def test_upload_is_charged_when_reserved(
+    file_services, presign, user_id, db_pool
+):
+    await file_services.upload_an_new_file(upload("photo.png", 300), user_id)
+    await file_services.keep_both_files(upload("photo.png", 200), user_id)
+
+    assert await available(db_pool, user_id) == 500
+
+
+async def test_upload_over_quota_leaves_no_file_behind(
+    file_services, presign, user_id, db_pool
+):
+    with pytest.raises(HTTPException) as exc_info:
+        await file_services.upload_an_new_file(upload("photo.png", 1001), user_id)
+
+    assert exc_info.value.status_code == 403
+    assert await available(db_pool, user_id) == 1000
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM files") == 0
+
+
+async def test_concurrent_uploads_never_overdraw_the_quota(
+    file_services, presign, user_id, db_pool
+):
+    results = await asyncio.gather(
+        *(
+            file_services.upload_an_new_file(upload(f"photo{i}.png", 100), user_id)
+            for i in range(20)
+        ),
+        return_exceptions=True,
+    )
+
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(rejected) == 10
+    assert {r.status_code for r in rejected} == {403}
+    assert await available(db_pool, user_id) == 0
+
+
+async def test_negative_upload_size_is_rejected_without_crediting_quota(
+    file_services, quota_services, presign, user_id, db_pool
+):
+    """Test that a negative size is a 422, never a refund to the user's quota."""
+    with pytest.raises(ValidationError):
+        upload("photo.png", -(10**12))
+
+    async with db_pool.acquire() as conn:
+        before = await conn.fetch(
+            "SELECT stripe, available_bytes FROM quota_stripes WHERE user_id = $1 "
+            "ORDER BY stripe",
+            user_id,
+        )
+    with pytest.raises(HTTPException) as exc_info:
+        await file_services.upload_an_new_file(
+            UploadFileInfo.model_construct(
+                file_name="photo.png", file_size_in_bytes=-(10**12)
+            ),
+            user_id,
+        )
+    assert exc_info.value.status_code == 422
+    async with db_pool.acquire() as conn:
+        with pytest.raises(HTTPException) as exc_info:
+            async with conn.transaction():
+                await quota_services.charge_new_files(
+                    conn, user_id, [uuid.uuid4()], [-100], [False]
+                )
+        assert exc_info.value.status_code == 422
+        after = await conn.fetch(
+            "SELECT stripe, available_bytes FROM quota_stripes WHERE user_id = $1 "
+            "ORDER BY stripe",
+            user_id,
+        )
+        assert await conn.fetchval("SELECT count(*) FROM files") == 0
+
+    assert after == before
+
+
+async def test_uploads_of_one_user_dont_wait_on_each_others_charge(
+    file_services, presign, user_id, db_pool
+):
+    """Test that an open charge locks one stripe and a big one pools the rest."""
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            assert await QuotaServices.claim(conn, user_id, 100)
+            await asyncio.wait_for(
+                file_services.upload_an_new_file(upload("photo.png", 100), user_id),
+                timeout=5,
+            )
+    assert await available(db_pool, user_id) == 800
+
+    await file_services.upload_an_new_file(upload("video.mp4", 700), user_id)
+    assert await available(db_pool, user_id) == 100
+    async with db_pool.acquire() as conn:
+        assert (
+            await conn.fetchval(
+                "SELECT max(available_bytes) - min(available_bytes) FROM quota_stripes "
+                "WHERE user_id = $1 AND stripe > 0",
+                user_id,
+            )
+            == 0
+        )
+
+
+async def test_smaller_replacement_is_refunded_on_commit(
+    file_services, presign, user_id, db_pool
+):
+    await file_services.upload_an_new_file(upload("photo.png", 300), user_id)
+    file_id = await file_id_by_name(db_pool, "photo.png")
+    await file_services.confirm_file_uploads([file_id], os.getenv("LAMBDA_SECRET"))
+
+    await file_services.replace_existing_file(
+        upload("photo.png", 100, "Replace"), user_id
+    )
+    assert await available(db_pool, user_id) == 700
+
+    assert (
+        await file_services.confirm_file_uploads([file_id], os.getenv("LAMBDA_SECRET"))
+        == 1
+    )
+    assert await available(db_pool, user_id) == 900
+    async with db_pool.acquire() as conn:
+        assert (
+            await conn.fetchval(
+                "SELECT size_in_bytes FROM files WHERE id = $1", file_id
+            )
+            == 100
+        )
+
+
+async def test_new_replacement_supersedes_the_pending_one(
+    file_services, presign, user_id, db_pool
+):
+    await file_services.upload_an_new_file(upload("photo.png", 300), user_id)
+    await file_services.replace_existing_file(
+        upload("photo.png", 600, "Replace"), user_id
+    )
+    assert await available(db_pool, user_id) == 400
+
+    await file_services.replace_existing_file(
+        upload("photo.png", 500, "Replace"), user_id
+    )
+    assert await available(db_pool, user_id) == 500
+
+    file_id = await file_id_by_name(db_pool, "photo.png")
+    await file_services.confirm_file_uploads([file_id], os.getenv("LAMBDA_SECRET"))
+    assert await available(db_pool, user_id) == 500
+
+
+async def test_growing_replacement_over_quota_is_rejected(
+    file_services, presign, user_id, db_pool
+):
+    await file_services.upload_an_new_file(upload("photo.png", 600), user_id)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await file_services.replace_existing_file(
+            upload("photo.png", 1100, "Replace"), user_id
+        )
+
+    assert exc_info.value.status_code == 403
+    assert await available(db_pool, user_id) == 400
+
+
+async def test_confirm_requires_the_lambda_secret(file_services):
+    with pytest.raises(HTTPException) as exc_info:
+        await file_services.confirm_file_uploads([], "wrong-secret")
+
+    assert exc_info.value.status_code == 403
+
+
+async def test_expired_new_upload_is_deleted_and_refunded(
+    file_services, quota_services, presign, user_id, db_pool
+):
+    await file_services.upload_an_new_file(upload("photo.png", 300), user_id)
+    await file_services.upload_an_new_file(upload("kept.png", 200), user_id)
+    await file_services.confirm_file_uploads(
+        [await file_id_by_name(db_pool, "kept.png")], os.getenv("LAMBDA_SECRET")
+    )
+
+    async with db_pool.acquire() as conn:
+        assert await quota_services.release_expired(conn, reservation_ttl_s=0) == 1
+        names = await conn.fetch("SELECT name FROM files")
+
+    assert [row["name"] for row in names] == ["kept.png"]
+    assert await available(db_pool, user_id) == 800
+
+
+async def test_reconciliation_corrects_drift_and_skips_busy_users(
+    file_services, quota_services, presign, user_id, db_pool
+):
+    await file_services.upload_an_new_file(upload("photo.png", 300), user_id)
+    async with db_pool.acquire() as conn:
+        await conn.execute("UPDATE quota_stripes SET available_bytes = 42")
+
+    ## A user with a stripe locked by an in-flight upload is left for the next pass
+    async with db_pool.acquire() as busy:
+        async with busy.transaction():
+            await busy.execute(
+                "SELECT 1 FROM quota_stripes WHERE user_id = $1 AND stripe = 3 FOR UPDATE",
+                user_id,
+            )
+            async with db_pool.acquire() as conn:
+                last_id, corrected = await asyncio.wait_for(
+                    quota_services.reconcile_batch(conn), timeout=5
+                )
+            assert (str(last_id), corrected) == (user_id, 0)
+
+    result = await quota_services.run_maintenance(reservation_ttl_s=3600)
+    assert result == {"released": 0, "reconciled": 1}
+    assert await available(db_pool, user_id) == 700
+
+
+async def test_maintenance_runs_on_one_worker_at_a_time(quota_services, db_pool):
+    async with db_pool.acquire() as conn:
+        await conn.execute("SELECT pg_advisory_lock($1)", MAINTENANCE_LOCK_KEY)
+        try:
+            assert await quota_services.run_maintenance(reservation_ttl_s=3600) is None
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MAINTENANCE_LOCK_KEY)
+
+
+async def test_upload_results_commit_and_flag_previews(
+    file_services, presign, user_id, db_pool
+):
+    await file_services.upload_an_new_file(upload("photo.png", 300), user_id)
+    file_id = await file_id_by_name(db_pool, "photo.png")
+
+    outcome = await file_services.record_upload_results(
+        [FileUploadResult(file_id=file_id, detected_type="png", has_thumbnails=True)],
+        os.getenv("LAMBDA_SECRET"),
+    )
+
+    assert outcome == {"committed": 1, "rejected_file_ids": []}
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval(
+            "SELECT has_thumbnails FROM files WHERE id = $1", file_id
+        )
+
+
+async def test_upload_with_mismatched_content_is_removed_and_refunded(
+    file_services, presign, user_id, db_pool
+):
+    await file_services.upload_an_new_file(upload("photo.png", 300), user_id)
+    file_id = await file_id_by_name(db_pool, "photo.png")
+
+    outcome = await file_services.record_upload_results(
+        [FileUploadResult(file_id=file_id, detected_type="executable")],
+        os.getenv("LAMBDA_SECRET"),
+    )
+
+    assert outcome == {"committed": 0, "rejected_file_ids": [file_id]}
+    assert await available(db_pool, user_id) == 1000
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM files") == 0
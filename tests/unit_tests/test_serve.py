@@ -0,0 +1,120 @@
+from app.serve import Supervisor, Worker, size_workers, worker_environment
+from app.services.worker_metrics import WorkerMetrics, WorkerMetricsMiddleware
+import app.serve
+import pytest
+import shutil
+
+
+def test_connection_budget_is_split_evenly_between_workers():
+    """Test that the LISTEN connections and a restart's spare worker fit the budget."""
+    assert size_workers(20, 4) == (4, 3)
+    assert size_workers(10, 3) == (3, 1)
+    for budget, workers in ((20, 4), (10, 3), (100, 7), (4, 1)):
+        workers, pool_size = size_workers(budget, workers)
+        assert (workers + 1) * (pool_size + 1) <= budget
+
+
+def test_workers_are_lowered_to_fit_the_budget():
+    """Test that many cores and a small budget start fewer workers instead of failing."""
+    assert size_workers(20, 64) == (9, 1)
+    with pytest.raises(ValueError):
+        size_workers(3, 1)
+
+
+def test_worker_pool_min_size_never_exceeds_its_share(monkeypatch):
+    monkeypatch.setenv("DB_POOL_MIN_SIZE", "10")
+
+    env = worker_environment(2, 4, "/tmp/metrics", "tokens")
+
+    assert env["WORKER_ID"] == "2"
+    assert env["DB_POOL_MAX_SIZE"] == "4"
+    assert env["DB_POOL_MIN_SIZE"] == "4"
+
+
+class CrashingProcess:
+    pid = 1
+    exitcode = 3
+
+    def is_alive(self):
+        return False
+
+
+def test_crashing_worker_is_respawned_with_backoff(monkeypatch):
+    """Test that a worker dying at startup is replaced later each time, not every tick."""
+    clock = [1000.0]
+    monkeypatch.setattr(app.serve, "monotonic", lambda: clock[0])
+    supervisor = Supervisor(None, 1, 1, {})
+    spawned = []
+
+    def spawn(worker_id, crashes=0):
+        spawned.append(clock[0])
+        return Worker(worker_id, CrashingProcess(), None, crashes)
+
+    monkeypatch.setattr(supervisor, "spawn", spawn)
+    try:
+        supervisor.workers = [Worker(0, CrashingProcess(), None)]
+        for _ in range(200):
+            supervisor.replace_dead_workers()
+            clock[0] += 0.5
+
+        ## 1s, 2s, 4s, ... after each crash, which is noticed a 0.5s tick after its spawn
+        assert spawned[0] == 1001
+        assert [b - a for a, b in zip(spawned, spawned[1:])] == [
+            2.5,
+            4.5,
+            8.5,
+            16.5,
+            32.5,
+        ]
+
+        ## A worker that served a while before dying is replaced quickly again
+        clock[0] += 120
+        supervisor.workers[0].started_at = clock[0] - 120
+        supervisor.workers[0].respawn_at = None
+        supervisor.replace_dead_workers()
+        clock[0] += 1
+        supervisor.replace_dead_workers()
+        assert spawned[-1] == clock[0]
+        assert supervisor.workers[0].crashes == 1
+    finally:
+        shutil.rmtree(supervisor.metrics_dir, ignore_errors=True)
+        supervisor.write_tokens_shm.close()
+        supervisor.write_tokens_shm.unlink()
+
+
+async def test_every_worker_snapshot_is_reported(tmp_path):
+    first = WorkerMetrics(worker_id="0", metrics_dir=str(tmp_path))
+    second = WorkerMetrics(worker_id="1", metrics_dir=str(tmp_path))
+    second.pid += 1  # both live in this process, the pid keeps their files apart
+    second.request_started()
+    second.request_finished(200, 12.5)
+    second.publish()
+
+    workers = first.all_workers()
+
+    assert [w["worker_id"] for w in workers] == ["0", "1"]
+    assert workers[1]["requests"] == 1
+    assert workers[1]["mean_ms"] == 12.5
+
+    second.remove_snapshot()
+    assert [w["worker_id"] for w in first.all_workers()] == ["0"]
+
+
+async def test_middleware_counts_requests_and_tags_responses():
+    metrics = WorkerMetrics(worker_id="3")
+    sent = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 503, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        sent.append(message)
+
+    await WorkerMetricsMiddleware(app, metrics)({"type": "http"}, None, send)
+
+    assert (b"x-worker-id", b"3") in sent[0]["headers"]
+    snapshot = metrics.snapshot()
+    assert snapshot["requests"] == 1
+    assert snapshot["server_errors"] == 1
+    assert snapshot["in_flight"] == 0
@@ -0,0 +1,187 @@
+from fastapi import HTTPException
+from pydantic import SecretStr
+from app.schemas.schemas import BulkShare, Share
+import uuid
+import pytest
+
+
+async def register(user_services, *usernames) -> list:
+    return [
+        await user_services.register_new_user(
+            username, f"{username}@example.com", SecretStr("Password123!")
+        )
+        for username in usernames
+    ]
+
+
+async def test_bulk_share_reports_pairs_already_shared(
+    db_pool, folder_services, share_services, user_services
+):
+    """Test that a bulk share inserts every new pair and skips the shared ones."""
+    owner, _, _ = await register(user_services, "owner", "alice", "bob")
+    folder_ids = []
+    for name in ("docs", "photos", "music"):
+        await folder_services.register_folder(name, None, owner)
+        async with db_pool.acquire() as conn:
+            folder_ids.append(
+                await conn.fetchval("SELECT id FROM folders WHERE name = $1", name)
+            )
+    await share_services.share_folder(
+        owner,
+        Share(
+            share_object_type="folder",
+            username="alice",
+            read=True,
+            folder_id=folder_ids[0],
+        ),
+    )
+
+    response = await share_services.share_many(
+        owner,
+        BulkShare(
+            usernames=["alice", "bob", "nobody"], folder_ids=folder_ids, write=True
+        ),
+    )
+
+    assert response["shared"] == 5
+    assert response["already_shared"] == [
+        {"username": "alice", "object_type": "folder", "object_id": str(folder_ids[0])}
+    ]
+    assert response["unknown_users"] == ["nobody"]
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM shares") == 6
+        assert await conn.fetchval("SELECT count(*) FROM permissions WHERE write") == 5
+        ## Each recipient's change log got one entry per new share
+        assert (
+            await conn.fetchval("SELECT count(*) FROM changes WHERE kind = 'shared'")
+            == 6
+        )
+
+
+async def test_bulk_share_of_items_not_owned_shares_nothing(
+    db_pool, folder_services, share_services, user_services
+):
+    """Test that one item the user doesn't own fails the whole batch."""
+    owner, _ = await register(user_services, "owner", "alice")
+    await folder_services.register_folder("docs", None, owner)
+    async with db_pool.acquire() as conn:
+        docs = await conn.fetchval("SELECT id FROM folders")
+
+    with pytest.raises(HTTPException) as exc:
+        await share_services.share_many(
+            owner,
+            BulkShare(
+                usernames=["alice"],
+                folder_ids=[docs],
+                file_ids=[uuid.uuid4()],
+                read=True,
+            ),
+        )
+
+    assert exc.value.status_code == 404
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM shares") == 0
+
+
+async def shared_folders(db_pool, folder_services, share_services, owner, names):
+    """Folders of owner, all shared with alice, returns their ids by name."""
+    for name in names:
+        await folder_services.register_folder(name, None, owner)
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch("SELECT id, name FROM folders")
+    ids = {row["name"]: row["id"] for row in rows}
+    await share_services.share_many(
+        owner, BulkShare(usernames=["alice"], folder_ids=list(ids.values()), read=True)
+    )
+    return ids
+
+
+@pytest.mark.parametrize(
+    "sort_by, order", [("name", "ASC"), ("name", "DESC"), ("shared_at", "DESC")]
+)
+async def test_shared_with_me_pages_through_every_share_once(
+    db_pool, folder_services, share_services, user_services, sort_by, order
+):
+    """Test that following next_cursor lists every share once, in order."""
+    owner, alice = await register(user_services, "owner", "alice")
+    names = [f"folder{n}" for n in range(7)]
+    await shared_folders(db_pool, folder_services, share_services, owner, names)
+
+    pages, cursor = [], None
+    while True:
+        page = await share_services.get_shared_with_me(
+            alice, sort_by=sort_by, order=order, cursor=cursor, limit=3
+        )
+        pages.append(page["content"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    listed = [item["name"] for page in pages for item in page]
+    assert sorted(listed) == names
+    if sort_by == "name":
+        assert listed == sorted(names, reverse=order == "DESC")
+    assert {item["email"] for page in pages for item in page} == {"owner@example.com"}
+
+
+async def test_shared_by_me_follows_renames(
+    db_pool, folder_services, share_services, user_services
+):
+    """Test that shared-by-me lists the recipients and the objects' current names."""
+    owner, _ = await register(user_services, "owner", "alice")
+    ids = await shared_folders(
+        db_pool, folder_services, share_services, owner, ["a", "b"]
+    )
+    await folder_services.rename_folder(owner, None, ids["a"], "z")
+
+    page = await share_services.get_shared_by_me(owner, sort_by="name", order="ASC")
+
+    assert [item["name"] for item in page["content"]] == ["b", "z"]
+    assert {item["email"] for item in page["content"]} == {"alice@example.com"}
+    assert page["next_cursor"] is None
+
+
+async def test_shared_with_me_lists_what_is_at_the_top_level_now(
+    db_pool, folder_services, share_services, user_services
+):
+    """Test that a shared folder moved into another leaves the listing until moved out."""
+    owner, alice = await register(user_services, "owner", "alice")
+    ids = await shared_folders(
+        db_pool, folder_services, share_services, owner, ["a", "b", "c"]
+    )
+
+    async def listed():
+        page = await share_services.get_shared_with_me(
+            alice, sort_by="name", order="ASC", limit=2
+        )
+        return [item["name"] for item in page["content"]]
+
+    async def move(parent_folder_id):
+        async with db_pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE folders SET parent_folder_id = $1 WHERE id = $2",
+                parent_folder_id,
+                ids["b"],
+            )
+
+    await move(ids["a"])
+    assert await listed() == ["a", "c"]
+    await move(None)
+    assert await listed() == ["a", "b"]
+
+
+async def test_cursor_of_another_sort_order_is_rejected(
+    db_pool, folder_services, share_services, user_services
+):
+    """Test that a cursor is only valid for the sort it came from."""
+    owner, alice = await register(user_services, "owner", "alice")
+    await shared_folders(db_pool, folder_services, share_services, owner, ["a", "b"])
+    page = await share_services.get_shared_with_me(alice, sort_by="name", limit=1)
+
+    for cursor in (page["next_cursor"], "not a cursor"):
+        with pytest.raises(HTTPException) as exc:
+            await share_services.get_shared_with_me(
+                alice, sort_by="shared_at", cursor=cursor
+            )
+        assert exc.value.status_code == 400
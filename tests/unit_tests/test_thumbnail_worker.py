@@ -0,0 +1,210 @@
+from app.helpers.image_utils import (
+    THUMBNAIL_SIZES,
+    is_acceptable,
+    make_thumbnails,
+    sniff_type,
+)
+from app.thumbnail_worker import ThumbnailWorker, parse_s3_notification
+from io import BytesIO
+from PIL import Image
+import json
+import pytest
+
+
+class MemoryS3:
+    """The handful of S3 client calls the worker makes, over a dict."""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.gets = []
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.gets.append((Key, Range))
+        data = self.objects[Key]
+        if Range:
+            start, end = Range.removeprefix("bytes=").split("-")
+            data = data[int(start) : int(end) + 1]
+        return {"Body": BytesIO(data)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def delete_objects(self, Bucket, Delete):
+        for entry in Delete["Objects"]:
+            self.objects.pop(entry["Key"], None)
+
+
+class ListSource:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.acked = []
+
+    def receive(self, wait_time_s):
+        messages, self.messages = self.messages[:10], self.messages[10:]
+        return messages
+
+    def ack(self, receipts):
+        self.acked += receipts
+
+
+def jpeg(width=1600, height=1200) -> bytes:
+    out = BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(out, "JPEG")
+    return out.getvalue()
+
+
+def notification(*keys) -> str:
+    return json.dumps(
+        {
+            "Records": [
+                {"eventName": "ObjectCreated:Post", "s3": {"object": {"key": key}}}
+                for key in keys
+            ]
+        }
+    )
+
+
+@pytest.fixture
+def worker_factory():
+    workers = []
+
+    def create(s3, post_results, **kwargs):
+        worker = ThumbnailWorker(s3, "bucket", post_results, processes=1, **kwargs)
+        workers.append(worker)
+        return worker
+
+    yield create
+    for worker in workers:
+        worker.close()
+
+
+def test_sniff_type_reads_magic_bytes():
+    assert sniff_type(jpeg(8, 8)[:32]) == "jpeg"
+    assert sniff_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "webp"
+    assert sniff_type(b"\x00\x00\x00\x18ftypheic") == "heic"
+    assert sniff_type(b"\x7fELF\x02\x01\x01") == "executable"
+    assert sniff_type(b"hello world") is None
+
+
+def test_windows_executables_are_told_apart_from_text_starting_mz():
+    dos_header = b"MZ\x90\x00".ljust(0x3C, b"\x00") + (0x80).to_bytes(4, "little")
+    assert sniff_type(dos_header.ljust(0x80, b"\x00") + b"PE\x00\x00") == "executable"
+    assert sniff_type(b"MZ\x90\x00") is None
+    assert sniff_type(b"MZ is the code of Mozambique, " * 10) is None
+
+
+def test_names_have_to_match_the_content():
+    assert is_acceptable("photo.jpg", "jpeg")
+    assert not is_acceptable("photo.jpg", "executable")
+    assert not is_acceptable("photo.png", None)
+    assert not is_acceptable("notes.txt", "executable")
+    assert is_acceptable("setup.exe", "executable")
+    assert is_acceptable("notes.txt", None)
+
+
+def test_every_size_comes_from_one_decode():
+    thumbnails = make_thumbnails(jpeg(1600, 1200))
+
+    assert set(thumbnails) == set(THUMBNAIL_SIZES)
+    for size, body in thumbnails.items():
+        with Image.open(BytesIO(body)) as image:
+            assert image.format == "WEBP"
+            assert max(image.size) == size
+
+
+def test_parse_s3_notification_decodes_keys_and_skips_unknown_ones():
+    events = parse_s3_notification(
+        notification(
+            "files/user%2Dvalue/folder/file",
+            "thumbnails/user/file/64.webp",
+            "files/user/chunks/chunk",
+            "profile_photos/original/user/photo",
+        )
+    )
+
+    assert [(e.kind, e.user_id, e.file_id) for e in events] == [
+        ("file", "user-value", "file"),
+        ("profile_photo", "user", None),
+    ]
+    assert parse_s3_notification(json.dumps({"Event": "s3:TestEvent"})) == []
+
+
+def test_worker_stores_previews_and_sniffs_without_full_downloads(worker_factory):
+    s3 = MemoryS3({"files/u/img": jpeg(), "files/u/doc": b"%PDF-1.7" + b"0" * 5000})
+    posted = []
+    worker = worker_factory(s3, lambda payload: posted.append(payload) or {})
+    source = ListSource(
+        [("r1", parse_s3_notification(notification("files/u/img", "files/u/doc")))]
+    )
+
+    worker.process(source.receive(0))
+    worker.flush(source)
+
+    assert {f"thumbnails/u/img/{size}.webp" for size in THUMBNAIL_SIZES} <= set(
+        s3.objects
+    )
+    assert ("files/u/doc", None) not in s3.gets
+    assert posted == [
+        {
+            "files": [
+                {"file_id": "img", "detected_type": "jpeg", "has_thumbnails": True},
+                {"file_id": "doc", "detected_type": "pdf", "has_thumbnails": False},
+            ],
+            "profile_photos": [],
+        }
+    ]
+    assert source.acked == ["r1"]
+
+
+def test_worker_batches_results_and_deletes_rejected_uploads(worker_factory):
+    s3 = MemoryS3({f"files/u/f{i}": b"MZ\x90\x00" for i in range(5)})
+    posted = []
+
+    def post_results(payload):
+        posted.append(payload)
+        return {"rejected_file_ids": ["f0", "f1"]}
+
+    worker = worker_factory(s3, post_results, batch_size=5, flush_interval_s=60)
+    source = ListSource([])
+    messages = [
+        (f"r{i}", parse_s3_notification(notification(f"files/u/f{i}")))
+        for i in range(5)
+    ]
+
+    worker.process(messages[:4])
+    assert not worker.should_flush()
+    worker.process(messages[4:])
+    assert worker.should_flush()
+    worker.flush(source)
+    worker.io_pool.shutdown()
+
+    assert len(posted) == 1 and len(posted[0]["files"]) == 5
+    assert sorted(s3.objects) == ["files/u/f2", "files/u/f3", "files/u/f4"]
+    assert source.acked == [f"r{i}" for i in range(5)]
+
+
+def test_profile_photo_that_is_not_an_image_is_deleted(worker_factory):
+    s3 = MemoryS3(
+        {
+            "profile_photos/original/a/photo": jpeg(),
+            "profile_photos/original/b/photo": b"<html></html>",
+        }
+    )
+    posted = []
+    worker = worker_factory(s3, lambda payload: posted.append(payload) or {})
+    events = parse_s3_notification(
+        notification(
+            "profile_photos/original/a/photo", "profile_photos/original/b/photo"
+        )
+    )
+
+    worker.process([("r1", events)])
+    worker.flush(ListSource([]))
+
+    assert posted[0]["profile_photos"] == ["a"]
+    assert "profile_photos/original/b/photo" not in s3.objects
+    with Image.open(BytesIO(s3.objects["profile_photos/resized/a/photo"])) as image:
+        assert image.size == (400, 400)
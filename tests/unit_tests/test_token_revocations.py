@@ -0,0 +1,106 @@
+from app.dependencies import get_token_and_decode, get_token_payload
+from app.services.token_revocations import BloomFilter, TokenRevocations
+from fastapi import HTTPException
+from types import SimpleNamespace
+from unittest.mock import patch
+import jwt
+import pytest
+import uuid
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    """Test that every key added is found and unknown keys rarely are."""
+    bloom = BloomFilter(10_000, error_rate=0.01)
+    added = [str(uuid.uuid4()) for _ in range(10_000)]
+    for key in added:
+        bloom.add(key)
+
+    assert all(key in bloom for key in added)
+    false_positives = sum(str(uuid.uuid4()) in bloom for _ in range(10_000))
+    assert false_positives < 200
+
+
+@pytest.fixture
+async def user_id(user_services, valid_user_data):
+    return await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+
+
+async def authenticate(auth_services, revocations, token):
+    """Runs a token through the API's auth dependencies, on a worker holding revocations."""
+    request = SimpleNamespace(
+        app=SimpleNamespace(state=SimpleNamespace(token_revocations=revocations))
+    )
+    settings = SimpleNamespace(
+        secret_key=auth_services.secret_key, algorithm=auth_services.algorithm
+    )
+    with patch("app.dependencies.get_settings", return_value=settings):
+        return await get_token_and_decode(await get_token_payload(request, token))
+
+
+def claims(token) -> dict:
+    return jwt.decode(token, options={"verify_signature": False})
+
+
+async def test_logout_revokes_only_that_token(db, auth_services, user_id):
+    """Test that a logged out token is refused and the user's others need no lookup."""
+    revocations = TokenRevocations(db, 1800)
+    await revocations.rebuild()
+    phone = auth_services.create_access_token({"sub": user_id})
+    laptop = auth_services.create_access_token({"sub": user_id})
+    assert await authenticate(auth_services, revocations, phone) == user_id
+
+    await revocations.revoke_token(claims(phone))
+
+    with pytest.raises(HTTPException) as exc:
+        await authenticate(auth_services, revocations, phone)
+    assert exc.value.status_code == 401
+    assert revocations.lookups == 1
+    assert await authenticate(auth_services, revocations, laptop) == user_id
+    assert revocations.lookups == 1
+
+
+async def test_logout_everywhere_revokes_tokens_issued_before(
+    db, auth_services, user_id
+):
+    """Test that logging out everywhere spares only tokens issued after it, in memory."""
+    revocations = TokenRevocations(db, 1800)
+    await revocations.rebuild()
+    before = auth_services.create_access_token({"sub": user_id})
+
+    await revocations.revoke_all(user_id)
+    after = auth_services.create_access_token({"sub": user_id})
+
+    with pytest.raises(HTTPException):
+        await authenticate(auth_services, revocations, before)
+    assert await authenticate(auth_services, revocations, after) == user_id
+    assert revocations.lookups == 0
+
+
+async def test_other_workers_pick_revocations_up_on_refresh(
+    db, db_pool, auth_services, user_id
+):
+    """Test that refresh reads new revocations and rebuild drops expired ones."""
+    worker, other_worker = TokenRevocations(db, 1800), TokenRevocations(db, 1800)
+    await worker.rebuild()
+    await other_worker.rebuild()
+    token = claims(auth_services.create_access_token({"sub": user_id}))
+
+    await worker.revoke_token(token)
+    await worker.revoke_all(user_id)
+    assert not await other_worker.is_revoked(token)
+
+    await other_worker.refresh()
+    assert await other_worker.is_revoked(token)
+    assert user_id in other_worker.cutoffs
+
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE token_revocations SET expires_at = NOW() - interval '1 second'"
+        )
+    await other_worker.rebuild()
+    assert other_worker.cutoffs == {}
+    assert token["jti"] not in other_worker.bloom
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT count(*) FROM token_revocations") == 0
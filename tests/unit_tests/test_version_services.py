@@ -0,0 +1,247 @@
+from fastapi import HTTPException
+from app.helpers.chunking import chunk_boundaries, chunk_manifest
+from app.schemas.schemas import ChunkInfo, FileUploadResult, UploadFileInfo
+from unittest.mock import AsyncMock, Mock
+import json
+import os
+import random
+import pytest
+
+SMALL_CHUNKS = {"min_size": 1024, "avg_size": 4096, "max_size": 16384}
+
+
+@pytest.fixture
+def version_s3_calls(version_services, mock_s3_response):
+    aws_services = version_services.aws_services
+    aws_services.generate_presigned_upload_url = Mock(return_value=mock_s3_response)
+    aws_services.generate_presigned_chunk_upload_urls = Mock(
+        side_effect=lambda user_id, chunks: [
+            {"sha256": c["sha256"].hex()} for c in chunks
+        ]
+    )
+    aws_services.missing_objects = AsyncMock(return_value=[])
+    return aws_services
+
+
+@pytest.fixture
+def mock_s3_response():
+    return {"url": "https://mock-bucket.s3.amazonaws.com/", "fields": {}}
+
+
+async def stored_file(file_services, db_pool, user_id, size_in_bytes=100):
+    """A confirmed file that was never replaced, returns its id."""
+    await file_services.upload_an_new_file(
+        UploadFileInfo(file_name="notes.txt", file_size_in_bytes=size_in_bytes), user_id
+    )
+    async with db_pool.acquire() as conn:
+        file_id = str(await conn.fetchval("SELECT id FROM files"))
+    await file_services.confirm_file_uploads([file_id], os.getenv("LAMBDA_SECRET"))
+    return file_id
+
+
+def manifest(data) -> list[ChunkInfo]:
+    return [ChunkInfo(**chunk) for chunk in chunk_manifest(data, **SMALL_CHUNKS)]
+
+
+def test_an_edit_only_changes_the_chunks_around_it():
+    data = random.Random(7).randbytes(256 * 1024)
+    edited = data[:100_000] + b"an edit" + data[100_000:]
+
+    before = {chunk["sha256"] for chunk in chunk_manifest(data, **SMALL_CHUNKS)}
+    after = chunk_manifest(edited, **SMALL_CHUNKS)
+    changed = [chunk for chunk in after if chunk["sha256"] not in before]
+
+    assert len(after) > 30
+    assert len(changed) <= 2
+    assert sum(chunk["size_in_bytes"] for chunk in after) == len(edited)
+    assert all(
+        SMALL_CHUNKS["min_size"] <= size <= SMALL_CHUNKS["max_size"]
+        for _, size in list(chunk_boundaries(edited, **SMALL_CHUNKS))[:-1]
+    )
+
+
+async def test_new_version_only_uploads_changed_chunks(
+    db_pool,
+    file_services,
+    version_services,
+    user_services,
+    valid_user_data,
+    version_s3_calls,
+):
+    """Test that a second version asks for the edited chunk only and downloads in order."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    file_id = await stored_file(file_services, db_pool, user_id)
+    data = random.Random(1).randbytes(128 * 1024)
+    edited = data[:50_000] + b"edit" + data[50_000:]
+
+    first = await version_services.create_chunked_version(
+        user_id, file_id, manifest(data)
+    )
+    assert len(first["uploads"]) == len(manifest(data))
+    await version_services.commit_chunked_version(user_id, file_id, first["version_id"])
+
+    second = await version_services.create_chunked_version(
+        user_id, file_id, manifest(edited)
+    )
+    assert 1 <= len(second["uploads"]) <= 2
+    await version_services.commit_chunked_version(
+        user_id, file_id, second["version_id"]
+    )
+
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT size_in_bytes FROM files") == len(edited)
+        assert await conn.fetchval(
+            "SELECT total_storage_in_bytes - (SELECT SUM(available_bytes) FROM quota_stripes) FROM users"
+        ) == len(edited)
+    download = await file_services.get_user_presigned_download_url(user_id, file_id)
+    assert download["file_name"] == "notes.txt"
+    assert f"/files/{user_id}/chunks/" in download["chunks"][0]["url"]
+    assert [chunk["size_in_bytes"] for chunk in download["chunks"]] == [
+        chunk.size_in_bytes for chunk in manifest(edited)
+    ]
+    assert [
+        version["number"]
+        for version in await version_services.list_versions(user_id, file_id)
+    ] == [3, 2, 1]
+
+
+async def test_version_is_not_committed_before_its_chunks_arrive(
+    db_pool,
+    file_services,
+    version_services,
+    user_services,
+    valid_user_data,
+    version_s3_calls,
+):
+    """Test that committing with chunks missing from S3 is a 409 and changes nothing."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    file_id = await stored_file(file_services, db_pool, user_id)
+    version = await version_services.create_chunked_version(
+        user_id, file_id, manifest(random.Random(2).randbytes(20_000))
+    )
+    version_s3_calls.missing_objects.side_effect = lambda keys: keys[:1]
+
+    with pytest.raises(HTTPException) as exc_info:
+        await version_services.commit_chunked_version(
+            user_id, file_id, version["version_id"]
+        )
+
+    assert exc_info.value.status_code == 409
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT size_in_bytes FROM files") == 100
+        assert await conn.fetchval("SELECT count(*) FROM chunks WHERE stored") == 0
+
+
+async def test_restore_references_the_old_content(
+    db_pool,
+    file_services,
+    version_services,
+    user_services,
+    valid_user_data,
+    version_s3_calls,
+):
+    """Test that restoring version 1 needs no upload and takes its size back."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    file_id = await stored_file(file_services, db_pool, user_id)
+    await file_services.replace_existing_file(
+        UploadFileInfo(
+            file_name="notes.txt", file_size_in_bytes=300, file_conflict="Replace"
+        ),
+        user_id,
+    )
+    blob_id = version_s3_calls.generate_presigned_upload_url.call_args.kwargs["blob_id"]
+    await file_services.confirm_file_uploads([blob_id], os.getenv("LAMBDA_SECRET"))
+
+    versions = await version_services.list_versions(user_id, file_id)
+    assert [(v["number"], v["size_in_bytes"], v["current"]) for v in versions] == [
+        (2, 300, True),
+        (1, 100, False),
+    ]
+
+    await version_services.restore_version(user_id, file_id, versions[1]["id"])
+
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT size_in_bytes, blob_id FROM files")
+        used = await conn.fetchval(
+            "SELECT total_storage_in_bytes - (SELECT SUM(available_bytes) FROM quota_stripes) FROM users"
+        )
+    assert (row["size_in_bytes"], row["blob_id"], used) == (100, None, 100)
+    assert version_s3_calls.generate_presigned_upload_url.call_count == 2
+
+
+async def test_rejected_replacement_keeps_the_current_content(
+    db_pool,
+    file_services,
+    version_services,
+    user_services,
+    valid_user_data,
+    version_s3_calls,
+):
+    """Test that a new version failing validation is dropped and refunded, not the file."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    file_id = await stored_file(file_services, db_pool, user_id)
+    await file_services.replace_existing_file(
+        UploadFileInfo(
+            file_name="notes.txt", file_size_in_bytes=500, file_conflict="Replace"
+        ),
+        user_id,
+    )
+    blob_id = version_s3_calls.generate_presigned_upload_url.call_args.kwargs["blob_id"]
+
+    outcome = await file_services.record_upload_results(
+        [FileUploadResult(file_id=blob_id, detected_type="executable")],
+        os.getenv("LAMBDA_SECRET"),
+    )
+
+    assert outcome["rejected_file_ids"] == [blob_id]
+    async with db_pool.acquire() as conn:
+        assert await conn.fetchval("SELECT size_in_bytes FROM files") == 100
+        assert await conn.fetchval("SELECT count(*) FROM blobs") == 0
+        assert (
+            await conn.fetchval(
+                "SELECT total_storage_in_bytes - (SELECT SUM(available_bytes) FROM quota_stripes) FROM users"
+            )
+            == 100
+        )
+    assert [
+        v["number"] for v in await version_services.list_versions(user_id, file_id)
+    ] == [1]
+
+
+async def test_deleting_a_file_deletes_every_version(
+    db_pool,
+    file_services,
+    version_services,
+    user_services,
+    valid_user_data,
+    version_s3_calls,
+):
+    """Test that a deleted file takes its own object and its last chunks with it."""
+    user_id = await user_services.register_new_user(
+        valid_user_data.username, valid_user_data.email, valid_user_data.password
+    )
+    file_id = await stored_file(file_services, db_pool, user_id)
+    data = random.Random(3).randbytes(20_000)
+    version = await version_services.create_chunked_version(
+        user_id, file_id, manifest(data)
+    )
+    await version_services.commit_chunked_version(
+        user_id, file_id, version["version_id"]
+    )
+
+    await file_services.delete_file(user_id, file_id)
+
+    async with db_pool.acquire() as conn:
+        keys = json.loads(await conn.fetchval("SELECT payload FROM jobs"))["keys"]
+        assert f"files/{user_id}/{file_id}" in keys
+        assert len(keys) == 1 + len(manifest(data))
+        assert await conn.fetchval("SELECT count(*) FROM chunks") == 0
+        assert await conn.fetchval("SELECT count(*) FROM file_versions") == 0